@@ -11,6 +11,8 @@ class instrument_prompts:
     INST_SLEEPY_PROMPT = "\0SBE 37-SM\r\nS>"
     INST_PROMPT = "\r\nS>"
     INST_CONFUSED = "\r\n?cmd S>"
+    # Every response to a command ends with the prompt
+    INST_RESPONSE_END = "S>"
 
 instrument_commands = (
     "setdefaults",
@@ -20,6 +20,7 @@ import miros
 from instrument_hsm import InstrumentHsm
 
 from ion.agents.instrumentagents.instrument_connection import InstrumentConnection
+from ion.agents.instrumentagents.command_pipeline import CommandPipeline, CommandPipelineError
 from twisted.internet.protocol import ClientCreator
 
 from collections import deque
@@ -35,7 +36,6 @@ from ion.agents.instrumentagents.SBE49_constants import instrument_commands
 from ion.agents.instrumentagents.SBE49_constants import instrument_prompts
 
 import ion.util.procutils as pu
-from threading import Timer
 
 from ion.core.process.process import ProcessFactory
 
@@ -44,6 +44,8 @@ from ion.core.process.process import ProcessFactory
 #
 
 RESPONSE_TIMEOUT = 5   # 5 second timeout for response from instrument
+WAKEUP_RETRIES = 2     # times the wakeup is sent again without a response
+MAX_QUEUED_COMMANDS = 32
 
 class SBE49_instCommandXlator():
     commands = {
@@ -91,9 +93,16 @@ class SBE49InstrumentDriver(InstrumentDriver):
         self.setTopicDefined(False)
         self.publish_to = None
         self.dataQueue = deque()
-        self.cmdQueue = deque()
         self.proto = None
-        self.TimeOut = None
+        self.timedOutCmd = None
+
+        # Commands are sent from the reactor, one at a time, each answered
+        # by a prompt or timed out
+        self.pipeline = CommandPipeline(self.sendCmd,
+            instrument_prompts.INST_RESPONSE_END,
+            timeout=RESPONSE_TIMEOUT,
+            maxQueued=MAX_QUEUED_COMMANDS,
+            onTimeout=self.TimeoutCallback)
     
         self.instCmdXlator = SBE49_instCommandXlator()
         
@@ -248,7 +257,7 @@ class SBE49InstrumentDriver(InstrumentDriver):
         elif caller.tEvt['sType'] == "eventConnectionComplete":
             # TODO: can this happen?????
             # Send crlf, then transition to stateConnecting
-            self.sendCmd(instrument_prompts.PROMPT_INST)
+            self.sendWakeup()
             caller.stateTran(self.stateConnecting)
             return 0
         # A command has been received from the agent
@@ -307,10 +316,11 @@ class SBE49InstrumentDriver(InstrumentDriver):
         elif caller.tEvt['sType'] == "exit":
             return 0
         elif caller.tEvt['sType'] == "eventCommandReceived":
-            # We got a command from the agent; need to get the prompt
-            # before sending
-            self.sendCmd(instrument_prompts.PROMPT_INST)
-            #self.sendWakeup()
+            # We got a command from the agent; the pipeline sends it, after
+            # a wakeup if the instrument has not answered since connecting
+            # or since the last timeout
+            if not self.pipeline.running:
+                self.sendWakeup()
             return 0
         elif caller.tEvt['sType'] == "eventDataReceived":
             # send this up to the agent to publish.
@@ -335,28 +345,22 @@ class SBE49InstrumentDriver(InstrumentDriver):
             caller.stateTran(self.stateDisconnecting)
             return 0
         elif caller.tEvt['sType'] == "eventResponseTimeout":
-            self.ProcessWakeupResponseTimeout()
+            self.ProcessCmdResponseTimeout()
             return 0
         return caller.tEvt['sType']
 
     def statePrompted(self, caller):
         log.info("statePrompted-%s;" %(caller.tEvt['sType']))
         if caller.tEvt['sType'] == "init":
-            """
-            @todo Need a queue of commands from which to pull commands
-            """
-            if self.cmdPending():
-                self.sendCmd(self.dequeueCmd())
             return 0
         elif caller.tEvt['sType'] == "entry":
             return 0
         elif caller.tEvt['sType'] == "exit":
             return 0
         elif caller.tEvt['sType'] == "eventCommandReceived":
-            if self.cmdPending():
-                self.sendCmd(self.dequeueCmd())
-            else:
-                log.error("statePrompted: No command to send!")
+            # The pipeline sends it when the commands before it are answered
+            if not self.pipeline.running:
+                self.sendWakeup()
             return 0
         elif caller.tEvt['sType'] == "eventDataReceived":
             # send this up to the agent to publish.
@@ -418,18 +422,13 @@ class SBE49InstrumentDriver(InstrumentDriver):
 
     @defer.inlineCallbacks
     def plc_terminate(self):
-        self.__terminateTimer()
+        self.pipeline.stop()
             
         yield self.op_disconnect(None, None, None)
 
     def __cleanUpConnection(self):
-        self.__terminateTimer()
-            
-    def __terminateTimer(self):
-        if self.TimeOut != None:
-            log.debug("Timer active: cancelling")
-            self.TimeOut.cancel()
-            self.TimeOut = None
+        # Cancels the pending commands and their deadlines
+        self.pipeline.stop()
         
 
     def isConnected(self):
@@ -457,52 +456,71 @@ class SBE49InstrumentDriver(InstrumentDriver):
         log.debug("dequeueData: dequeued command: %s" %data)
         return data
         
-    def enqueueCmd(self, cmd):
+    def enqueueCmd(self, cmd, **kwargs):
+        """
+        @brief Queue a command for the instrument
+        @retval Deferred firing with the response
+        @throws CommandQueueFull if too many commands are waiting
+        """
         log.debug("enqueueCmd: enqueueing command: %s" %cmd)
-        self.cmdQueue.append(cmd)
-
-    def dequeueCmd(self):
-        cmd = self.cmdQueue.popleft()
-        #log.debug("dequeueCmd: dequeueing command: %s" %cmd)
-        return cmd
+        d = self.pipeline.enqueue(cmd, **kwargs)
+        d.addCallbacks(self.gotCmdResponse, self.cmdFailed,
+                       callbackArgs=(cmd,), errbackArgs=(cmd,))
+        return d
 
     def cmdPending(self):
-        if len(self.cmdQueue) > 0:
+        if self.pipeline.pending() > 0:
             return True
         else:
             return False
 
-    def TimeoutCallback(self):
+    def gotCmdResponse(self, response, cmd):
+        log.debug("Response to command %r received" % cmd)
+        return response
+
+    def cmdFailed(self, reason, cmd):
+        # Timeouts are reported through the state machine; a command dropped
+        # on disconnect needs no further handling. A command which could not
+        # be sent stopped the pipeline - the next command wakes it again.
+        if reason.check(CommandPipelineError):
+            log.info("Command %r failed: %s" % (cmd, reason.getErrorMessage()))
+        else:
+            log.error("Command %r could not be sent: %s" % (cmd, reason.getErrorMessage()))
+
+    def TimeoutCallback(self, command):
+        """
+        Called in the reactor by the pipeline when a command got no response
+        """
         log.info("TimeoutCallback()")
-        if self.TimeOut != None:
-            self.TimeOut = None
-            self.hsm.sendEvent('eventResponseTimeout');
+        self.timedOutCmd = command.command
+        self.hsm.sendEvent('eventResponseTimeout');
             
     def ProcessCmdResponseTimeout(self):
-        if len(self.cmdQueue) > 0:
-            log.error("No response from instrument for cammand \'%s\'" % self.cmdQueue[0])
-            self.publish("No response from instrument for cammand \'%s\'".format(self.cmdQueue[0]), self.publish_to)
-            self.cmdQueue = []
-
-    def ProcessWakeupResponseTimeout(self):
-        if len(self.cmdQueue) > 0:
-            log.error("No response from instrument for wakeup")
-            self.publish("No response from instrument for wakeup", self.publish_to)
-            self.cmdQueue = []
-      
+        if self.timedOutCmd == instrument_prompts.PROMPT_INST:
+            error = "No response from instrument for wakeup"
+        else:
+            error = "No response from instrument for command \'%s\'" % self.timedOutCmd.strip()
+        log.error(error)
+        self.publish(error, self.publish_to)
+        # The instrument is not answering - drop what is still queued, and
+        # wake it again before the next command
+        self.pipeline.stop()
+
     def sendCmd(self, cmd):
         log.debug("Sending Command: %s" %cmd)
+        if self.instrument is None:
+            raise RuntimeError("Not connected to the instrument")
         self.instrument.transport.write(cmd)
-        # TODO: What if self.TimeOut exists and is running?  
-        self.TimeOut = Timer(RESPONSE_TIMEOUT, self.TimeoutCallback)
-        self.TimeOut.start()
         
     def sendWakeup(self):
+        """
+        Wake the instrument before any queued command is sent, and start
+        sending them
+        """
         log.debug("Sending Wakeup")
-        self.instrument.transport.write(instrument_prompts.PROMPT_INST)
-        # TODO: What if self.TimeOut exists and is running?  
-        #self.TimeOut = Timer(RESPONSE_TIMEOUT, self.TimeoutCallback)
-        #self.TimeOut.start()
+        self.enqueueCmd(instrument_prompts.PROMPT_INST, first=True,
+                        retries=WAKEUP_RETRIES)
+        self.pipeline.start()
         
     @defer.inlineCallbacks
     def getConnected(self):
@@ -570,16 +588,8 @@ class SBE49InstrumentDriver(InstrumentDriver):
         @retval none
         """
         
-        #
-        # TODO: currently doing this here, but this will change to
-        # where it is discovered that the command is valid
-        #
-        if self.TimeOut != None:
-            log.debug("gotData: cancelling timer.")
-            self.TimeOut.cancel()
-            self.TimeOut = None
-        else:
-            log.debug("gotData: NOT cancelling timer")
+        # Answers the command waiting for a response, if any
+        self.pipeline.dataReceived(data)
         
         if data == instrument_prompts.INST_PROMPT or \
               data == instrument_prompts.INST_SLEEPY_PROMPT:
@@ -671,7 +681,12 @@ class SBE49InstrumentDriver(InstrumentDriver):
                     Send the command received event.  This should kick off the
                     appropriate sequence of events to get the command sent.
                     """
-                    self.enqueueCmd(command)
+                    try:
+                        self.enqueueCmd(command)
+                    except CommandPipelineError, ex:
+                        error_msg = str(ex)
+                        log.error(error_msg)
+                        break
                     self.hsm.sendEvent('eventCommandReceived')
                 else:
                     error_msg = str(param) + " is not a settable parameter"
@@ -709,7 +724,12 @@ class SBE49InstrumentDriver(InstrumentDriver):
                 log.debug("op_execute would send command: %s to instrument" % instCommand)
                 instCommand += instrument_prompts.PROMPT_INST
 
-                self.enqueueCmd(instCommand)
+                try:
+                    self.enqueueCmd(instCommand)
+                except CommandPipelineError, ex:
+                    log.error("Command not queued: %s" % str(ex))
+                    yield self.reply_err(msg, "Command not queued: %s" % str(ex))
+                    return
 
                 """
                 Send the command received event.  This should kick off the
@@ -12,6 +12,8 @@ from twisted.internet import defer, reactor
 from instrument_hsm import InstrumentHsm
 
 from ion.agents.instrumentagents.instrument_connection import InstrumentConnection
+from ion.agents.instrumentagents.command_pipeline import CommandPipeline, \
+    CommandPipelineError, responseAfter
 from twisted.internet.protocol import ClientCreator
 
 from ion.core.process.process import Process
@@ -32,12 +34,12 @@ import logging
 import time
 from socket import *
 import sys
-from threading import Timer, BoundedSemaphore
-from collections import deque
 from twisted.internet.protocol import Protocol
                        
 CMD_RESPONSE_TIMEOUT = 3     # 2 second timeout for command response from instrument
 BREAK_RESPONSE_TIMEOUT = 4   # 4 second timeout for break response from instrument
+BREAK_RETRIES = 1            # times the break is sent again without a response
+MAX_QUEUED_COMMANDS = 32
 
 class CmdPort(Protocol):
     
@@ -87,17 +89,22 @@ class WHSentinelADCPInstrumentDriver(InstrumentDriver):
     controlled vocabulary
     """
     def __init__(self, *args, **kwargs):
-        self.SendingBreak = False
         self.instrument = None
         self.CmdInstrument = None
         self.command = None
         self.setTopicDefined(False)
         self.publish_to = None
         self.dataQueue = ""
-        self.cmdQueue = deque([])
         self.proto = None
-        self.TimeOut = None
-        NoResponseIsError = False
+        self.timedOutCmd = None
+
+        # Commands are sent from the reactor, one at a time, each answered
+        # by its echo and the prompt or timed out
+        self.pipeline = CommandPipeline(self.sendCmd,
+            instrument_prompts.INST_PROMPT,
+            timeout=CMD_RESPONSE_TIMEOUT,
+            maxQueued=MAX_QUEUED_COMMANDS,
+            onTimeout=self.TimeoutCallback)
         
         self.instCmdXlator = WHSentinelADCP_instCommandXlator()
         
@@ -225,61 +232,49 @@ class WHSentinelADCPInstrumentDriver(InstrumentDriver):
         log.debug("stateConnected-%s;" %(caller.tEvt['sType']))
         if caller.tEvt['sType'] == "init":
             if self.cmdPending():
-                self.sendBreak()
+                self.sendWakeup()
             return 0
         elif caller.tEvt['sType'] == "entry":
             return 0
         elif caller.tEvt['sType'] == "exit":
             return 0
         elif caller.tEvt['sType'] == "eventCommandReceived":
-            if self.TimeOut == None:
+            if not self.pipeline.running:
                 # We got a command from the agent; need to get the prompt
                 # before sending
-                self.sendBreak()
+                self.sendWakeup()
             return 0
         elif caller.tEvt['sType'] == "eventDataReceived":
             self.ProcessRcvdData()
             return 0
         elif caller.tEvt['sType'] == "eventPromptReceived":
-            if self.TimeOut != None:
-                self.TimeOut.cancel()
-                self.TimeOut = None
             caller.stateTran(self.statePrompted)
             return 0
         elif caller.tEvt['sType'] == "eventDisconnectReceived":
             caller.stateTran(self.stateDisconnecting)
             return 0
         elif caller.tEvt['sType'] == "eventResponseTimeout":
-            self.ProcessWakeupResponseTimeout()
+            self.ProcessCmdResponseTimeout()
             return 0
         return caller.tEvt['sType']
 
     def statePrompted(self, caller):
         log.debug("statePrompted-%s;" %(caller.tEvt['sType']))
         if caller.tEvt['sType'] == "init":
-            if self.cmdPending():
-                if (self.TimeOut == None) and (self.SendingBreak == False):
-                    self.sendCmd(self.PeekCmd())
-                # Only way to get here is from stateConnected after receiving a
-                # prompt, so not getting a response is an error condition
-                self.NoResponseIsError = True
             return 0
         elif caller.tEvt['sType'] == "entry":
             return 0
         elif caller.tEvt['sType'] == "exit":
             return 0
         elif caller.tEvt['sType'] == "eventResponseTimeout":
-            if self.NoResponseIsError == True:
-                self.ProcessCmdResponseTimeout()
+            self.ProcessCmdResponseTimeout()
             # Goto connected state since command response failed
             caller.stateTran(self.stateConnected)
             return 0
         elif caller.tEvt['sType'] == "eventCommandReceived":
-            if self.cmdPending():
-                if (self.TimeOut == None) and (self.SendingBreak == False):
-                    self.sendCmd(self.PeekCmd())
-            else:
-                log.error("statePrompted: No command to send!")
+            # The pipeline sends it when the commands before it are answered
+            if not self.pipeline.running:
+                self.sendWakeup()
             return 0
         elif caller.tEvt['sType'] == "eventDataReceived":
              self.ProcessRcvdData()
@@ -337,9 +332,7 @@ class WHSentinelADCPInstrumentDriver(InstrumentDriver):
 
     @defer.inlineCallbacks
     def plc_terminate(self):
-        if self.TimeOut != None:
-            self.TimeOut.cancel()
-            self.TimeOut = None
+        self.pipeline.stop()
         self.hsm.sendEvent('eventDisconnectReceived')
 
 
@@ -356,78 +349,103 @@ class WHSentinelADCPInstrumentDriver(InstrumentDriver):
         self.agent = agent
         
 
-    def enqueueCmd(self, cmd):
+    def enqueueCmd(self, cmd, **kwargs):
+        """
+        @brief Queue a command for the instrument
+        @retval Deferred firing with the response
+        @throws CommandQueueFull if too many commands are waiting
+        """
         log.debug("enqueueCmd: enqueueing command: %s" %cmd)
-        self.cmdQueue.append(cmd)
-
-
-    def dequeueCmd(self):
-        if len(self.cmdQueue) > 0:     
-            cmd = self.cmdQueue.popleft()
-            log.info("dequeueCmd: dequeueing command: %s" %cmd)
-            return cmd
-
-
-    def PeekCmd(self):
-        if len(self.cmdQueue) > 0:     
-            return self.cmdQueue[0]
+        if cmd == "break":
+            kwargs.setdefault('timeout', BREAK_RESPONSE_TIMEOUT)
+            match = responseAfter("BREAK Wakeup A", instrument_prompts.INST_PROMPT)
         else:
-            return ""
+            # The instrument echoes the command before responding
+            match = responseAfter(cmd, instrument_prompts.INST_PROMPT)
+        d = self.pipeline.enqueue(cmd, match=match, **kwargs)
+        d.addCallbacks(self.gotCmdResponse, self.cmdFailed,
+                       callbackArgs=(cmd,), errbackArgs=(cmd,))
+        return d
 
 
     def cmdPending(self):
-        if len(self.cmdQueue) > 0:
+        if self.pipeline.pending() > 0:
             return True
         else:
             return False
         
 
-    def TimeoutCallback(self, Reason):
-        if Reason == "C":
-            log.info("TimeoutCallback() for Command")
+    def gotCmdResponse(self, response, cmd):
+        log.info("Response to command \'%s\' received" % cmd)
+        if " ERR " in response:
+            log.error("Instrument rejected command \'%s\': %s" % (cmd, response))
+        return response
+
+
+    def cmdFailed(self, reason, cmd):
+        # Timeouts are reported through the state machine; a command dropped
+        # on disconnect needs no further handling. A command which could not
+        # be sent (the break, for one) stopped the pipeline - the next
+        # command wakes it again.
+        if reason.check(CommandPipelineError):
+            log.info("Command \'%s\' failed: %s" % (cmd, reason.getErrorMessage()))
         else:
+            log.error("Command \'%s\' could not be sent: %s" % (cmd, reason.getErrorMessage()))
+
+
+    def TimeoutCallback(self, command):
+        """
+        Called in the reactor by the pipeline when a command got no response
+        """
+        if command.command == "break":
             log.info("TimeoutCallback() for Break")
-        if self.TimeOut != None:
-            self.TimeOut = None
-            self.hsm.sendEvent('eventResponseTimeout')
+        else:
+            log.info("TimeoutCallback() for Command")
+        self.timedOutCmd = command.command
+        self.hsm.sendEvent('eventResponseTimeout')
         
 
     def ProcessCmdResponseTimeout(self):
-        log.error("No response from instrument for cammand \'%s\'" % self.cmdQueue[0])
-        self.publish("No response from instrument for cammand \'%s\'".format(self.cmdQueue[0]), self.publish_to)
-        self.cmdQueue = []
-        self.NoResponseIsError = False
- 
-
-    def ProcessWakeupResponseTimeout(self):
-        log.error("No response from instrument for wakeup")
-        self.publish("No response from instrument for wakeup", self.publish_to)
-        self.cmdQueue = []
+        if self.timedOutCmd == "break":
+            error = "No response from instrument for wakeup"
+        else:
+            error = "No response from instrument for command \'%s\'" % self.timedOutCmd
+        log.error(error)
+        self.publish(error, self.publish_to)
+        # The instrument is not answering - drop what is still queued, and
+        # wake it again before the next command
+        self.pipeline.stop()
       
 
     def sendCmd(self, cmd):
         log.info("Sending Command: %s" %cmd)
         if cmd == "break":
-            self.sendBreak()
+            return self.sendBreak()
+        elif self.instrument is None:
+            raise RuntimeError("Not connected to the instrument")
         else:
             self.instrument.transport.write(cmd + instrument_prompts.DRIVER_LINE_TERMINATOR)
-            self.TimeOut = Timer(CMD_RESPONSE_TIMEOUT, self.TimeoutCallback, "C")
-            self.TimeOut.start()
-        
         
+
+    def sendWakeup(self):
+        """
+        Send a break before any queued command, and start sending them
+        """
+        self.enqueueCmd("break", first=True, retries=BREAK_RETRIES)
+        self.pipeline.start()
+
+
     @defer.inlineCallbacks
     def sendBreak(self):
-        if self.SendingBreak == True:
-            log.debug("already sending break")
-            return
-        else:
-            self.SendingBreak = True
+        """
+        Send a break on the command port. The pipeline waits for the wakeup
+        message from the data port.
+        """
         Cmdcc = ClientCreator(reactor, CmdPort, self)
         log.info("Driver connecting to instrument command port ipaddr: %s, ipportCmd: %s" %(self.instrument_ipaddr, self.instrument_ipportCmd))
         self.Cmdproto = yield Cmdcc.connectTCP(self.instrument_ipaddr, int(self.instrument_ipportCmd))
         if self.CmdInstrument == None:
-            log.error("Driver failed to connect to instrument command port")
-            return
+            raise RuntimeError("Driver failed to connect to instrument command port")
         else:
             log.info("Driver connected to instrument command port")
         log.info("Sending break to instrument ipaddr: %s, ipport: %s" %(self.instrument_ipaddr, self.instrument_ipportCmd))
@@ -442,14 +460,8 @@ class WHSentinelADCPInstrumentDriver(InstrumentDriver):
             #if self.CmdData != '\x22OK':
             #    raise RuntimeError('OK response not received')
             #log.debug("Rcvd OK response for 'stop break' cmd")
-        except:
-            log.error("Send break failed: %s" % sys.exc_info()[1])
+        finally:
             self.Cmdproto.transport.loseConnection()
-            return
-        self.Cmdproto.transport.loseConnection()
-        self.TimeOut = Timer(BREAK_RESPONSE_TIMEOUT, self.TimeoutCallback, "B")
-        self.TimeOut.start()
-        self.SendingBreak = False
                 
 
     def ProcessRcvdData(self):
@@ -457,18 +469,6 @@ class WHSentinelADCPInstrumentDriver(InstrumentDriver):
         while instrument_prompts.ADCP_LINE_TERMINATOR in self.dataQueue:
             partition = self.dataQueue.partition(instrument_prompts.ADCP_LINE_TERMINATOR)
             self.dataQueue = partition[2]
-            if len(self.cmdQueue) > 0:
-                Cmd = self.PeekCmd()
-                log.debug("looking for command %s in %s" % (Cmd, partition[0]))
-                if (((Cmd == "break") and ("BREAK Wakeup A" in partition[0])) or
-                    (Cmd in partition[0])):
-                    if self.TimeOut != None:
-                        self.TimeOut.cancel()
-                        self.TimeOut = None
-                    log.info("Response to command \'%s\' received" % Cmd)
-                    self.dequeueCmd()
-                    if self.cmdPending():
-                        self.sendCmd(self.PeekCmd())
             # send this up to the agent to publish.
             log.info("Calling publish with \"%s\"" %partition[0])
             self.publish(partition[0], self.publish_to)
@@ -551,6 +551,8 @@ class WHSentinelADCPInstrumentDriver(InstrumentDriver):
         log.debug("gotDisconnected!!!")
 
         self.instrument = None
+        # Cancels the pending commands and their deadlines
+        self.pipeline.stop()
         self.hsm.sendEvent('eventDisconnectComplete')
 
 
@@ -569,6 +571,8 @@ class WHSentinelADCPInstrumentDriver(InstrumentDriver):
                     DataAsHex += ","
                 DataAsHex += "{0:X}".format(ord(data[i]))
             log.debug("gotData() [%s] [%s]" % (data, DataAsHex))
+        # Answers the command waiting for a response, if any
+        self.pipeline.dataReceived(data)
         if instrument_prompts.INST_PROMPT in data:
             log.info("gotData(): prompt seen")
             self.hsm.sendEvent('eventPromptReceived')
@@ -608,9 +612,7 @@ class WHSentinelADCPInstrumentDriver(InstrumentDriver):
     @defer.inlineCallbacks
     def op_disconnect(self, content, headers, msg):
         log.debug("in Instrument Driver op_disconnect!")
-        if self.TimeOut != None:
-            self.TimeOut.cancel()
-            self.TimeOut = None
+        self.pipeline.stop()
         self.hsm.sendEvent('eventDisconnectReceived')
         if msg:
             yield self.reply_ok(msg, content)
@@ -661,7 +663,12 @@ class WHSentinelADCPInstrumentDriver(InstrumentDriver):
                     Send the command received event.  This should kick off the
                     appropriate sequence of events to get the command sent.
                     """
-                    self.enqueueCmd(command)
+                    try:
+                        self.enqueueCmd(command)
+                    except CommandPipelineError, ex:
+                        error_msg = str(ex)
+                        log.error(error_msg)
+                        break
                     self.hsm.sendEvent('eventCommandReceived')
                 else:
                     error_msg = str(param) + " is not a settable parameter"
@@ -698,14 +705,16 @@ class WHSentinelADCPInstrumentDriver(InstrumentDriver):
             else:
                 log.debug("op_execute translating command: %s" % command)
                 instCommand = self.instCmdXlator.translate(command)
-                if isinstance(instCommand, list):
+                if not isinstance(instCommand, list):
+                    instCommand = [instCommand + value]
+                try:
                     for instCmd in instCommand:
                         log.info("op_execute queueing command: %s" % instCmd)
                         self.enqueueCmd(instCmd)
-                else:
-                    instCommand += value
-                    log.info("op_execute queueing command: %s" % instCommand)
-                    self.enqueueCmd(instCommand)
+                except CommandPipelineError, ex:
+                    log.error("Command not queued: %s" % str(ex))
+                    yield self.reply_err(msg, "Command not queued: %s" % str(ex))
+                    return
                 # respond to command
                 agentCommands.append(command)
                 yield self.reply_ok(msg, agentCommands)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+"""
+@file ion/agents/instrumentagents/command_pipeline.py
+@author agent
+@brief A queue of commands to an instrument, sent in order from the reactor,
+    each with a deadline for its response
+"""
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from collections import deque
+
+from twisted.internet import defer, reactor
+
+
+class CommandPipelineError(Exception):
+    """
+    An exception class for the command pipeline
+    """
+
+class CommandQueueFull(CommandPipelineError):
+    """
+    The command was not queued: too many commands are waiting
+    """
+
+class CommandTimeout(CommandPipelineError):
+    """
+    The instrument did not respond to the command in time, after all retries
+    """
+
+class CommandCancelled(CommandPipelineError):
+    """
+    The command was dropped before its response came, by flush or stop
+    """
+
+
+def responseAfter(marker, end):
+    """
+    @brief Make a response match for instruments which echo the command: the
+    response is complete at the first end (a prompt) after the marker
+    @retval callable taking the received data and returning the length of
+    the response, or -1 if it is not complete
+    """
+    def match(data):
+        start = data.find(marker)
+        if start < 0:
+            return -1
+        index = data.find(end, start + len(marker))
+        if index < 0:
+            return -1
+        return index + len(end)
+    return match
+
+
+class PipelinedCommand(object):
+    """
+    A command in the pipeline. The deferred fires with the response, or fails
+    with a CommandPipelineError.
+    """
+
+    def __init__(self, command, match, timeout, retries):
+        self.command = command
+        self.match = match
+        self.timeout = timeout
+        self.retries = retries
+        self.attempts = 0
+        self.deferred = defer.Deferred()
+        self.deadline = None
+
+    def __repr__(self):
+        return 'PipelinedCommand(%r, attempts=%d)' % (self.command, self.attempts)
+
+    def responseLength(self, data):
+        if callable(self.match):
+            return self.match(data)
+        index = data.find(self.match)
+        if index < 0:
+            return -1
+        return index + len(self.match)
+
+
+class CommandPipeline(object):
+    """
+    Sends queued commands to an instrument and matches the responses to them.
+
+    Commands are sent in order as soon as the responses to the ones before
+    them came - at most window commands wait for a response at a time, and
+    responses are taken to come in the order the commands were sent. Each
+    sent command has a deadline, scheduled on the reactor, and is sent again
+    up to its retries if it passes without a response. A command which got
+    no response at all fails with CommandTimeout, and onTimeout is called
+    with it. A command which could not be sent fails with the error of send;
+    the pipeline then stops and cancels the other pending commands, since
+    the instrument can not be reached - start it again, after a wakeup, to
+    send more. At most maxQueued commands wait to be sent; enqueue raises
+    CommandQueueFull beyond that.
+
+    The driver passes everything the instrument sends to dataReceived. Data
+    which comes while no command waits for a response (autonomous samples)
+    is not matched.
+    """
+
+    def __init__(self, send, match, timeout=5, retries=0, maxQueued=32,
+                 window=1, onTimeout=None, clock=reactor, maxBuffered=65536):
+        """
+        @param send callable writing a command to the instrument; it may
+            return a Deferred, the deadline starts when it fires
+        @param match the default response match: the string which ends a
+            response (the prompt), or a callable as made by responseAfter
+        @param timeout default seconds to wait for a response
+        @param retries default number of times a command is sent again
+        @param maxQueued the most commands waiting to be sent
+        @param window the most commands waiting for their response
+        @param onTimeout callable called with a PipelinedCommand which
+            timed out
+        @param clock the reactor, or a task.Clock in tests
+        @param maxBuffered the most bytes of an incomplete response kept
+        """
+        self.send = send
+        self.match = match
+        self.timeout = timeout
+        self.retries = retries
+        self.maxQueued = maxQueued
+        self.window = window
+        self.onTimeout = onTimeout
+        self.clock = clock
+        self.maxBuffered = maxBuffered
+
+        self.queued = deque()
+        self.inFlight = deque()
+        self.buffer = ''
+        self.running = False
+
+        self.sent = 0
+        self.answered = 0
+        self.resent = 0
+        self.timedOut = 0
+
+    def enqueue(self, command, match=None, timeout=None, retries=None, first=False):
+        """
+        @brief Queue a command, to be sent when the commands before it
+        are answered
+        @param first put the command ahead of the others, as for a wakeup;
+            it is queued even if the queue is full
+        @retval Deferred firing with the response to the command
+        """
+        if not first and len(self.queued) >= self.maxQueued:
+            raise CommandQueueFull('%d commands are waiting to be sent' % len(self.queued))
+
+        if match is None:
+            match = self.match
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries
+        cmd = PipelinedCommand(command, match, timeout, retries)
+
+        if first:
+            self.queued.appendleft(cmd)
+        else:
+            self.queued.append(cmd)
+        self._pump()
+        return cmd.deferred
+
+    def pending(self):
+        """
+        @retval the number of commands not answered yet
+        """
+        return len(self.queued) + len(self.inFlight)
+
+    def start(self):
+        """
+        Start sending the queued commands, for instance once connected
+        """
+        self.running = True
+        self._pump()
+
+    def pause(self):
+        """
+        Stop sending commands; the ones already sent still get their response
+        """
+        self.running = False
+
+    def stop(self):
+        """
+        Stop sending commands and cancel the pending ones, as on disconnect
+        """
+        self.running = False
+        self.flush()
+
+    def flush(self, reason=None):
+        """
+        @brief Drop the pending commands; their deferreds fail with reason,
+        a CommandCancelled by default
+        """
+        if reason is None:
+            reason = CommandCancelled('The command pipeline was flushed')
+        cmds = list(self.inFlight) + list(self.queued)
+        self.inFlight.clear()
+        self.queued.clear()
+        self.buffer = ''
+        for cmd in cmds:
+            self._cancelDeadline(cmd)
+            cmd.deferred.errback(reason)
+
+    def dataReceived(self, data):
+        """
+        @brief Match data from the instrument to the commands waiting for a
+        response
+        """
+        if not self.inFlight or self.inFlight[0].deadline is None:
+            # Nothing sent yet which the data could answer
+            return
+        self.buffer += data
+
+        while self.inFlight:
+            cmd = self.inFlight[0]
+            if cmd.deadline is None:
+                break
+            length = cmd.responseLength(self.buffer)
+            if length < 0:
+                break
+            response = self.buffer[:length]
+            self.buffer = self.buffer[length:]
+            self.inFlight.popleft()
+            self._cancelDeadline(cmd)
+            self.answered += 1
+            cmd.deferred.callback(response)
+
+        if not self.inFlight:
+            self.buffer = ''
+        elif len(self.buffer) > self.maxBuffered:
+            self.buffer = self.buffer[-self.maxBuffered:]
+        self._pump()
+
+    def _pump(self):
+        while self.running and self.queued and len(self.inFlight) < self.window:
+            cmd = self.queued.popleft()
+            self.inFlight.append(cmd)
+            self._send(cmd)
+
+    def _send(self, cmd):
+        cmd.attempts += 1
+        self.sent += 1
+        d = defer.maybeDeferred(self.send, cmd.command)
+        d.addCallbacks(self._sent, self._sendFailed, callbackArgs=(cmd,), errbackArgs=(cmd,))
+
+    def _sent(self, result, cmd):
+        if cmd in self.inFlight:
+            cmd.deadline = self.clock.callLater(cmd.timeout, self._expired, cmd)
+
+    def _sendFailed(self, failure, cmd):
+        log.error('Sending command %r failed: %s' % (cmd.command, failure.getErrorMessage()))
+        if cmd in self.inFlight:
+            self.inFlight.remove(cmd)
+            self.running = False
+            cmd.deferred.errback(failure)
+            self.flush(CommandCancelled('Sending command %r failed' % cmd.command))
+
+    def _expired(self, cmd):
+        cmd.deadline = None
+        if cmd not in self.inFlight:
+            return
+        if cmd.attempts <= cmd.retries:
+            log.info('No response to command %r, sending it again' % cmd.command)
+            self.resent += 1
+            self.buffer = ''
+            self._send(cmd)
+            return
+
+        log.error('No response to command %r after %d attempts' % (cmd.command, cmd.attempts))
+        self.inFlight.remove(cmd)
+        self.buffer = ''
+        self.timedOut += 1
+        cmd.deferred.errback(CommandTimeout('No response to command %r' % cmd.command))
+        if self.onTimeout is not None:
+            self.onTimeout(cmd)
+        self._pump()
+
+    def _cancelDeadline(self, cmd):
+        if cmd.deadline is not None:
+            if cmd.deadline.active():
+                cmd.deadline.cancel()
+            cmd.deadline = None
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""
+@file ion/agents/instrumentagents/test/test_command_pipeline.py
+@brief Test the command pipeline of the instrument drivers, on its own and
+    against the instrument simulators
+@author agent
+"""
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.internet import defer, reactor, task
+from twisted.internet.protocol import ClientCreator
+from twisted.trial import unittest
+
+from ion.agents.instrumentagents.command_pipeline import CommandPipeline, \
+    CommandQueueFull, CommandTimeout, CommandCancelled, responseAfter
+from ion.agents.instrumentagents.instrument_connection import InstrumentConnection
+from ion.agents.instrumentagents.simulators import sim_SBE49
+from ion.agents.instrumentagents.simulators import sim_WHSentinelADCP
+
+
+class CommandPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.written = []
+        self.timedOut = []
+        self.pipeline = CommandPipeline(self.written.append, 'S>', timeout=5,
+            maxQueued=3, onTimeout=self.timedOut.append, clock=self.clock)
+
+    def _results(self, deferreds):
+        results = []
+        for d in deferreds:
+            d.addBoth(results.append)
+        return results
+
+    def test_in_order(self):
+        results = self._results([self.pipeline.enqueue('ds\r\n'),
+                                 self.pipeline.enqueue('ts\r\n')])
+        # Nothing goes out until the pipeline is started
+        self.assertEqual(self.written, [])
+
+        self.pipeline.start()
+        self.assertEqual(self.written, ['ds\r\n'])
+        self.pipeline.dataReceived('SBE 49\r\n')
+        self.pipeline.dataReceived('S>')
+        self.assertEqual(self.written, ['ds\r\n', 'ts\r\n'])
+
+        # One write can carry a response and the start of the next
+        self.pipeline.dataReceived('20.9028,  0.00012\nS>')
+        self.assertEqual(results, ['SBE 49\r\nS>', '20.9028,  0.00012\nS>'])
+        self.assertEqual(self.pipeline.pending(), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_unsolicited_data(self):
+        self.pipeline.start()
+        # An autonomous sample with nothing waiting is not a response
+        self.pipeline.dataReceived('21.9028\nS>')
+        results = self._results([self.pipeline.enqueue('ts\r\n')])
+        self.pipeline.dataReceived('20.9028\nS>')
+        self.assertEqual(results, ['20.9028\nS>'])
+
+    def test_bounded_queue(self):
+        for i in range(3):
+            self.pipeline.enqueue('ts\r\n').addErrback(lambda f: None)
+        self.assertRaises(CommandQueueFull, self.pipeline.enqueue, 'ts\r\n')
+
+        # Sent commands do not count against the bound
+        self.pipeline.start()
+        self.pipeline.enqueue('ts\r\n').addErrback(lambda f: None)
+        self.pipeline.flush()
+
+    def test_first(self):
+        self.pipeline.enqueue('ds\r\n')
+        self.pipeline.enqueue('\r\n', first=True)
+        self.pipeline.start()
+        self.assertEqual(self.written, ['\r\n'])
+
+    def test_timeout_and_retry(self):
+        results = self._results([self.pipeline.enqueue('\r\n', retries=1),
+                                 self.pipeline.enqueue('ds\r\n')])
+        self.pipeline.start()
+
+        self.clock.advance(5)
+        self.assertEqual(self.written, ['\r\n', '\r\n'])
+        self.assertEqual(results, [])
+
+        self.clock.advance(5)
+        self.assertEqual(len(results), 1)
+        results[0].trap(CommandTimeout)
+        self.assertEqual([cmd.command for cmd in self.timedOut], ['\r\n'])
+        self.assertEqual(self.pipeline.timedOut, 1)
+
+        # The next command goes out after the timeout
+        self.assertEqual(self.written[-1], 'ds\r\n')
+        self.pipeline.dataReceived('S>')
+        self.assertEqual(results[1], 'S>')
+
+    def test_late_response(self):
+        # With echoed commands a late response can be told apart
+        results = self._results([self.pipeline.enqueue(cmd, match=responseAfter(cmd, 'S>'))
+                                 for cmd in ('ts', 'ds')])
+        self.pipeline.start()
+        self.pipeline.dataReceived('ts\r\n20.90')
+        self.clock.advance(5)
+        self.pipeline.dataReceived('28\nS>')
+        self.assertEqual(len(results), 1)
+        self.pipeline.dataReceived('ds\r\nSBE 49\r\nS>')
+        self.assertTrue(results[1].endswith('ds\r\nSBE 49\r\nS>'))
+
+    def test_stop(self):
+        results = self._results([self.pipeline.enqueue('ts\r\n'),
+                                 self.pipeline.enqueue('ds\r\n')])
+        self.pipeline.start()
+        self.pipeline.stop()
+
+        self.assertEqual(len(results), 2)
+        for result in results:
+            result.trap(CommandCancelled)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(self.pipeline.pending(), 0)
+
+    def test_deferred_send(self):
+        sending = defer.Deferred()
+        pipeline = CommandPipeline(lambda cmd: sending, '>', timeout=4, clock=self.clock)
+        results = self._results([pipeline.enqueue('break')])
+        pipeline.start()
+
+        # The deadline starts when the send is done
+        self.clock.advance(10)
+        pipeline.dataReceived('>')
+        self.assertEqual(results, [])
+        sending.callback(None)
+        self.clock.advance(3)
+        pipeline.dataReceived('[BREAK Wakeup A]\r\n>')
+        self.assertEqual(results, ['[BREAK Wakeup A]\r\n>'])
+
+    def test_window(self):
+        self.pipeline.window = 2
+        results = self._results([self.pipeline.enqueue(cmd) for cmd in ('a', 'b', 'c')])
+        self.pipeline.start()
+        self.assertEqual(self.written, ['a', 'b'])
+        self.pipeline.dataReceived('1S>2S>')
+        self.assertEqual(results, ['1S>', '2S>'])
+        self.assertEqual(self.written, ['a', 'b', 'c'])
+
+    def test_send_failed(self):
+        def send(cmd):
+            raise RuntimeError('Connection refused')
+        pipeline = CommandPipeline(send, 'S>', timeout=5, clock=self.clock)
+        results = self._results([pipeline.enqueue('ds\r\n'),
+                                 pipeline.enqueue('ts\r\n')])
+        pipeline.start()
+
+        # The instrument can not be reached: the pipeline stops rather than
+        # sending the next command
+        self.assertEqual(len(results), 2)
+        results[0].trap(RuntimeError)
+        results[1].trap(CommandCancelled)
+        self.assertFalse(pipeline.running)
+        self.assertEqual(pipeline.pending(), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_responseAfter(self):
+        match = responseAfter('cr1', '>')
+        self.assertEqual(match('>cr1\r\n'), -1)
+        self.assertEqual(match('>cr1\r\n>'), 7)
+
+
+class Client(object):
+    """
+    The parent of an InstrumentConnection, which hands the data to a pipeline.
+    As the drivers do, the pipeline is started once the commands are queued.
+    """
+    def __init__(self, match):
+        self.instrument = None
+        self.written = []
+        self.pipeline = CommandPipeline(self.write, match, timeout=5)
+
+    def write(self, cmd):
+        self.written.append(cmd)
+        self.instrument.transport.write(cmd)
+
+    def gotConnected(self, instrument):
+        self.instrument = instrument
+
+    def gotDisconnected(self, instrument):
+        self.pipeline.stop()
+
+    def gotData(self, data):
+        self.pipeline.dataReceived(data)
+
+
+class SimulatorPipelineTest(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def _connect(self, port, match):
+        client = Client(match)
+        cc = ClientCreator(reactor, InstrumentConnection, client)
+        self.proto = yield cc.connectTCP('localhost', port)
+        defer.returnValue(client)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        self.proto.transport.loseConnection()
+        yield self.simulator.stop()
+
+    @defer.inlineCallbacks
+    def test_SBE49(self):
+        self.simulator = sim_SBE49.Simulator('123', 9100)
+        port = self.simulator.start()
+        client = yield self._connect(port, 'S>')
+
+        # Queue all of them at once, as the agent does; the wakeup is queued
+        # last but goes out first, since nothing is sent before the start
+        ds = client.pipeline.enqueue('ds\r\n')
+        ts = client.pipeline.enqueue('ts\r\n')
+        wakeup = client.pipeline.enqueue('\r\n', first=True)
+        client.pipeline.start()
+
+        response = yield wakeup
+        self.assertEqual(response, 'S>')
+        response = yield ds
+        self.assertIn('SBE 49 FastCAT SIMULATOR', response)
+        response = yield ts
+        self.assertIn('20.9028', response)
+        self.assertEqual(client.pipeline.answered, 3)
+        self.assertEqual(client.written, ['\r\n', 'ds\r\n', 'ts\r\n'])
+
+    @defer.inlineCallbacks
+    def test_WHSentinelADCP(self):
+        self.simulator = sim_WHSentinelADCP.Simulator('456', 9200)
+        port, cmdport = self.simulator.start()
+        client = yield self._connect(port, '>')
+
+        results = []
+        for cmd in ('cr1', 'ck', 'xyz'):
+            d = client.pipeline.enqueue(cmd + '\r', match=responseAfter(cmd, '>'))
+            results.append(d)
+        client.pipeline.start()
+
+        response = yield results[0]
+        self.assertTrue(response.startswith('cr1\r\n'))
+        response = yield results[1]
+        self.assertIn('[Parameters saved as USER defaults]', response)
+        response = yield results[2]
+        self.assertIn('ERR 010', response)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""
+@file ion/agents/instrumentagents/test/test_driver_pipeline.py
+@brief Test the state machines of the instrument drivers around their
+    command pipelines, without a container or an instrument
+@author agent
+"""
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from ion.services.dm.distribution import pubsub_service
+
+# The drivers import DataPubsubClient, which the pubsub service does not
+# provide; these tests never publish, so a stand-in is enough to import them
+class StubDataPubsubClient(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+_stubbed = not hasattr(pubsub_service, 'DataPubsubClient')
+if _stubbed:
+    pubsub_service.DataPubsubClient = StubDataPubsubClient
+try:
+    from ion.agents.instrumentagents import SBE49_driver
+    from ion.agents.instrumentagents import WHSentinelADCP_driver
+finally:
+    if _stubbed:
+        del pubsub_service.DataPubsubClient
+
+from ion.agents.instrumentagents.SBE49_constants import instrument_prompts
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class FakeInstrument(object):
+    """
+    Stands in for the InstrumentConnection protocol of the driver
+    """
+    def __init__(self):
+        self.transport = FakeTransport()
+
+
+class SBE49DriverStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.driver = SBE49_driver.SBE49InstrumentDriver()
+        self.driver.pipeline.clock = self.clock
+        # Connecting is simulated below
+        self.driver.getConnected = lambda: None
+
+        self.driver.hsm.onStart(self.driver.stateUnconfigured)
+        self.driver.hsm.sendEvent('eventConfigured')
+
+    def tearDown(self):
+        self.driver.pipeline.stop()
+
+    def _connect(self):
+        self.instrument = FakeInstrument()
+        self.driver.hsm.sendEvent('eventCommandReceived')
+        self.driver.gotConnected(self.instrument)
+        self.driver.hsm.sendEvent('eventConnectionComplete')
+
+    def _command(self, command):
+        # As op_execute does
+        d = self.driver.enqueueCmd(command)
+        self.driver.hsm.sendEvent('eventCommandReceived')
+        return d
+
+    def _written(self):
+        return self.instrument.transport.written
+
+    def assertState(self, state):
+        self.assertEqual(self.driver.hsm.stateCurrent()['handler'], state)
+
+    def test_wakeup_then_commands(self):
+        self._connect()
+        self.assertState(self.driver.stateConnected)
+        self.assertEqual(self._written(), [instrument_prompts.PROMPT_INST])
+
+        self.driver.gotData(instrument_prompts.INST_PROMPT)
+        self.assertState(self.driver.statePrompted)
+
+        results = []
+        self._command('ds\r\n').addCallback(results.append)
+        self._command('ts\r\n').addCallback(results.append)
+        self.assertEqual(self._written()[1:], ['ds\r\n'])
+
+        self.driver.gotData('SBE 49\r\nS>')
+        self.assertEqual(self._written()[1:], ['ds\r\n', 'ts\r\n'])
+        self.driver.gotData('20.9028\r\nS>')
+        self.assertEqual(results, ['SBE 49\r\nS>', '20.9028\r\nS>'])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_timeout_wakes_again(self):
+        self._connect()
+        self.driver.gotData(instrument_prompts.INST_PROMPT)
+
+        results = []
+        self._command('ds\r\n').addBoth(results.append)
+        self.clock.advance(SBE49_driver.RESPONSE_TIMEOUT)
+
+        # The timeout went through the state machine and stopped the pipeline
+        self.assertEqual(self.driver.timedOutCmd, 'ds\r\n')
+        self.assertState(self.driver.stateConnected)
+        self.assertFalse(self.driver.pipeline.running)
+
+        # The next command is sent after a new wakeup
+        self._command('ts\r\n')
+        self.assertEqual(self._written()[-1], instrument_prompts.PROMPT_INST)
+        self.driver.gotData(instrument_prompts.INST_PROMPT)
+        self.assertEqual(self._written()[-1], 'ts\r\n')
+
+    def test_send_failed(self):
+        self._connect()
+        self.driver.gotData(instrument_prompts.INST_PROMPT)
+
+        # The connection is gone, but no disconnect was reported yet
+        self.driver.instrument = None
+        results = []
+        self._command('ds\r\n').addBoth(results.append)
+        self._command('ts\r\n').addBoth(results.append)
+
+        # cmdFailed handled both; the pipeline stopped instead of going on
+        self.assertEqual(results, [None, None])
+        self.assertFalse(self.driver.pipeline.running)
+        self.assertEqual(self.driver.pipeline.pending(), 0)
+
+        # Once connected again the next command wakes the instrument first
+        self.driver.instrument = self.instrument
+        written = len(self._written())
+        self._command('ts\r\n')
+        self.assertEqual(self._written()[written:], [instrument_prompts.PROMPT_INST])
+        self.driver.gotData(instrument_prompts.INST_PROMPT)
+        self.assertEqual(self._written()[written:],
+                         [instrument_prompts.PROMPT_INST, 'ts\r\n'])
+
+
+class WHSentinelADCPDriverStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.driver = WHSentinelADCP_driver.WHSentinelADCPInstrumentDriver()
+        self.driver.pipeline.clock = self.clock
+        self.driver.getConnected = lambda: None
+        self.breaks = 0
+        self.driver.sendBreak = self._sendBreak
+
+        self.driver.hsm.onStart(self.driver.stateUnconfigured)
+        self.driver.hsm.sendEvent('eventConfigured')
+
+    def tearDown(self):
+        self.driver.pipeline.stop()
+
+    def _sendBreak(self):
+        # As when the command port refuses the connection
+        self.breaks += 1
+        return defer.fail(RuntimeError('Connection refused'))
+
+    def test_break_failed(self):
+        self.driver.hsm.sendEvent('eventCommandReceived')
+        self.driver.gotConnected(FakeInstrument())
+        self.driver.hsm.sendEvent('eventConnectionComplete')
+
+        results = []
+        d = self.driver.enqueueCmd('cr1')
+        d.addBoth(results.append)
+        self.driver.hsm.sendEvent('eventCommandReceived')
+
+        # The failed break is logged by cmdFailed, not left unhandled, and
+        # the command behind it is cancelled
+        self.assertEqual(self.breaks, 1)
+        self.assertEqual(results, [None])
+        self.assertFalse(self.driver.pipeline.running)
+        self.assertEqual(self.driver.pipeline.pending(), 0)
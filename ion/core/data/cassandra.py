@@ -23,6 +23,7 @@ from telephus.cassandra.ttypes import ColumnDef, IndexExpression, IndexOperator
 from ion.core.data import store
 
 from ion.util.tcp_connections import TCPConnection
+from ion.util.deferreds import gather
 
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
@@ -138,6 +139,61 @@ class CassandraStore(TCPConnection):
         @note Deletes are lazy, so key may still be visible for some time.
         """
         yield self.client.remove(key, self._cache_name)
+
+    @defer.inlineCallbacks
+    def get_many(self, keys):
+        """
+        @brief Read the values of many keys with one multiget_slice
+        @retval Deferred, for dict of key to value, None for keys not existing
+        """
+        keys = list(keys)
+        values = {}
+        if keys:
+            rows = yield self.client.multiget_slice(keys, self._cache_name, names=['value'])
+            for key, columns in rows.iteritems():
+                if columns:
+                    values[key] = columns[0].column.value
+        defer.returnValue(dict([(key, values.get(key)) for key in keys]))
+
+    def put_many(self, items):
+        """
+        @brief Write many key/value pairs with one batch_mutate
+        @param items dict of key to value, or list of (key, value) pairs
+        @retval Deferred for success
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        mutations = {}
+        for key, value in items:
+            mutations[key] = {self._cache_name:{'value':value}}
+        if not mutations:
+            return defer.succeed(None)
+        log.debug("CassandraStore: Calling put_many on %d keys" % len(mutations))
+        return self.client.batch_mutate(mutations)
+
+    def remove_many(self, keys):
+        """
+        @brief Delete many rows. Cassandra 0.7 can not delete a whole row in
+        a batch_mutate, so the removes are sent together on the connection.
+        @retval Deferred, for success of operation
+        """
+        d = gather([self.client.remove(key, self._cache_name) for key in keys])
+        d.addCallback(lambda _: None)
+        return d
+
+    @defer.inlineCallbacks
+    def exists_many(self, keys):
+        """
+        @brief Test many keys with one multiget_slice which reads at most one
+        column of each row
+        @retval Deferred, for dict of key to True if the row has a value
+        """
+        keys = list(keys)
+        found = {}
+        if keys:
+            rows = yield self.client.multiget_slice(keys, self._cache_name, count=1)
+            found = dict([(key, bool(columns)) for key, columns in rows.iteritems()])
+        defer.returnValue(dict([(key, found.get(key, False)) for key in keys]))
     
     def on_deactivate(self, *args, **kwargs):
         self._manager.shutdown()
@@ -48,6 +48,30 @@ class IStore(Interface):
      
         """
 
+    def get_many(keys):
+        """
+        @param keys  list of keys
+        @retval Deferred, for dict of key to value, None for keys not existing
+        """
+
+    def put_many(items):
+        """
+        @param items  dict of key to value, or list of (key, value) pairs
+        @retval Deferred, for success of this operation
+        """
+
+    def remove_many(keys):
+        """
+        @param keys  list of keys
+        @retval Deferred, for success of this operation
+        """
+
+    def exists_many(keys):
+        """
+        @param keys  list of keys
+        @retval Deferred, for dict of key to True if a value is associated
+        """
+
 class Store(object):
     """
     Memory implementation of an asynchronous key/value store, using a dict.
@@ -80,6 +104,35 @@ class Store(object):
             del self.kvs[key]
         return defer.succeed(None)
 
+    def get_many(self, keys):
+        """
+        @see IStore.get_many
+        """
+        return defer.succeed(dict([(key, self.kvs.get(key, None)) for key in keys]))
+
+    def put_many(self, items):
+        """
+        @see IStore.put_many
+        """
+        if isinstance(items, dict):
+            items = items.items()
+        self.kvs.update(items)
+        return defer.succeed(None)
+
+    def remove_many(self, keys):
+        """
+        @see IStore.remove_many
+        """
+        for key in keys:
+            self.kvs.pop(key, None)
+        return defer.succeed(None)
+
+    def exists_many(self, keys):
+        """
+        @see IStore.exists_many
+        """
+        return defer.succeed(dict([(key, self.kvs.has_key(key)) for key in keys]))
+
 class IDataManager(Interface):
     """
     @note Proposed class to fulfill preservation service management?
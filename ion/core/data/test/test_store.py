@@ -87,6 +87,30 @@ class IStoreTest(unittest.TestCase):
         self.failUnlessEqual(self.value, b)
         yield self.ds.remove(self.key)
 
+    #@itv(CONF)
+    @defer.inlineCallbacks
+    def test_put_get_many(self):
+        items = dict([(str(uuid4()), str(uuid4())) for i in range(5)])
+        yield self.ds.put_many(items)
+
+        values = yield self.ds.get_many(items.keys() + [self.key])
+        self.failUnlessEqual(values.pop(self.key), None)
+        self.failUnlessEqual(values, items)
+        yield self.ds.remove_many(items.keys())
+
+    #@itv(CONF)
+    @defer.inlineCallbacks
+    def test_remove_exists_many(self):
+        keys = [str(uuid4()) for i in range(4)]
+        yield self.ds.put_many([(key, self.value) for key in keys])
+        yield self.ds.remove_many(keys[:2])
+
+        found = yield self.ds.exists_many(keys + [self.key])
+        self.failUnlessEqual(found, {keys[0]:False, keys[1]:False,
+                                     keys[2]:True, keys[3]:True,
+                                     self.key:False})
+        yield self.ds.remove_many(keys)
+
 
 class CassandraStoreTest(IStoreTest):
 
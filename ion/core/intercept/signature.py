@@ -7,6 +7,9 @@
 """
 
 import hashlib
+import os
+import time
+from collections import deque
 try:
     import json
 except:
@@ -30,6 +33,10 @@ msg_sign = CONF.getValue('msg_sign', True)
 #XXX HACKS
 _priv_key_path = CONF.getValue('priv_key_path')
 _cert_path = CONF.getValue('cert_path')
+# Seconds between checks of the key and certificate file modification times
+key_check_interval = CONF.getValue('key_check_interval', 1.0)
+# Number of signature verification results to remember
+verified_cache_size = CONF.getValue('verified_cache_size', 1024)
 
 
 class DigitalSignatureInterceptor(interceptor.EnvelopeInterceptor):
@@ -57,6 +64,122 @@ class DigitalSignatureInterceptor(interceptor.EnvelopeInterceptor):
         invocation.message = msg
         return invocation
 
+class KeyFileCache(object):
+    """
+    @brief Key material read from files and parsed once. A file is read and
+    parsed again when its modification time changes; the modification time
+    is checked at most once every check_interval seconds.
+    """
+
+    def __init__(self, parse, check_interval=1.0):
+        """
+        @param parse a function of the file contents which returns the parsed
+        key material
+        @param check_interval seconds between checks of the file modification
+        time. Zero checks on every access.
+        """
+        self._parse = parse
+        self.check_interval = check_interval
+        self.loads = 0
+
+        self._entries = {}
+        """
+        Map of path to a list of [mtime, checked time, contents, parsed]
+        """
+
+    def get(self, path):
+        """
+        @retval a tuple of the file contents and the parsed key material
+        """
+        entry = self._entries.get(path, None)
+        now = time.time()
+        if entry is not None and now - entry[1] < self.check_interval:
+            return entry[2], entry[3]
+
+        mtime = os.stat(path).st_mtime
+        if entry is None or entry[0] != mtime:
+            f = open(path)
+            contents = f.read()
+            f.close()
+            entry = [mtime, now, contents, self._parse(contents)]
+            self._entries[path] = entry
+            self.loads += 1
+        else:
+            entry[1] = now
+        return entry[2], entry[3]
+
+    def clear(self):
+        self._entries = {}
+
+
+class VerifiedCache(object):
+    """
+    @brief A small LRU of signature verification results
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = {}
+        """
+        Map of key to a list of [value, stamp]
+        """
+
+        self._order = deque()
+        """
+        (stamp, key) in order of use. Entries whose stamp no longer matches
+        were used again later and are skipped on eviction.
+        """
+
+        self._stamp = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._touch(key, entry)
+        return entry[0]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        entry = self._entries.get(key, None)
+        if entry is None:
+            entry = [value, 0]
+            self._entries[key] = entry
+        else:
+            entry[0] = value
+        self._touch(key, entry)
+
+        while len(self._entries) > self.max_entries:
+            stamp, old = self._order.popleft()
+            old_entry = self._entries.get(old, None)
+            if old_entry is not None and old_entry[1] == stamp:
+                del self._entries[old]
+
+    def clear(self):
+        self._entries = {}
+        self._order.clear()
+
+    def _touch(self, key, entry):
+        self._stamp += 1
+        entry[1] = self._stamp
+        self._order.append((self._stamp, key))
+
+        if len(self._order) > 4 * max(self.max_entries, len(self._entries)):
+            # Drop the stale stamps
+            live = [(entry[1], key) for key, entry in self._entries.iteritems()]
+            live.sort()
+            self._order = deque(live)
+
+
 class SystemSecurityPlugin(interceptor.EnvelopeInterceptor):
     """Decorate outgoing messages with security attributes and read
     security attributes of incoming messages.
@@ -78,8 +201,14 @@ class SystemSecurityPlugin(interceptor.EnvelopeInterceptor):
     
     Need to research more on what other user/security attributes should be
     included in the message headers.
+
+    The private key and the certificates are parsed once and read again only
+    when their files change. Verification results are remembered by signer,
+    content hash and signature, so a repeated message is not verified twice.
     """
 
+    TIMED_OPERATIONS = ('hash', 'sign', 'verify', 'load_key', 'load_cert')
+
     def __init__(self, name, system_priv_key_path=None, allowed_certs={}):
         interceptor.EnvelopeInterceptor.__init__(self, name)
         #XXX @todo need to be able to properly configure this interceptor
@@ -94,11 +223,47 @@ class SystemSecurityPlugin(interceptor.EnvelopeInterceptor):
         self.allowed_certs = allowed_certs
         self.auth = authentication.Authentication()
 
-    def _read_key(self, path):
-        f = open(path)
-        key = f.read()
-        f.close()
-        return key
+        self.timing = {}
+        """
+        Map of operation name to [count, total seconds]
+        """
+        for op in self.TIMED_OPERATIONS:
+            self.timing[op] = [0, 0.0]
+
+        self._keys = KeyFileCache(self._timed_parser('load_key', self.auth.load_private_key),
+                                  key_check_interval)
+        self._certs = KeyFileCache(self._timed_parser('load_cert', self.auth.load_certificate_pubkey),
+                                   key_check_interval)
+        self._verified = VerifiedCache(verified_cache_size)
+
+    def _timed_parser(self, op, parse):
+        def timed_parse(contents):
+            tstart = time.time()
+            result = parse(contents)
+            self._count(op, tstart)
+            return result
+        return timed_parse
+
+    def _count(self, op, tstart):
+        counter = self.timing[op]
+        counter[0] += 1
+        counter[1] += time.time() - tstart
+
+    def stats(self):
+        """
+        @brief Report the time spent in each crypto operation and the cache
+        counters
+        @retval dictionary of counters
+        """
+        stats = {'verified_hits':self._verified.hits,
+                 'verified_misses':self._verified.misses,
+                 'verified_entries':len(self._verified),
+                 'key_loads':self._keys.loads,
+                 'cert_loads':self._certs.loads}
+        for op, (count, seconds) in self.timing.iteritems():
+            stats[op + '_count'] = count
+            stats[op + '_seconds'] = seconds
+        return stats
 
     def certs(self, id):
         """
@@ -107,12 +272,12 @@ class SystemSecurityPlugin(interceptor.EnvelopeInterceptor):
         """
         path = self.allowed_certs[id] #XXX Need an error condition for a
                                       #bad id
-        cert = self._read_key(path)
+        cert, pubkey = self._certs.get(path)
         return cert
 
     @property
     def priv_key(self):
-        key = self._read_key(self._priv_key_path)
+        key, pkey = self._keys.get(self._priv_key_path)
         return key
 
     def after(self, invocation):
@@ -122,6 +287,7 @@ class SystemSecurityPlugin(interceptor.EnvelopeInterceptor):
         encoded content. Add signature to the message headers.
         """
         content = invocation.message['content'] #Hope this is a string!
+        tstart = time.time()
         try:
             hash = hashlib.sha1(content).hexdigest()
         except TypeError:
@@ -130,8 +296,12 @@ class SystemSecurityPlugin(interceptor.EnvelopeInterceptor):
             # of error.
             invocation.error(note='Error taking hash of content!')
             return invocation
-        priv_key = self.priv_key
-        signature = self.auth.sign_message(hash, priv_key)
+        self._count('hash', tstart)
+
+        key, pkey = self._keys.get(self._priv_key_path)
+        tstart = time.time()
+        signature = self.auth.sign_message_pkey(hash, pkey)
+        self._count('sign', tstart)
         invocation.message['signer'] = 'ooi-ion' #XXX What should this header be?
         invocation.message['signature'] = signature
         # Do we call invocation.proceed ???
@@ -146,11 +316,12 @@ class SystemSecurityPlugin(interceptor.EnvelopeInterceptor):
         #hack check of message spec!
         if message.has_key('signature') and message.has_key('signer'):
             content = invocation.message['content'] #this better be there
+            tstart = time.time()
             hash = hashlib.sha1(content).hexdigest()
+            self._count('hash', tstart)
             signature = invocation.message['signature']
             signer = invocation.message['signer']
-            cert = self.certs(signer)
-            verifiedQ = self.auth.verify_message(hash, cert, signature)
+            verifiedQ = self._verify(signer, hash, signature)
             if verifiedQ:
                 # Do we call invocation.proceed ???
                 return invocation
@@ -161,6 +332,26 @@ class SystemSecurityPlugin(interceptor.EnvelopeInterceptor):
             invocation.drop('Invalid Message Format')
             return invocation
 
+    def _verify(self, signer, hash, signature):
+        """
+        Verify the signature of a content hash, or return the remembered
+        result. A result is only used while the signer's certificate is the
+        one it was verified with.
+        """
+        path = self.allowed_certs[signer]
+        cert, pubkey = self._certs.get(path)
+
+        key = (signer, hash, signature)
+        result = self._verified.get(key)
+        if result is not None and result[0] is pubkey:
+            return result[1]
+
+        tstart = time.time()
+        verifiedQ = self.auth.verify_message_pubkey(hash, pubkey, signature)
+        self._count('verify', tstart)
+        self._verified.put(key, (pubkey, verifiedQ))
+        return verifiedQ
+
 
 if not msg_sign:
     del DigitalSignatureInterceptor
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+@file ion/core/intercept/test/test_signature.py
+@brief test the key caches of the system security interceptor
+"""
+import os
+import shutil
+import tempfile
+
+from twisted.trial import unittest
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from ion.core.intercept.interceptor import Invocation
+from ion.core.intercept import signature
+
+
+class SystemSecurityPluginCacheTest(unittest.TestCase):
+
+    def test_verified_cache(self):
+        """
+        Test that a repeated message is verified once and that the key and
+        certificate are parsed once
+        """
+        plugin = signature.SystemSecurityPlugin('sig')
+
+        for i in range(3):
+            inv = Invocation(path=Invocation.PATH_OUT, message={'content':'foo'})
+            inv = plugin.after(inv)
+            inv.path = Invocation.PATH_IN
+            inv = plugin.before(inv)
+            self.failUnlessEqual(inv.status, Invocation.STATUS_PROCESS)
+
+        stats = plugin.stats()
+        self.failUnlessEqual(stats['sign_count'], 3)
+        self.failUnlessEqual(stats['verify_count'], 1)
+        self.failUnlessEqual(stats['verified_hits'], 2)
+        self.failUnlessEqual(stats['key_loads'], 1)
+        self.failUnlessEqual(stats['cert_loads'], 1)
+
+        # A modified message is still verified and dropped
+        inv.message['content'] = 'bar'
+        inv = plugin.before(inv)
+        self.failUnlessEqual(inv.status, Invocation.STATUS_DROP)
+
+    def test_key_reload(self):
+        """
+        Test that the private key is read again when its file changes
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'test.priv.pem')
+            shutil.copy(signature._priv_key_path, path)
+
+            plugin = signature.SystemSecurityPlugin('sig', system_priv_key_path=path)
+            plugin._keys.check_interval = 0
+
+            key = plugin.priv_key
+            plugin.priv_key
+            self.failUnlessEqual(plugin.stats()['key_loads'], 1)
+
+            mtime = os.stat(path).st_mtime
+            os.utime(path, (mtime + 10, mtime + 10))
+            self.failUnlessEqual(plugin.priv_key, key)
+            self.failUnlessEqual(plugin.stats()['key_loads'], 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class VerifiedCacheTest(unittest.TestCase):
+
+    def test_lru(self):
+        cache = signature.VerifiedCache(max_entries=3)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, key.upper())
+
+        # Use a so that b is the least recently used
+        self.failUnlessEqual(cache.get('a'), 'A')
+        cache.put('d', 'D')
+
+        self.failUnlessEqual(len(cache), 3)
+        self.failUnlessEqual(cache.get('b'), None)
+        self.failUnlessEqual(cache.get('a'), 'A')
+        self.failUnlessEqual(cache.get('d'), 'D')
+        self.failUnlessEqual(cache.hits, 3)
+        self.failUnlessEqual(cache.misses, 1)
+
+    def test_stale_order_is_compacted(self):
+        cache = signature.VerifiedCache(max_entries=2)
+        cache.put('a', 1)
+        for i in range(100):
+            cache.get('a')
+        self.failUnless(len(cache._order) <= 8)
+        self.failUnlessEqual(cache.get('a'), 1)
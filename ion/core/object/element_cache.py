@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+"""
+@file ion/core/object/element_cache.py
+@brief Bounded caches for the hashed structure elements shared by the
+repositories of a work bench. The caches present the small part of the dict
+interface which the object management stack uses (get, has_key, update, item
+access) so that they can replace the plain dictionary in the WorkBench.
+@author agent
+"""
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+
+class ElementCacheError(Exception):
+    """
+    An exception class for errors in the element cache
+    """
+
+
+# Approximate memory cost of the wrapper, the GPB structure element and the
+# dictionary entries which hold an element - in addition to key and value.
+ELEMENT_OVERHEAD = 200
+
+def element_size(element):
+    """
+    @brief Estimate the number of bytes held by a structure element
+    """
+    return len(element.value) + len(element.key) + ELEMENT_OVERHEAD
+
+
+class _Node(object):
+    """
+    Entry in a doubly linked list of cache entries
+    """
+    __slots__ = ('prev', 'next', 'key', 'element', 'size', 'owner')
+
+    def __init__(self, key, element, size):
+        self.prev = None
+        self.next = None
+        self.key = key
+        self.element = element
+        self.size = size
+        self.owner = None
+
+
+class _NodeList(object):
+    """
+    A doubly linked list with O(1) append and remove.
+    The head of the list is the least recently used entry.
+    """
+
+    def __init__(self):
+        self.head = None
+        self.tail = None
+        self.nbytes = 0
+        self.count = 0
+
+    def append(self, node):
+        node.owner = self
+        node.prev = self.tail
+        node.next = None
+        if self.tail is None:
+            self.head = node
+        else:
+            self.tail.next = node
+        self.tail = node
+        self.nbytes += node.size
+        self.count += 1
+
+    def remove(self, node):
+        if node.prev is None:
+            self.head = node.next
+        else:
+            node.prev.next = node.next
+        if node.next is None:
+            self.tail = node.prev
+        else:
+            node.next.prev = node.prev
+        node.prev = node.next = node.owner = None
+        self.nbytes -= node.size
+        self.count -= 1
+
+
+class ElementCache(object):
+    """
+    @brief Unbounded element cache - the historical behavior of the work bench
+    hashed elements dictionary, plus hit and miss accounting. Subclasses
+    implement an eviction policy by overriding _insert, _touch, _discard and
+    _evict.
+
+    Eviction never removes an element that is pinned. The pinned set is
+    provided by a callable (normally the work bench) which returns the keys of
+    all elements still reachable from live repositories. It is evaluated once
+    per eviction pass; a pass reduces the cache to low_water * max_bytes so
+    that the cost of computing the pinned set is amortized over many inserts.
+    """
+
+    policy = 'none'
+
+    def __init__(self, max_bytes=None, pinned=None, low_water=0.9):
+        """
+        @param max_bytes the byte budget for the cache, None for unbounded
+        @param pinned a callable returning a set of keys which may not be evicted
+        @param low_water fraction of max_bytes to evict down to when the budget is exceeded
+        """
+        if max_bytes is not None and max_bytes <= 0:
+            raise ElementCacheError('The element cache byte budget must be positive: %s' % max_bytes)
+        if not 0 < low_water <= 1:
+            raise ElementCacheError('The element cache low water mark must be in (0, 1]: %s' % low_water)
+
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.pinned = pinned
+
+        self.listener = None
+        """
+        A callable given a dictionary of the elements new to the cache after
+        each update - used to write them behind to a persistent store
+        """
+
+        self._nodes = {}
+        """
+        Map from element key to the list node holding the element
+        """
+
+        self._list = _NodeList()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.pinned_skips = 0
+
+    def __repr__(self):
+        return '<%s policy=%s entries=%d bytes=%d max_bytes=%s>' % \
+            (self.__class__.__name__, self.policy, len(self), self.nbytes, self.max_bytes)
+
+    # Dictionary interface used by the object management stack
+
+    def get(self, key, default=None):
+        node = self._nodes.get(key, None)
+        if node is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._touch(node)
+        return node.element
+
+    def __getitem__(self, key):
+        node = self._nodes.get(key, None)
+        if node is None:
+            self.misses += 1
+            raise KeyError(key)
+        self.hits += 1
+        self._touch(node)
+        return node.element
+
+    def peek(self, key, default=None):
+        """
+        Get an element without counting a hit or miss or changing its recency
+        """
+        node = self._nodes.get(key, None)
+        if node is None:
+            return default
+        return node.element
+
+    def has_key(self, key):
+        return key in self._nodes
+
+    __contains__ = has_key
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        return iter(self._nodes.keys())
+
+    def keys(self):
+        return self._nodes.keys()
+
+    def values(self):
+        return [node.element for node in self._nodes.itervalues()]
+
+    def items(self):
+        return [(key, node.element) for key, node in self._nodes.iteritems()]
+
+    def __setitem__(self, key, element):
+        self.update({key:element})
+
+    def update(self, elements):
+        """
+        Add a dictionary of elements. Eviction is deferred until all of the
+        elements are in and none of the new elements are evicted by this call.
+        """
+        added = {}
+        for key, element in elements.iteritems():
+            if self._set(key, element):
+                added[key] = element
+        self._maybe_evict(exclude=elements)
+        if added and self.listener is not None:
+            self.listener(added)
+
+    def load(self, elements):
+        """
+        Add a dictionary of elements read back from a persistent store. Like
+        update, but the listener is not told about them.
+        """
+        for key, element in elements.iteritems():
+            self._set(key, element)
+        self._maybe_evict(exclude=elements)
+
+    def __delitem__(self, key):
+        node = self._nodes.pop(key)
+        self._discard(node)
+
+    def pop(self, key, *default):
+        node = self._nodes.pop(key, None)
+        if node is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        self._discard(node)
+        return node.element
+
+    def clear(self):
+        for key in self._nodes.keys():
+            del self[key]
+
+    @property
+    def nbytes(self):
+        """
+        The estimated number of bytes held by the cached elements
+        """
+        return self._nbytes()
+
+    def stats(self):
+        """
+        @brief Report the state of the cache so that it can be sized per process
+        @retval dictionary of counters
+        """
+        lookups = self.hits + self.misses
+        if lookups:
+            hit_ratio = float(self.hits) / lookups
+        else:
+            hit_ratio = 0.0
+        return {'policy':self.policy,
+                'entries':len(self),
+                'bytes':self.nbytes,
+                'max_bytes':self.max_bytes,
+                'hits':self.hits,
+                'misses':self.misses,
+                'hit_ratio':hit_ratio,
+                'evictions':self.evictions,
+                'evicted_bytes':self.evicted_bytes,
+                'pinned_skips':self.pinned_skips}
+
+    # Internals
+
+    def _set(self, key, element):
+        """
+        @retval True if the key was not in the cache
+        """
+        size = element_size(element)
+        node = self._nodes.get(key, None)
+        if node is not None:
+            # Content addressed - the element is the same, but keep the newest
+            # wrapper since it may carry the child links.
+            node.element = element
+            self._resize(node, size)
+            self._touch(node)
+            return False
+
+        node = _Node(key, element, size)
+        self._nodes[key] = node
+        self._insert(node)
+        return True
+
+    def _maybe_evict(self, exclude=()):
+        if self.max_bytes is None or self._nbytes() <= self.max_bytes:
+            return
+
+        pinned = set()
+        if self.pinned is not None:
+            pinned.update(self.pinned())
+        pinned.update(exclude)
+
+        target = int(self.max_bytes * self.low_water)
+        self._evict(target, pinned)
+
+        if self._nbytes() > self.max_bytes:
+            log.warn('Element cache over budget after eviction: %d bytes held, %d bytes allowed; all remaining elements are pinned' % \
+                (self._nbytes(), self.max_bytes))
+
+    def evict(self, max_bytes):
+        """
+        @brief Evict unpinned elements until at most max_bytes are held,
+        whatever the byte budget of the cache
+        @retval the number of bytes held after eviction
+        """
+        if self._nbytes() > max_bytes:
+            pinned = set()
+            if self.pinned is not None:
+                pinned.update(self.pinned())
+            self._evict(max_bytes, pinned)
+        return self._nbytes()
+
+    def _remove_evicted(self, node):
+        """
+        Bookkeeping for a node chosen by the policy for eviction
+        """
+        del self._nodes[node.key]
+        self.evictions += 1
+        self.evicted_bytes += node.size
+
+    # Policy hooks - the base class keeps everything in a single list
+
+    def _nbytes(self):
+        return self._list.nbytes
+
+    def _insert(self, node):
+        self._list.append(node)
+
+    def _touch(self, node):
+        pass
+
+    def _resize(self, node, size):
+        owner = node.owner
+        owner.nbytes += size - node.size
+        node.size = size
+
+    def _discard(self, node):
+        node.owner.remove(node)
+
+    def _evict(self, target, pinned):
+        pass
+
+
+class LRUElementCache(ElementCache):
+    """
+    @brief Element cache which evicts the least recently used unpinned elements
+    """
+
+    policy = 'lru'
+
+    def _touch(self, node):
+        self._list.remove(node)
+        self._list.append(node)
+
+    def _evict(self, target, pinned):
+        for i in xrange(self._list.count):
+            if self._list.nbytes <= target:
+                break
+            node = self._list.head
+            self._list.remove(node)
+            if node.key in pinned:
+                # Pinned elements are in use - treat them as recently used
+                self.pinned_skips += 1
+                self._list.append(node)
+                continue
+            self._remove_evicted(node)
+
+
+class ARCElementCache(ElementCache):
+    """
+    @brief Element cache using Adaptive Replacement Cache eviction.
+
+    Elements seen once live in T1, elements seen more than once in T2. The
+    ghost lists B1 and B2 remember the keys (and sizes) of elements recently
+    evicted from T1 and T2; a new insert which hits a ghost moves the target
+    size of T1 (p) toward the list which would have kept it. All quantities are
+    measured in bytes rather than entries since the elements vary greatly in
+    size.
+    """
+
+    policy = 'arc'
+
+    def __init__(self, max_bytes=None, pinned=None, low_water=0.9):
+        ElementCache.__init__(self, max_bytes, pinned, low_water)
+        self._t1 = self._list
+        self._t2 = _NodeList()
+        self._b1 = _NodeList()
+        self._b2 = _NodeList()
+        self._ghosts = {}
+        self.p = 0
+
+    def _nbytes(self):
+        return self._t1.nbytes + self._t2.nbytes
+
+    def _insert(self, node):
+        ghost = self._ghosts.pop(node.key, None)
+        if ghost is None:
+            self._t1.append(node)
+            return
+
+        # A ghost hit - adapt the target size of T1 and admit straight to T2
+        if ghost.owner is self._b1:
+            ratio = max(float(self._b2.nbytes) / max(self._b1.nbytes, 1), 1.0)
+            self.p = min(self.p + int(ratio * node.size), self.max_bytes or 0)
+        else:
+            ratio = max(float(self._b1.nbytes) / max(self._b2.nbytes, 1), 1.0)
+            self.p = max(self.p - int(ratio * node.size), 0)
+        ghost.owner.remove(ghost)
+        self._t2.append(node)
+
+    def _touch(self, node):
+        node.owner.remove(node)
+        self._t2.append(node)
+
+    def _evict(self, target, pinned):
+        while self._nbytes() > target:
+            if self._t1.nbytes > 0 and (self._t1.nbytes > self.p or self._t2.nbytes == 0):
+                victim = self._victim(self._t1, pinned) or self._victim(self._t2, pinned)
+            else:
+                victim = self._victim(self._t2, pinned) or self._victim(self._t1, pinned)
+
+            if victim is None:
+                # Everything left is pinned
+                break
+
+            if victim.owner is self._t1:
+                ghosts = self._b1
+            else:
+                ghosts = self._b2
+            victim.owner.remove(victim)
+            self._remove_evicted(victim)
+
+            # Keep only the key and size in the ghost list
+            victim.element = None
+            ghosts.append(victim)
+            self._ghosts[victim.key] = victim
+
+        self._trim_ghosts()
+
+    def _victim(self, nodelist, pinned):
+        for i in xrange(nodelist.count):
+            node = nodelist.head
+            if node.key not in pinned:
+                return node
+            # Pinned elements are in use - treat them as recently used
+            self.pinned_skips += 1
+            nodelist.remove(node)
+            nodelist.append(node)
+        return None
+
+    def _trim_ghosts(self):
+        limit = self.max_bytes
+        while self._b1.nbytes + self._b2.nbytes > limit:
+            if self._b1.nbytes > self._b2.nbytes:
+                ghost = self._b1.head
+            else:
+                ghost = self._b2.head
+            ghost.owner.remove(ghost)
+            del self._ghosts[ghost.key]
+
+
+CACHE_POLICIES = {'none':ElementCache,
+                  'lru':LRUElementCache,
+                  'arc':ARCElementCache}
+"""
+The available element cache policies by name. Add a class here to make a new
+policy available to the work bench configuration.
+"""
+
+def create_element_cache(policy='lru', max_bytes=None, pinned=None, low_water=0.9):
+    """
+    @brief Factory for element caches
+    @param policy the name of a policy in CACHE_POLICIES
+    @param max_bytes the byte budget for the cache, None for unbounded
+    @param pinned a callable returning the set of keys which may not be evicted
+    @retval an ElementCache instance
+    """
+    try:
+        cls = CACHE_POLICIES[policy]
+    except KeyError, ex:
+        raise ElementCacheError('Unknown element cache policy "%s"; valid policies are: %s' % \
+            (policy, ', '.join(sorted(CACHE_POLICIES.keys()))))
+    return cls(max_bytes=max_bytes, pinned=pinned, low_water=low_water)
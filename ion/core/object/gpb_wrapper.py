@@ -10,6 +10,7 @@ Finish test of new Invalid methods using weakrefs - make sure it is deleted!
 
 from ion.util import procutils as pu
 
+from ion.core.object import object_utils
 from ion.core.object.object_utils import set_type_from_obj, sha1bin, sha1hex, sha1_to_hex, ObjectUtilException
 
 import ion.util.ionlog
@@ -72,10 +73,10 @@ class Wrapper(object):
         
         """
         
-        object.__setattr__(self,'_gpbFields',[])
+        object.__setattr__(self,'_gpbFields',{})
         """
-        A list of fields names empty for now... so that we can use getter/setters
-        on the data elements of the wrapped proto buffer
+        The accessor table for the fields of the wrapped proto buffer - empty
+        for now so that we can use the default getter/setters during init
         """
         
         object.__setattr__(self,'_invalid',False)
@@ -91,12 +92,8 @@ class Wrapper(object):
         
         self._gpbMessage = gpbMessage
         self._GPBClass = gpbMessage.__class__
-        # Get the GPB Field Names
-        field_names = self._GPBClass.DESCRIPTOR.fields_by_name.keys()
-        # Get the GPB Enum Names
-        for enum_type in self._GPBClass.DESCRIPTOR.enum_types:
-            for enum_value in enum_type.values:
-                field_names.append(enum_value.name)
+        # Get the accessors for the GPB Field and Enum Names
+        accessors = get_accessor_table(self._GPBClass)
         
         try:
             self._gpb_type = set_type_from_obj(gpbMessage)
@@ -155,7 +152,7 @@ class Wrapper(object):
         """
         
         # Now set the fields from that GPB to preempt getter/setter!
-        self._gpbFields = field_names
+        self._gpbFields = accessors
                 
         
     @property
@@ -175,7 +172,7 @@ class Wrapper(object):
         self._repository = None
         self._bytes = None
         self._root = None
-        object.__setattr__(self,'_gpbFields',[])
+        object.__setattr__(self,'_gpbFields',{})
         
         self._invalid = True
         
@@ -376,8 +373,12 @@ class Wrapper(object):
             raise OOIObjectError('Can not access Invalidated Object which may be left behind after a checkout or reset.')
             
         self.read_only = True
+        repo = self.Repository
         for link in self.ChildLinks:
-            child = self.Repository.get_linked_object(link)
+            # Do not load children which have not been accessed yet
+            child = repo._workspace.get(link.key, None)
+            if child is None:
+                continue
             child.SetStructureReadOnly()
         
         
@@ -389,8 +390,12 @@ class Wrapper(object):
             raise OOIObjectError('Can not access Invalidated Object which may be left behind after a checkout or reset.')
             
         self.read_only = False
+        repo = self.Repository
         for link in self.ChildLinks:
-            child = self.Repository.get_linked_object(link)
+            # Do not load children which have not been accessed yet
+            child = repo._workspace.get(link.key, None)
+            if child is None:
+                continue
             child.SetStructureReadWrite()
 
     def RecurseCommit(self,structure):
@@ -540,77 +545,42 @@ class Wrapper(object):
 
     def __getattribute__(self, key):
         
-        invalid = object.__getattribute__(self,'Invalid')
+        # Because we have over-riden the default getattribute we must be extremely
+        # careful about how we use it!
+        # Fields of the GPB dispatch straight to the getter for their kind. An
+        # invalidated wrapper has an empty table, so it falls through below.
+        accessor = object.__getattribute__(self,'_gpbFields').get(key, None)
+        if accessor is not None:
+            return accessor[0](self, key)
+        
+        invalid = object.__getattribute__(self,'_invalid')
         if key == 'Invalid':
             return invalid
         elif invalid:
             raise OOIObjectError('Can not access Invalidated Object which may be left behind after a checkout or reset.')
             
-        # Because we have over-riden the default getattribute we must be extremely
-        # careful about how we use it!
-        gpbfields = object.__getattribute__(self,'_gpbFields')
-        
-        if key in gpbfields:
-            
-            # If it is a Field defined by the gpb...
-            gpb = self.GPBMessage
-            
-            # This may be the result we were looking for, in the case of a simple
-            # scalar field
-            field = getattr(gpb,key)
-            
-            # Or it may be something more complex that we need to operate on...        
-            if isinstance(field, containers.RepeatedScalarFieldContainer):
-                result = ScalarContainerWrapper.factory(self, field)
-                
-            elif isinstance(field, containers.RepeatedCompositeFieldContainer):
-                result = ContainerWrapper.factory(self, field)
-                
-            elif isinstance(field, message.Message):
-                result = self._rewrap(field)
-                
-                if result.ObjectType == self.LinkClassType:
-                    result = self.Repository.get_linked_object(result)
-            else:
-                # Probably bad that the common case comes last!
-                result = field
-                
-        else:
-            # If it is a attribute of this class, use the base class's getattr
-            try:
-                result = object.__getattribute__(self, key)
-            except AttributeError, ex:                
-                raise OOIObjectError(
-                '''"Wrapper" object for GPB class "%s"; has no attribute "%s"''' 
-                % (self._GPBClass, key))
+        # If it is a attribute of this class, use the base class's getattr
+        try:
+            result = object.__getattribute__(self, key)
+        except AttributeError, ex:                
+            raise OOIObjectError(
+            '''"Wrapper" object for GPB class "%s"; has no attribute "%s"''' 
+            % (self._GPBClass, key))
         
         return result
 
     def __setattr__(self,key,value):
 
-        if object.__getattribute__(self,'Invalid'):
+        if object.__getattribute__(self,'_invalid'):
             raise OOIObjectError('Can not access Invalidated Object which may be left behind after a checkout or reset.')
 
-        gpbfields = object.__getattribute__(self,'_gpbFields')
-        
-        if key in gpbfields:
+        accessor = object.__getattribute__(self,'_gpbFields').get(key, None)
+        if accessor is not None:
             # If it is a Field defined by the gpb...
             if self.ReadOnly:
                 raise OOIObjectError('This object wrapper is read only!')
-                        
-            gpb = self.GPBMessage
-
-            # If the value we are setting is a Wrapper Object
-            if isinstance(value, Wrapper):
-                    
-                if value.Invalid:
-                    raise OOIObjectError('Can not access Invalidated Object which may be left behind after a checkout or reset.')
-                    
-                self.SetLinkByName(key,value)
-                    
-            else:
-                
-                setattr(gpb, key, value)
+            
+            accessor[1](self, key, value)
                 
             # Set this object and it parents to be modified
             self._set_parents_modified()
@@ -1180,6 +1150,75 @@ class ScalarContainerWrapper(object):
     
     
     
+def _wrapped_message(wrapper):
+    """
+    The GPB message of a wrapper - parse it first if it is still a proxy
+    """
+    if object.__getattribute__(wrapper,'_bytes') is None:
+        return object.__getattribute__(wrapper,'_gpbMessage')
+    return wrapper.GPBMessage
+
+def _get_scalar(wrapper, key):
+    return getattr(_wrapped_message(wrapper), key)
+
+def _get_repeated_scalar(wrapper, key):
+    return ScalarContainerWrapper.factory(wrapper, getattr(_wrapped_message(wrapper), key))
+
+def _get_repeated_composite(wrapper, key):
+    return ContainerWrapper.factory(wrapper, getattr(_wrapped_message(wrapper), key))
+
+def _get_message(wrapper, key):
+    return wrapper._rewrap(getattr(_wrapped_message(wrapper), key))
+
+def _get_link(wrapper, key):
+    link = wrapper._rewrap(getattr(_wrapped_message(wrapper), key))
+    return wrapper.Repository.get_linked_object(link)
+
+def _set_scalar(wrapper, key, value):
+    setattr(_wrapped_message(wrapper), key, value)
+
+def _set_composite(wrapper, key, value):
+    # If the value we are setting is a Wrapper Object
+    if isinstance(value, Wrapper):
+        if value.Invalid:
+            raise OOIObjectError('Can not access Invalidated Object which may be left behind after a checkout or reset.')
+        wrapper.SetLinkByName(key,value)
+    else:
+        setattr(_wrapped_message(wrapper), key, value)
+
+FIELD_ACCESSORS = {
+    object_utils.FIELD_SCALAR:(_get_scalar, _set_scalar),
+    object_utils.FIELD_ENUM_VALUE:(_get_scalar, _set_scalar),
+    object_utils.FIELD_REPEATED_SCALAR:(_get_repeated_scalar, _set_composite),
+    object_utils.FIELD_REPEATED_COMPOSITE:(_get_repeated_composite, _set_composite),
+    object_utils.FIELD_MESSAGE:(_get_message, _set_composite),
+    object_utils.FIELD_LINK:(_get_link, _set_composite),
+    }
+"""
+The getter and setter used by the Wrapper for each kind of GPB field
+"""
+
+_accessor_tables = {}
+
+def get_accessor_table(msg_class):
+    """
+    @brief The accessor table of a GPB message class: a dictionary of field
+    and enum value names to a (getter, setter) tuple. Built once per class from
+    the field table made in object_utils.build_gpb_lookup.
+    """
+    table = _accessor_tables.get(msg_class, None)
+    if table is None:
+        table = {}
+        for name, kind in object_utils.get_field_table(msg_class).iteritems():
+            table[name] = FIELD_ACCESSORS[kind]
+        _accessor_tables[msg_class] = table
+    return table
+
+# Build the accessor tables for the registered classes on first import
+for msg_class in object_utils.gpb_class_to_fields.keys():
+    get_accessor_table(msg_class)
+
+    
 class StructureElement(object):
     """
     @brief Wrapper for the container structure element. These are the objects
@@ -1192,6 +1231,13 @@ class StructureElement(object):
         self._element = container_pb2.StructureElement()
         self.ChildLinks = set()
         
+        self._sha1 = None
+        """
+        The memoized digest of value and type - reset when either is set.
+        Elements are immutable once hashed, so the digest is computed once per
+        element no matter how often it is committed, loaded or verified.
+        """
+        
     @classmethod
     def wrap_structure_element(cls,se):
         inst = cls()
@@ -1233,7 +1279,11 @@ class StructureElement(object):
         #################
         # This does the same thing much faster and shorter!
         #################
-        return sha1bin(sha1bin(self.value) + self.type.SerializeToString())
+        sha1 = self._sha1
+        if sha1 is None:
+            sha1 = sha1bin(sha1bin(self.value) + self.type.SerializeToString())
+            self._sha1 = sha1
+        return sha1
         
     #@property
     def _get_type(self):
@@ -1241,6 +1291,7 @@ class StructureElement(object):
         
     #@type.setter
     def _set_type(self,value):
+        self._sha1 = None
         self._element.type.object_id = value.ObjectType.object_id
         self._element.type.version = value.ObjectType.version
      
@@ -1252,6 +1303,7 @@ class StructureElement(object):
         
     #@value.setter
     def _set_value(self,value):
+        self._sha1 = None
         self._element.value = value
 
     value = property(_get_value, _set_value)
@@ -8,14 +8,31 @@
 from ion.util import procutils as pu
 
 from net.ooici.core.type import type_pb2
+from net.ooici.core.link import link_pb2
 
 import hashlib
+import binascii
 import struct
 from google.protobuf import message
 
 # Globals
 gpb_id_to_class = {}
 
+# Kinds of GPB message attributes - used to dispatch wrapper attribute access
+FIELD_SCALAR = 'scalar'
+FIELD_REPEATED_SCALAR = 'repeated scalar'
+FIELD_REPEATED_COMPOSITE = 'repeated composite'
+FIELD_MESSAGE = 'message'
+FIELD_LINK = 'link'
+FIELD_ENUM_VALUE = 'enum value'
+
+gpb_class_to_fields = {}
+"""
+Map of GPB message class to a dictionary of its field (and enum value) names
+and their kinds. Built for every class in build_gpb_lookup, and on demand for
+any other message class by get_field_table.
+"""
+
 class ObjectUtilException(Exception):
     """ Exceptions specific to Object Utilities. """
     pass
@@ -40,6 +57,11 @@ def sha1_to_hex(bytes):
     almosthex = map(hex, hex_bytes)
     return ''.join([y[-2:] for y in [x.replace('x', '0') for x in almosthex]]).upper()
 
+def hex_to_sha1(hexstr):
+    """hex string (40 char) to the binary form (20 bytes) of a sha1 digest
+    """
+    return binascii.unhexlify(hexstr)
+
 def set_type_from_obj(obj, type=None):
     """    
     Operates on instances and classes of gpb messages!
@@ -103,6 +125,7 @@ def build_gpb_lookup(rootpath):
 
     global gpb_id_to_class
     gpb_id_to_class = {}
+    gpb_class_to_fields.clear()
 
     root = __import__(rootpath)
     protos = root.protos
@@ -115,6 +138,7 @@ def build_gpb_lookup(rootpath):
         if msg_class.__module__.startswith(rootpath):
             if hasattr(msg_class, 'DESCRIPTOR'):
                 descriptor = msg_class.DESCRIPTOR
+                gpb_class_to_fields[msg_class] = build_field_table(msg_class)
                 if hasattr(descriptor, 'enum_types'):
                     for enum_type in descriptor.enum_types:
                         if enum_type.name == ENUM_NAME:
@@ -122,6 +146,46 @@ def build_gpb_lookup(rootpath):
                                 if val.name == ENUM_ID_NAME:
                                     gpb_id_to_class[val.number] = msg_class
 
+def build_field_table(msg_class):
+    """
+    @brief Classify the fields and enum values of a GPB message class once so
+    that the object wrapper can dispatch attribute access without inspecting
+    the value returned by the message.
+    @param msg_class a google.protobuf.message.Message subclass
+    @retval a dictionary of attribute name to one of the FIELD_ kinds
+    """
+    descriptor = msg_class.DESCRIPTOR
+    table = {}
+    for field in descriptor.fields:
+        if field.message_type is not None:
+            if field.label == field.LABEL_REPEATED:
+                kind = FIELD_REPEATED_COMPOSITE
+            elif field.message_type is link_pb2.CASRef.DESCRIPTOR:
+                kind = FIELD_LINK
+            else:
+                kind = FIELD_MESSAGE
+        elif field.label == field.LABEL_REPEATED:
+            kind = FIELD_REPEATED_SCALAR
+        else:
+            kind = FIELD_SCALAR
+        table[field.name] = kind
+    
+    for enum_type in descriptor.enum_types:
+        for enum_value in enum_type.values:
+            table.setdefault(enum_value.name, FIELD_ENUM_VALUE)
+    return table
+
+def get_field_table(msg_class):
+    """
+    @brief Get the field table for a GPB message class, building it if the
+    class was not registered by build_gpb_lookup.
+    """
+    table = gpb_class_to_fields.get(msg_class, None)
+    if table is None:
+        table = build_field_table(msg_class)
+        gpb_class_to_fields[msg_class] = table
+    return table
+
 def get_gpb_class_from_type_id(typeid):
     """
     Get a callable google.protobuf.message.Message subclass with the given MessageTypeIdentifier enum id.
@@ -365,11 +365,10 @@ class Repository(object):
         self._workspace_root = None
             
         # Automatically fetch the object from the hashed dictionary
+        # The linked objects are loaded when they are first accessed
         rootobj = cref.objectroot
         self._workspace_root = rootobj
         
-        self._load_links(rootobj)
-        
         
         self._detached_head = detached
         
@@ -453,10 +452,9 @@ class Repository(object):
             
             
         # Automatically fetch the object from the hashed dictionary or fetch if needed!
+        # The linked objects are loaded when they are first accessed
         rootobj = cref.objectroot
         self._workspace_root = rootobj
-        
-        self._load_links(rootobj)
                 
         return rootobj
         
@@ -721,10 +719,9 @@ class Repository(object):
             obj.AddParentLink(link)
             return obj
 
-        elif self._hashed_elements.has_key(link.key):
-            
-            element = self._hashed_elements.get(link.key)
-            
+        # Look it up once so that the element cache counts the hit or miss
+        element = self._hashed_elements.get(link.key, None)
+        if element is not None:
             
             if not link.type.object_id == element.type.object_id and \
                     link.type.version == element.type.version:
@@ -760,7 +757,8 @@ class Repository(object):
             
     def _load_links(self, obj):
         """
-        Load the child objects into the work space
+        Load all of the child objects into the work space. Checkout and unpack
+        do not call this - get_linked_object loads each object on first access.
         """
         for link in obj.ChildLinks:
             child = self.get_linked_object(link)  
@@ -820,7 +818,8 @@ class Repository(object):
             
             obj = self._load_element(element)
             
-            self._load_links(obj)
+            # Its children are loaded from the shared hashed elements on access
+            self._workspace[obj.MyId] = obj
             
             value = obj
         
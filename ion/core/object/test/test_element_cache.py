@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+@brief Test implementation of the hashed element caches
+
+@file ion/core/object/test/test_element_cache.py
+@author agent
+@test The object management element cache classes
+"""
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.trial import unittest
+
+from ion.core.object import element_cache
+
+
+class FakeElement(object):
+    """
+    Stands in for a StructureElement - the cache only uses key and value
+    """
+    def __init__(self, key, size=100):
+        self.key = key
+        self.value = 'x' * size
+        self.ChildLinks = set()
+
+def esize(size=100, key='k00'):
+    return size + len(key) + element_cache.ELEMENT_OVERHEAD
+
+
+class ElementCacheTest(unittest.TestCase):
+
+    def test_unbounded(self):
+        cache = element_cache.create_element_cache('none')
+        for i in range(100):
+            key = 'k%02d' % i
+            cache[key] = FakeElement(key)
+
+        self.assertEqual(len(cache), 100)
+        self.assertEqual(cache.stats()['evictions'], 0)
+
+    def test_dict_interface(self):
+        cache = element_cache.create_element_cache('lru')
+        e1 = FakeElement('k01')
+        cache.update({'k01':e1})
+
+        self.assertIn('k01', cache)
+        self.assertEqual(cache.has_key('k01'), True)
+        self.assertEqual(cache.keys(), ['k01'])
+        self.assertIdentical(cache['k01'], e1)
+        self.assertIdentical(cache.get('k01'), e1)
+        self.assertEqual(cache.get('k02', None), None)
+        self.assertRaises(KeyError, cache.__getitem__, 'k02')
+
+        del cache['k01']
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_hit_miss_counts(self):
+        cache = element_cache.create_element_cache('lru')
+        cache['k01'] = FakeElement('k01')
+
+        cache.get('k01')
+        cache.get('k01')
+        cache.get('nothere')
+        # has_key and peek do not count
+        cache.has_key('nothere')
+        cache.peek('k01')
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['bytes'], esize())
+
+    def test_invalid_args(self):
+        self.assertRaises(element_cache.ElementCacheError, element_cache.create_element_cache, 'fifo')
+        self.assertRaises(element_cache.ElementCacheError, element_cache.create_element_cache, 'lru', max_bytes=0)
+        self.assertRaises(element_cache.ElementCacheError, element_cache.create_element_cache, 'lru', low_water=0)
+
+    def test_lru_eviction(self):
+        cache = element_cache.create_element_cache('lru', max_bytes=esize()*10, low_water=1.0)
+        for i in range(10):
+            key = 'k%02d' % i
+            cache[key] = FakeElement(key)
+
+        # Touch k00 so that k01 is the least recently used
+        cache.get('k00')
+        cache['k10'] = FakeElement('k10')
+
+        self.assertIn('k00', cache)
+        self.assertNotIn('k01', cache)
+        self.assertIn('k10', cache)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertTrue(cache.nbytes <= cache.max_bytes)
+
+    def test_low_water(self):
+        cache = element_cache.create_element_cache('lru', max_bytes=esize()*10, low_water=0.5)
+        for i in range(11):
+            key = 'k%02d' % i
+            cache[key] = FakeElement(key)
+
+        self.assertTrue(cache.nbytes <= cache.max_bytes * 0.5)
+        self.assertIn('k10', cache)
+
+    def test_pinned(self):
+        pinned = set(['k00', 'k01'])
+        cache = element_cache.create_element_cache('lru', max_bytes=esize()*5,
+            pinned=lambda: pinned, low_water=1.0)
+        for i in range(20):
+            key = 'k%02d' % i
+            cache[key] = FakeElement(key)
+
+        self.assertIn('k00', cache)
+        self.assertIn('k01', cache)
+        self.assertIn('k19', cache)
+        self.assertTrue(cache.stats()['pinned_skips'] > 0)
+        self.assertTrue(cache.nbytes <= cache.max_bytes)
+
+    def test_all_pinned(self):
+        cache = element_cache.create_element_cache('lru', max_bytes=esize()*2,
+            pinned=lambda: set(['k00', 'k01', 'k02']))
+        for i in range(3):
+            key = 'k%02d' % i
+            cache[key] = FakeElement(key)
+
+        # Over budget, but nothing can be removed
+        self.assertEqual(len(cache), 3)
+
+    def test_evict(self):
+        pinned = set(['k00'])
+        cache = element_cache.create_element_cache('lru', pinned=lambda: pinned)
+        for i in range(5):
+            key = 'k%02d' % i
+            cache[key] = FakeElement(key)
+
+        self.assertEqual(cache.evict(esize()*2), esize()*2)
+        self.assertEqual(sorted(cache.keys()), ['k00', 'k04'])
+
+        # Pinned elements stay, over the limit or not
+        self.assertEqual(cache.evict(0), esize())
+        self.assertEqual(cache.keys(), ['k00'])
+
+    def test_update_does_not_evict_batch(self):
+        cache = element_cache.create_element_cache('lru', max_bytes=esize()*2)
+        batch = {}
+        for i in range(5):
+            key = 'k%02d' % i
+            batch[key] = FakeElement(key)
+        cache.update(batch)
+
+        self.assertEqual(len(cache), 5)
+
+    def test_listener(self):
+        cache = element_cache.create_element_cache('lru')
+        added = []
+        cache.listener = added.append
+
+        cache.update({'k01':FakeElement('k01'), 'k02':FakeElement('k02')})
+        cache['k02'] = FakeElement('k02')
+        cache['k03'] = FakeElement('k03')
+        # Elements read back from a store are not new
+        cache.load({'k04':FakeElement('k04')})
+
+        self.assertEqual([sorted(batch.keys()) for batch in added],
+                         [['k01', 'k02'], ['k03']])
+        self.assertIn('k04', cache)
+
+    def test_arc_eviction(self):
+        cache = element_cache.create_element_cache('arc', max_bytes=esize()*10, low_water=1.0)
+        for i in range(10):
+            key = 'k%02d' % i
+            cache[key] = FakeElement(key)
+
+        # Make the first five frequent
+        for i in range(5):
+            cache.get('k%02d' % i)
+
+        # Scan through many new elements - the frequent set survives
+        for i in range(10, 40):
+            key = 'k%02d' % i
+            cache[key] = FakeElement(key)
+
+        for i in range(5):
+            self.assertIn('k%02d' % i, cache)
+        self.assertTrue(cache.nbytes <= cache.max_bytes)
+        self.assertEqual(len(cache), 10)
+
+    def test_arc_ghost_adapts(self):
+        cache = element_cache.create_element_cache('arc', max_bytes=esize()*4, low_water=1.0)
+        for i in range(6):
+            key = 'k%02d' % i
+            cache[key] = FakeElement(key)
+
+        self.assertNotIn('k00', cache)
+        p = cache.p
+
+        # Re-inserting a recently evicted element grows the recency target
+        cache['k00'] = FakeElement('k00')
+        self.assertTrue(cache.p > p)
+        self.assertIn('k00', cache)
+
+    def test_arc_pinned(self):
+        pinned = set(['k00'])
+        cache = element_cache.create_element_cache('arc', max_bytes=esize()*3,
+            pinned=lambda: pinned, low_water=1.0)
+        for i in range(20):
+            key = 'k%02d' % i
+            cache[key] = FakeElement(key)
+
+        self.assertIn('k00', cache)
+        self.assertTrue(cache.nbytes <= cache.max_bytes)
@@ -218,6 +218,31 @@ class RepositoryTest(unittest.TestCase):
         self.assertEqual(ab.owner.name, 'Michael')
         
         self.assertEqual(ab.person[0].name, 'Michael')
+        
+    def test_checkout_is_lazy(self):
+        repo, ab = self.wb.init_repository(addresslink_type)
+        
+        p = repo.create_object(person_type)
+        p.name='David'
+        ab.owner = p
+        
+        p = repo.create_object(person_type)
+        p.name='John'
+        ab.person.add()
+        ab.person[0] = p
+        
+        repo.commit(comment='testing commit')
+        
+        ab = repo.checkout(branchname='master')
+        
+        # Only the root object is loaded by checkout
+        self.assertEqual(repo._workspace.keys(), [ab.MyId])
+        
+        self.assertEqual(ab.person[0].name, 'John')
+        self.assertEqual(len(repo._workspace), 2)
+        
+        self.assertEqual(ab.owner.name, 'David')
+        self.assertEqual(len(repo._workspace), 3)
  
  
     def test_lost_objects(self):
@@ -22,6 +22,7 @@ from ion.core.object import gpb_wrapper
 from ion.core.object import repository
 from ion.core.object import workbench
 from ion.core.object import object_utils
+from ion.core.object import element_cache
 
 person_type = object_utils.create_type_identifier(object_id=20001, version=1)
 addresslink_type = object_utils.create_type_identifier(object_id=20003, version=1)
@@ -152,6 +153,127 @@ class WorkBenchTest(unittest.TestCase):
         self.assertEqual(repo, self.wb.get_repository('David'))
         self.assertIsInstance(rootobj, gpb_wrapper.Wrapper)
         
+    def test_cache_pins_live_repositories(self):
+        
+        # A budget of one byte - every insert triggers an eviction pass
+        cache = element_cache.create_element_cache('lru', max_bytes=1)
+        wb = workbench.WorkBench('No Process Test', cache=cache)
+        
+        repo1, ab1 = wb.init_repository(addressbook_type)
+        ab1.title = 'Live'
+        repo1.commit('live repository')
+        
+        repo2, ab2 = wb.init_repository(addressbook_type)
+        ab2.title = 'Released'
+        repo2.commit('released repository')
+        released_key = ab2.MyId
+        
+        wb.clear_repository(repo2.repository_key)
+        self.assertEqual(wb.get_repository(repo2.repository_key), None)
+        
+        repo3, ab3 = wb.init_repository(addressbook_type)
+        ab3.title = 'Another'
+        repo3.commit('trigger eviction')
+        
+        self.assertIn(ab1.MyId, wb._hashed_elements)
+        self.assertIn(ab3.MyId, wb._hashed_elements)
+        self.assertNotIn(released_key, wb._hashed_elements)
+        
+        stats = wb.cache_stats()
+        self.assertEqual(stats['policy'], 'lru')
+        self.assertTrue(stats['evictions'] > 0)
+        
+    def test_message_repository_is_weak(self):
+        
+        serialized = self.wb.pack_structure(self.ab)
+        res = self.wb.unpack_structure(serialized)
+        
+        repo_key = res.Repository.repository_key
+        self.assertEqual(self.wb.get_repository(repo_key), res.Repository)
+        self.assertNotIn(repo_key, self.wb.list_repositories())
+        
+    def test_unpack_is_lazy(self):
+        
+        serialized = self.wb.pack_structure(self.ab)
+        
+        wb2 = workbench.WorkBench('No Process Test')
+        res = wb2.unpack_structure(serialized)
+        repo = res.Repository
+        
+        # Only the root is loaded until a link is accessed
+        self.assertEqual(repo._workspace.keys(), [res.MyId])
+        
+        owner_key = res.GetLink('owner').key
+        self.assertEqual(res.owner.name, 'David')
+        self.assertIn(owner_key, repo._workspace)
+        self.assertEqual(len(repo._workspace), 2)
+        
+        # Forwarding the message packs the elements which were never loaded
+        wb3 = workbench.WorkBench('No Process Test')
+        res3 = wb3.unpack_structure(wb2.pack_structure(res))
+        self.assertEqual(res3.person[1].name, 'John')
+        
+    def test_unpack_checks_sha1_on_access(self):
+        
+        serialized = self.wb.pack_structure(self.ab)
+        
+        wb2 = workbench.WorkBench('No Process Test')
+        res = wb2.unpack_structure(serialized)
+        
+        # Corrupt an element which has not been loaded yet
+        element = wb2._hashed_elements.get(res.GetLink('owner').key)
+        element.value = element.value + 'corrupt'
+        
+        self.assertRaises(repository.RepositoryError, getattr, res, 'owner')
+        
+    def test_pack_repository_delta(self):
+        
+        for i in range(3):
+            self.ab.person[1].name = 'John %d' % i
+            self.repo.commit('history %d' % i)
+        
+        # A peer with the full history
+        wb2 = workbench.WorkBench('No Process Test')
+        repo2 = wb2.unpack_structure(self.wb.pack_structure(self.repo._dotgit))
+        heads = wb2.repository_heads(self.repo.repository_key)
+        self.assertEqual(heads, self.wb.repository_heads(self.repo.repository_key))
+        
+        self.ab.person[1].name = 'Changed'
+        self.repo.commit('new commit')
+        
+        # Only the new commit, the new root and the changed person are sent
+        cs = self.wb.pack_repository_delta(self.repo, heads)
+        self.assertEqual(len(cs.items), 3)
+        
+        repo2 = wb2.unpack_structure(cs.SerializeToString())
+        self.assertEqual(wb2.repository_heads(self.repo.repository_key),
+                         self.wb.repository_heads(self.repo.repository_key))
+        
+        ab2 = repo2.checkout(branchname='master')
+        self.assertEqual(ab2.person[1].name, 'Changed')
+        self.assertEqual(ab2.owner.name, 'David')
+        
+        # An up to date peer gets just the mutable head
+        cs = self.wb.pack_repository_delta(self.repo, wb2.repository_heads(self.repo.repository_key))
+        self.assertEqual(len(cs.items), 0)
+        
+    def test_pack_repository_delta_new_peer(self):
+        
+        self.repo.commit('first')
+        self.ab.person[1].name = 'Changed'
+        self.repo.commit('second')
+        
+        # A peer which has nothing gets every commit and element
+        cs = self.wb.pack_repository_delta(self.repo, [])
+        
+        wb2 = workbench.WorkBench('No Process Test')
+        repo2 = wb2.unpack_structure(cs.SerializeToString())
+        
+        self.assertEqual(len(repo2._commit_index), 2)
+        ab2 = repo2.checkout(branchname='master')
+        self.assertEqual(ab2.person[1].name, 'Changed')
+        self.assertEqual(ab2.person[0].name, 'David')
+        
         
         
 class WorkBenchMergeTest(unittest.TestCase):
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+@brief Test implementation of the work bench store
+
+@file ion/core/object/test/test_workbench_store.py
+@author agent
+@test The write-behind persistence of a work bench
+"""
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from ion.core.data import store
+from ion.core.object import workbench
+from ion.core.object import workbench_store
+from ion.core.object import object_utils
+
+person_type = object_utils.create_type_identifier(object_id=20001, version=1)
+addresslink_type = object_utils.create_type_identifier(object_id=20003, version=1)
+
+
+class WorkBenchStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = store.Store()
+        self.wb = workbench.WorkBench('No Process Test')
+        self.wbs = workbench_store.WorkBenchStore(self.wb, self.backend)
+
+    def _make_repo(self, name, nickname=None):
+        repo, ab = self.wb.init_repository(addresslink_type, nickname=nickname)
+        p = repo.create_object(person_type)
+        p.name = name
+        p.id = 5
+        ab.owner = p
+        ab.person.add()
+        ab.person[0] = p
+        repo.commit('created %s' % name)
+        return repo
+
+    def _stored_elements(self):
+        return [key for key in self.backend.kvs
+                if key.startswith(workbench_store.ELEMENT_PREFIX)]
+
+    @defer.inlineCallbacks
+    def test_write_behind(self):
+        repo = self._make_repo('David')
+        self.assertTrue(self.wbs.stats()['pending'] > 0)
+        self.assertEqual(self.backend.kvs, {})
+
+        # Queued elements may not be evicted before they are written
+        self.assertTrue(set(self.wbs._pending) <= self.wb._hashed_elements.pinned())
+
+        yield self.wbs.flush()
+        self.assertEqual(self.wbs.stats()['pending'], 0)
+        self.assertIn(workbench_store.HEAD_PREFIX + repo.repository_key, self.backend.kvs)
+        self.assertEqual(len(self._stored_elements()), self.wbs.written)
+
+    @defer.inlineCallbacks
+    def test_write_once(self):
+        repo = self._make_repo('David')
+        yield self.wbs.flush()
+        written = self.wbs.written
+        heads = self.wbs.heads_written
+
+        # Nothing changed - nothing is written
+        yield self.wbs.flush()
+        self.assertEqual((self.wbs.written, self.wbs.heads_written), (written, heads))
+
+        # Only the new commit and the changed elements are written
+        ab = repo.checkout(branchname='master')
+        ab.title = 'changed'
+        repo.commit('changed')
+        yield self.wbs.flush()
+        self.assertTrue(0 < self.wbs.written - written < written)
+        self.assertEqual(self.wbs.heads_written, heads + 1)
+
+    @defer.inlineCallbacks
+    def test_restore(self):
+        repo = self._make_repo('David', nickname='book')
+        ab = repo.checkout(branchname='master')
+        ab.title = 'second'
+        repo.commit('second')
+        yield self.wbs.stop()
+
+        # A new work bench on the same store - as after a restart
+        wb = workbench.WorkBench('No Process Test')
+        wbs = workbench_store.WorkBenchStore(wb, self.backend)
+        restored = yield wbs.load_repository(repo.repository_key)
+        self.assertEqual(len(restored._commit_index), 2)
+        self.assertEqual(wb.repository_heads(repo.repository_key),
+                         self.wb.repository_heads(repo.repository_key))
+
+        yield wbs.load_reachable(restored)
+        ab = restored.checkout(branchname='master')
+        self.assertEqual(ab.title, 'second')
+        self.assertEqual(ab.owner.name, 'David')
+        # Elements read back are not written again
+        self.assertEqual(wbs.stats()['pending'], 0)
+
+        missing = yield wbs.load_repository('not a repository')
+        self.assertEqual(missing, None)
+
+        # Nicknames are stored as well
+        wb = workbench.WorkBench('No Process Test')
+        wbs = workbench_store.WorkBenchStore(wb, self.backend)
+        restored = yield wbs.load_repository('book')
+        self.assertEqual(restored.repository_key, repo.repository_key)
+        self.assertEqual(wb.get_repository('book'), restored)
+
+    @defer.inlineCallbacks
+    def test_load_delta(self):
+        repo = self._make_repo('David')
+        first = repo._current_branch.commitrefs[0]
+        for title in ('second', 'third'):
+            ab = repo.checkout(branchname='master')
+            ab.title = title
+            repo.commit(title)
+            if title == 'second':
+                have = [repo._current_branch.commitrefs[0].MyId]
+        yield self.wbs.stop()
+
+        wb = workbench.WorkBench('No Process Test')
+        wbs = workbench_store.WorkBenchStore(wb, self.backend)
+        restored = yield wbs.load_repository(repo.repository_key)
+        yield wbs.load_delta(restored, have)
+
+        # The first commit is neither sent nor the peer's head
+        self.assertFalse(wb._hashed_elements.has_key(first.GetLink('objectroot').key))
+        delta = wb.pack_repository_delta(restored, have)
+        self.assertEqual(len(delta.items), len(self.wb.pack_repository_delta(repo, have).items))
+
+    @defer.inlineCallbacks
+    def test_bounded_repositories(self):
+        self.wbs.max_repositories = 2
+        repos = [self._make_repo('Person %d' % i) for i in range(4)]
+        # Use the last two most recently
+        for repo in repos[2:]:
+            yield self.wbs.load_repository(repo.repository_key)
+        yield self.wbs.flush()
+
+        self.assertEqual(len(self.wb.list_repositories()), 2)
+        self.assertEqual(self.wbs.repositories_dropped, 2)
+        self.assertEqual(self.wb.get_repository(repos[0].repository_key), None)
+        self.assertEqual(self.wb.get_repository(repos[1].repository_key), None)
+
+        # A dropped repository comes back from the store
+        repo = yield self.wbs.load_repository(repos[0].repository_key)
+        yield self.wbs.load_reachable(repo)
+        self.assertEqual(repo.checkout(branchname='master').owner.name, 'Person 0')
+        self.assertEqual(len(self.wb.list_repositories()), 2)
+
+    @defer.inlineCallbacks
+    def test_bounded_bytes(self):
+        repos = [self._make_repo('Person %d' % i) for i in range(4)]
+        self.wb.set_repository_nickname(repos[0].repository_key, 'first')
+        # Use them oldest first
+        for repo in repos:
+            yield self.wbs.load_repository(repo.repository_key)
+        yield self.wbs.flush()
+        cache = self.wb._hashed_elements
+        one_repo = cache.nbytes / 4
+
+        # Room for about two of them
+        self.wbs.max_bytes = one_repo * 5 / 2
+        yield self.wbs.flush()
+        self.assertTrue(cache.nbytes <= self.wbs.max_bytes)
+        self.assertTrue(self.wbs.repositories_dropped >= 1)
+        self.assertEqual(self.wb.get_repository(repos[0].repository_key), None)
+        self.assertNotEqual(self.wb.get_repository(repos[3].repository_key), None)
+
+        # A dropped repository is found by its nickname
+        repo = yield self.wbs.load_repository('first')
+        self.assertEqual(repo.repository_key, repos[0].repository_key)
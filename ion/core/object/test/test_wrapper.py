@@ -57,6 +57,37 @@ class WrapperMethodsTest(unittest.TestCase):
         
         
 
+class FieldTableTest(unittest.TestCase):
+    
+    def test_field_kinds(self):
+        wb = workbench.WorkBench('No Process Test')
+        repo, ab = wb.init_repository(addresslink_type)
+        p = repo.create_object(person_type)
+        
+        table = object_utils.get_field_table(ab.ObjectClass)
+        self.assertEqual(table['owner'], object_utils.FIELD_LINK)
+        self.assertEqual(table['person'], object_utils.FIELD_REPEATED_COMPOSITE)
+        
+        table = object_utils.get_field_table(p.ObjectClass)
+        self.assertEqual(table['name'], object_utils.FIELD_SCALAR)
+        self.assertEqual(table['phone'], object_utils.FIELD_REPEATED_COMPOSITE)
+        self.assertEqual(table['WORK'], object_utils.FIELD_ENUM_VALUE)
+        
+        # The wrapper dispatches through the accessor table for its class
+        self.assertIdentical(p._gpbFields, gpb_wrapper.get_accessor_table(p.ObjectClass))
+        
+    def test_invalid_wrapper_fields(self):
+        wb = workbench.WorkBench('No Process Test')
+        repo, ab = wb.init_repository(addresslink_type)
+        p = repo.create_object(person_type)
+        p.name = 'David'
+        
+        p.Invalidate()
+        self.assertRaises(gpb_wrapper.OOIObjectError, getattr, p, 'name')
+        self.assertRaises(gpb_wrapper.OOIObjectError, setattr, p, 'name', 'John')
+        self.assertEqual(p.Invalid, True)
+        
+        
 class NodeLinkTest(unittest.TestCase):
             
             
@@ -242,4 +273,45 @@ class RecurseCommitTest(unittest.TestCase):
         self.assertEqual(len(ab_se.ChildLinks),1)
         self.assertIn(p.MyId, ab_se.ChildLinks)
         
-            
\ No newline at end of file
+                    
+    def test_incremental_commit(self):
+        wb = workbench.WorkBench('No Process Test')
+            
+        repo, ab = wb.init_repository(addresslink_type)
+        
+        for i in range(3):
+            p = repo.create_object(person_type)
+            p.name='Person %d' % i
+            p.id = i
+            ab.person.add()
+            ab.person[i] = p
+        
+        repo.commit(comment='first commit')
+        unchanged = ab.person[1].MyId
+        
+        ab.person[0].name = 'Changed'
+        
+        # Only the modified object and the path to the root are committed
+        strct={}
+        ab.RecurseCommit(strct)
+        
+        self.assertEqual(len(strct), 2)
+        self.assertIn(ab.MyId, strct.keys())
+        self.assertIn(ab.person[0].MyId, strct.keys())
+        self.assertNotIn(unchanged, strct.keys())
+        
+    def test_sha1_memoized(self):
+        wb = workbench.WorkBench('No Process Test')
+        repo, ab = wb.init_repository(addresslink_type)
+        
+        se = gpb_wrapper.StructureElement()
+        se.value = 'Some content'
+        se.type = ab
+        
+        sha1 = se.sha1
+        self.assertIdentical(se.sha1, sha1)
+        
+        # Setting the value resets the digest
+        se.value = 'Other content'
+        self.assertNotEqual(se.sha1, sha1)
+        self.assertEqual(se.sha1, object_utils.sha1bin(object_utils.sha1bin('Other content') + se.type.SerializeToString()))
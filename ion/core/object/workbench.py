@@ -8,18 +8,23 @@ TODO
 Add persistent store to the work bench. Use it fetch linked objects
 """
 
+import weakref
+
 from twisted.internet import defer
 
 from google.protobuf import message
 
+from ion.core import ioninit
 from ion.core.object import object_utils
 from ion.core.object import repository
 from ion.core.object import gpb_wrapper
+from ion.core.object import element_cache
 
 from twisted.internet import defer
 
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
+CONF = ioninit.config(__name__)
 
 from net.ooici.core.container import container_pb2
 from net.ooici.core.mutable import mutable_pb2
@@ -40,26 +45,46 @@ class WorkBench(object):
     CommitClassType = gpb_wrapper.set_type_from_obj(mutable_pb2.CommitRef())
     
     
-    def __init__(self, myprocess):   
+    def __init__(self, myprocess, cache=None):   
+        """
+        @param myprocess the process which owns this work bench
+        @param cache an optional ElementCache instance for the hashed elements.
+        By default the policy and byte budget are taken from the configuration.
+        """
     
         self._process = myprocess
         
         self._repos = {}
         
+        self._message_repos = weakref.WeakValueDictionary()
+        """
+        Repositories created to hold the content of incoming messages. They are
+        only live as long as the application holds a reference to the content.
+        """
+        
         self._repository_nicknames = {}
         
+        if cache is None:
+            cache = element_cache.create_element_cache(
+                policy=CONF.getValue('element_cache', 'lru'),
+                max_bytes=CONF.getValue('element_cache_max_bytes', None),
+                low_water=CONF.getValue('element_cache_low_water', 0.9))
+        cache.pinned = self._live_element_keys
+        
         """
-        A dictionary - shared between repositories for hashed objects
+        A bounded cache - shared between repositories for hashed objects
         """  
-        self._hashed_elements={}
+        self._hashed_elements=cache
       
         
-    def init_repository(self, root_type=None, nickname=None):
+    def init_repository(self, root_type=None, nickname=None, persistent=True):
         """
         Initialize a new repository
         Factory method for creating a repository - this is the responsibility
         of the workbench.
         @param root_type is the object type identifier for the object
+        @param persistent if False the work bench only keeps a weak reference
+        to the repository - used for the content of messages.
         """
         
         repo = repository.Repository()
@@ -86,7 +111,7 @@ class WorkBench(object):
             raise WorkBenchError('Invalid root type argument passed in init_repository')
         
         
-        self.put_repository(repo)
+        self.put_repository(repo, persistent=persistent)
         
         if nickname:
             self.set_repository_nickname(repo.repository_key, nickname)
@@ -106,7 +131,10 @@ class WorkBench(object):
         if not rkey:
             rkey = key
             
-        return self._repos.get(rkey,None)
+        repo = self._repos.get(rkey,None)
+        if repo is None:
+            repo = self._message_repos.get(rkey,None)
+        return repo
         
     def list_repositories(self):
         """
@@ -114,9 +142,92 @@ class WorkBench(object):
         """
         return self._repos.keys()
         
-    def put_repository(self,repo):
+    def put_repository(self,repo, persistent=True):
+        
+        if persistent:
+            self._repos[repo.repository_key] = repo
+        else:
+            self._message_repos[repo.repository_key] = repo
+            
+    def clear_repository(self, key):
+        """
+        Remove a repository from the work bench. Its hashed elements are no
+        longer pinned in the element cache and may be evicted.
+        """
+        rkey = self._repository_nicknames.get(key, None)
+        if not rkey:
+            rkey = key
+            
+        for nickname, value in self._repository_nicknames.items():
+            if value == rkey:
+                del self._repository_nicknames[nickname]
+                
+        repo = self._repos.pop(rkey, None)
+        if repo is None:
+            repo = self._message_repos.pop(rkey, None)
+        return repo
+        
+    def _live_element_keys(self):
+        """
+        Find the keys of all hashed elements reachable from the repositories
+        which are still live in this work bench. These are pinned in the
+        element cache.
+        """
+        keys = set()
+        
+        stack = []
+        for repo in self._repos.values() + self._message_repos.values():
+            stack.extend(repo._commit_index.keys())
+            for key, obj in repo._workspace.items():
+                stack.append(key)
+                if obj.Modified:
+                    # Modified objects are not hashed yet, but the children
+                    # they link to may be - and may not be loaded yet.
+                    stack.extend([link.key for link in obj.ChildLinks])
+            
+        while len(stack) > 0:
+            key = stack.pop()
+            if key in keys:
+                continue
+            
+            element = self._hashed_elements.peek(key)
+            if element is None:
+                # Workspace objects which are not committed are not hashed
+                continue
+            
+            keys.add(key)
+            stack.extend(self._element_child_keys(element))
+            
+        return keys
+        
+    def _element_child_keys(self, element):
+        """
+        The keys of the children of a hashed element. Elements which have not
+        been loaded yet do not know their children - decode them once and
+        record the keys in the element.
+        """
+        if element.isleaf or len(element.ChildLinks) > 0:
+            return element.ChildLinks
+        
+        cls = object_utils.get_gpb_class_from_type_id(element.type)
+        obj = gpb_wrapper.Wrapper(cls())
+        obj._root = obj
+        obj._child_links = set()
+        obj._derived_wrappers = {}
+        obj.ParseFromString(element.value)
+        obj.FindChildLinks()
+        
+        for link in obj.ChildLinks:
+            element.ChildLinks.add(link.key)
+            
+        return element.ChildLinks
         
-        self._repos[repo.repository_key] = repo
+    def cache_stats(self):
+        """
+        Report the hit, miss and eviction counts and the size of the hashed
+        element cache. Use it to size the cache for a process.
+        """
+        return self._hashed_elements.stats()
        
     def reference_repository(self, repo_key, current_state=False):
     
@@ -145,16 +256,27 @@ class WorkBench(object):
         """
          
     @defer.inlineCallbacks
-    def pull(self, origin, repo_name):
+    def pull(self, origin, repo_name, delta=True):
         """
         Pull the current state of the repository
+        With delta, the request carries the heads we already have, so that
+        only the commits and elements we lack come back - in a single
+        container. Targets older than that take the request for a repository
+        name and do not find it - pull from them with delta=False, which asks
+        for the repository by its name alone as before.
         """
         targetname = self._process.get_scoped_name('system', origin)
         
         #print 'PULL Targetname: ', targetname
         #print 'PULL RepoName: ', repo_name
         
-        repo, headers, msg = yield self._process.rpc_send(targetname,'pull', repo_name)
+        if delta:
+            request = {'repository_key':repo_name,
+                       'have':self._encode_keys(self.repository_heads(repo_name))}
+        else:
+            request = repo_name
+        
+        repo, headers, msg = yield self._process.rpc_send(targetname,'pull', request)
         
         response = headers.get(self._process.MSG_RESPONSE)
         exception = headers.get(self._process.MSG_EXCEPTION)
@@ -177,26 +299,46 @@ class WorkBench(object):
         
         #print 'Received pull request, id:', content
         
-        repo = self.get_repository(content)
+        if isinstance(content, dict):
+            repo = self.get_repository(content['repository_key'])
+            if repo:
+                have = self._decode_keys(content.get('have', []))
+                content = self.pack_repository_delta(repo, have)
+        else:
+            # Old style request - send all the commits
+            repo = self.get_repository(content)
+            content = repo
         
         if repo:
-            yield self._process.reply(msg,content=repo)
+            yield self._process.reply(msg,content=content)
         else:
             yield self._process.reply(msg,response_code=self._process.APP_RESOURCE_NOT_FOUND)
         
         
     @defer.inlineCallbacks
-    def push(self, origin, name):
+    def push(self, origin, name, delta=True):
         """
         Push the current state of the repository
+        With delta, the target is asked for the heads it has (op push_heads)
+        and only what it lacks is pushed. Targets older than push_heads do
+        not answer it - push to them with delta=False, which sends the whole
+        repository in one message as before.
         """
         targetname = self._process.get_scoped_name('system', origin)
         repo = self.get_repository(name)
 
         if repo:
             
+            if delta:
+                # Ask the target which heads it has, then send only what it lacks
+                content, headers, msg = yield self._process.rpc_send(targetname,'push_heads',
+                        {'repository_key':repo.repository_key})
+                content = self.pack_repository_delta(repo, self._decode_keys(content.get('have', [])))
+            else:
+                content = repo
+            
             #print 'PUSH TARGET: ',targetname
-            content, headers, msg = yield self._process.rpc_send(targetname,'push', repo)
+            content, headers, msg = yield self._process.rpc_send(targetname,'push', content)
         
             response = headers.get(self._process.MSG_RESPONSE)
             exception = headers.get(self._process.MSG_EXCEPTION)
@@ -216,10 +358,20 @@ class WorkBench(object):
             
 
         
+    @defer.inlineCallbacks
+    def op_push_heads(self, content, headers, msg):
+        """
+        The operation which starts a delta push: reply with the heads of the
+        repository we have, so that the pusher sends only the rest
+        """
+        have = self.repository_heads(content['repository_key'])
+        yield self._process.reply(msg, content={'have':self._encode_keys(have)})
+        
     @defer.inlineCallbacks
     def op_push(self, repo, headers, msg):
         """
         The Operation which responds to a push
+        The content is the whole repository or, after op_push_heads, the delta.
         """
         log.info('op_push: received content type, %s' % type(repo))
                 
@@ -317,8 +469,10 @@ class WorkBench(object):
         #    # Would like to have fetch use reply to - to keep the conversation context but does not work yet...
         #    objs, headers, reply_msg = yield self._process.reply(address, operation='fetch_linked_objects', content=cs)
         
+        elements = {}
         for obj in objs:
-            self._hashed_elements[obj.key]=obj
+            elements[obj.key]=obj
+        self._hashed_elements.update(elements)
         return
         
             
@@ -365,32 +519,115 @@ class WorkBench(object):
         side to deal with merge otherwise.
         """
         log.debug('pack_repository_commits: Packing repository:\n'+str(repo))
+        root_obj = self._pack_mutable_head(repo)
+        
+        obj_list = self._commit_ancestors(repo, repo._dotgit.branches).keys()
+        
+        serialized = self._pack_container(root_obj, obj_list)
+        log.debug('pack_repository_commits: Packing Complete!')
+        return serialized
+        
+    def pack_repository_delta(self, repo, have):
+        """
+        @brief Pack the mutable head with only the commits and structure
+        elements which a peer holding the commits in have does not have yet.
+        @param repo the repository to send
+        @param have the keys of the head commits the peer has. It has all of
+        their ancestors and the structure of their object roots.
+        @retval a container_pb2.Structure, sent as message content
+        @note Keys in have which are not known here (a diverged peer) can not
+        narrow the delta; the merge on the receiving side ignores commits and
+        elements it already has.
+        """
+        log.debug('pack_repository_delta: Packing repository:\n'+str(repo))
+        root_obj = self._pack_mutable_head(repo)
+        
+        known, commits = self._delta_commits(repo, have)
+        
+        # The peer has every element reachable from the roots of its heads
+        peer_elements = set()
+        if commits:
+            for cref in known:
+                self._reachable_elements(cref.GetLink('objectroot').key, peer_elements)
+        
+        obj_list = commits.keys()
+        seen = set(peer_elements)
+        for cref in commits.itervalues():
+            obj_list.extend(self._reachable_elements(cref.GetLink('objectroot').key, seen))
+        
+        log.info('pack_repository_delta: sending %d of %d commits and %d structure elements' % \
+            (len(commits), len(repo._commit_index), len(obj_list) - len(commits)))
+        return self._build_container(root_obj, obj_list)
+        
+    def _delta_commits(self, repo, have):
+        """
+        @brief The commits a peer holding the commits in have lacks
+        @retval the commit wrappers in have which are known here, and a
+        dictionary of the commit wrappers the peer lacks by key
+        """
+        known = [repo._commit_index[key] for key in have if repo._commit_index.has_key(key)]
+        
+        peer_commits = self._commit_ancestors(repo, known)
+        commits = self._commit_ancestors(repo, repo._dotgit.branches, peer_commits)
+        return known, commits
+        
+    def repository_heads(self, key):
+        """
+        @brief The keys of the head commits of every branch of a repository
+        @retval a list of keys, empty if the repository is not in the work bench
+        """
+        repo = self.get_repository(key)
+        if repo is None:
+            return []
+        heads = []
+        for branch in repo.branches:
+            for link in branch.commitrefs.GetLinks():
+                heads.append(link.key)
+        return heads
+        
+    def _encode_keys(self, keys):
+        return [object_utils.sha1_to_hex(key) for key in keys]
+        
+    def _decode_keys(self, keys):
+        return [object_utils.hex_to_sha1(key) for key in keys]
+        
+    def _pack_mutable_head(self, repo):
+        """
+        Create the Structure Element for the mutable head of a repository
+        """
         mutable = repo._dotgit
         
-        # Create the Structure Element for the mutable head
         structure = {}
         mutable.RecurseCommit(structure)
         root_obj = structure.get(mutable.MyId)
         # Set it back to modified as soon as we are done!
         mutable.Modified = True
         mutable.MyId = repo.new_id()
-
-
-        #print 'ROOT Obj', root_obj
-            
+        return root_obj
+        
+    def _commit_ancestors(self, repo, crefs, stop=()):
+        """
+        @brief Find the commits and all of their ancestors
+        @param crefs commit wrappers, or branches whose head commits to start from
+        @param stop commit keys which are not followed
+        @retval a dictionary of the commit wrappers by key
+        """
         cref_set = set()
-        for branch in mutable.branches:
-            
-            for cref in branch.commitrefs:
+        for cref in crefs:
+            if cref.ObjectType == self.CommitClassType:
                 cref_set.add(cref)
-            
-        obj_set = set()
-            
+            else:
+                for head in cref.commitrefs:
+                    cref_set.add(head)
+        
+        commits = {}
         while len(cref_set)>0:                
             new_set = set()
                         
             for cref in cref_set:
-                obj_set.add(cref.MyId)
+                if cref.MyId in commits or cref.MyId in stop:
+                    continue
+                commits[cref.MyId] = cref
                     
                 for prefs in cref.parentrefs:
                     new_set.add(prefs.commitref)
@@ -398,17 +635,7 @@ class WorkBench(object):
             # Now recurse on the ancestors    
             cref_set = new_set
             
-            
-        # Now make a list of just the keys that we want to send!
-        obj_list = []
-        for key in obj_set:
-            obj_list.append(key)
-                
-        serialized = self._pack_container(root_obj, obj_list)
-        log.debug('pack_repository_commits: Packing Complete!')
-        return serialized
-                
-        
+        return commits
         
     def pack_structure(self, wrapper, include_leaf=True):
         """
@@ -457,11 +684,13 @@ class WorkBench(object):
             child_items = set()
             for item in items:
                 
-                if len(item.ChildLinks) >0:
+                # Received elements which were never loaded do not know their children yet
+                child_keys = self._element_child_keys(item)
+                if len(child_keys) >0:
                     
                     obj_set.add(item.key)    
                     
-                    for key in item.ChildLinks:
+                    for key in child_keys:
                     
                         obj = self._hashed_elements.get(key,None)
                         if not obj:
@@ -488,11 +717,42 @@ class WorkBench(object):
         log.debug('pack_structure: Packing Complete!')
         return serialized
         
+    def _reachable_elements(self, key, seen):
+        """
+        @brief The keys of the hashed elements reachable from key which are not
+        in seen. The keys found are added to seen.
+        @retval a list of the new keys
+        """
+        found = []
+        stack = [key]
+        while len(stack) > 0:
+            key = stack.pop()
+            if key in seen:
+                continue
+            seen.add(key)
+            
+            element = self._hashed_elements.get(key, None)
+            if element is None:
+                raise WorkBenchError('Hashed element not found while packing the repository: %s' % \
+                    object_utils.sha1_to_hex(key))
+            found.append(key)
+            stack.extend(self._element_child_keys(element))
+        return found
+        
     
     def _pack_container(self, head, object_keys):
         """
         Helper for the sender to pack message content into a container in order
         """
+        cs = self._build_container(head, object_keys)
+        serialized = cs.SerializeToString()
+        
+        return serialized
+        
+    def _build_container(self, head, object_keys):
+        """
+        Helper to build the container message for a head and object keys
+        """
         log.debug('_pack_container: Packing container head and object_keys!')
         # An unwrapped GPB Structure message to put stuff into!
         cs = container_pb2.Structure()
@@ -516,9 +776,7 @@ class WorkBench(object):
         
         
         log.debug('_pack_container: Packed container!')
-        serialized = cs.SerializeToString()
-        
-        return serialized
+        return cs
         
     def unpack_structure(self, serialized_container):
         """
@@ -543,8 +801,7 @@ class WorkBench(object):
             # Return the mutable head as the content and let the process
             # operation figure out what to do with it!
                         
-            for item in obj_list:
-                self._hashed_elements[item.key]=item
+            self._add_elements(obj_list)
             
             repo = self._load_repo_from_mutable(head)
             log.debug('unpack_structure: returning repository:'+str(repo))
@@ -552,11 +809,11 @@ class WorkBench(object):
         
         else:
                 
-            for item in obj_list:
-                self._hashed_elements[item.key]=item
+            self._add_elements(obj_list)
             
             # Create a new repository for the structure in the container
-            repo, none = self.init_repository()
+            # It lives only as long as the message content is referenced
+            repo, none = self.init_repository(persistent=False)
                 
            
             # Load the object and set it as the workspace root
@@ -567,8 +824,8 @@ class WorkBench(object):
             # Create a commit to record the state when the message arrived
             cref = repo.commit(comment='Message for you Sir!')
 
-            # Now load the rest of the linked objects - down to the leaf nodes.
-            repo._load_links(root_obj)
+            # The rest of the linked objects are loaded, and their sha1 keys
+            # checked, only when a handler first accesses them.
             
             
             log.debug('unpack_structure: returning root_obj:'+str(root_obj))
@@ -576,6 +833,16 @@ class WorkBench(object):
         
         
         
+    def _add_elements(self, obj_list):
+        """
+        Add a list of structure elements to the hashed elements in one batch
+        so that the cache does not evict any of them while they are loaded.
+        """
+        elements = {}
+        for item in obj_list:
+            elements[item.key]=item
+        self._hashed_elements.update(elements)
+        
     def _unpack_container(self,serialized_container):
         """
         Helper for the receiver for unpacking message content
@@ -0,0 +1,482 @@
+#!/usr/bin/env python
+"""
+@file ion/core/object/workbench_store.py
+@brief Persistence for the repositories of a work bench. New hashed elements
+and repository heads are written behind to an IStore in batches, and the
+elements and repositories which are not in memory are read back from it.
+@author agent
+"""
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.internet import defer, task
+
+from ion.core.object import gpb_wrapper
+from ion.core.object import object_utils
+from ion.core.object import repository
+from ion.core.object import element_cache
+
+from net.ooici.core.container import container_pb2
+
+
+ELEMENT_PREFIX = 'element:'
+"""
+Prefix of the store keys of hashed elements, followed by the sha1 key
+"""
+
+HEAD_PREFIX = 'head:'
+"""
+Prefix of the store keys of repository heads, followed by the repository key
+"""
+
+NICKNAME_PREFIX = 'nickname:'
+"""
+Prefix of the store keys of repository nicknames, followed by the nickname.
+The value is the repository key.
+"""
+
+
+class WorkBenchStoreError(Exception):
+    """
+    An exception class for errors in the work bench store
+    """
+
+
+def encode_element(element):
+    return element._element.SerializeToString()
+
+def decode_element(data):
+    se = container_pb2.StructureElement()
+    se.ParseFromString(data)
+    return gpb_wrapper.StructureElement.wrap_structure_element(se)
+
+
+class WorkBenchStore(object):
+    """
+    @brief Write-behind and read-through persistence of a work bench in an
+    IStore (for instance the in memory Store or a CassandraStore).
+
+    Every element new to the element cache of the work bench is queued, once
+    per key, and the queue is written with put_many when flush is called -
+    by a timer, or early when the queued bytes pass max_pending_bytes. The
+    heads of the repositories which changed since they were last written go
+    out after their elements, so a stored head only refers to stored
+    elements. Queued elements are pinned in the cache until they are written.
+
+    The element cache of the work bench is the hot tier. It pins the
+    elements of the repositories in the work bench, so its byte budget alone
+    does not bound it. After each write, while the cache holds more than
+    max_bytes, the least recently used repositories whose heads are stored
+    and which have no uncommitted changes are dropped from the work bench
+    and their elements evicted. max_repositories bounds the number of
+    repositories kept in the same way. Nicknames are stored too, so a
+    dropped repository can be loaded by its nickname.
+
+    The work bench itself only reads the cache, so the callers must load
+    what an operation needs first - load_repository for a repository which
+    may have been dropped, load_delta or load_reachable for the structure of
+    a repository and load_elements for single elements.
+    """
+
+    def __init__(self, workbench, backend, flush_interval=1.0, batch_size=500,
+                 max_pending_bytes=16777216, max_bytes=None,
+                 max_repositories=None):
+        """
+        @param workbench the WorkBench to persist
+        @param backend an IStore instance
+        @param flush_interval seconds between writes of the queue
+        @param batch_size the most elements written by one put_many
+        @param max_pending_bytes queued bytes which start a write early
+        @param max_bytes the most bytes of elements kept in the element
+        cache of the work bench, None for no bound
+        @param max_repositories the most repositories kept in the work
+        bench, None for no bound
+        """
+        self.workbench = workbench
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending_bytes = max_pending_bytes
+        self.max_bytes = max_bytes
+        self.max_repositories = max_repositories
+
+        if max_bytes is not None and workbench._hashed_elements.policy == 'none':
+            raise WorkBenchStoreError('A byte bound needs an element cache which evicts, not policy "none"')
+
+        self._pending = {}
+        """
+        Map of key to the elements waiting to be written
+        """
+        self._pending_bytes = 0
+
+        self._stored_heads = {}
+        """
+        Map of repository key to the head commit keys last written
+        """
+
+        self._stored_nicknames = {}
+        """
+        Map of nickname to the repository key last written
+        """
+
+        self._used = {}
+        """
+        Map of repository key to the use counter when it was last used
+        """
+        self._use_count = 0
+
+        self._held = {}
+        """
+        Map of element key to the number of loads which need it in the cache
+        """
+
+        self._lock = defer.DeferredLock()
+        self._loop = task.LoopingCall(self._scheduled_flush)
+
+        self.written = 0
+        self.written_bytes = 0
+        self.heads_written = 0
+        self.loaded = 0
+        self.repositories_loaded = 0
+        self.repositories_dropped = 0
+
+        cache = workbench._hashed_elements
+        self._live_keys = cache.pinned
+        cache.pinned = self._pinned
+        cache.listener = self._added
+
+    def start(self):
+        if not self._loop.running:
+            self._loop.start(self.flush_interval, now=False)
+
+    @defer.inlineCallbacks
+    def stop(self):
+        """
+        Stop the timer and write everything which is queued
+        """
+        if self._loop.running:
+            self._loop.stop()
+        yield self.flush()
+
+    def stats(self):
+        """
+        @retval dictionary of counters
+        """
+        return {'pending':len(self._pending),
+                'pending_bytes':self._pending_bytes,
+                'written':self.written,
+                'written_bytes':self.written_bytes,
+                'heads_written':self.heads_written,
+                'loaded':self.loaded,
+                'repositories':len(self.workbench.list_repositories()),
+                'repositories_loaded':self.repositories_loaded,
+                'repositories_dropped':self.repositories_dropped}
+
+    # Write behind
+
+    def _added(self, elements):
+        for key, element in elements.iteritems():
+            if key not in self._pending:
+                self._pending[key] = element
+                self._pending_bytes += element_cache.element_size(element)
+
+        if self._pending_bytes > self.max_pending_bytes and not self._lock.locked:
+            self.flush().addErrback(self._flush_failed)
+
+    def _pinned(self):
+        keys = set(self._pending)
+        keys.update(self._held)
+        if self._live_keys is not None:
+            keys.update(self._live_keys())
+        return keys
+
+    def _scheduled_flush(self):
+        # Errors are logged rather than stopping the timer
+        return self.flush().addErrback(self._flush_failed)
+
+    def _flush_failed(self, failure):
+        log.error('Work bench store write failed, will retry: %s' % failure.getErrorMessage())
+
+    def flush(self):
+        """
+        @brief Write the queued elements, then the changed repository heads
+        @retval Deferred
+        """
+        return self._lock.run(self._flush)
+
+    @defer.inlineCallbacks
+    def _flush(self):
+        # The heads as they are now - all of their elements are in the cache
+        # or the queue, and are written first
+        heads = self._changed_heads()
+
+        while self._pending:
+            keys = self._pending.keys()[:self.batch_size]
+            items = []
+            nbytes = 0
+            for key in keys:
+                data = encode_element(self._pending[key])
+                items.append((ELEMENT_PREFIX + key, data))
+                nbytes += len(data)
+            yield self.backend.put_many(items)
+
+            for key in keys:
+                element = self._pending.pop(key, None)
+                if element is not None:
+                    self._pending_bytes -= element_cache.element_size(element)
+            self.written += len(keys)
+            self.written_bytes += nbytes
+
+        nicknames = self._changed_nicknames()
+        if heads or nicknames:
+            items = []
+            for rkey, (commits, head) in heads.iteritems():
+                items.append((HEAD_PREFIX + rkey, encode_element(head)))
+            for nickname, rkey in nicknames.iteritems():
+                items.append((NICKNAME_PREFIX + nickname, rkey))
+            yield self.backend.put_many(items)
+            for rkey, (commits, head) in heads.iteritems():
+                self._stored_heads[rkey] = commits
+            self._stored_nicknames.update(nicknames)
+            self.heads_written += len(heads)
+
+        self._drop_repositories()
+
+    def _changed_heads(self):
+        heads = {}
+        for rkey in self.workbench.list_repositories():
+            commits = sorted(self.workbench.repository_heads(rkey))
+            if commits and commits != self._stored_heads.get(rkey):
+                repo = self.workbench.get_repository(rkey)
+                heads[rkey] = (commits, self.workbench._pack_mutable_head(repo))
+        return heads
+
+    def _changed_nicknames(self):
+        nicknames = {}
+        rkeys = set(self.workbench.list_repositories())
+        for nickname, rkey in self.workbench._repository_nicknames.iteritems():
+            if rkey in rkeys and self._stored_nicknames.get(nickname) != rkey:
+                nicknames[nickname] = rkey
+        return nicknames
+
+    # Repository residency
+
+    def _touch(self, rkey):
+        self._use_count += 1
+        self._used[rkey] = self._use_count
+
+    def _droppable(self):
+        """
+        The repositories which may be dropped, least recently used first:
+        their heads are stored and they have no uncommitted changes
+        """
+        rkeys = self.workbench.list_repositories()
+        rkeys.sort(key=lambda rkey: self._used.get(rkey, 0))
+        for rkey in rkeys:
+            if sorted(self.workbench.repository_heads(rkey)) != self._stored_heads.get(rkey):
+                # Not written yet
+                continue
+            if self.workbench.get_repository(rkey).status == repository.Repository.MODIFIED:
+                # Work in progress which is not committed
+                continue
+            yield rkey
+
+    def _drop(self, rkey):
+        self.workbench.clear_repository(rkey)
+        self._used.pop(rkey, None)
+        self.repositories_dropped += 1
+
+    def _drop_repositories(self, keep=None):
+        """
+        Drop the least recently used repositories beyond max_repositories,
+        then while the element cache holds more than max_bytes
+        @param keep the key of a repository which is not dropped
+        """
+        candidates = None
+        if self.max_repositories is not None:
+            excess = len(self.workbench.list_repositories()) - self.max_repositories
+            if excess > 0:
+                candidates = [rkey for rkey in self._droppable() if rkey != keep]
+                for rkey in candidates[:excess]:
+                    self._drop(rkey)
+                candidates = candidates[excess:]
+
+        if self.max_bytes is None:
+            return
+        cache = self.workbench._hashed_elements
+        # Elements no repository pins go first
+        if cache.evict(self.max_bytes) <= self.max_bytes:
+            return
+        if candidates is None:
+            candidates = [rkey for rkey in self._droppable() if rkey != keep]
+        # One eviction pass per repository dropped - each pass finds the
+        # pinned elements, which are what the dropped repository freed
+        for rkey in candidates:
+            self._drop(rkey)
+            if cache.evict(self.max_bytes) <= self.max_bytes:
+                return
+        log.warn('Work bench element cache over its bound: %d bytes held, %d bytes allowed' % \
+            (cache.nbytes, self.max_bytes))
+
+    # Read through
+
+    def _hold(self, keys):
+        for key in keys:
+            self._held[key] = self._held.get(key, 0) + 1
+
+    def _release(self, keys):
+        for key in keys:
+            count = self._held.get(key, 0) - 1
+            if count > 0:
+                self._held[key] = count
+            else:
+                self._held.pop(key, None)
+
+    @defer.inlineCallbacks
+    def load_elements(self, keys):
+        """
+        @brief Read the elements which are not in the cache from the store
+        @retval Deferred, the keys which are in neither
+        """
+        cache = self.workbench._hashed_elements
+        missing = [key for key in keys if not cache.has_key(key)]
+        if not missing:
+            defer.returnValue([])
+
+        values = yield self.backend.get_many([ELEMENT_PREFIX + key for key in missing])
+        elements = {}
+        absent = []
+        for key in missing:
+            data = values.get(ELEMENT_PREFIX + key)
+            if data is None:
+                # Written behind, but not yet - or unknown
+                element = self._pending.get(key)
+                if element is None:
+                    absent.append(key)
+                    continue
+            else:
+                element = decode_element(data)
+            elements[key] = element
+        cache.load(elements)
+        self.loaded += len(elements)
+        defer.returnValue(absent)
+
+    @defer.inlineCallbacks
+    def load_repository(self, key):
+        """
+        @brief Get a repository from the work bench, reading its head and
+        commits back from the store if it is not there
+        @param key a repository key or nickname
+        @retval Deferred, the repository or None if it is not stored either
+        """
+        repo = self.workbench.get_repository(key)
+        if repo is not None:
+            self._touch(repo.repository_key)
+            defer.returnValue(repo)
+
+        rkey = key
+        data = yield self.backend.get(HEAD_PREFIX + key)
+        if data is None:
+            # The nickname of a repository which was dropped?
+            nickkey = yield self.backend.get(NICKNAME_PREFIX + key)
+            if nickkey is not None:
+                rkey = nickkey
+                if self.workbench.get_repository(rkey) is None:
+                    data = yield self.backend.get(HEAD_PREFIX + rkey)
+
+        repo = self.workbench.get_repository(rkey)
+        if repo is None and data is not None:
+            head = decode_element(data)
+            held = []
+            try:
+                yield self._load_commits(head, held)
+                repo = self.workbench._load_repo_from_mutable(head)
+            finally:
+                self._release(held)
+            self._stored_heads[repo.repository_key] = sorted(self.workbench.repository_heads(repo.repository_key))
+            self.repositories_loaded += 1
+
+        if repo is not None:
+            if rkey != key:
+                self.workbench.set_repository_nickname(repo.repository_key, key)
+            self._touch(repo.repository_key)
+            self._drop_repositories(keep=repo.repository_key)
+        defer.returnValue(repo)
+
+    @defer.inlineCallbacks
+    def _load_commits(self, head, held):
+        """
+        Load every commit in the history of a head into the cache
+        """
+        # A scratch repository to decode the head and commits with
+        scratch = repository.Repository(head)
+        scratch._hashed_elements = self.workbench._hashed_elements
+
+        keys = set()
+        for branch in scratch.branches:
+            for link in branch.commitrefs.GetLinks():
+                keys.add(link.key)
+
+        seen = set()
+        while keys:
+            seen.update(keys)
+            self._hold(keys)
+            held.extend(keys)
+            absent = yield self.load_elements(list(keys))
+            if absent:
+                raise WorkBenchStoreError('Commit not found in the store: %s' % \
+                    object_utils.sha1_to_hex(absent[0]))
+
+            parents = set()
+            for key in keys:
+                cref = scratch._load_element(self.workbench._hashed_elements.peek(key))
+                for pref in cref.parentrefs:
+                    parents.add(pref.GetLink('commitref').key)
+            keys = parents - seen
+
+    def load_reachable(self, repo):
+        """
+        @brief Load the structure of every commit of a repository which is in
+        the work bench, level by level with one read per level
+        @retval Deferred
+        """
+        self._touch(repo.repository_key)
+        roots = [cref.GetLink('objectroot').key for cref in repo._commit_index.itervalues()]
+        return self._load_structure(roots)
+
+    def load_delta(self, repo, have):
+        """
+        @brief Load what pack_repository_delta needs to send a repository to
+        a peer which has the commits in have: the structure of the commits
+        the peer lacks, and of its head commits to tell what it already has.
+        The structure of older commits is not read.
+        @retval Deferred
+        """
+        self._touch(repo.repository_key)
+        known, commits = self.workbench._delta_commits(repo, have)
+        if not commits:
+            return defer.succeed(None)
+        roots = [cref.GetLink('objectroot').key for cref in known + commits.values()]
+        return self._load_structure(roots)
+
+    @defer.inlineCallbacks
+    def _load_structure(self, roots):
+        """
+        Load the elements reachable from roots, one read per level
+        """
+        cache = self.workbench._hashed_elements
+        keys = set(roots)
+
+        seen = set()
+        while keys:
+            seen.update(keys)
+            absent = yield self.load_elements(list(keys))
+            if absent:
+                raise WorkBenchStoreError('Element not found in the store: %s' % \
+                    object_utils.sha1_to_hex(absent[0]))
+
+            children = set()
+            for key in keys:
+                children.update(self.workbench._element_child_keys(cache.peek(key)))
+            keys = children - seen
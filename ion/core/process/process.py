@@ -8,6 +8,7 @@
 
 from twisted.internet import defer
 from twisted.internet import reactor
+from twisted.internet import task
 from twisted.python import failure
 
 from zope.interface import implements, Interface
@@ -27,6 +28,8 @@ from ion.interact.conversation import Conversation
 from ion.interact.message import Message
 import ion.util.procutils as pu
 from ion.util.state_object import BasicLifecycleObject, BasicStates
+from ion.util.deferreds import gather
+from ion.util.timer_wheel import TimeWheel
 
 from ion.core.object import workbench
 
@@ -34,6 +37,14 @@ CONF = ioninit.config(__name__)
 CF_conversation_log = CONF['conversation_log']
 CF_fail_fast = CONF['fail_fast']
 CF_rpc_timeout = CONF['rpc_timeout']
+# Seconds a conversation is kept without a reply
+CF_conversation_ttl = CONF.getValue('conversation_ttl', 300)
+CF_conversation_max = CONF.getValue('conversation_max', 100000)
+# Seconds a timed out RPC is remembered to recognize its late reply
+CF_rpc_tombstone_ttl = CONF.getValue('rpc_tombstone_ttl', 300)
+CF_rpc_tombstone_max = CONF.getValue('rpc_tombstone_max', 10000)
+# Seconds between expiry sweeps of the conversation and tombstone tables
+CF_conversation_sweep = CONF.getValue('conversation_sweep', 5.0)
 
 # @todo CHANGE: Dict of "name" to process (service) declaration
 processes = {}
@@ -51,6 +62,37 @@ class ProcessError(Exception):
     An exception class for errors that occur in Process
     """
 
+class BatchRPC(object):
+    """
+    The outstanding items of a pipelined batch RPC. Each item has its own
+    deferred, fired by the reply with its batch sequence number.
+    """
+    def __init__(self, size):
+        self.deferreds = [defer.Deferred() for i in range(size)]
+        self.pending = size
+        self._answered = [False] * size
+
+    def take(self, seq):
+        """
+        @retval the deferred of the item with sequence number seq, or None if it
+        is not pending
+        """
+        try:
+            seq = int(seq)
+        except (TypeError, ValueError), ex:
+            return None
+        if seq < 0 or seq >= len(self.deferreds) or self._answered[seq]:
+            return None
+        self._answered[seq] = True
+        self.pending -= 1
+        return self.deferreds[seq]
+
+    def remaining(self):
+        """
+        @retval the deferreds of the items which are not answered yet
+        """
+        return [d for d, answered in zip(self.deferreds, self._answered) if not answered]
+
 class Process(BasicLifecycleObject,ResponseCodes):
     """
     This is the base class for all processes. Processes can be spawned and
@@ -135,6 +177,21 @@ class Process(BasicLifecycleObject,ResponseCodes):
         # Conversations by conv-id for currently outstanding RPCs
         self.rpc_conv = {}
 
+        # Timed out RPCs by conv-id, kept to recognize late replies
+        self.rpc_tombstones = {}
+
+        # Expiry of conversations without a reply and of tombstones
+        self._conv_wheel = TimeWheel(slots=TimeWheel.slots_for(CF_conversation_ttl),
+                                     max_entries=CF_conversation_max,
+                                     on_expire=self._expire_conversation)
+        self._tombstone_wheel = TimeWheel(slots=TimeWheel.slots_for(CF_rpc_tombstone_ttl),
+                                          max_entries=CF_rpc_tombstone_max,
+                                          on_expire=self.rpc_tombstones.pop)
+        # Runs while the wheels hold entries, so that they expire on a
+        # process which sends nothing new
+        self._conv_sweep = task.LoopingCall(self._sweep_conversations)
+        self._conv_counts = {'ended_reply':0, 'ended_timeout':0, 'late_replies':0}
+
         # List of ProcessDesc instances of defined and spawned child processes
         self.child_procs = []
 
@@ -298,6 +355,8 @@ class Process(BasicLifecycleObject,ResponseCodes):
                 log.exception("Error terminating child %s" % child.proc_id)
 
         yield defer.maybeDeferred(self.plc_terminate)
+        if self._conv_sweep.running:
+            self._conv_sweep.stop()
         log.info('----- Process %s TERMINATED -----' % (self.proc_name))
 
     def plc_terminate(self):
@@ -395,7 +454,8 @@ class Process(BasicLifecycleObject,ResponseCodes):
         """
         try:
             # Check if this response is in reply to an outstanding RPC call
-            if 'conv-id' in payload and payload['conv-id'] in self.rpc_conv:
+            convid = payload.get('conv-id', None)
+            if convid in self.rpc_conv or convid in self.rpc_tombstones:
                 yield self._receive_rpc(payload, msg)
             else:
                 yield self._receive_msg(payload, msg)
@@ -407,42 +467,78 @@ class Process(BasicLifecycleObject,ResponseCodes):
     @defer.inlineCallbacks
     def _receive_rpc(self, payload, msg):
         """
-        Handling of RPC reply messages.
+        Handling of RPC reply messages. A reply to a batch RPC carries the
+        sequence number of the item it answers in the batch-seq header, or the
+        sequence numbers of several items in batch-seqs with a list of contents.
         """
         fromname = payload['sender']
         if 'sender-name' in payload:
             fromname = payload['sender-name']
         log.info('>>> [%s] receive(): RPC reply from [%s] <<<' % (self.proc_name, fromname))
-        rpc_deferred = self.rpc_conv.pop(payload['conv-id'])
+        convid = payload['conv-id']
         content = payload.get('content', None)
-        if type(rpc_deferred) is str:
+        if convid in self.rpc_tombstones:
+            # A timed out batch may still have more replies coming
+            if not 'batch-seq' in payload and not 'batch-seqs' in payload:
+                self.rpc_tombstones.pop(convid)
+                self._tombstone_wheel.discard(convid)
+            tombstone = self.rpc_tombstones.get(convid, 'TIMEOUT')
+            self._conv_counts['late_replies'] += 1
             log.error("Message received after process %s RPC conv-id=%s timed out=%s: %s" % (
-                self.proc_name, payload['conv-id'], rpc_deferred, payload))
+                self.proc_name, convid, tombstone, payload))
             return
-        rpc_deferred.rpc_call.cancel()
-        res = (content, payload, msg)
 
+        rpc_deferred = self.rpc_conv[convid]
+        if isinstance(rpc_deferred, BatchRPC):
+            if 'batch-seqs' in payload:
+                seqs = payload['batch-seqs']
+                contents = content
+            else:
+                seqs = [payload.get('batch-seq', None)]
+                contents = [content]
+
+            replies = []
+            for seq, item in zip(seqs, contents):
+                d = rpc_deferred.take(seq)
+                if d is None:
+                    log.error("Process %s batch RPC conv-id=%s reply for unknown item %s" % (
+                        self.proc_name, convid, seq))
+                    continue
+                replies.append((d, item))
+            done = rpc_deferred.pending == 0
+        else:
+            replies = [(rpc_deferred, content)]
+            done = True
+
+        if done:
+            del self.rpc_conv[convid]
+            self._end_conversation(convid, 'ended_reply')
+            if hasattr(rpc_deferred, 'rpc_call'):
+                rpc_deferred.rpc_call.cancel()
 
         yield msg.ack()
-        
+
+        for d, item in replies:
+            self._fire_rpc_reply(d, item, payload, msg)
+
+    def _fire_rpc_reply(self, rpc_deferred, content, payload, msg):
+        res = (content, payload, msg)
         status = payload.get(self.MSG_STATUS, None)
         if status == self.ION_OK:
             #Cannot do the callback right away, because the message is not yet handled
-            reactor.callLater(0, lambda: rpc_deferred.callback(res))
+            reactor.callLater(0, rpc_deferred.callback, res)
                 
         elif status == self.ION_ERROR:
             log.warn('RPC reply is an ERROR: '+str(payload.get(self.MSG_RESPONSE)))
             log.debug('RPC reply ERROR Content: '+str(content))
             err = failure.Failure(ReceivedError(payload, content))
-            #rpc_deferred.errback(err)
             # Cannot do the callback right away, because the message is not yet handled
-            reactor.callLater(0, lambda: rpc_deferred.errback(err))
-            
+            reactor.callLater(0, rpc_deferred.errback, err)
             
         else:
             log.error('RPC reply is not well formed. Header "status" must be set!')
             #Cannot do the callback right away, because the message is not yet handled
-            reactor.callLater(0, lambda: rpc_deferred.callback(res))
+            reactor.callLater(0, rpc_deferred.callback, res)
 
     @defer.inlineCallbacks
     def _receive_msg(self, payload, msg):
@@ -536,7 +632,10 @@ class Process(BasicLifecycleObject,ResponseCodes):
             log.warn("Process %s RPC conv-id=%s timed out! " % (self.proc_name,convid))
             # Remove RPC. Delayed result will go to catch operation
             d = self.rpc_conv.pop(convid)
-            self.rpc_conv[convid] = "TIMEOUT:%s" % pu.currenttime_ms()
+            self._end_conversation(convid, 'ended_timeout')
+            self.rpc_tombstones[convid] = "TIMEOUT:%s" % pu.currenttime_ms()
+            self._tombstone_wheel.add(convid, CF_rpc_tombstone_ttl)
+            self._start_sweep()
             d.errback(defer.TimeoutError())
         if timeout:
             callto = reactor.callLater(timeout, _timeoutf)
@@ -548,6 +647,56 @@ class Process(BasicLifecycleObject,ResponseCodes):
         # to call back the caller on the rpc_deferred when the receipt is done.
         return rpc_deferred
 
+    def rpc_send_many(self, recv, operation, contents, headers=None, **kwargs):
+        """
+        @brief Sends many requests for one operation RPC style without waiting
+        for the replies in between. The requests share one conversation id; each
+        carries its position in the batch-seq header, which the reply returns.
+        The service may answer each request as it comes (see reply) or several
+        together (see reply_many).
+        @param contents a list of message contents, one per request
+        @param headers headers sent with every request
+        @param timeout seconds to wait for all the replies
+        @retval a list of Deferreds, one per request, each with the message
+        value on receipt. Use gather to wait for all of them.
+        """
+        msgheaders = self._prepare_message(headers)
+        convid = msgheaders['conv-id']
+        batch = BatchRPC(len(contents))
+        if len(contents) == 0:
+            self._end_conversation(convid, 'ended_reply')
+            return batch.deferreds
+
+        timeout = float(kwargs.get('timeout', CF_rpc_timeout))
+        def _timeoutf():
+            log.warn("Process %s batch RPC conv-id=%s timed out with %d of %d replies missing! " % (
+                self.proc_name, convid, batch.pending, len(batch.deferreds)))
+            self.rpc_conv.pop(convid)
+            self._end_conversation(convid, 'ended_timeout')
+            self.rpc_tombstones[convid] = "TIMEOUT:%s" % pu.currenttime_ms()
+            self._tombstone_wheel.add(convid, CF_rpc_tombstone_ttl)
+            self._start_sweep()
+            for d in batch.remaining():
+                d.errback(defer.TimeoutError())
+        if timeout:
+            batch.rpc_call = reactor.callLater(timeout, _timeoutf)
+        self.rpc_conv[convid] = batch
+
+        for seq, content in enumerate(contents):
+            itemheaders = msgheaders.copy()
+            itemheaders['batch-seq'] = seq
+            itemheaders['batch-size'] = len(contents)
+            self.send(recv, operation, content, itemheaders)
+        return batch.deferreds
+
+    def gather(self, deferreds):
+        """
+        @brief Wait for a list of Deferreds, such as those of rpc_send_many
+        @retval a Deferred with the list of their results in order. It fails
+        with the failure of the first one to fail.
+        """
+        return gather(deferreds)
+
     def send(self, recv, operation, content, headers=None, reply=False):
         """
         @brief Send a message via the process receiver to destination.
@@ -573,8 +722,51 @@ class Process(BasicLifecycleObject,ResponseCodes):
             msgheaders['conv-id'] = convid
             msgheaders['conv-seq'] = 1
             self.conversations[convid] = Conversation()
+            self._conv_wheel.add(convid, CF_conversation_ttl)
+            self._start_sweep()
         return msgheaders
 
+    def _end_conversation(self, convid, reason):
+        """
+        Remove a conversation which ended with a reply or a timeout
+        """
+        if self.conversations.pop(convid, None) is not None:
+            self._conv_wheel.discard(convid)
+            self._conv_counts[reason] += 1
+
+    def _expire_conversation(self, convid):
+        """
+        Called by the time wheel for a conversation which outlived its ttl
+        """
+        self.conversations.pop(convid, None)
+
+    def _start_sweep(self):
+        if not self._conv_sweep.running and self._get_state() != BasicStates.S_TERMINATED:
+            self._conv_sweep.start(CF_conversation_sweep, now=False)
+
+    def _sweep_conversations(self):
+        self._conv_wheel.advance()
+        self._tombstone_wheel.advance()
+        if not len(self._conv_wheel) and not len(self._tombstone_wheel):
+            self._conv_sweep.stop()
+
+    def conversation_stats(self):
+        """
+        @brief Report the sizes of the conversation tables and how their
+        entries were removed
+        @retval dictionary of counters
+        """
+        self._conv_wheel.advance()
+        self._tombstone_wheel.advance()
+        stats = {'conversations':len(self.conversations),
+                 'rpc_outstanding':len(self.rpc_conv),
+                 'rpc_tombstones':len(self.rpc_tombstones),
+                 'expired_ttl':self._conv_wheel.expired,
+                 'expired_max':self._conv_wheel.evicted,
+                 'tombstones_expired':self._tombstone_wheel.expired + self._tombstone_wheel.evicted}
+        stats.update(self._conv_counts)
+        return stats
+
     def _create_convid(self):
         # Returns a new unique conversation id
         send = self.id.full
@@ -590,6 +782,7 @@ class Process(BasicLifecycleObject,ResponseCodes):
         """
         if not operation:
             operation = self.MSG_RESULT
+        headers = dict(headers)
                 
         ionMsg = msg.payload
         recv = ionMsg.get('reply-to', None)
@@ -598,6 +791,9 @@ class Process(BasicLifecycleObject,ResponseCodes):
         else:
             headers['conv-id'] = ionMsg.get('conv-id','')
             headers['conv-seq'] = int(ionMsg.get('conv-seq',0)) + 1
+            # Tell a batch RPC which item this answers
+            if 'batch-seq' in ionMsg and not 'batch-seqs' in headers:
+                headers['batch-seq'] = ionMsg['batch-seq']
             
         # Values in the headers KWarg take precidence over the response_code and exception KWargs!
         reshdrs = dict()
@@ -614,6 +810,19 @@ class Process(BasicLifecycleObject,ResponseCodes):
             
         return self.send(pu.get_process_id(recv), operation, content, reshdrs, reply=True)
 
+    def reply_many(self, msgs, contents, operation=None, headers={}):
+        """
+        @brief Answer several requests of one batch RPC (see rpc_send_many)
+        with a single message
+        @param msgs the request messages, all from the same conversation
+        @param contents a list of the reply content for each message
+        @retval Deferred for send of reply
+        """
+        seqs = [m.payload.get('batch-seq', None) for m in msgs]
+        reshdrs = {'batch-seqs':seqs}
+        reshdrs.update(headers)
+        return self.reply(msgs[0], operation=operation, content=list(contents), headers=reshdrs)
+
     def reply_ok(self, msg, content=None, headers={}):
         """
         Boilerplate method that replies to a given message with a success
@@ -674,7 +883,7 @@ class Process(BasicLifecycleObject,ResponseCodes):
 
     def get_conversation(self, headers):
         convid = headers.get('conv-id', None)
-        return self.conversations(convid, None)
+        return self.conversations.get(convid, None)
 
     # --- Process and child process management
 
@@ -791,6 +1000,19 @@ class ProcessClient(ProcessClientBase):
         """
         return self.proc.rpc_send(self.target, *args)
 
+    def rpc_send_many(self, *args, **kwargs):
+        """
+        Sends pipelined RPC messages to the specified target via originator
+        process - see Process.rpc_send_many
+        """
+        return self.proc.rpc_send_many(self.target, *args, **kwargs)
+
+    def gather(self, deferreds):
+        """
+        Waits for a list of Deferreds - see Process.gather
+        """
+        return self.proc.gather(deferreds)
+
     def send(self, *args):
         """
         Sends a message to the specified target via originator process
@@ -10,14 +10,15 @@ import os
 import hashlib
 
 from twisted.trial import unittest
-from twisted.internet import defer
+from twisted.internet import defer, task
 
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 
 from ion.core import ioninit
 from ion.core.messaging import ion_reply_codes
-from ion.core.process.process import Process, ProcessDesc, ProcessFactory, ProcessError
+from ion.core.process.process import Process, ProcessDesc, ProcessFactory, ProcessError, BatchRPC, \
+    CF_conversation_sweep
 from ion.core.cc.container import Container
 from ion.core.exception import ReceivedError
 from ion.core.messaging.receiver import Receiver, WorkerReceiver
@@ -243,6 +244,31 @@ class ProcessTest(IonTestCase):
         except defer.TimeoutError, te:
             log.info('Timeout received')
 
+        stats = sup.conversation_stats()
+        self.assertEquals(stats['rpc_tombstones'], 1)
+        self.assertEquals(stats['ended_timeout'], 1)
+        self.assertEquals(len(sup.rpc_conv), 0)
+
+    @defer.inlineCallbacks
+    def test_rpc_send_many(self):
+        child1 = ProcessDesc(name='echo', module='ion.core.process.test.test_process')
+        pid1 = yield self.test_sup.spawn_child(child1)
+
+        contents = ['content%d' % i for i in range(10)]
+        replies = yield self.test_sup.gather(self.test_sup.rpc_send_many(pid1, 'echo', contents))
+        self.assertEquals([cont for (cont, hdrs, msg) in replies], contents)
+        self.assertEquals(self.test_sup.rpc_conv, {})
+
+        # The service answers all of them in one message
+        replies = yield self.test_sup.gather(self.test_sup.rpc_send_many(pid1, 'echo_together', contents))
+        self.assertEquals([cont for (cont, hdrs, msg) in replies], contents)
+
+        try:
+            yield self.test_sup.gather(self.test_sup.rpc_send_many(pid1, 'echo_exception', contents))
+            self.fail("ReceivedError expected")
+        except ReceivedError, re:
+            log.info('Batch failed correctly')
+
     @defer.inlineCallbacks
     def test_register_lco(self):
         """
@@ -301,6 +327,126 @@ class ProcessTest(IonTestCase):
         #self.assertRaises(ProcessError,lcop.register_life_cycle_object,lco5)
         #yield lcop.register_life_cycle_object(lco5)
         
+class ConversationTableTest(unittest.TestCase):
+    """
+    Tests the expiry of the conversation tables of a process without a container
+    """
+
+    def setUp(self):
+        self.now = 1000.0
+        self.proc = Process()
+        for wheel in (self.proc._conv_wheel, self.proc._tombstone_wheel):
+            wheel._clock = lambda: self.now
+            wheel._tick = wheel._now_tick()
+        self.clock = task.Clock()
+        self.proc._conv_sweep.clock = self.clock
+
+    def tearDown(self):
+        if self.proc._conv_sweep.running:
+            self.proc._conv_sweep.stop()
+
+    def test_conversation_ttl(self):
+        proc = self.proc
+        convids = [proc._prepare_message(None)['conv-id'] for i in range(10)]
+        self.assertEquals(len(proc.conversations), 10)
+
+        # Continuing a conversation does not create a new one
+        proc._prepare_message({'conv-id':convids[0]})
+        self.assertEquals(len(proc.conversations), 10)
+
+        proc._end_conversation(convids[0], 'ended_reply')
+
+        self.now += 301
+        stats = proc.conversation_stats()
+        self.assertEquals(stats['conversations'], 0)
+        self.assertEquals(stats['expired_ttl'], 9)
+        self.assertEquals(stats['ended_reply'], 1)
+
+    def test_tombstones_expire(self):
+        proc = self.proc
+        proc.rpc_tombstones['#1'] = 'TIMEOUT:0'
+        proc._tombstone_wheel.add('#1', 300)
+
+        self.now += 100
+        self.assertEquals(proc.conversation_stats()['rpc_tombstones'], 1)
+
+        self.now += 201
+        stats = proc.conversation_stats()
+        self.assertEquals(stats['rpc_tombstones'], 0)
+        self.assertEquals(stats['tombstones_expired'], 1)
+
+    def test_sweep(self):
+        proc = self.proc
+        for i in range(3):
+            proc._prepare_message(None)
+        self.assertTrue(proc._conv_sweep.running)
+
+        # Expired without any further messages
+        self.now += 301
+        self.clock.advance(CF_conversation_sweep)
+        self.assertEquals(len(proc.conversations), 0)
+        self.assertEquals(proc._conv_wheel.expired, 3)
+        # and the sweep stops with nothing left to expire
+        self.assertFalse(proc._conv_sweep.running)
+
+
+class FakeMessage(object):
+    """
+    Stands in for a received message in the tests without a container
+    """
+    def __init__(self, payload):
+        self.payload = payload
+
+    def ack(self):
+        return defer.succeed(None)
+
+
+class BatchReplyTest(unittest.TestCase):
+    """
+    Tests how the replies to a batch RPC are matched to its items
+    """
+
+    def setUp(self):
+        self.proc = Process()
+        self.convid = '#batch'
+        self.batch = BatchRPC(3)
+        self.proc.rpc_conv[self.convid] = self.batch
+
+    def _reply(self, content, **headers):
+        payload = {'sender':'test', 'conv-id':self.convid, 'status':'OK', 'content':content}
+        payload.update(headers)
+        return self.proc.receive(payload, FakeMessage(payload))
+
+    @defer.inlineCallbacks
+    def test_stream(self):
+        results = self.proc.gather(self.batch.deferreds)
+
+        yield self._reply('two', **{'batch-seq':2})
+        yield self._reply('zero', **{'batch-seq':0})
+        self.assertEquals(self.batch.pending, 1)
+        self.assertIn(self.convid, self.proc.rpc_conv)
+
+        # A repeated reply is ignored
+        yield self._reply('again', **{'batch-seq':0})
+        self.assertEquals(self.batch.pending, 1)
+
+        yield self._reply('one', **{'batch-seq':1})
+        self.assertNotIn(self.convid, self.proc.rpc_conv)
+
+        results = yield results
+        self.assertEquals([cont for (cont, hdrs, msg) in results], ['zero', 'one', 'two'])
+
+    @defer.inlineCallbacks
+    def test_together(self):
+        results = self.proc.gather(self.batch.deferreds)
+        yield self._reply(['zero', 'two'], **{'batch-seqs':[0, 2]})
+        yield self._reply(['one'], **{'batch-seqs':[1]})
+
+        results = yield results
+        self.assertEquals([cont for (cont, hdrs, msg) in results], ['zero', 'one', 'two'])
+        self.assertEquals(self.proc.conversation_stats()['rpc_outstanding'], 0)
+
+
 class EchoProcess(Process):
         
     @defer.inlineCallbacks
@@ -315,6 +461,16 @@ class EchoProcess(Process):
         # Reply as though we caught an exception!
         yield self.reply(msg,content=None, exception=ex, response_code=self.APP_INVALID_KEY)
 
+    @defer.inlineCallbacks
+    def op_echo_together(self, content, headers, msg):
+        # Hold the requests of a batch and answer them all in one message
+        held = getattr(self, '_held', [])
+        held.append(msg)
+        self._held = held
+        if len(held) == int(headers['batch-size']):
+            self._held = []
+            yield self.reply_many(held, [m.payload['content'] for m in held])
+
     @defer.inlineCallbacks
     def op_echo_exception(self, content, headers, msg):
         log.info("Message received: "+str(content))
@@ -49,7 +49,20 @@ class Authentication(object):
         """
         take a message, and return a binary signature of it
         """
-        pkey = EVP.load_key_string(rsa_private_key)
+        pkey = self.load_private_key(rsa_private_key)
+        return self.sign_message_pkey(message, pkey)
+
+    def load_private_key(self, rsa_private_key):
+        """
+        parse a private key once so that it can be used to sign many messages
+        """
+        return EVP.load_key_string(rsa_private_key)
+
+    def sign_message_pkey(self, message, pkey):
+        """
+        take a message, and return a binary signature of it using a parsed
+        private key from load_private_key
+        """
         pkey.sign_init()
         pkey.sign_update(message)
         sig = pkey.sign_final()
@@ -65,8 +78,21 @@ class Authentication(object):
         """
         This verifies that the message and the signature are indeed signed by the certificate
         """
+        pubkey = self.load_certificate_pubkey(certificate)
+        return self.verify_message_pubkey(message, pubkey, signed_message)
+
+    def load_certificate_pubkey(self, certificate):
+        """
+        parse a certificate once and return its public key so that it can be
+        used to verify many messages
+        """
         x509 = X509.load_cert_string(certificate)
-        pubkey = x509.get_pubkey()
+        return x509.get_pubkey()
+
+    def verify_message_pubkey(self, message, pubkey, signed_message):
+        """
+        verify a signature using a public key from load_certificate_pubkey
+        """
         pubkey.verify_init()
         pubkey.verify_update(message)
         if pubkey.verify_final(signed_message) == 1:
@@ -181,3 +181,64 @@ class CassandraStore(IStore):
         else:
             self.kvs.remove(self.key, columns=[col])
         return defer.succeed(None)
+
+    def _get_columns(self, cols):
+        try:
+            if self.cf_super:
+                return self.kvs.get(self.key, columns=cols, super_column=self.namespace)
+            return self.kvs.get(self.key, columns=cols)
+        except pycassa.NotFoundException:
+            return {}
+
+    def get_many(self, cols):
+        """
+        @brief Read many columns of the row with one get
+        @retval Deferred, for dict of column to value, None for columns not
+        existing
+        """
+        cols = list(cols)
+        values = {}
+        if cols:
+            values = self._get_columns(cols)
+        return defer.succeed(dict([(col, values.get(col)) for col in cols]))
+
+    def put_many(self, items):
+        """
+        @brief Write many columns of the row with one insert
+        @param items  dict of column to value, or list of (column, value) pairs
+        """
+        if not isinstance(items, dict):
+            items = dict(items)
+        if not items:
+            return defer.succeed(None)
+        try:
+            if self.cf_super:
+                self.kvs.insert(self.key, {self.namespace:items})
+            else:
+                self.kvs.insert(self.key, items)
+        except pycassa.connection.NoServerAvailable, ex:
+            log.info("Problem with the put_many of %d columns" % len(items))
+            log.debug(ex.argskw)
+        return defer.succeed(None)
+
+    def remove_many(self, cols):
+        """
+        @brief Delete many columns of the row with one remove
+        """
+        cols = list(cols)
+        if cols:
+            if self.cf_super:
+                self.kvs.remove(self.key, columns=cols, super_column=self.namespace)
+            else:
+                self.kvs.remove(self.key, columns=cols)
+        return defer.succeed(None)
+
+    def exists_many(self, cols):
+        """
+        @brief Test many columns of the row with one get
+        """
+        cols = list(cols)
+        values = {}
+        if cols:
+            values = self._get_columns(cols)
+        return defer.succeed(dict([(col, col in values) for col in cols]))
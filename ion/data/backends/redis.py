@@ -3,6 +3,7 @@
 @author Dorian Raymer
 """
 
+from twisted.internet import defer
 from twisted.internet import reactor
 from twisted.internet.protocol import ClientCreator
 
@@ -62,3 +63,50 @@ class Store(store.IStore):
         @retval Deferred, for success of this operation
         """
         return self.kvs.delete(key)
+
+    def exists(self, key):
+        """
+        @param key  an immutable key
+        @retval Deferred, for True if a value is associated with key
+        """
+        d = self.kvs.exists(key)
+        d.addCallback(bool)
+        return d
+
+    def get_many(self, keys):
+        """
+        @brief Read the values of many keys with one MGET
+        @retval Deferred, for dict of key to value, None for keys not existing
+        """
+        keys = list(keys)
+        if not keys:
+            return defer.succeed({})
+        d = self.kvs.mget(*keys)
+        d.addCallback(lambda values: dict(zip(keys, values)))
+        return d
+
+    def put_many(self, items):
+        """
+        @brief Write many values with one MSET
+        @param items  dict of key to value, or list of (key, value) pairs
+        """
+        items = dict(store._items(items))
+        if not items:
+            return defer.succeed(None)
+        return self.kvs.mset(items)
+
+    def remove_many(self, keys):
+        """
+        @brief Delete many keys with one DEL
+        """
+        keys = list(keys)
+        if not keys:
+            return defer.succeed(None)
+        return self.kvs.delete(*keys)
+
+    def exists_many(self, keys):
+        """
+        @brief Test many keys; the EXISTS commands are pipelined on the
+        connection
+        """
+        return store._gather_many(self.exists, keys)
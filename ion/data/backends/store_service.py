@@ -93,6 +93,42 @@ class StoreService(ServiceProcess):
         val = yield self.store.get(key)
         yield self.reply_ok(msg, {'value':val})
 
+    @defer.inlineCallbacks
+    def op_get_many(self, content, headers, msg):
+        """
+        Service operation: Gets the values of a list of keys.
+        """
+        keys = [str(key) for key in content['keys']]
+        vals = yield self.store.get_many(keys)
+        yield self.reply_ok(msg, {'values':vals})
+
+    @defer.inlineCallbacks
+    def op_put_many(self, content, headers, msg):
+        """
+        Service operation: Puts a list of [key, value] pairs into the store.
+        """
+        items = [(str(key), value) for key, value in content['items']]
+        res = yield self.store.put_many(items)
+        yield self.reply_ok(msg, {'result':res})
+
+    @defer.inlineCallbacks
+    def op_remove_many(self, content, headers, msg):
+        """
+        Service operation: Delete the values of a list of keys.
+        """
+        keys = [str(key) for key in content['keys']]
+        res = yield self.store.remove_many(keys)
+        yield self.reply_ok(msg, {'result':res})
+
+    @defer.inlineCallbacks
+    def op_exists_many(self, content, headers, msg):
+        """
+        Service operation: Which of a list of keys have values.
+        """
+        keys = [str(key) for key in content['keys']]
+        res = yield self.store.exists_many(keys)
+        yield self.reply_ok(msg, {'result':res})
+
     @defer.inlineCallbacks
     def op_query(self, content, headers, msg):
         """
@@ -143,6 +179,57 @@ class StoreServiceClient(ServiceClient, IStore):
         log.info('Service put reply: '+str(content))
         defer.returnValue(str(content))
 
+    @defer.inlineCallbacks
+    def get_many(self, keys):
+        """
+        @brief Get the values of many keys with one request
+        @retval a Deferred with a dictionary of key to value, None for keys
+        which are not in the store
+        """
+        yield self._check_init()
+        keys = [str(key) for key in keys]
+        (content, headers, msg) = yield self.rpc_send('get_many', {'keys':keys})
+        defer.returnValue(content['values'])
+
+    @defer.inlineCallbacks
+    def put_many(self, items):
+        """
+        @brief Put many values with one request
+        @param items a dictionary or a list of (key, value) pairs
+        """
+        yield self._check_init()
+        if isinstance(items, dict):
+            items = items.items()
+        items = [[str(key), value] for key, value in items]
+        (content, headers, msg) = yield self.rpc_send('put_many', {'items':items})
+        log.info('Service put_many: stored %d values' % len(items))
+
+    @defer.inlineCallbacks
+    def remove_many(self, keys):
+        """
+        @brief Remove many keys with one request
+        """
+        yield self._check_init()
+        keys = [str(key) for key in keys]
+        (content, headers, msg) = yield self.rpc_send('remove_many', {'keys':keys})
+        defer.returnValue(content['result'])
+
+    @defer.inlineCallbacks
+    def exists(self, key):
+        result = yield self.exists_many([key])
+        defer.returnValue(result[str(key)])
+
+    @defer.inlineCallbacks
+    def exists_many(self, keys):
+        """
+        @brief Find which of many keys have values with one request
+        @retval a Deferred with a dictionary of key to True or False
+        """
+        yield self._check_init()
+        keys = [str(key) for key in keys]
+        (content, headers, msg) = yield self.rpc_send('exists_many', {'keys':keys})
+        defer.returnValue(content['result'])
+
     @defer.inlineCallbacks
     def query(self, regex):
         (content, headers, msg) = yield self.rpc_send('query', {'regex':regex})
@@ -21,6 +21,11 @@ from zope.interface import Interface
 from zope.interface import implements
 from zope.interface import Attribute 
 
+from twisted.internet import defer
+
+from ion.util.timer_wheel import TimeWheel
+from ion.util.deferreds import gather
+
 
 NULL_CHR = "\x00"
 
@@ -534,6 +539,12 @@ class StoreContextWrapper(object):
     def get(self, id):
         return self.backend.get(self._key(id))
 
+    def get_many(self, ids):
+        ids = list(ids)
+        d = self.backend.get_many([self._key(id) for id in ids])
+        d.addCallback(lambda values: dict([(id, values.get(self._key(id))) for id in ids]))
+        return d
+
     def put(self, id, val):
         return self.backend.put(self._key(id), val)
 
@@ -544,6 +555,105 @@ class StoreContextWrapper(object):
         pattern = "%s%s" % (self.prefix, regex,)
         return self.backend.query(pattern)
 
+    def exists(self, id):
+        return self.backend.exists(self._key(id))
+
+
+# Byte budget of the encoded object cache of each CAStore
+CACHE_BYTES = 8 * 1024 * 1024
+
+# Seconds an id which was not found is remembered as missing by exists, and
+# the most such ids remembered
+NEGATIVE_TTL = 10.0
+NEGATIVE_MAX = 10000
+
+
+class ObjectCache(object):
+    """
+    @brief Encoded content objects by id, within a byte budget. The encoding
+    of a content object never changes, so an entry is valid for as long as
+    it is held.
+
+    Entries are kept in two generations. A hit in the old generation moves
+    the entry to the young one; when the young generation fills half the
+    budget it becomes the old one and the previous old generation is
+    dropped. This approximates least recently used eviction at O(1) per
+    operation.
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.clear()
+
+    def __len__(self):
+        return len(self._young) + len(self._old)
+
+    def __contains__(self, id):
+        return id in self._young or id in self._old
+
+    def get(self, id):
+        """
+        @retval the encoded object with id, or None
+        """
+        entry = self._young.get(id)
+        if entry is None:
+            entry = self._old.pop(id, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._old_bytes -= entry[1]
+            self._insert(id, entry)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, id, data, size):
+        """
+        @param size the number of bytes the entry is charged for
+        """
+        if size > self.max_bytes / 2:
+            return
+        if id in self._young:
+            return
+        entry = self._old.pop(id, None)
+        if entry is not None:
+            self._old_bytes -= entry[1]
+        self._insert(id, (data, size))
+
+    def discard(self, id):
+        entry = self._young.pop(id, None)
+        if entry is not None:
+            self._young_bytes -= entry[1]
+        entry = self._old.pop(id, None)
+        if entry is not None:
+            self._old_bytes -= entry[1]
+
+    def clear(self):
+        self._young = {}
+        self._young_bytes = 0
+        self._old = {}
+        self._old_bytes = 0
+
+    def stats(self):
+        return {'entries':len(self),
+                'bytes':self._young_bytes + self._old_bytes,
+                'hits':self.hits,
+                'misses':self.misses,
+                'evictions':self.evictions}
+
+    def _insert(self, id, entry):
+        if self._young_bytes + entry[1] > self.max_bytes / 2:
+            self.evictions += len(self._old)
+            self._old = self._young
+            self._old_bytes = self._young_bytes
+            self._young = {}
+            self._young_bytes = 0
+        self._young[id] = entry
+        self._young_bytes += entry[1]
+
+
 class CAStore(object):
     """
     Content Addressable Store
@@ -557,17 +667,38 @@ class CAStore(object):
             Commit.type:Commit,
             }
 
-    def __init__(self, backend, namespace='', compression=None):
+    def __init__(self, backend, namespace='', compression=None,
+                 cache_bytes=CACHE_BYTES, negative_ttl=NEGATIVE_TTL):
         """
         @param backend instance that provides the ion.data.store.IStore
         interface.
         @param namespace root prefix qualifying context for this CAS with in the
         general space of the backend store.
+        @param cache_bytes byte budget for encoded objects held in process,
+        0 for no cache
+        @param negative_ttl seconds exists remembers that an id was not found,
+        0 to always ask the backend. An object written to a shared backend
+        by another store can look missing to exists for that long; get
+        always asks the backend.
         """
         self.backend = backend
         self.namespace = namespace
         self.objs = StoreContextWrapper(backend, namespace + '.objs.')
 
+        self.cache = None
+        if cache_bytes:
+            self.cache = ObjectCache(cache_bytes)
+
+        self.missing = None
+        """
+        Ids recently found missing from the backend
+        """
+        if negative_ttl:
+            self.missing = TimeWheel(granularity=negative_ttl / 10.0,
+                                     slots=11, max_entries=NEGATIVE_MAX)
+        self.negative_ttl = negative_ttl
+        self.negative_hits = 0
+
     def decode(self, encoded_obj):
         """
         @brief decode raw object read from backend store
@@ -599,9 +730,30 @@ class CAStore(object):
         hash = sha1(data)
         id = sha1_to_hex(hash)
         d = self.objs.put(id, data)
-        d.addCallback(lambda _: id)
+        d.addCallback(self._put_cb, id, data)
         return d
 
+    def _put_cb(self, result, id, data):
+        if self.missing is not None:
+            self.missing.discard(id)
+        if self.cache is not None:
+            # The encoding, not obj - the caller may go on changing it
+            self.cache.put(id, data, len(data))
+        return id
+
+    def _is_missing(self, id):
+        if self.missing is None:
+            return False
+        self.missing.advance()
+        if id in self.missing:
+            self.negative_hits += 1
+            return True
+        return False
+
+    def _set_missing(self, id):
+        if self.missing is not None:
+            self.missing.add(id, self.negative_ttl)
+
     def get(self, id):
         """
         @param id key where an object is stored (object hash)
@@ -610,23 +762,71 @@ class CAStore(object):
         """
         if len(id) == 20:
             id = sha1_to_hex(id)
+        if self.cache is not None:
+            data = self.cache.get(id)
+            if data is not None:
+                # Each get returns a new object. The encoding was checked
+                # against the id when it went into the cache.
+                return defer.maybeDeferred(self.decode, data)
+
         d = self.objs.get(id)
         def _decode_cb(data):
             if not data:
+                self._set_missing(id)
                 raise CAStoreError("Object with id: %s not found" % id)
-            obj = self.decode(data)
-            # assure integrity 
-            if not id == sha1(obj, bin=False):
-                raise CAStoreError("Object Integrity Error!")
+            obj = self._decode_checked(id, data)
+            if self.missing is not None:
+                self.missing.discard(id)
+            if self.cache is not None:
+                self.cache.put(id, data, len(data))
             return obj
         d.addCallback(_decode_cb)
         # d.addErrback
         return d
 
+    def _decode_checked(self, id, data):
+        obj = self.decode(data)
+        # assure integrity
+        if not id == sha1(obj, bin=False):
+            raise CAStoreError("Object Integrity Error!")
+        return obj
+
+    def exists(self, id):
+        """
+        @param id key of a content object (object hash)
+        @retval defer.Deferred that fires with True if the object is stored.
+        The object itself is not read.
+        """
+        if len(id) == 20:
+            id = sha1_to_hex(id)
+        if self.cache is not None and id in self.cache:
+            return defer.succeed(True)
+        if self._is_missing(id):
+            return defer.succeed(False)
+
+        d = self.objs.exists(id)
+        def _exists_cb(found):
+            if not found:
+                self._set_missing(id)
+            return found
+        d.addCallback(_exists_cb)
+        return d
+
+    def has_many(self, ids):
+        """
+        @param ids list of content object ids
+        @retval defer.Deferred that fires with a dict of id to True if the
+        object is stored. The ids are looked up concurrently.
+        """
+        ids = list(ids)
+        d = gather([self.exists(id) for id in ids])
+        d.addCallback(lambda results: dict(zip(ids, results)))
+        return d
+
     def _obj_exists(self, id):
-        """Store (backend) interface does not have an 'exists' method; this
-        has to be implemented by trying to get the whole object, which
-        could be just as inefficient as writing over the existing object.
         """
+        @deprecated Use exists
+        """
+        return self.exists(id)
 
 
@@ -51,50 +51,221 @@ class TypedAttribute(object):
         """
         @brief This class method decodes a typed attribute
         @param value is the string which is to be decoded
-        @param _types is a dictionary of types which can be decoded
+        @param _types is a dictionary of types which can be decoded. Types
+        are looked up in it before DataObject._types.
         """
-
-        #print '=================================================='
-        types = _types.copy()
-        stype, default = value.split(NULL_CHR)
-        #print '---------- ', stype, default
-
-        #the use of str is temporary unti lcaarch msging is fixed
-        mytype = eval(str(stype), types)
+        stype, sep, default = value.partition(NULL_CHR)
+        mytype = lookup_type(stype, _types)
 
         # If a value is given for the typed attribute decode it.
         if default:
-            #print 'type, default:',type, default
-            #return cls(type, eval(str(default), types))
-            if issubclass(mytype, DataObject):
-                data_object = mytype.decode(json.loads(default),header=False)
-                return cls(mytype, data_object)
-
-            elif issubclass(mytype, (list, set, tuple)):
-                list_enc = json.loads(default)
-
-                objs=[]
-                for item in list_enc:
-                    itype, ival = item.split(NULL_CHR)
-                    itype = eval(str(itype), types)
-
-                    if issubclass(itype, DataObject):
-                        objs.append(itype.decode(json.loads(ival),header=False) )
-                    else:
-                        objs.append(itype(str(ival)))
+            return cls(mytype, _decode_legacy(mytype, default))
+        return cls(mytype)
+
+
+# Types which may appear in an encoded DataObject besides the registered
+# DataObject._types
+BUILTIN_TYPES = dict([(t.__name__, t) for t in
+                      (str, unicode, int, long, float, bool, list, tuple, set,
+                       dict, type(None))])
+
+def lookup_type(name, types=None):
+    """
+    @brief Find the class for a type name in an encoded DataObject
+    @param types an optional dictionary searched first
+    """
+    if types:
+        t = types.get(name)
+        if t is not None:
+            return t
+    t = DataObject._types.get(name)
+    if t is None:
+        t = BUILTIN_TYPES.get(name)
+        if t is None:
+            # Names which are not in the tables - as decoding always did
+            scope = DataObject._types.copy()
+            if types:
+                scope.update(types)
+            t = eval(str(name), scope)
+    return t
+
+_BOOLS = {'True':True, 'False':False}
+
+def _decode_legacy(mytype, default):
+    """
+    Decode the value part of a legacy encoded attribute
+    """
+    if issubclass(mytype, DataObject):
+        return mytype._codec.decode(json.loads(default), header=False)
+
+    elif issubclass(mytype, (list, set, tuple)):
+        objs = []
+        for item in json.loads(default):
+            itype, sep, ival = item.partition(NULL_CHR)
+            itype = lookup_type(itype)
+            if issubclass(itype, DataObject):
+                objs.append(itype._codec.decode(json.loads(ival), header=False))
+            else:
+                objs.append(itype(str(ival)))
+        return mytype(objs)
 
-                return cls(mytype, mytype(objs))
-            elif issubclass(mytype, dict):
-                # since dicts are 'just' json encoded load and return!
+    elif issubclass(mytype, dict):
+        # since dicts are 'just' json encoded load and return!
+        return json.loads(default)
 
-                return cls(mytype, json.loads(default))
+    elif issubclass(mytype, bool):
+        value = _BOOLS.get(default)
+        if value is None:
+            value = eval(str(default))
+        return value
 
-            elif issubclass(mytype, bool):
-                return cls(mytype, eval(str(default)))
+    return mytype(str(default))
 
+def _encode_legacy(value):
+    """
+    Encode an attribute value in the legacy type-name, NUL, value format
+    """
+    prefix = _SCALAR_PREFIX.get(type(value))
+    if prefix is not None:
+        return prefix + str(value)
+
+    name = type(value).__name__
+    # Attempt to handle nested Resources
+    if isinstance(value, DataObject):
+        value_enc = type(value)._codec.encode(value, header=False)
+        return "%s%s%s" % (name, NULL_CHR, json.dumps(value_enc))
+    elif isinstance(value, (list, tuple, set)):
+        # List can contain other data object or decodable types
+        list_enc = []
+        for val in value:
+            if isinstance(val, DataObject):
+                val_enc = type(val)._codec.encode(val, header=False)
+                list_enc.append("%s%s%s" % (type(val).__name__, NULL_CHR, json.dumps(val_enc)))
             else:
-                return cls(mytype, mytype(str(default)))
-        return cls(mytype)
+                list_enc.append("%s%s%s" % (type(val).__name__, NULL_CHR, str(val)))
+        return "%s%s%s" % (name, NULL_CHR, json.dumps(list_enc))
+    elif isinstance(value, dict):
+        # dict can only contain JSONable types!
+        return "%s%s%s" % (name, NULL_CHR, json.dumps(value))
+    return "%s%s%s" % (name, NULL_CHR, str(value))
+
+_SCALAR_PREFIX = dict([(t, t.__name__ + NULL_CHR) for t in (str, int, long, float, bool)])
+
+# Types carried as themselves in the JSON format, by name. A str may hold
+# any bytes, so it is carried as the latin-1 decoding of its bytes.
+_JSON_SCALARS = dict([(t.__name__, t) for t in (unicode, int, long, float, bool)])
+_JSON_SCALARS['NoneType'] = lambda payload: None
+
+_JSON_SCALAR_NAMES = dict([(t, name) for name, t in _JSON_SCALARS.items()])
+_JSON_SCALAR_NAMES[type(None)] = 'NoneType'
+
+_JSON_SCALARS['str'] = lambda payload: payload.encode('latin-1')
+
+def _to_json(value):
+    """
+    Convert a value to the [type name, payload] form of the JSON format
+    """
+    if type(value) is str:
+        return ['str', value.decode('latin-1')]
+    name = _JSON_SCALAR_NAMES.get(type(value))
+    if name is not None:
+        return [name, value]
+    t = type(value)
+    if isinstance(value, DataObject):
+        return [t.__name__, t._codec.to_json(value)]
+    if isinstance(value, (list, tuple, set)):
+        return [t.__name__, [_to_json(v) for v in value]]
+    if isinstance(value, dict):
+        return [t.__name__, value]
+    return [t.__name__, str(value)]
+
+def _from_json(pair):
+    """
+    Convert the [type name, payload] form of the JSON format to a value
+    """
+    name, payload = pair
+    scalar = _JSON_SCALARS.get(name)
+    if scalar is not None:
+        return scalar(payload)
+    t = lookup_type(name)
+    if issubclass(t, DataObject):
+        return t._codec.from_json(payload)
+    if issubclass(t, (list, tuple, set)):
+        return t([_from_json(v) for v in payload])
+    if issubclass(t, dict):
+        return payload
+    return t(str(payload))
+
+
+class DataObjectCodec(object):
+    """
+    @brief Encoder and decoder for the instances of one DataObject class.
+    DataObjectType builds one for each class, so the attribute names are
+    found once rather than for every message.
+
+    Two formats are supported: the legacy list of (name, 'type NUL value')
+    pairs, in which nested objects are JSON strings inside the list, and a
+    JSON format - one document in which each value is a [type name, payload]
+    pair and nested objects are nested JSON objects.
+    """
+
+    def __init__(self, cls, names):
+        self.cls = cls
+        self.names = names
+        self.typedattributes = cls._find_typedattributes()
+
+        self.containers = []
+        """
+        Attributes which each instance must get its own empty container for
+        """
+        for name, att in self.typedattributes.items():
+            if att.type in (list, dict, set):
+                self.containers.append((name, att.type))
+
+    def encode(self, obj, header=True):
+        """
+        @retval the legacy encoding of obj
+        """
+        encoded = []
+        if header:
+            encoded.append(('Object_Type', self.cls.__name__))
+        for name in self.names:
+            encoded.append((name, _encode_legacy(getattr(obj, name))))
+        return encoded
+
+    def decode(self, attrs, header=True):
+        """
+        @brief Decode the legacy encoding of an instance of this class, or
+        with a header of any registered class
+        """
+        codec = self
+        if header:
+            attrs = iter(attrs)
+            hdr, clsname = attrs.next()
+            codec = lookup_type(clsname)._codec
+
+        obj = codec.cls()
+        for name, value in attrs:
+            stype, sep, default = value.partition(NULL_CHR)
+            mytype = lookup_type(stype)
+            if default:
+                value = _decode_legacy(mytype, default)
+            else:
+                value = mytype()
+            setattr(obj, name, value)
+        return obj
+
+    def to_json(self, obj):
+        """
+        @retval dict of attribute name to [type name, payload]
+        """
+        return dict([(name, _to_json(getattr(obj, name))) for name in self.names])
+
+    def from_json(self, fields):
+        obj = self.cls()
+        for name, pair in fields.iteritems():
+            setattr(obj, name, _from_json(pair))
+        return obj
 
 
 class DataObjectType(type):
@@ -126,7 +297,9 @@ class DataObjectType(type):
                 d[value.name] = value.default
 
         dict['__dict__'] = d
-        return type.__new__(cls, name, bases, dict)
+        newcls = type.__new__(cls, name, bases, dict)
+        newcls._codec = DataObjectCodec(newcls, [key[1:] for key in d])
+        return newcls
 
 class DataObject(object):
     """
@@ -140,13 +313,8 @@ class DataObject(object):
     _types = {}
 
     def __init__(self):
-        for name, att in self.get_typedattributes().items():
-            if att.type == list:
-                setattr(self,name,[])
-            if att.type == dict:
-                setattr(self,name,{})
-            if att.type == set:
-                setattr(self,name,set([]))
+        for name, container in type(self)._codec.containers:
+            setattr(self, name, container())
 
 
     def __eq__(self, other):
@@ -309,10 +477,15 @@ class DataObject(object):
         @brief Get the typed attributes of the class
         @note What about typed attributes that are over ridden?
         """
+        return dict(cls._codec.typedattributes)
+
+    @classmethod
+    def _find_typedattributes(cls):
         d={}
         ayb = reflect.allYourBase(cls)
         for yb in reversed(ayb):
-            if issubclass(yb, DataObject):
+            # Called while DataObject itself is being created
+            if isinstance(yb, DataObjectType):
                 d.update(yb.__dict__)
 
         d.update(cls.__dict__)
@@ -348,75 +521,30 @@ class DataObject(object):
 
     def encode(self,header=True):
         """
+        @brief Encode in the legacy format, a list of (name, value) pairs
         """
-        encoded = []
-        if header:
-            encoded.append(('Object_Type', "%s" % (type(self).__name__)))
-
-        for name in self.attributes:
-            value = getattr(self, name)
-
-            # Attempt to handle nested Resources
-            if isinstance(value, DataObject):
-                value_enc = value.encode(header = False)
-                encoded.append((name, "%s%s%s" % (type(value).__name__, NULL_CHR, json.dumps(value_enc),)))
-            elif isinstance(value,(list,tuple,set)):
-                # List can contain other data object or decodable types
-                list_enc = []
-                for val in value:
-                    if isinstance(val, DataObject):
-                        val_enc = val.encode(header = False)
-                        list_enc.append("%s%s%s" % (type(val).__name__, NULL_CHR, json.dumps(val_enc),))
-                    else:
-                        list_enc.append("%s%s%s" % (type(val).__name__, NULL_CHR, str(val)))
-
-                encoded.append((name, "%s%s%s" % (type(value).__name__, NULL_CHR, json.dumps(list_enc),)))
-            elif isinstance(value,dict):
-                # dict can only contain JSONable types!
-                encoded.append((name, "%s%s%s" % (type(value).__name__, NULL_CHR, json.dumps(value),)))
-
-            else:
-                encoded.append((name, "%s%s%s" % (type(value).__name__, NULL_CHR, str(value),)))
-
-
-        return encoded
-
+        return type(self)._codec.encode(self, header)
 
     @classmethod
     def decode(cls, attrs,header=True):
         """
         decode store object[s]
         """
-        #d = dict([(str(name), TypedAttribute.decode(value)) for name, value in attrs])
-        
-        clsobj = cls
-        if isinstance(attrs, tuple):
-            attrs = list(attrs)
-
-        if header:
-            header,clsname = attrs.pop(0)
-            #print 'header',header
-            #print 'clsname',clsname
-            clsobj = eval(str(clsname), cls._types)
-
-        obj = clsobj()
-
-
-        for name, value in attrs:
-            #print 'name',name
-            #print 'value',value
-            ta = TypedAttribute.decode(value, cls._types)
-            #print 'ta',ta.default
-
-            setattr(obj,name, ta.default)
-            #print name, d[str(name)].default
-        #print 'clsobj', clsobj
-
+        return cls._codec.decode(attrs, header)
 
+    def encode_json(self):
+        """
+        @brief Encode as a single JSON document
+        """
+        return json.dumps([type(self).__name__, type(self)._codec.to_json(self)])
 
-        #
-        #return type(clsobj.__name__, (clsobj,), d)
-        return obj
+    @staticmethod
+    def decode_json(data):
+        """
+        @brief Decode a DataObject encoded by encode_json. Its class must be
+        in DataObject._types.
+        """
+        return _from_json(json.loads(data))
 
 
 
@@ -843,7 +971,13 @@ def register_jsond():
         content_type='application/ion-jsond',
         content_encoding='utf-8')
 
+def register_json():
+    serializer.register('json', lambda o: o.encode_json(), DataObject.decode_json,
+        content_type='application/ion-dataobject-json',
+        content_encoding='utf-8')
+
 register_alpha()
 register_jsond()
 register_dencoder()
+register_json()
 serializer.set_default('alpha')
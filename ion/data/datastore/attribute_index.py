@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""
+@file ion/data/datastore/attribute_index.py
+@author agent
+@brief Secondary index over the TypedAttribute values of the resources in a
+registry. The index is used to narrow a find to the resources which can
+possibly match a description, so that only those have to be loaded and
+compared.
+"""
+
+import re
+import bisect
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from ion.data import dataobject
+
+# Characters which make a pattern a real regular expression
+REGEX_META = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+def index_key(value):
+    """
+    @brief Normalize a typed attribute value to a hashable index key
+    @retval the key or None if the value can not be indexed
+    @note Values are normalized the way they are stored and decoded by the
+    object store (see DataObject.encode) so that a description built from a
+    find result maps to the same key as the stored resource.
+    """
+    if isinstance(value, dataobject.LCState):
+        return ('LCState', str(value))
+    elif isinstance(value, bool):
+        return value
+    elif isinstance(value, float):
+        return float(str(value))
+    elif isinstance(value, (str, unicode, int, long)):
+        return value
+    return None
+
+
+class AttributeIndex(object):
+    """
+    @brief In memory index from attribute name and value to the set of
+    resource identities which have that value at their head commit.
+
+    Scalar attribute values (str, int, float, bool and LCState) are indexed.
+    Exact matches are a dictionary lookup, anchored literal regex patterns are
+    prefix queries against a sorted list of the distinct string values and
+    other regex patterns are evaluated against the distinct values only - never
+    against the stored resources. Attributes which can not be indexed (lists,
+    dicts and nested DataObjects) do not narrow the candidate set; the caller
+    must still compare each candidate with the description.
+    """
+
+    UNINDEXED = ('RegistryCommit', 'RegistryBranch')
+    """
+    Reference attributes which are set from the request in get_resource rather
+    than stored with the resource - they can not be used to narrow a find.
+    """
+
+    def __init__(self):
+        self.complete = False
+        """
+        Set once every resource in the backend has been added to the index
+        """
+
+        self.generation = None
+        """
+        The registry generation the index was last checked against
+        """
+
+        self._records = {}
+        """
+        Map of identity to a dictionary of the attribute keys indexed for it
+        """
+
+        self._commits = {}
+        """
+        Map of identity to the commit of the resource which was indexed
+        """
+
+        self._ids = []
+        """
+        Sorted list of the indexed identities
+        """
+
+        self._values = {}
+        """
+        Map of attribute name to a map of key to the set of identities
+        """
+
+        self._strings = {}
+        """
+        Map of attribute name to a sorted list of the distinct string keys
+        """
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, identity):
+        return identity in self._records
+
+    def ids(self):
+        """
+        @retval the set of all indexed identities
+        """
+        return set(self._records.keys())
+
+    def commit(self, identity):
+        """
+        @retval the commit of the resource which was indexed, or None
+        """
+        return self._commits.get(identity)
+
+    def ids_after(self, cursor=''):
+        """
+        @brief Iterate over the indexed identities in order, starting after
+        cursor. Identities added or removed while iterating are seen or
+        skipped as their place in the order is reached.
+        """
+        i = bisect.bisect_right(self._ids, cursor)
+        while i < len(self._ids):
+            identity = self._ids[i]
+            yield identity
+            i = bisect.bisect_right(self._ids, identity)
+
+    def clear(self):
+        self.complete = False
+        self.generation = None
+        self._records = {}
+        self._commits = {}
+        self._ids = []
+        self._values = {}
+        self._strings = {}
+
+    def add(self, resource, overwrite=True):
+        """
+        @brief Index the attribute values of a resource
+        @param resource a Resource with a RegistryIdentity
+        @param overwrite if False an existing entry for the identity is kept.
+        Used when loading the index so that a concurrent register wins.
+        """
+        identity = resource.RegistryIdentity
+        if identity in self._records:
+            if not overwrite:
+                return
+            self.remove(identity)
+        bisect.insort(self._ids, identity)
+
+        record = {}
+        for name in resource.attributes:
+            if name in self.UNINDEXED:
+                continue
+            key = index_key(getattr(resource, name))
+            if key is None:
+                continue
+            record[name] = key
+
+            att_values = self._values.setdefault(name, {})
+            ids = att_values.get(key, None)
+            if ids is None:
+                ids = set()
+                att_values[key] = ids
+                if isinstance(key, basestring):
+                    bisect.insort(self._strings.setdefault(name, []), key)
+            ids.add(identity)
+
+        self._records[identity] = record
+        self._commits[identity] = resource.RegistryCommit
+
+    def remove(self, identity):
+        """
+        @brief Remove an identity from the index
+        """
+        record = self._records.pop(identity, None)
+        if record is None:
+            return
+        del self._commits[identity]
+        del self._ids[bisect.bisect_left(self._ids, identity)]
+
+        for name, key in record.iteritems():
+            att_values = self._values[name]
+            ids = att_values[key]
+            ids.discard(identity)
+            if not ids:
+                del att_values[key]
+                if isinstance(key, basestring):
+                    strings = self._strings[name]
+                    del strings[bisect.bisect_left(strings, key)]
+
+    def candidates(self, description, regex=True, ignore_defaults=True, attnames=None):
+        """
+        @brief Find the identities which may match the description - the same
+        arguments as DataObject.compared_to.
+        @retval a set of identities, or None if no attribute of the description
+        can narrow the search and every resource is a candidate.
+        """
+        if not attnames:
+            atts = description.attributes
+        else:
+            atts = attnames
+
+        if ignore_defaults:
+            atts = description.non_default_atts(atts)
+
+        result = None
+        for name in atts:
+            if name in self.UNINDEXED:
+                continue
+
+            try:
+                value = getattr(description, name)
+            except AttributeError, ex:
+                # compared_to can not match any resource
+                return set()
+
+            ids = self._match(name, value, regex)
+            if ids is None:
+                continue
+
+            if result is None:
+                result = set(ids)
+            else:
+                result.intersection_update(ids)
+
+            if not result:
+                break
+
+        return result
+
+    def _match(self, name, value, regex):
+        """
+        @retval the identities whose attribute may match value or None if the
+        predicate can not use the index.
+        """
+        att_values = self._values.get(name, {})
+
+        if isinstance(value, dataobject.DataObject):
+            # Nested objects are compared recursively
+            return None
+
+        key = index_key(value)
+        if key is None:
+            return None
+
+        exact = att_values.get(key, set())
+        if not regex or not isinstance(value, basestring):
+            return exact
+
+        # Regex comparison - equal values always match
+        result = set(exact)
+
+        if not REGEX_META.search(value):
+            # A literal pattern matches anywhere in the value
+            for skey, ids in self._string_items(name):
+                if value in skey:
+                    result.update(ids)
+            return result
+
+        if value.startswith('^') and not REGEX_META.search(value[1:]):
+            # Prefix query
+            prefix = value[1:]
+            strings = self._strings.get(name, [])
+            start = bisect.bisect_left(strings, prefix)
+            for skey in strings[start:]:
+                if not skey.startswith(prefix):
+                    break
+                result.update(att_values[skey])
+            return result
+
+        if value.startswith('^') and value.endswith('$') and \
+                not value.endswith('\\$') and not REGEX_META.search(value[1:-1]):
+            # Anchored literal
+            result.update(att_values.get(value[1:-1], set()))
+            return result
+
+        # A real regular expression - evaluate it against the distinct values
+        try:
+            pattern = re.compile(value)
+        except re.error, ex:
+            log.debug('Invalid regex in find: %s' % value)
+            return result
+
+        for skey, ids in self._string_items(name):
+            if pattern.search(skey):
+                result.update(ids)
+        return result
+
+    def _string_items(self, name):
+        att_values = self._values.get(name, {})
+        for skey in self._strings.get(name, []):
+            yield skey, att_values[skey]
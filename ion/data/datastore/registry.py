@@ -8,6 +8,8 @@
 @brief base service for registering ooi resources
 """
 
+import bisect
+
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 
@@ -16,15 +18,28 @@ from twisted.internet import defer
 from ion.data import store
 from ion.data import dataobject
 from ion.data.datastore import objstore
+from ion.data.datastore import attribute_index
 
 from ion.core import ioninit
 from ion.core.process.process import ProcessFactory
 from ion.core.process.service_process import ServiceProcess, ServiceClient
 from ion.resources import coi_resource_descriptions
 import ion.util.procutils as pu
+from ion.util.deferreds import gather
 
 CONF = ioninit.config(__name__)
 
+INDEX_GENERATION = 'index_generation'
+"""
+Store meta key changed by every register, so that the registries sharing a
+backend know when their attribute index is out of date
+"""
+
+INDEX_LOAD_BATCH = 50
+"""
+Number of resources read at once when the attribute index is loaded
+"""
+
 class LCStateMixin(object):
     """
     @brief This mixin class is used to add life cycle state convenience methods
@@ -73,6 +88,13 @@ class IRegistry(object):
         """
         raise NotImplementedError, "Abstract Interface Not Implemented"
 
+    def get_resources(self,resource_references):
+        """
+        @param resource_references a list of references
+        @retval a list of the resources in the same order
+        """
+        raise NotImplementedError, "Abstract Interface Not Implemented"
+
     def set_resource_lcstate(self,resource_reference,lcstate):
         """
         """
@@ -83,6 +105,15 @@ class IRegistry(object):
         """
         raise NotImplementedError, "Abstract Interface Not Implemented"
 
+    def find_resource_page(self,description,regex=True,ignore_defaults=True,attnames=[],limit=None,cursor=''):
+        """
+        @brief Find a page of at most limit matching resources, starting after
+        the continuation token cursor.
+        @retval tuple of the list of resources and the cursor for the next
+        page - an empty cursor when there are no more results.
+        """
+        raise NotImplementedError, "Abstract Interface Not Implemented"
+
 class RegistryBackend(objstore.ObjectChassis):
     """
     """
@@ -95,8 +126,30 @@ class Registry(objstore.ObjectStore, IRegistry, LCStateMixin):
 
     objectChassis = RegistryBackend
 
+    def __init__(self, backend, partition=''):
+        objstore.ObjectStore.__init__(self, backend, partition)
+
+        self.index = attribute_index.AttributeIndex()
+        """
+        Secondary index over the typed attribute values of the head of each
+        resource. It is loaded from the backend on the first find and kept up
+        to date by register_resource. Other registries on the same backend
+        change the index generation when they register; a find which sees a
+        new generation reloads the resources whose head commit changed.
+        """
+        self._index_lock = defer.DeferredLock()
+
+        self._page_ids = None
+        """
+        The identities paged through before the index is loaded: a tuple of
+        the index generation they were listed at, the sorted identities and
+        the set of those not indexed yet
+        """
+
     def clear_registry(self):
         log.info(self.__class__.__name__ + '################################################################# clear_registry called ')
+        self.index.clear()
+        self._page_ids = None
         return self.backend.clear_store()
 
 
@@ -130,6 +183,14 @@ class Registry(objstore.ObjectStore, IRegistry, LCStateMixin):
             log.info("Committing resource")
             resource.RegistryCommit = yield res_client.commit()
             log.info("Committed resource")
+            last_generation = yield self.storemeta.get(INDEX_GENERATION)
+            generation = pu.create_guid()
+            yield self.storemeta.put(INDEX_GENERATION, generation)
+            self.index.add(resource)
+            if last_generation == self.index.generation:
+                # Nothing was registered elsewhere since the index was last
+                # checked, so it is still up to date
+                self.index.generation = generation
         else:
             resource = None
 
@@ -160,6 +221,12 @@ class Registry(objstore.ObjectStore, IRegistry, LCStateMixin):
 
         defer.returnValue(resource)
 
+    def get_resources(self, resource_references):
+        """
+        @brief Get many resource description objects
+        """
+        return gather([self.get_resource(ref) for ref in resource_references])
+
     @defer.inlineCallbacks
     def get_resource_by_id(self, id):
         resource_client = yield self.clone(id)
@@ -204,6 +271,38 @@ class Registry(objstore.ObjectStore, IRegistry, LCStateMixin):
         defer.returnValue([(yield self.get_resource(ref)) for ref in refs])
 
 
+    def _load_index(self):
+        """
+        @brief Bring the attribute index up to date with the backend
+        """
+        return self._index_lock.run(self._load_index_locked)
+
+    @defer.inlineCallbacks
+    def _load_index_locked(self):
+        # One read when nothing was registered since the last find
+        generation = yield self.storemeta.get(INDEX_GENERATION)
+        if self.index.complete and generation == self.index.generation:
+            return
+
+        refs = yield self._list()
+        ids = [ref.RegistryIdentity for ref in refs]
+        heads = yield self.refs.get_many([id + '.refs.master' for id in ids])
+
+        for id in self.index.ids().difference(ids):
+            self.index.remove(id)
+        stale = [ref for ref in refs
+                 if heads[ref.RegistryIdentity + '.refs.master'] != self.index.commit(ref.RegistryIdentity)]
+
+        for i in range(0, len(stale), INDEX_LOAD_BATCH):
+            resources = yield self.get_resources(stale[i:i + INDEX_LOAD_BATCH])
+            for res in resources:
+                if res:
+                    self.index.add(res)
+
+        self.index.generation = generation
+        self.index.complete = True
+        log.info(self.__class__.__name__ + ': loaded ' + str(len(stale)) + ' resources into the attribute index of ' + str(len(self.index)))
+
     @defer.inlineCallbacks
     def find_resource(self,description,regex=True,ignore_defaults=True,attnames=[]):
         """
@@ -213,36 +312,120 @@ class Registry(objstore.ObjectStore, IRegistry, LCStateMixin):
         @param regex Whether a regex is used or not
         @param ignore_defaults ignore registry defaults
         @param attnames attribute names associated with the resource
+        @note The attribute index narrows the search to the resources which
+        may match; only those are loaded and compared with the description.
         """
+        results, cursor = yield self.find_resource_page(description,regex,ignore_defaults,attnames,limit=None)
+        defer.returnValue(results)
 
-        # container for the return arguments
-        log.info("called find_resource")
+    @defer.inlineCallbacks
+    def find_resource_page(self,description,regex=True,ignore_defaults=True,attnames=[],limit=None,cursor=''):
+        """
+        @brief Find a page of resource descriptions meeting the criteria. The
+        candidates are visited in identity order and the scan stops as soon as
+        limit matches are found, so the cost of a page is proportional to the
+        page rather than to the size of the registry.
+        @param limit the maximum number of results to return, None or 0 for all
+        @param cursor the continuation token returned with the previous page,
+        empty for the first page
+        @retval tuple of the list of matching resources and the cursor for the
+        next page, which is empty when the scan is complete.
+        @note The cursor is the identity of the last candidate examined, so it
+        remains valid while resources are registered between pages.
+        @note Before the attribute index is loaded, a page is found by reading
+        the resources in identity order from the backend; the resources read
+        are indexed on the way, so the first page does not wait for the index.
+        The identities are listed once for all pages, and again only when a
+        register changes the index generation.
+        """
+        log.info("called find_resource_page")
         log.info("description class %s" % description.__class__)
         results=[]
+        next_cursor=''
         if isinstance(description,dataobject.DataObject):
-            refs = yield self._list()
             log.debug(description)
 
-            # Get the list of descriptions in this registry
+            if limit and not self.index.complete:
+                page = yield self._find_page_unindexed(description,regex,ignore_defaults,attnames,limit,cursor)
+                defer.returnValue(page)
+
+            yield self._load_index()
 
-            reslist = yield self._list_descriptions()
-            log.info(self.__class__.__name__ + ': find_resource found ' + str(len(reslist)) + ' items in registry')
-            num_match = 1
-            for ref in refs:
-                log.info("ref: %s" % ref)
+            candidates = self.index.candidates(description,
+                                        regex=regex,
+                                        ignore_defaults=ignore_defaults,
+                                        attnames=attnames)
+            if candidates is None:
+                # Nothing to narrow the search - scan every resource
+                ids = self.index.ids_after(cursor)
+            elif len(candidates) * 8 < len(self.index):
+                # Few candidates - sorting them beats walking the whole index
+                ids = iter(sorted([id for id in candidates if id > cursor]))
+            else:
+                ids = (id for id in self.index.ids_after(cursor) if id in candidates)
+
+            for id in ids:
+                ref = dataobject.ResourceReference(RegistryIdentity=id)
                 res = yield self.get_resource(ref)
-                log.debug("Found #"+str(num_match)+":"+str(res))
-                num_match += 1
+                log.debug("Candidate:"+str(res))
                 matches_desc = description.compared_to(res,
                                         regex=regex,
                                         ignore_defaults=ignore_defaults,
                                         attnames=attnames)
                 if matches_desc:
                     results.append(res)
+                    if limit and len(results) >= limit:
+                        # A cursor only if there are candidates left
+                        for more in ids:
+                            next_cursor = id
+                            break
+                        break
 
-        defer.returnValue(results)
+        defer.returnValue((results, next_cursor))
+
+    @defer.inlineCallbacks
+    def _find_page_unindexed(self,description,regex,ignore_defaults,attnames,limit,cursor):
+        """
+        @brief Find a page by reading the resources after cursor in identity
+        order, limit at a time, and add them to the attribute index
+        """
+        generation = yield self.storemeta.get(INDEX_GENERATION)
+        if self._page_ids is None or self._page_ids[0] != generation:
+            refs = yield self._list()
+            ids = sorted([ref.RegistryIdentity for ref in refs])
+            self._page_ids = (generation, ids, set([id for id in ids if id not in self.index]))
+        generation, ids, unindexed = self._page_ids
+        pos = bisect.bisect_right(ids, cursor)
+
+        results = []
+        while pos < len(ids) and len(results) < limit:
+            batch = ids[pos:pos + min(limit, INDEX_LOAD_BATCH)]
+            resources = yield self.get_resources([dataobject.ResourceReference(RegistryIdentity=id) for id in batch])
+            for res in resources:
+                if res:
+                    self.index.add(res, overwrite=False)
+                    unindexed.discard(res.RegistryIdentity)
+
+            for res in resources:
+                pos += 1
+                if res and description.compared_to(res,
+                                        regex=regex,
+                                        ignore_defaults=ignore_defaults,
+                                        attnames=attnames):
+                    results.append(res)
+                    if len(results) >= limit:
+                        break
 
+        next_cursor = ''
+        if pos < len(ids):
+            next_cursor = ids[pos - 1]
 
+        if not unindexed:
+            # Every resource was read by the pages so far
+            self.index.generation = generation
+            self.index.complete = True
+            self._page_ids = None
+        defer.returnValue((results, next_cursor))
 
 
 
@@ -382,11 +565,14 @@ class BaseRegistryService(ServiceProcess):
         """
         @brief Find resource descriptions in the registry meeting the criteria
         listed in the properties dictionary
+        @note If the container sets a limit, one page of results is returned
+        along with the cursor to request the next page.
         """
         description = None
         regex = None
         ignore_defaults = None
         attnames = []
+        cursor = ''
 
         log.debug('Registry Service MSG:'+ str(headers))
         #container = dataobject.Resource.decode(content)
@@ -405,10 +591,12 @@ class BaseRegistryService(ServiceProcess):
             ignore_defaults = container.ignore_defaults
             attnames = container.attnames
 
-            result_list = yield self.reg.find_resource(description,regex,ignore_defaults, attnames)
+            result_list, cursor = yield self.reg.find_resource_page(description,regex,ignore_defaults, attnames,
+                                                                     limit=container.limit, cursor=container.cursor)
 
         results = coi_resource_descriptions.ResourceListContainer()
         results.resources = result_list
+        results.cursor = cursor
 
         log.info(self.__class__.__name__ + ': op_'+ headers['op'] + ' Success! ' + str(len(result_list)) + ' Matches Found')
         encoding, _, data = dataobject.serializer.encode(results, accept_encoding)
@@ -507,6 +695,35 @@ class BaseRegistryClient(ServiceClient):
         log.info(self.__class__.__name__ + ': '+ op_name + ' Success!')
         defer.returnValue(resource)
 
+    @defer.inlineCallbacks
+    def base_get_resources(self, op_name, resource_references):
+        """
+        @brief Retrieve many resources from the registry by Reference with
+        pipelined requests to the get resource operation
+        @param op_name the operation name to call in the service
+        @param resource_references a list of registry identifiers
+        @retval a Deferred with the list of resources in the same order
+        """
+        yield self._check_init()
+        log.info(self.__class__.__name__ + '; Calling:'+ op_name + ' for %d references' % len(resource_references))
+
+        assert isinstance(op_name, str), 'Invalid argument to base_get_resources'
+
+        contents = []
+        for resource_reference in resource_references:
+            assert isinstance(resource_reference, dataobject.ResourceReference), 'Invalid argument to base_get_resources'
+            encoding, _, data = dataobject.serializer.encode(resource_reference)
+            contents.append(data)
+
+        headers = {'encoding':encoding, 'accept-encoding':encoding} if contents else {}
+        replies = yield self.gather(self.rpc_send_many(op_name, contents, headers))
+
+        resources = []
+        for content, headers, msg in replies:
+            resources.append(dataobject.serializer.decode(content, headers['encoding']))
+        log.info(self.__class__.__name__ + ': '+ op_name + ' Success! %d resources' % len(resources))
+        defer.returnValue(resources)
+
     @defer.inlineCallbacks
     def base_get_resource_by_id(self, op_name, id):
         yield self._check_init()
@@ -570,15 +787,40 @@ class BaseRegistryClient(ServiceClient):
         which are still set to their default value.
         @param attnames is a list of the tyeped attribute names which should
         match to select a resource
+        @note The results are requested in pages of find_page_size so that no
+        single message has to carry the whole result set.
+        """
+        page_size = CONF.getValue('find_page_size', 100)
+        resources = []
+        cursor = ''
+        while True:
+            page, cursor = yield self.base_find_resource_page(op_name, description, regex, ignore_defaults, attnames,
+                                                              limit=page_size, cursor=cursor)
+            resources.extend(page)
+            if not cursor:
+                break
+        defer.returnValue(resources)
+
+    @defer.inlineCallbacks
+    def base_find_resource_page(self, op_name, description, regex=True,ignore_defaults=True,attnames=[],limit=None,cursor=''):
+        """
+        @brief Retrieve one page of the resources in the registry matching the
+        description - see base_find_resource for the matching arguments.
+        @param limit the maximum number of resources in the page
+        @param cursor the continuation token from the previous page, empty for
+        the first page
+        @retval a deferred tuple of the list of resources and the cursor for the
+        next page; the cursor is empty when there are no more results.
         """
         yield self._check_init()
         log.info(self.__class__.__name__ + '; Calling:'+ op_name)
 
-        assert isinstance(description, dataobject.DataObject), 'Invalid argument to base_register_resource'
-        assert isinstance(op_name, str), 'Invalid argument to base_register_resource'
-        assert isinstance(regex, bool), 'Invalid argument to base_register_resource'
-        assert isinstance(ignore_defaults, bool), 'Invalid argument to base_register_resource'
-        assert isinstance(attnames, list), 'Invalid argument to base_register_resource'
+        assert isinstance(description, dataobject.DataObject), 'Invalid argument to base_find_resource'
+        assert isinstance(op_name, str), 'Invalid argument to base_find_resource'
+        assert isinstance(regex, bool), 'Invalid argument to base_find_resource'
+        assert isinstance(ignore_defaults, bool), 'Invalid argument to base_find_resource'
+        assert isinstance(attnames, list), 'Invalid argument to base_find_resource'
+        assert isinstance(cursor, str), 'Invalid argument to base_find_resource'
 
 
         container = coi_resource_descriptions.FindResourceContainer()
@@ -586,6 +828,8 @@ class BaseRegistryClient(ServiceClient):
         container.ignore_defaults = ignore_defaults
         container.regex = regex
         container.attnames = attnames
+        container.limit = limit or 0
+        container.cursor = cursor
 
         encoding, _, data = dataobject.serializer.encode(container)
         headers = {'encoding':encoding, 'accept-encoding':encoding}
@@ -593,12 +837,10 @@ class BaseRegistryClient(ServiceClient):
 
         log.debug(self.__class__.__name__ + ': '+ op_name + '; Result:' + str(headers))
 
-        # Return a list of resources
-        #results = dataobject.DataObject.decode(content['value'])
-        #results = dataobject.serializer.decode(content['value'], headers['encoding'])
+        # Return a list of resources and the continuation token
         results = dataobject.serializer.decode(content, headers['encoding'])
-        log.info(self.__class__.__name__ + ': '+ op_name + ' Success!')
-        defer.returnValue(results.resources)
+        log.info(self.__class__.__name__ + ': '+ op_name + ' Success! ' + str(len(results.resources)) + ' Matches in page')
+        defer.returnValue((results.resources, results.cursor))
 
 
 class RegistryClient(BaseRegistryClient,IRegistry,LCStateMixin):
@@ -622,11 +864,17 @@ class RegistryClient(BaseRegistryClient,IRegistry,LCStateMixin):
     def get_resource(self,resource_reference):
         return self.base_get_resource('get_resource', resource_reference)
 
+    def get_resources(self,resource_references):
+        return self.base_get_resources('get_resource', resource_references)
+
     def set_resource_lcstate(self, resource_reference, lcstate):
         return self.base_set_resource_lcstate('set_resource_lcstate',resource_reference, lcstate)
 
     def find_resource(self, description,regex=True,ignore_defaults=True, attnames=[]):
         return self.base_find_resource('find_resource',description,regex,ignore_defaults,attnames)
 
+    def find_resource_page(self, description,regex=True,ignore_defaults=True, attnames=[],limit=None,cursor=''):
+        return self.base_find_resource_page('find_resource',description,regex,ignore_defaults,attnames,limit,cursor)
+
     def get_resource_by_id(self, id):
         return self.base_get_resource_by_id('get_resource_by_id', id)
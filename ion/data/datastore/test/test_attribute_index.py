@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+@file ion/data/datastore/test/test_attribute_index.py
+@author agent
+@brief Test the registry attribute index
+"""
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.trial import unittest
+
+from ion.data import dataobject
+from ion.data.datastore import attribute_index
+
+
+class IndexedResource(dataobject.Resource):
+    count = dataobject.TypedAttribute(int)
+    ratio = dataobject.TypedAttribute(float)
+    tags = dataobject.TypedAttribute(list)
+
+dataobject.DataObject._types['IndexedResource']=IndexedResource
+
+
+class AttributeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = attribute_index.AttributeIndex()
+        self.resources = {}
+        for name, count in (('foo', 1), ('foobar', 2), ('moo', 1), ('xfoo', 3)):
+            res = IndexedResource.create_new_resource()
+            res.name = name
+            res.count = count
+            res.tags = [name]
+            self.index.add(res)
+            self.resources[name] = res
+
+    def _ids(self, *names):
+        return set([self.resources[name].RegistryIdentity for name in names])
+
+    def _find(self, description, regex=True, ignore_defaults=True, attnames=None):
+        return self.index.candidates(description, regex, ignore_defaults, attnames)
+
+    def test_exact(self):
+        desc = IndexedResource()
+        desc.name = 'foo'
+        self.assertEqual(self._find(desc, regex=False), self._ids('foo'))
+
+        desc.count = 1
+        self.assertEqual(self._find(desc, regex=False), self._ids('foo'))
+
+        desc.name = 'nothere'
+        self.assertEqual(self._find(desc, regex=False), set())
+
+    def test_int(self):
+        desc = IndexedResource()
+        desc.count = 1
+        self.assertEqual(self._find(desc), self._ids('foo', 'moo'))
+
+    def test_literal_regex_is_substring(self):
+        desc = IndexedResource()
+        desc.name = 'foo'
+        self.assertEqual(self._find(desc), self._ids('foo', 'foobar', 'xfoo'))
+
+    def test_prefix(self):
+        desc = IndexedResource()
+        desc.name = '^foo'
+        self.assertEqual(self._find(desc), self._ids('foo', 'foobar'))
+
+    def test_anchored_literal(self):
+        desc = IndexedResource()
+        desc.name = '^foo$'
+        self.assertEqual(self._find(desc), self._ids('foo'))
+
+    def test_real_regex(self):
+        desc = IndexedResource()
+        desc.name = '[mx]f?oo$'
+        self.assertEqual(self._find(desc), self._ids('moo', 'xfoo'))
+
+        desc.name = 'foo('
+        self.assertEqual(self._find(desc), set())
+
+    def test_lcstate(self):
+        desc = IndexedResource()
+        desc.lifecycle = dataobject.LCStates.new
+        self.assertEqual(self._find(desc, ignore_defaults=False, attnames=['lifecycle']),
+                         self._ids('foo', 'foobar', 'moo', 'xfoo'))
+
+        desc.lifecycle = dataobject.LCStates.active
+        self.assertEqual(self._find(desc, ignore_defaults=False, attnames=['lifecycle']), set())
+
+    def test_unindexed_attributes(self):
+        desc = IndexedResource()
+        desc.tags = ['foo']
+        # Lists do not narrow the search
+        self.assertEqual(self._find(desc), None)
+
+        # Nothing set - everything is a candidate
+        self.assertEqual(self._find(IndexedResource()), None)
+
+    def test_float_normalized(self):
+        res = IndexedResource.create_new_resource()
+        res.ratio = 1.0/3.0
+        self.index.add(res)
+
+        # The value as decoded from the store
+        desc = IndexedResource()
+        desc.ratio = float(str(res.ratio))
+        self.assertEqual(self._find(desc, regex=False), set([res.RegistryIdentity]))
+
+    def test_update_and_remove(self):
+        res = self.resources['foo']
+        res.name = 'baz'
+        res.set_lifecyclestate(dataobject.LCStates.active)
+        self.index.add(res)
+
+        desc = IndexedResource()
+        desc.name = '^foo'
+        self.assertEqual(self._find(desc), self._ids('foobar'))
+
+        desc = IndexedResource()
+        desc.lifecycle = dataobject.LCStates.active
+        self.assertEqual(self._find(desc), self._ids('foo'))
+
+        self.index.remove(res.RegistryIdentity)
+        self.assertNotIn(res.RegistryIdentity, self.index)
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self._find(desc), set())
+
+    def test_add_no_overwrite(self):
+        stale = IndexedResource.create_new_resource(id=self.resources['moo'].RegistryIdentity)
+        stale.name = 'stale'
+        self.index.add(stale, overwrite=False)
+
+        desc = IndexedResource()
+        desc.name = 'moo'
+        self.assertEqual(self._find(desc), self._ids('moo'))
+
+    def test_ids_after(self):
+        ids = sorted(self._ids('foo', 'foobar', 'moo', 'xfoo'))
+        self.assertEqual(list(self.index.ids_after()), ids)
+        self.assertEqual(list(self.index.ids_after(ids[1])), ids[2:])
+
+        # Changes while iterating are seen in order
+        walk = self.index.ids_after()
+        self.assertEqual(walk.next(), ids[0])
+        self.index.remove(ids[1])
+        self.assertEqual(walk.next(), ids[2])
+        self.index.remove(ids[0])
+        self.assertEqual(list(walk), ids[3:])
@@ -35,6 +35,14 @@ class RegistryTest(unittest.TestCase):
     def tearDown(self):
         yield self.reg.clear_registry()
 
+    def _count_lists(self, reg):
+        calls = []
+        _list = reg._list
+        def counting_list():
+            calls.append(None)
+            return _list()
+        reg._list = counting_list
+        return calls
 
     @defer.inlineCallbacks
     def test_register(self):
@@ -59,6 +67,21 @@ class RegistryTest(unittest.TestCase):
 
 
 
+    @defer.inlineCallbacks
+    def test_get_resources(self):
+        refs = []
+        for name in ('foo', 'moo', 'bar'):
+            res = dataobject.Resource.create_new_resource()
+            res.name = name
+            res = yield self.reg.register_resource(res)
+            refs.append(res.reference())
+
+        resources = yield self.reg.get_resources(refs)
+        self.assertEqual([res.name for res in resources], ['foo', 'moo', 'bar'])
+
+        resources = yield self.reg.get_resources([])
+        self.assertEqual(resources, [])
+
     @defer.inlineCallbacks
     def test_register_overwrite(self):
         res = dataobject.Resource.create_new_resource()
@@ -168,6 +191,131 @@ class RegistryTest(unittest.TestCase):
         self.assertNotIn(res1, results)
         self.assertIn(res2, results)
 
+    @defer.inlineCallbacks
+    def test_registry_find_indexed(self):
+
+        res1 = dataobject.Resource.create_new_resource()
+        res1.name = 'foo'
+        res1 = yield self.reg.register_resource(res1)
+
+        res2 = dataobject.Resource.create_new_resource()
+        res2.name = 'foobar'
+        res2 = yield self.reg.register_resource(res2)
+
+        blank = dataobject.Resource()
+        blank.name = '^foo'
+        results = yield self.reg.find_resource(blank,regex=True,ignore_defaults=True)
+        self.assertEqual(len(results), 2)
+
+        blank.name = '^foo$'
+        results = yield self.reg.find_resource(blank,regex=True,ignore_defaults=True)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].name, 'foo')
+
+        # Changing the life cycle state must update the index
+        yield self.reg.set_resource_lcstate_active(res2.reference())
+
+        blank = dataobject.Resource()
+        blank.lifecycle = dataobject.LCStates.active
+        results = yield self.reg.find_resource(blank,regex=False,ignore_defaults=True)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].name, 'foobar')
+
+        # A registry over the same backend loads its index from the store
+        if isinstance(self.reg, registry.Registry):
+            reg2 = registry.Registry(self.reg.backend)
+            results = yield reg2.find_resource(blank,regex=False,ignore_defaults=True)
+            self.assertEqual(len(results), 1)
+
+            # and sees what the other registry changes afterwards
+            yield self.reg.set_resource_lcstate_active(res1.reference())
+            res3 = dataobject.Resource.create_new_resource()
+            res3.name = 'foobaz'
+            res3.set_lifecyclestate(dataobject.LCStates.active)
+            yield self.reg.register_resource(res3)
+            results = yield reg2.find_resource(blank,regex=False,ignore_defaults=True)
+            self.assertEqual(sorted([res.name for res in results]), ['foo', 'foobar', 'foobaz'])
+
+            # A register of its own keeps the index of a registry up to date
+            lists = self._count_lists(reg2)
+            res4 = dataobject.Resource.create_new_resource()
+            res4.name = 'foobat'
+            res4.set_lifecyclestate(dataobject.LCStates.active)
+            yield reg2.register_resource(res4)
+            results = yield reg2.find_resource(blank,regex=False,ignore_defaults=True)
+            self.assertEqual(len(results), 4)
+            self.assertEqual(lists, [])
+
+            # but not after a register elsewhere
+            yield self.reg.set_resource_lcstate_new(res4.reference())
+            results = yield reg2.find_resource(blank,regex=False,ignore_defaults=True)
+            self.assertEqual(len(results), 3)
+            self.assertEqual(len(lists), 1)
+
+    @defer.inlineCallbacks
+    def test_registry_find_paged(self):
+
+        names = set()
+        for i in range(7):
+            res = dataobject.Resource.create_new_resource()
+            res.name = 'page%d' % i
+            yield self.reg.register_resource(res)
+            names.add(res.name)
+
+        other = dataobject.Resource.create_new_resource()
+        other.name = 'other'
+        yield self.reg.register_resource(other)
+
+        blank = dataobject.Resource()
+        blank.name = '^page'
+
+        found = []
+        cursor = ''
+        pages = 0
+        while True:
+            results, cursor = yield self.reg.find_resource_page(blank,regex=True,ignore_defaults=True,limit=3,cursor=cursor)
+            self.assertTrue(len(results) <= 3)
+            found.extend([res.name for res in results])
+            pages += 1
+            if not cursor:
+                break
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(found), 7)
+        self.assertEqual(set(found), names)
+
+        # An exact final page does not leave a dangling cursor
+        blank.name = '^page[0-5]$'
+        results, cursor = yield self.reg.find_resource_page(blank,regex=True,ignore_defaults=True,limit=3)
+        results, cursor = yield self.reg.find_resource_page(blank,regex=True,ignore_defaults=True,limit=3,cursor=cursor)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(cursor, '')
+
+        # The full find is unchanged
+        blank.name = '^page'
+        results = yield self.reg.find_resource(blank,regex=True,ignore_defaults=True)
+        self.assertEqual(len(results), 7)
+
+        # Before its index is loaded, a registry reads only what a page needs
+        if isinstance(self.reg, registry.Registry):
+            reg2 = registry.Registry(self.reg.backend)
+            lists = self._count_lists(reg2)
+            blank = dataobject.Resource()
+            results, cursor = yield reg2.find_resource_page(blank,regex=True,ignore_defaults=True,limit=3)
+            self.assertEqual(len(results), 3)
+            self.assertEqual(len(reg2.index), 3)
+            self.assertFalse(reg2.index.complete)
+
+            found = [res.name for res in results]
+            while cursor:
+                results, cursor = yield reg2.find_resource_page(blank,regex=True,ignore_defaults=True,limit=3,cursor=cursor)
+                found.extend([res.name for res in results])
+            self.assertEqual(set(found), names | set(['other']))
+            self.assertEqual(len(found), 8)
+            self.assertTrue(reg2.index.complete)
+            # The identities were listed for the first page only
+            self.assertEqual(len(lists), 1)
+
 
         
 class RegistryServiceTest(IonTestCase, RegistryTest):
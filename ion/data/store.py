@@ -17,6 +17,8 @@ log = ion.util.ionlog.getLogger(__name__)
 
 from twisted.internet import defer
 
+from ion.util.deferreds import gather
+
 
 class IStore(object):
     """
@@ -80,6 +82,70 @@ class IStore(object):
         """
         raise NotImplementedError, "Abstract Interface Not Implemented"
 
+    def exists(self, key):
+        """
+        @param key  an immutable key
+        @retval Deferred, for True if a value is associated with key
+        @note The default reads the value; backends which can test for a key
+        without moving its value should override this.
+        """
+        d = self.get(key)
+        d.addCallback(lambda value: value is not None)
+        return d
+
+    def get_many(self, keys):
+        """
+        @param keys  list of keys
+        @retval Deferred, for dict of key to value, None for keys not existing
+        @note The default issues one get per key, all at once. Backends with a
+        multi-key read should override this and the other *_many methods.
+        """
+        return _gather_many(self.get, keys)
+
+    def put_many(self, items):
+        """
+        @param items  dict of key to value, or list of (key, value) pairs
+        @retval Deferred, for success of this operation
+        """
+        d = gather([self.put(key, value) for key, value in _items(items)])
+        d.addCallback(lambda _: None)
+        return d
+
+    def remove_many(self, keys):
+        """
+        @param keys  list of keys
+        @retval Deferred, for success of this operation
+        """
+        d = gather([self.remove(key) for key in keys])
+        d.addCallback(lambda _: None)
+        return d
+
+    def exists_many(self, keys):
+        """
+        @param keys  list of keys
+        @retval Deferred, for dict of key to True if a value is associated
+        """
+        return _gather_many(self.exists, keys)
+
+
+def _items(items):
+    """
+    @retval list of (key, value) pairs from a dict or a list of pairs
+    """
+    if isinstance(items, dict):
+        return items.items()
+    return list(items)
+
+def _gather_many(op, keys):
+    """
+    Call op for each key at once
+    @retval Deferred, for dict of key to the result of op
+    """
+    keys = list(keys)
+    d = gather([op(key) for key in keys])
+    d.addCallback(lambda results: dict(zip(keys, results)))
+    return d
+
 
 class Store(IStore):
     """
@@ -128,3 +194,36 @@ class Store(IStore):
         if self.kvs.has_key(key):
             del self.kvs[key]
         return defer.succeed(None)
+
+    def exists(self, key):
+        """
+        @see IStore.exists
+        """
+        return defer.succeed(self.kvs.has_key(key))
+
+    def get_many(self, keys):
+        """
+        @see IStore.get_many
+        """
+        return defer.succeed(dict([(key, self.kvs.get(key, None)) for key in keys]))
+
+    def put_many(self, items):
+        """
+        @see IStore.put_many
+        """
+        self.kvs.update(_items(items))
+        return defer.succeed(None)
+
+    def remove_many(self, keys):
+        """
+        @see IStore.remove_many
+        """
+        for key in keys:
+            self.kvs.pop(key, None)
+        return defer.succeed(None)
+
+    def exists_many(self, keys):
+        """
+        @see IStore.exists_many
+        """
+        return defer.succeed(dict([(key, self.kvs.has_key(key)) for key in keys]))
@@ -226,3 +226,166 @@ class CAStoreTest(unittest.TestCase):
 
 
 
+
+
+class CountingStore(store.Store):
+    """
+    In-memory store which counts the reads of values
+    """
+    def __init__(self, **kwargs):
+        store.Store.__init__(self, **kwargs)
+        self.gets = 0
+
+    def get(self, key):
+        self.gets += 1
+        return store.Store.get(self, key)
+
+
+class CAStoreCacheTest(unittest.TestCase):
+    """@brief Test the in process cache of decoded objects and of ids
+    which were not found.
+    """
+
+    def setUp(self):
+        self.backend = CountingStore()
+        self.cas = cas.CAStore(self.backend)
+
+    @defer.inlineCallbacks
+    def test_cached_get(self):
+        b = cas.Blob('test content')
+        bid = yield self.cas.put(b)
+        b_out = yield self.cas.get(bid)
+        self.failUnlessEqual(b_out.value, b.value)
+        self.failIf(b_out is b)
+        self.failUnlessEqual(self.backend.gets, 0)
+
+        self.cas.cache.clear()
+        b_out = yield self.cas.get(bid)
+        self.failUnlessEqual(b_out.value, b.value)
+        b_out2 = yield self.cas.get(sha1(b))
+        self.failUnlessEqual(b_out2.value, b.value)
+        self.failIf(b_out2 is b_out)
+        self.failUnlessEqual(self.backend.gets, 1)
+        self.failUnlessEqual(self.cas.cache.hits, 2)
+
+    @defer.inlineCallbacks
+    def test_checked_once(self):
+        b = cas.Blob('test content')
+        bid = yield self.cas.put(b)
+        self.cas.cache.clear()
+
+        calls = []
+        def counting_sha1(val, bin=True):
+            calls.append(val)
+            return sha1(val, bin)
+        self.patch(cas, 'sha1', counting_sha1)
+
+        # Only the read from the backend is checked
+        yield self.cas.get(bid)
+        yield self.cas.get(bid)
+        self.failUnlessEqual(len(calls), 1)
+        self.failUnlessEqual(self.backend.gets, 1)
+
+    @defer.inlineCallbacks
+    def test_cached_copies(self):
+        b = cas.Blob('test content')
+        bid = yield self.cas.put(b)
+        # Changing an object put or got does not change what is stored
+        b.content = 'changed'
+        b_out = yield self.cas.get(bid)
+        self.failUnlessEqual(b_out.content, 'test content')
+        b_out.content = 'changed again'
+        b_out = yield self.cas.get(bid)
+        self.failUnlessEqual(b_out.content, 'test content')
+
+    @defer.inlineCallbacks
+    def test_integrity_on_fill(self):
+        b = cas.Blob('test content')
+        bid = yield self.cas.put(b)
+        self.cas.cache.clear()
+        yield self.backend.put('.objs.' + bid, cas.Blob('other').encode())
+        try:
+            yield self.cas.get(bid)
+            self.fail()
+        except cas.CAStoreError:
+            pass
+        self.failIf(bid in self.cas.cache)
+
+    @defer.inlineCallbacks
+    def test_negative(self):
+        b = cas.Blob('later')
+        bid = sha1(b, bin=False)
+        found = yield self.cas.exists(bid)
+        self.failIf(found)
+        found = yield self.cas.exists(bid)
+        self.failIf(found)
+        self.failUnlessEqual(self.cas.negative_hits, 1)
+
+        # get always asks the backend - the object may have been written
+        # by another store
+        yield self.backend.put('.objs.' + bid, b.encode())
+        b_out = yield self.cas.get(bid)
+        self.failUnlessEqual(b_out.value, b.value)
+        found = yield self.cas.exists(bid)
+        self.failUnless(found)
+
+        # A put through this store is seen at once
+        b2 = cas.Blob('later still')
+        b2id = sha1(b2, bin=False)
+        found = yield self.cas.exists(b2id)
+        self.failIf(found)
+        yield self.cas.put(b2)
+        found = yield self.cas.exists(b2id)
+        self.failUnless(found)
+
+    @defer.inlineCallbacks
+    def test_negative_expires(self):
+        clock = [1000.0]
+        self.cas.missing = cas.TimeWheel(granularity=1.0, slots=11,
+                                         clock=lambda: clock[0])
+        b = cas.Blob('written elsewhere')
+        bid = sha1(b, bin=False)
+        found = yield self.cas.exists(bid)
+        self.failIf(found)
+
+        yield self.backend.put('.objs.' + bid, b.encode())
+        found = yield self.cas.exists(bid)
+        self.failIf(found)
+
+        clock[0] += self.cas.negative_ttl + 1
+        found = yield self.cas.exists(bid)
+        self.failUnless(found)
+
+    @defer.inlineCallbacks
+    def test_has_many(self):
+        b = cas.Blob('test content')
+        b2 = cas.Blob('deja vu')
+        bid = yield self.cas.put(b)
+        self.cas.cache.clear()
+        b2id = sha1(b2, bin=False)
+        result = yield self.cas.has_many([bid, b2id])
+        self.failUnlessEqual(result, {bid:True, b2id:False})
+        self.failUnlessEqual(self.backend.gets, 0)
+
+    def test_cache_bounded(self):
+        cache = cas.ObjectCache(max_bytes=100)
+        for i in range(20):
+            cache.put(str(i), i, 10)
+            self.failUnless(cache.stats()['bytes'] <= 100)
+        self.failUnlessEqual(cache.get('19'), 19)
+        self.failUnlessEqual(cache.get('0'), None)
+
+        # a hit in the old generation keeps the entry
+        cache = cas.ObjectCache(max_bytes=100)
+        for i in range(5):
+            cache.put(str(i), i, 10)
+        cache.put('5', 5, 10)
+        self.failUnlessEqual(cache.get('0'), 0)
+        for i in range(6, 10):
+            cache.put(str(i), i, 10)
+        self.failUnlessEqual(cache.get('0'), 0)
+        self.failUnlessEqual(cache.get('1'), None)
+
+        # too big to cache
+        cache.put('big', 'big', 60)
+        self.failIf('big' in cache)
@@ -318,6 +318,11 @@ class TestSimpleObject(unittest.TestCase):
         self.assertEqual(self.obj,dec,'Original: %s \n Decoded: %s' % (str(self.obj), str(dec)))
         self.assertEqual(type(self.obj).__name__,type(dec).__name__)
 
+    def testJSON(self):
+        dec = dataobject.DataObject.decode_json(self.obj.encode_json())
+        self.assertEqual(self.obj,dec,'Original: %s \n Decoded: %s' % (str(self.obj), str(dec)))
+        self.assertEqual(type(self.obj).__name__,type(dec).__name__)
+
 
 class PrimaryTypesObject(SimpleObject):
     """
@@ -375,6 +380,37 @@ class TestDataObjectMethods(unittest.TestCase):
         self.assertEqual(atts['boolen'].type,type(self.obj.boolen))
         self.assertEqual(atts['integer'].type,type(self.obj.integer))
 
+class TestDataObjectCodec(unittest.TestCase):
+    def setUp(self):
+        obj = PrimaryTypesObject()
+        obj.key = 'seabird'
+        obj.floating = 3.14159
+        self.obj = obj
+
+    def test_lookup_type(self):
+        self.assertEqual(dataobject.lookup_type('PrimaryTypesObject'),PrimaryTypesObject)
+        self.assertEqual(dataobject.lookup_type('int'),int)
+        self.assertEqual(dataobject.lookup_type('NoneType'),type(None))
+        self.assertEqual(dataobject.lookup_type('x',{'x':SimpleObject}),SimpleObject)
+
+    def test_decode_keeps_input(self):
+        encoded = self.obj.encode()
+        copy = list(encoded)
+        dec = dataobject.DataObject.decode(encoded)
+        self.assertEqual(self.obj,dec)
+        self.assertEqual(encoded,copy)
+
+    def test_typedattributes_copy(self):
+        atts = PrimaryTypesObject.get_typedattributes()
+        del atts['key']
+        self.assertIn('key',PrimaryTypesObject.get_typedattributes())
+
+    def test_json_serializer(self):
+        content_type, content_encoding, data = dataobject.serializer.encode(self.obj, serializer='json')
+        self.assertEqual(content_type,'application/ion-dataobject-json')
+        dec = dataobject.serializer.decode(data, content_type)
+        self.assertEqual(self.obj,dec)
+
 class BinaryObject(dataobject.DataObject):
     name = dataobject.TypedAttribute(str)
     binary = dataobject.TypedAttribute(str)
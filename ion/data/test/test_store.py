@@ -16,7 +16,7 @@ from uuid import uuid4
 from twisted.trial import unittest
 from twisted.internet import defer
 
-from ion.data.store import Store
+from ion.data.store import Store, IStore
 
 from ion.data.backends.store_service import StoreServiceClient
 from ion.test.iontest import IonTestCase
@@ -81,6 +81,56 @@ class IStoreTest(unittest.TestCase):
         self.failUnlessEqual(self.value, b)
         yield self.ds.remove(self.key)
 
+    @defer.inlineCallbacks
+    def test_exists(self):
+        rc = yield self.ds.exists(self.key)
+        self.failIf(rc)
+        yield self.ds.put(self.key, self.value)
+        rc = yield self.ds.exists(self.key)
+        self.failUnless(rc)
+        yield self.ds.remove(self.key)
+        rc = yield self.ds.exists(self.key)
+        self.failIf(rc)
+
+    @defer.inlineCallbacks
+    def test_put_get_many(self):
+        items = dict([(str(uuid4()), str(uuid4())) for i in range(5)])
+        yield self.ds.put_many(items)
+
+        keys = items.keys() + [self.key]
+        values = yield self.ds.get_many(keys)
+        self.assertEqual(values[self.key], None)
+        del values[self.key]
+        self.assertEqual(values, items)
+
+    @defer.inlineCallbacks
+    def test_put_many_pairs(self):
+        items = [(str(uuid4()), str(uuid4())) for i in range(3)]
+        yield self.ds.put_many(items)
+        for key, value in items:
+            rc = yield self.ds.get(key)
+            self.failUnlessEqual(rc, value)
+
+    @defer.inlineCallbacks
+    def test_remove_exists_many(self):
+        keys = [str(uuid4()) for i in range(4)]
+        yield self.ds.put_many([(key, self.value) for key in keys])
+        yield self.ds.remove_many(keys[:2] + [self.key])
+
+        found = yield self.ds.exists_many(keys + [self.key])
+        self.failUnlessEqual(found, {keys[0]:False, keys[1]:False,
+                                     keys[2]:True, keys[3]:True,
+                                     self.key:False})
+
+    @defer.inlineCallbacks
+    def test_many_empty(self):
+        yield self.ds.put_many({})
+        yield self.ds.remove_many([])
+        rc = yield self.ds.get_many([])
+        self.failUnlessEqual(rc, {})
+        rc = yield self.ds.exists_many([])
+        self.failUnlessEqual(rc, {})
+
     @defer.inlineCallbacks
     def test_query(self):
         # Write a key, query for it, verify contents
@@ -181,6 +231,23 @@ class IStoreTest(unittest.TestCase):
 #        self.ds.manager.shutdown()
         
 
+class SingleKeyStore(Store):
+    """
+    Memory store which uses the IStore defaults for the multi-key operations
+    """
+    exists = IStore.exists
+    get_many = IStore.get_many
+    put_many = IStore.put_many
+    remove_many = IStore.remove_many
+    exists_many = IStore.exists_many
+
+
+class SingleKeyStoreTest(IStoreTest):
+
+    def _setup_backend(self):
+        return SingleKeyStore.create_store()
+
+
 class StoreServiceTest(IonTestCase, IStoreTest):
     """
     Testing example hello service.
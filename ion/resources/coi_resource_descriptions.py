@@ -23,17 +23,22 @@ class ResourceListContainer(DataObject):
     @ Brief a message object used to pass a list of resource description objects
     """
     resources = TypedAttribute(list, default=None)
+    cursor = TypedAttribute(str, default='')
 
 
 class FindResourceContainer(DataObject):
     """
     @ Brief a message object used to find resource description in a registry
     @ note string_comparison_method can be 'regex' or '=='
+    @ note limit is the maximum number of results in a page (0 for all) and
+    cursor is the continuation token returned with the previous page
     """
     description = TypedAttribute(Resource, default=None)
     regex = TypedAttribute(bool, default=True)
     ignore_defaults = TypedAttribute(bool, default=True)
     attnames = TypedAttribute(list)
+    limit = TypedAttribute(int, default=0)
+    cursor = TypedAttribute(str, default='')
 
 
 """
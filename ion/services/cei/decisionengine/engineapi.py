@@ -48,6 +48,21 @@ class Engine(object):
         """
         raise NotImplementedError
 
+    def state_changed(self, state_items):
+        """
+        Tell the engine about the data that arrived since the last 'decide'
+        call, so it can keep its own view of the state up to date
+        incrementally instead of recomputing it from the whole State.
+        
+        @note Called just before 'decide', never during it.  Engines which
+        keep no view of their own can ignore it.
+        
+        @param state_items list of new StateItem instances, oldest first
+        @retval None
+        
+        """
+        pass
+
     def decide(self, control, state):
         """
         Give the engine a chance to act on the current state of the system.
@@ -35,18 +35,10 @@ class DefaultEngine(Engine):
 
     def decide(self, control, state):
         """Engine API method"""
-        all_instance_lists = state.get_all("instance-state")
-        
         bad_states = [InstanceStates.TERMINATING, InstanceStates.TERMINATED, InstanceStates.FAILED]
-        valid_count = 0
-        for instance_list in all_instance_lists:
-            ok = True
-            for state_item in instance_list:
-                if state_item.value in bad_states:
-                    ok = False
-                    break
-            if ok:
-                valid_count += 1
+        all_latest = state.get_all_latest("instance-state")
+        bad_instances = state.get_keys_seen("instance-state", bad_states)
+        valid_count = len(all_latest) - len(bad_instances)
         
         while valid_count < self.preserve_n:
             self._launch_one(control)
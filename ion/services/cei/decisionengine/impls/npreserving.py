@@ -292,6 +292,14 @@ class NpreservingEngine(Engine):
         # track of here.
         self.uniques_that_need_to_die = []
         
+        # The engine's own view of the instances, kept up to date by
+        # state_changed: instance id -> latest StateItem, and the ids which
+        # have been in a bad state.  None until decide has seeded it from
+        # the State, and only used once the controller calls state_changed.
+        self.instance_latest = None
+        self.instance_bad = None
+        self.incremental = False
+        
     def _initdone(self, control, parameters):
         control.configure(parameters)
         log.info("Npreserving engine initialized, preserve_n: %d, unique instances: %s" % (self.preserve_n, self._uniq_report()))
@@ -480,6 +488,61 @@ class NpreservingEngine(Engine):
             self._reconfigure_uniques(uniques_conf)
 
 
+    # -----------------------------------------------------------------------
+    # Instance view
+    # -----------------------------------------------------------------------
+
+    def state_changed(self, state_items):
+        """
+        Tell the engine about the data that arrived since the last 'decide'
+        call.  Instance states are folded into the engine's view so that
+        decide does not need to ask the State for every instance.
+        
+        @param state_items list of new StateItem instances, oldest first
+        @retval None
+        
+        """
+        self.incremental = True
+        if self.instance_latest is None:
+            # seeded from the State on the next decide, which includes these
+            return
+        for item in state_items:
+            if item.typename == "instance-state":
+                self._observe(item)
+
+    def _observe(self, item):
+        self.instance_latest[item.key] = item
+        if item.value in BAD_STATES:
+            self.instance_bad.add(item.key)
+
+    def _instance_view(self, state):
+        """Return (all_latest, bad_instances) for this decide call.
+        
+        Without state_changed calls the State is asked every time.  With
+        them the view is seeded from the State once and then only drops the
+        bad instances the State itself has forgotten.
+        """
+        if not self.incremental:
+            return (state.get_all_latest("instance-state"),
+                    state.get_keys_seen("instance-state", BAD_STATES))
+        
+        if self.instance_latest is None:
+            self.instance_latest = {}
+            self.instance_bad = set()
+            for item in state.get_all_latest("instance-state"):
+                self.instance_latest[item.key] = item
+            self.instance_bad.update(
+                    state.get_keys_seen("instance-state", BAD_STATES))
+        else:
+            forgotten = [key for key in self.instance_bad
+                         if state.get_latest("instance-state", key) is None]
+            for key in forgotten:
+                self.instance_bad.discard(key)
+                self.instance_latest.pop(key, None)
+        
+        # decide adds the instances it destroys to its copy of the bad set
+        return self.instance_latest.values(), set(self.instance_bad)
+
     # -----------------------------------------------------------------------
     # Decide (instance launches/terminations)
     # -----------------------------------------------------------------------
@@ -506,10 +569,10 @@ class NpreservingEngine(Engine):
         # provisioner has not queried IaaS and sent state update notifications
         # back to the controller in less time than it takes for this method
         # to complete.
-        all_instance_lists = state.get_all("instance-state")
+        all_latest, bad_instances = self._instance_view(state)
         
         # How many instances are not terminated/ing or corrupted?
-        valid_count = self._valid_count(all_instance_lists)
+        valid_count = self._valid_count(all_latest, bad_instances)
         log.debug("valid count: %d" % valid_count)
         
         # First task is always to make sure that any unique instances that
@@ -535,7 +598,7 @@ class NpreservingEngine(Engine):
             if iaas_id:
                 # If there is already an IaaS ID for this unique instance ID,
                 # make sure it is active or starting already.
-                iaas_state = self._state_of_iaas_id(iaas_id, all_instance_lists)
+                iaas_state = self._state_of_iaas_id(iaas_id, state)
                 if iaas_state in BAD_STATES:
                     log.warn("The VM '%s' for unique instance '%s' is in a state that needs compensation: %s" % (iaas_id, uniq_id, iaas_state))
                     thiskv = self.unique_instances[uniq_id]
@@ -572,24 +635,16 @@ class NpreservingEngine(Engine):
         elif valid_count > target:
             log.info("Taking generic instance count from %d to %d (and there are %d unique-instances)" % (valid_count, target, uniqnum))
             while valid_count > target:
-                die_id = self._something_to_kill(all_instance_lists)
+                die_id = self._something_to_kill(all_latest, bad_instances)
                 if not die_id:
                     # Should be impossible in this situation
                     raise Exception("Cannot find any valid instances to terminate?")
                 self._destroy_one(control, die_id)
+                bad_instances.add(die_id)
                 valid_count -= 1
                 
-    def _valid_count(self, all_instance_lists):
-        valid_count = 0
-        for instance_list in all_instance_lists:
-            ok = True
-            for state_item in instance_list:
-                if state_item.value in BAD_STATES:
-                    ok = False
-                    break
-            if ok:
-                valid_count += 1
-        return valid_count
+    def _valid_count(self, all_latest, bad_instances):
+        return len(all_latest) - len(bad_instances)
             
     def _launch_one(self, control, uniquekv=None):
         """Return instance_id"""
@@ -607,9 +662,9 @@ class NpreservingEngine(Engine):
             
         return str(launch_item.instance_ids[0])
     
-    def _something_to_kill(self, all_instance_lists):
+    def _something_to_kill(self, all_latest, bad_instances):
         """Pick one instance to die.  Filters instances that are not uniques"""
-        candidates = self._filter_bad_instances(all_instance_lists)
+        candidates = self._filter_bad_instances(all_latest, bad_instances)
         candidates = self._filter_unique_instances(candidates)
         if len(candidates) == 0:
             return None
@@ -629,29 +684,24 @@ class NpreservingEngine(Engine):
                 newcandidates.append(candidate)
         return newcandidates
     
-    def _filter_bad_instances(self, all_instance_lists):
+    def _filter_bad_instances(self, all_latest, bad_instances):
         """Filter out instances that are in terminating state or 'worse'"""
         
-        candidates = []
-        for instance_list in all_instance_lists:
-            ok = True
-            for state_item in instance_list:
-                if state_item.value in BAD_STATES:
-                    ok = False
-                    break
-            if ok:
-                candidates.append(state_item.key)
+        candidates = [state_item.key for state_item in all_latest
+                      if state_item.key not in bad_instances]
         
         log.debug("Found %d instances that could be killed:\n%s" % (len(candidates), candidates))
         
         return candidates
         
-    def _state_of_iaas_id(self, iaas_id, all_instance_lists):
-        for instance_list in all_instance_lists:
-            # Important to get last item, most recent state
-            one_state_item = instance_list[-1]
-            if one_state_item.key == iaas_id:
-                return one_state_item.value
+    def _state_of_iaas_id(self, iaas_id, state):
+        # Important to get last item, most recent state
+        if self.instance_latest is not None:
+            state_item = self.instance_latest.get(iaas_id)
+        else:
+            state_item = state.get_latest("instance-state", iaas_id)
+        if state_item:
+            return state_item.value
     
     def _destroy_one(self, control, instanceid):
         log.info("Destroying an instance ('%s')" % instanceid)
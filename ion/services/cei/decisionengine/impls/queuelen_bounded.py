@@ -60,17 +60,10 @@ class QueueLengthBoundedEngine(Engine):
 
     def decide(self, control, state):
         """Engine API method"""
-        all_instance_lists = state.get_all("instance-state")
-        
-        valid_count = 0
-        for instance_list in all_instance_lists:
-            ok = True
-            for state_item in instance_list:
-                if state_item.value in BAD_STATES:
-                    ok = False
-                    break
-            if ok:
-                valid_count += 1
+        all_latest = state.get_all_latest("instance-state")
+        bad_instances = state.get_keys_seen("instance-state", BAD_STATES)
+        
+        valid_count = len(all_latest) - len(bad_instances)
         
         
         # If there is an explicit minimum, always respect that.
@@ -84,16 +77,9 @@ class QueueLengthBoundedEngine(Engine):
         # Won't make a decision if there are pending instances. This would
         # need to be a lot more elaborate (requiring a datastore) to get a
         # faster response time whilst not grossly overcompensating. 
-        any_pending = False
-        for instance_list in all_instance_lists:
-            # "has it contextualized at some point in its life?"
-            found_started = False
-            for state_item in instance_list:
-                if state_item.value == InstanceStates.RUNNING:
-                    found_started = True
-                    break
-            if not found_started:
-                any_pending = True
+        # "has it contextualized at some point in its life?"
+        started = state.get_keys_seen("instance-state", [InstanceStates.RUNNING])
+        any_pending = len(started) < len(all_latest)
         
         if any_pending:
             log.debug("Will not analyze with pending instances")
@@ -104,7 +90,7 @@ class QueueLengthBoundedEngine(Engine):
             self._launch_one(control)
             valid_count += 1
         elif heading < 0:
-            instanceid = self._pick_instance_to_die(all_instance_lists)
+            instanceid = self._pick_instance_to_die(all_latest, bad_instances)
             if not instanceid:
                 log.error("There are no valid instances to terminate")
             else:
@@ -117,7 +103,7 @@ class QueueLengthBoundedEngine(Engine):
         log.debug("Aware of %d running/starting %s" % (valid_count, txt))
             
     def _heading(self, state, valid_count):
-        all_qlens = state.get_all("queue-length")
+        all_qlens = state.get_all_latest("queue-length")
         # should only be one queue reading for now:
         if len(all_qlens) == 0:
             log.debug("no queuelen readings to analyze")
@@ -126,13 +112,7 @@ class QueueLengthBoundedEngine(Engine):
         if len(all_qlens) != 1:
             raise Exception("multiple queuelen readings to analyze?")
         
-        qlens = all_qlens[0]
-        
-        if len(qlens) == 0:
-            log.debug("no queuelen readings to analyze")
-            return 0
-            
-        recent = qlens[-1].value
+        recent = all_qlens[0].value
         msg = "most recent qlen reading is %d" % recent
         
         if recent == 0 and valid_count == 0:
@@ -171,18 +151,11 @@ class QueueLengthBoundedEngine(Engine):
                 LaunchItem(1, self._allocation(), self._site(), None)
         control.launch(self._deployable_type(), launch_description)
     
-    def _pick_instance_to_die(self, all_instance_lists):
+    def _pick_instance_to_die(self, all_latest, bad_instances):
         # filter out instances that are in terminating state or 'worse'
         
-        candidates = []
-        for instance_list in all_instance_lists:
-            ok = True
-            for state_item in instance_list:
-                if state_item.value in BAD_STATES:
-                    ok = False
-                    break
-            if ok:
-                candidates.append(state_item.key)
+        candidates = [state_item.key for state_item in all_latest
+                      if state_item.key not in bad_instances]
         
         log.debug("Found %d instances that could be killed:\n%s" % (len(candidates), candidates))
         
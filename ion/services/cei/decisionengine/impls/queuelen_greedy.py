@@ -36,17 +36,10 @@ class QueueLengthGreedyEngine(Engine):
 
     def decide(self, control, state):
         """Engine API method"""
-        all_instance_lists = state.get_all("instance-state")
+        all_latest = state.get_all_latest("instance-state")
+        bad_instances = state.get_keys_seen("instance-state", BAD_STATES)
         
-        valid_count = 0
-        for instance_list in all_instance_lists:
-            ok = True
-            for state_item in instance_list:
-                if state_item.value in BAD_STATES:
-                    ok = False
-                    break
-            if ok:
-                valid_count += 1
+        valid_count = len(all_latest) - len(bad_instances)
         
         #log.debug("Before: %s" % self._aware_txt(valid_count))
         
@@ -65,7 +58,7 @@ class QueueLengthGreedyEngine(Engine):
         return "aware of %d running/starting %s" % (valid_count, txt)
         
     def _getqlen(self, state):
-        all_qlens = state.get_all("queue-length")
+        all_qlens = state.get_all_latest("queue-length")
         # should only be one queue reading for now:
         if len(all_qlens) == 0:
             log.debug("no queuelen readings to analyze")
@@ -74,13 +67,7 @@ class QueueLengthGreedyEngine(Engine):
         if len(all_qlens) != 1:
             raise Exception("multiple queuelen readings to analyze?")
         
-        qlens = all_qlens[0]
-        
-        if len(qlens) == 0:
-            log.debug("no queuelen readings to analyze")
-            return 0
-            
-        return qlens[-1].value
+        return all_qlens[0].value
             
     def _launch_one(self, control):
         launch_description = {}
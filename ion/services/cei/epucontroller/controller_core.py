@@ -3,7 +3,8 @@ log = ion.util.ionlog.getLogger(__name__)
 
 import time
 import uuid
-from collections import defaultdict
+from collections import defaultdict, deque
+from ion.core import ioninit
 from ion.services.cei.decisionengine import EngineLoader
 import ion.services.cei.states as InstanceStates
 from ion.services.cei import cei_events
@@ -14,8 +15,13 @@ from forengine import Control
 from forengine import State
 from forengine import StateItem
 
+CONF = ioninit.config(__name__)
+
 PROVISIONER_VARS_KEY = 'provisioner_vars'
 
+# instance states no instance comes back from
+TERMINAL_STATES = (InstanceStates.TERMINATED, InstanceStates.FAILED)
+
 class ControllerCore(object):
     """Controller functionality that is not specific to the messaging layer.
     """
@@ -36,6 +42,13 @@ class ControllerCore(object):
         self.engine = EngineLoader().load(engineclass)
         self.engine.initialize(self.control, self.state, conf)
 
+        # The engine is not called when nothing has changed since the last
+        # decide, unless decide_idle_interval seconds have passed
+        self.decide_idle_interval = float(CONF.getValue('decide_idle_interval', 60))
+        self.last_decide = None
+        self.reconfigured = False
+        self.decides_skipped = 0
+
     def new_sensor_info(self, content):
         """Ingests new sensor information, decides on validity and type of msg.
         """
@@ -59,39 +72,176 @@ class ControllerCore(object):
         
     @defer.inlineCallbacks
     def run_decide(self):
-        yield self.busy.run(self.engine.decide, self.control, self.state)
+        yield self.busy.run(self._decide)
+
+    def _decide(self):
+        changes = self.state.take_changes()
+        now = time.time()
+        if not (changes or self.reconfigured or self.last_decide is None):
+            idle = now - self.last_decide
+            if not self.decide_idle_interval or idle < self.decide_idle_interval:
+                log.debug("Nothing changed since the last decide, skipping")
+                self.decides_skipped += 1
+                return
+
+        self.reconfigured = False
+        self.last_decide = now
+        self.state.prune(now)
+        if changes:
+            self.engine.state_changed(changes)
+        return self.engine.decide(self.control, self.state)
         
     @defer.inlineCallbacks
     def run_reconfigure(self, conf):
-        yield self.busy.run(self.engine.reconfigure, self.control, conf)
+        yield self.busy.run(self._reconfigure, conf)
+
+    def _reconfigure(self, conf):
+        self.engine.reconfigure(self.control, conf)
+        self.reconfigured = True
+
+class StateHistory(object):
+    """Bounded history of the StateItems of one key, oldest first.
+
+    Keeps at most max_items items, and drops items older than max_age
+    seconds relative to the newest. The newest item is always kept.
+    Supports len, iteration and indexing like the list it replaces.
+    """
+
+    def __init__(self, max_items, max_age=None):
+        self.max_items = max_items
+        self.max_age = max_age
+        self.items = deque()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def append(self, item):
+        items = self.items
+        items.append(item)
+        while len(items) > self.max_items:
+            items.popleft()
+        if self.max_age:
+            cutoff = item.time - self.max_age
+            while len(items) > 1 and items[0].time < cutoff:
+                items.popleft()
+
 
 class ControllerCoreState(State):
     """Keeps data, also what is passed to decision engine.
 
     In the future the decision engine will be passed more of a "view"
+
+    The history of each key is bounded. For instance states the keys which
+    have ever had each state are tracked as data arrives, so get_keys_seen
+    does not depend on the history that is retained. Instances whose latest
+    state is terminal are forgotten once that state is older than max_age,
+    see prune().
     """
 
-    def __init__(self):
+    def __init__(self, max_items=None, max_age=None):
         super(ControllerCoreState, self).__init__()
         self.instance_state_parser = InstanceStateParser()
         self.queuelen_parser = QueueLengthParser()
-        self.instance_states = defaultdict(list)
-        self.queue_lengths = defaultdict(list)
+
+        if max_items is None:
+            max_items = int(CONF.getValue('state_history_max_items', 100))
+        if max_age is None:
+            max_age = float(CONF.getValue('state_history_max_age', 3600))
+        self.max_items = max(1, max_items)
+        self.max_age = max_age
+
+        self.instance_states = {}
+        self.queue_lengths = {}
+
+        # typename -> value -> set of keys which have had that value
+        self._keys_seen = {"instance-state": defaultdict(set)}
+
+        # instance id -> time of its latest item, for instances whose
+        # latest state is terminal
+        self._terminal = {}
+
+        # items added since the last take_changes
+        self._changes = []
+
+    def _add(self, data, item):
+        history = data.get(item.key)
+        if history is None:
+            history = data[item.key] = StateHistory(self.max_items, self.max_age)
+        history.append(item)
+        self._changes.append(item)
+
+        seen = self._keys_seen.get(item.typename)
+        if seen is not None:
+            seen[item.value].add(item.key)
+
+        if item.typename == "instance-state":
+            if item.value in TERMINAL_STATES:
+                self._terminal[item.key] = item.time
+            else:
+                self._terminal.pop(item.key, None)
+
+    def _data(self, typename):
+        if typename == "instance-state":
+            return self.instance_states
+        elif typename == "queue-length":
+            return self.queue_lengths
+        else:
+            raise KeyError("Unknown typename: '%s'" % typename)
 
     def new_instancestate(self, content):
         state_item = self.instance_state_parser.state_item(content)
         if state_item:
-            self.instance_states[state_item.key].append(state_item)
+            self._add(self.instance_states, state_item)
 
     def new_launch(self, new_instance_id):
         state = InstanceStates.REQUESTING
         item = StateItem("instance-state", new_instance_id, time.time(), state)
-        self.instance_states[item.key].append(item)
+        self._add(self.instance_states, item)
 
     def new_queuelen(self, content):
         state_item = self.queuelen_parser.state_item(content)
         if state_item:
-            self.queue_lengths[state_item.key].append(state_item)
+            self._add(self.queue_lengths, state_item)
+
+    def prune(self, now=None):
+        """Forgets the instances whose latest state is terminal and older
+        than max_age seconds, history and get_keys_seen entries alike.
+
+        @retval list of the instance ids that were dropped
+        """
+        if not self.max_age:
+            return []
+        if now is None:
+            now = time.time()
+        cutoff = now - self.max_age
+        expired = [key for key, t in self._terminal.iteritems() if t < cutoff]
+        if not expired:
+            return expired
+
+        for key in expired:
+            del self._terminal[key]
+            del self.instance_states[key]
+        seen = self._keys_seen["instance-state"]
+        for value in seen.keys():
+            keys = seen[value]
+            keys.difference_update(expired)
+            if not keys:
+                del seen[value]
+        log.debug("Dropped the state of %d terminated instances", len(expired))
+        return expired
+
+    def take_changes(self):
+        """Returns the StateItems added since the last call, oldest first.
+        """
+        changes = self._changes
+        self._changes = []
+        return changes
 
     def get_all(self, typename):
         """
@@ -103,14 +253,7 @@ class ControllerCoreState(State):
         or an empty list if nothing matches.
         @exception KeyError if typename is unknown
         """
-        if typename == "instance-state":
-            data = self.instance_states
-        elif typename == "queue-length":
-            data = self.queue_lengths
-        else:
-            raise KeyError("Unknown typename: '%s'" % typename)
-
-        return data.values()
+        return self._data(typename).values()
 
     def get(self, typename, key):
         """Get all data about a particular key of a particular type.
@@ -121,18 +264,37 @@ class ControllerCoreState(State):
         or an empty list if nothing matches.
         @exception KeyError if typename is unknown
         """
-        if typename == "instance-state":
-            data = self.instance_states
-        elif typename == "queue-length":
-            data = self.queue_lengths
-        else:
-            raise KeyError("Unknown typename: '%s'" % typename)
-
+        data = self._data(typename)
         if data.has_key(key):
             return data[key]
         else:
             return []
 
+    def get_latest(self, typename, key):
+        """State API method, see the decision engine implementer's guide.
+        """
+        history = self._data(typename).get(key)
+        if history:
+            return history[-1]
+        return None
+
+    def get_all_latest(self, typename):
+        """State API method, see the decision engine implementer's guide.
+        """
+        return [history[-1] for history in self._data(typename).itervalues()]
+
+    def get_keys_seen(self, typename, values):
+        """State API method, see the decision engine implementer's guide.
+        """
+        seen = self._keys_seen.get(typename)
+        if seen is None:
+            return super(ControllerCoreState, self).get_keys_seen(typename, values)
+        keys = set()
+        for value in values:
+            if value in seen:
+                keys.update(seen[value])
+        return keys
+
 
 class InstanceStateParser(object):
     """Converts instance state message into a StateItem
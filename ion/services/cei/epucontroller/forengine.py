@@ -137,6 +137,51 @@ class State(object):
         """
         raise NotImplementedError
 
+    # The methods below have implementations in terms of get_all so that
+    # any State works with engines that use them.  The EPU Controller keeps
+    # what they need up to date as data arrives, so engines do not have to
+    # walk the whole history on every decide.
+
+    def get_latest(self, typename, key):
+        """
+        Get the most recent data about a particular key of a particular type.
+        
+        @retval StateItem the latest StateItem for the key or None
+        @exception KeyError if typename is unknown
+        
+        """
+        for items in self.get_all(typename):
+            if items and items[-1].key == key:
+                return items[-1]
+        return None
+    
+    def get_all_latest(self, typename):
+        """
+        Get the most recent data about each key of a particular type.
+        
+        @retval list(StateItem) the latest StateItem of each key
+        @exception KeyError if typename is unknown
+        
+        """
+        return [items[-1] for items in self.get_all(typename) if items]
+    
+    def get_keys_seen(self, typename, values):
+        """
+        Get the keys of a particular type which have had any of the given
+        values at some point.
+        
+        @retval set(str) keys which had one of the values
+        @exception KeyError if typename is unknown
+        
+        """
+        keys = set()
+        for items in self.get_all(typename):
+            for item in items:
+                if item.value in values:
+                    keys.add(item.key)
+                    break
+        return keys
+
 
 class StateItem(object):
     """
@@ -12,7 +12,7 @@ import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 
 from itertools import izip
-from twisted.internet import defer, threads
+from twisted.internet import defer, threads, reactor
 
 from nimboss.node import NimbusNodeDriver
 from nimboss.ctx import ContextClient, BrokerError
@@ -42,6 +42,12 @@ _NIMBOSS_STATE_MAP = {
 # are assumed to be terminated out of band and marked FAILED
 _IAAS_NODE_QUERY_WINDOW_SECONDS = 60
 
+# Most sites queried at once in a node query round, and the time allowed
+# for one site to respond. A site which doesn't respond in time is skipped
+# until the next round.
+_IAAS_QUERY_CONCURRENCY = 4
+_IAAS_QUERY_TIMEOUT_SECONDS = 60
+
 class ProvisionerCore(object):
     """Provisioner functionality that is not specific to the service.
     """
@@ -57,6 +63,13 @@ class ProvisionerCore(object):
 
         self.cluster_driver = ClusterDriver()
 
+        self.query_concurrency = _IAAS_QUERY_CONCURRENCY
+        self.query_timeout = _IAAS_QUERY_TIMEOUT_SECONDS
+
+        # sites whose list_nodes thread is still running, even if the query
+        # timed out. They are not queried again until it returns.
+        self._busy_sites = set()
+
     def setup_drivers(self):
         nimbus_key = os.environ['NIMBUS_KEY']
         nimbus_secret = os.environ['NIMBUS_SECRET']
@@ -426,19 +439,90 @@ class ProvisionerCore(object):
         nodes = yield self.store.get_nodes(max_state=states.TERMINATING)
         site_nodes = group_records(nodes, 'site')
 
+        # Sites are queried concurrently, a bounded number at a time, so one
+        # slow site doesn't hold up the rest. Launch records are looked up
+        # at most once in a round.
+        launches = {}
+        semaphore = defer.DeferredSemaphore(self.query_concurrency)
+        queries = []
         for site in site_nodes:
-            yield self.query_one_site(site, site_nodes[site])
+            if site in self._busy_sites:
+                log.warn('Skipping site "%s", its previous query has not returned',
+                         site)
+                continue
+            d = semaphore.run(self.query_one_site, site, site_nodes[site],
+                              launches=launches)
+            d.addErrback(self._query_site_failed, site)
+            queries.append(d)
+        yield defer.DeferredList(queries)
 
         yield self.query_contexts()
 
+    def _query_site_failed(self, failure, site):
+        log.error('Failed to query site "%s": %s', site,
+                  failure.getErrorMessage())
+
+    def _list_site_nodes(self, site, node_driver):
+        """Lists the nodes of a site in a thread, failing with a TimeoutError
+        if the site doesn't respond within query_timeout seconds.
+        At most one thread per site is used: a hung site holds on to one
+        thread of the reactor pool rather than one more every round.
+        """
+        if site in self._busy_sites:
+            return defer.fail(ProvisioningError(
+                'Site "%s" is still answering a previous query' % site))
+        self._busy_sites.add(site)
+        d = threads.deferToThread(node_driver.list_nodes)
+        def _returned(result):
+            self._busy_sites.discard(site)
+            return result
+        d.addBoth(_returned)
+        if not self.query_timeout:
+            return d
+
+        result = defer.Deferred()
+        def _timeout():
+            result.errback(defer.TimeoutError('Query of site "%s" timed out after %s seconds'
+                                              % (site, self.query_timeout)))
+        call = reactor.callLater(self.query_timeout, _timeout)
+
+        # the thread can't be interrupted. A late response is dropped.
+        def _callback(nodes):
+            if call.active():
+                call.cancel()
+                result.callback(nodes)
+        def _errback(failure):
+            if call.active():
+                call.cancel()
+                result.errback(failure)
+        d.addCallbacks(_callback, _errback)
+        return result
+
     @defer.inlineCallbacks
-    def query_one_site(self, site, nodes, driver=None):
+    def _get_launch_cached(self, launch_id, launches):
+        if launch_id in launches:
+            defer.returnValue(launches[launch_id])
+        launch = yield self.store.get_launch(launch_id)
+        launches[launch_id] = launch
+        defer.returnValue(launch)
+
+    @defer.inlineCallbacks
+    def query_one_site(self, site, nodes, driver=None, launches=None):
+        """Queries one IaaS site and sends updates for its changed nodes.
+        Updates are stored and sent as one batch per launch.
+        @param launches Cache of launch records by id, shared by a query round
+        """
         node_driver = driver or self.site_drivers[site]
+        if launches is None:
+            launches = {}
 
         log.info('Querying site "%s"', site)
-        nimboss_nodes = yield threads.deferToThread(node_driver.list_nodes)
+        nimboss_nodes = yield self._list_site_nodes(site, node_driver)
         nimboss_nodes = dict((node.id, node) for node in nimboss_nodes)
 
+        # launch_id -> list of updated nodes
+        updated = {}
+
         # note we are walking the nodes from datastore, NOT from nimboss
         for node in nodes:
             state = node['state']
@@ -469,8 +553,7 @@ class ProvisionerCore(object):
                     node['state'] = states.FAILED
                     node['state_desc'] = 'NODE_DISAPPEARED'
 
-                    launch = yield self.store.get_launch(node['launch_id'])
-                    yield self.store_and_notify([node], launch['subscribers'])
+                    updated.setdefault(node['launch_id'], []).append(node)
             else:
                 nimboss_state = _NIMBOSS_STATE_MAP[nimboss_node.state]
                 if nimboss_state > node['state']:
@@ -493,8 +576,12 @@ class ProvisionerCore(object):
                         cei_events.event("provisioner", "node_started",
                                          log, extra=extradict)
 
-                    launch = yield self.store.get_launch(node['launch_id'])
-                    yield self.store_and_notify([node], launch['subscribers'])
+                    updated.setdefault(node['launch_id'], []).append(node)
+
+        for launch_id, launch_nodes in updated.iteritems():
+            launch = yield self._get_launch_cached(launch_id, launches)
+            yield self.store_and_notify(launch_nodes, launch['subscribers'])
+
         #TODO nimboss_nodes now contains any other running instances that
         # are unknown to the datastore (or were started after the query)
         # Could do some analysis of these nodes
@@ -13,6 +13,7 @@ import ion.util.ionlog
 from ion.util.tcp_connections import TCPConnection
 
 log = ion.util.ionlog.getLogger(__name__)
+import bisect
 from itertools import groupby
 from twisted.internet import defer
 
@@ -84,7 +85,11 @@ class CassandraProvisionerStore(TCPConnection):
     Provides high level provisioner storage operations for Cassandra
     """
 
-    def __init__(self, host, port, username, password, keyspace=None, prefix=''):
+    # Most records written with one batch_mutate
+    BATCH_SIZE = 100
+
+    def __init__(self, host, port, username, password, keyspace=None, prefix='',
+                 batch_size=None):
 
         authorization_dictionary = {'username': username, 'password': password}
 
@@ -104,6 +109,8 @@ class CassandraProvisionerStore(TCPConnection):
         self._launch_column_family = prefix + 'Launch'
         self._node_column_family = prefix + 'Node'
 
+        self.batch_size = batch_size or self.BATCH_SIZE
+
     @defer.inlineCallbacks
     def assure_schema(self, keyspace):
         """
@@ -173,17 +180,46 @@ class CassandraProvisionerStore(TCPConnection):
         return self.client.insert(launch_id, self._launch_column_family,
                                   value, column=state)
 
-    @defer.inlineCallbacks
+    def put_launches(self, launches):
+        """
+        @brief Stores a set of launch records
+        @param launches Iterable of launch records
+        @retval Deferred for success
+        """
+        return self._put_records(launches, 'launch_id',
+                                 self._launch_column_family)
+
     def put_nodes(self, nodes):
         """
         @brief Stores a set of node records
         @param nodes Iterable of node records
         @retval Deferred for success
         """
+        return self._put_records(nodes, 'node_id', self._node_column_family)
 
-        # could be more efficient with a batch_mutate
-        for node in nodes:
-            yield self.put_node(node)
+    @defer.inlineCallbacks
+    def _put_records(self, records, id_key, column_family):
+        """
+        @brief Stores records with one batch_mutate for each chunk of at most
+        batch_size records
+        """
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == self.batch_size:
+                yield self._batch_put(chunk, id_key, column_family)
+                chunk = []
+        if chunk:
+            yield self._batch_put(chunk, id_key, column_family)
+
+    def _batch_put(self, records, id_key, column_family):
+        # Each record is a column named by its state in the row of its id.
+        # Records of the same row share a mutation.
+        mutations = {}
+        for record in records:
+            columns = mutations.setdefault(record[id_key], {column_family : {}})
+            columns[column_family][record['state']] = json.dumps(record)
+        return self.client.batch_mutate(mutations)
 
     def put_node(self, node):
         """
@@ -306,12 +342,88 @@ class CassandraProvisionerStore(TCPConnection):
         log.info('on_terminate: Lose Connection TCP')
 
 
+def _copy_record(value):
+    """Copies a JSON-style record: nested dicts and lists are copied, other
+    values are shared. Much cheaper than a JSON round-trip or deepcopy.
+    """
+    if isinstance(value, dict):
+        return dict((k, _copy_record(v)) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [_copy_record(v) for v in value]
+    return value
+
+
+class _RecordIndex(object):
+    """Latest record of each id, indexed by state
+
+    Records are copied on the way in and on the way out so callers can't
+    modify stored records. The states present are kept sorted, so a state
+    range query only visits the records which match.
+    """
+    def __init__(self):
+        self.records = {}
+        self.by_state = {}
+        self.states = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def put(self, record_id, record):
+        """Stores a copy of the record unless a record with a newer state is
+        already stored. Returns True if the record was stored.
+        """
+        state = record['state']
+        existing = self.records.get(record_id)
+        if existing is not None:
+            old_state = existing['state']
+            if old_state > state:
+                return False
+            bucket = self.by_state[old_state]
+            del bucket[record_id]
+            if not bucket:
+                del self.by_state[old_state]
+                del self.states[bisect.bisect_left(self.states, old_state)]
+
+        record = _copy_record(record)
+        self.records[record_id] = record
+        bucket = self.by_state.get(state)
+        if bucket is None:
+            bucket = self.by_state[state] = {}
+            bisect.insort(self.states, state)
+        bucket[record_id] = record
+        return True
+
+    def get(self, record_id):
+        record = self.records.get(record_id)
+        if record is None:
+            return None
+        return _copy_record(record)
+
+    def query(self, state=None, min_state=None, max_state=None):
+        # overrides range arguments
+        if state:
+            min_state = max_state = state
+
+        lo = 0
+        if min_state:
+            lo = bisect.bisect_left(self.states, min_state)
+        hi = len(self.states)
+        if max_state:
+            hi = bisect.bisect_right(self.states, max_state)
+
+        records = []
+        for state in self.states[lo:hi]:
+            for record in self.by_state[state].itervalues():
+                records.append(_copy_record(record))
+        return records
+
+
 class ProvisionerStore(object):
     """In-memory version of Provisioner storage
     """
     def __init__(self):
-        self.nodes = {}
-        self.launches = {}
+        self.nodes = _RecordIndex()
+        self.launches = _RecordIndex()
 
     def put_launch(self, launch):
         """
@@ -319,25 +431,28 @@ class ProvisionerStore(object):
         @param launch Launch record to store
         @retval Deferred for success
         """
-        launch_id = launch['launch_id']
-        state = launch['state']
+        self.launches.put(launch['launch_id'], launch)
+        return defer.succeed(None)
 
-        existing = self.launches.get(launch_id)
-        if not existing or json.loads(existing)['state'] <= state:
-            self.launches[launch_id] = json.dumps(launch)
+    def put_launches(self, launches):
+        """
+        @brief Stores a set of launch records
+        @param launches Iterable of launch records
+        @retval Deferred for success
+        """
+        for launch in launches:
+            self.launches.put(launch['launch_id'], launch)
         return defer.succeed(None)
 
-    @defer.inlineCallbacks
     def put_nodes(self, nodes):
         """
         @brief Stores a set of node records
         @param nodes Iterable of node records
         @retval Deferred for success
         """
-
-        # could be more efficient with a batch_mutate
         for node in nodes:
-            yield self.put_node(node)
+            self.nodes.put(node['node_id'], node)
+        return defer.succeed(None)
 
     def put_node(self, node):
         """
@@ -345,12 +460,7 @@ class ProvisionerStore(object):
         @param node Node record
         @retval Deferred for success
         """
-        node_id = node['node_id']
-        state = node['state']
-
-        existing = self.nodes.get(node_id)
-        if not existing or json.loads(existing)['state'] <= state:
-                self.nodes[node_id] = json.dumps(node)
+        self.nodes.put(node['node_id'], node)
         return defer.succeed(None)
 
     def get_launch(self, launch_id, count=1):
@@ -360,15 +470,8 @@ class ProvisionerStore(object):
         @param count Number of launch state records to retrieve
         @retval Deferred record(s), or None. A list of records if count > 1
         """
-        log.debug(self.launches)
         assert count == 1
-        record = self.launches.get(launch_id)
-        if record:
-            ret = json.loads(record)
-        else:
-            ret = None
-        return defer.succeed(ret)
-
+        return defer.succeed(self.launches.get(launch_id))
 
     def get_launches(self, state=None, min_state=None, max_state=None):
         """
@@ -378,7 +481,7 @@ class ProvisionerStore(object):
         @param max_state Inclusive end bound
         @retval Deferred list of launch records
         """
-        records = self._get_records(self.launches, state, min_state, max_state)
+        records = self.launches.query(state, min_state, max_state)
         return defer.succeed(records)
 
     def get_node(self, node_id, count=1):
@@ -389,12 +492,7 @@ class ProvisionerStore(object):
         @retval Deferred record(s), or None. A list of records if count > 1
         """
         assert count == 1
-        record = self.nodes.get(node_id)
-        if record:
-            ret = json.loads(record)
-        else:
-            ret = None
-        return defer.succeed(ret)
+        return defer.succeed(self.nodes.get(node_id))
 
     def get_nodes(self, state=None, min_state=None, max_state=None):
         """
@@ -404,23 +502,9 @@ class ProvisionerStore(object):
         @param max_state Inclusive end bound
         @retval Deferred list of launch records
         """
-        records = self._get_records(self.nodes, state, min_state, max_state)
+        records = self.nodes.query(state, min_state, max_state)
         return defer.succeed(records)
 
-    def _get_records(self, dct, state=None, min_state=None, max_state=None):
-
-        # overrides range arguments
-        if state:
-            min_state = max_state = state
-
-        records = []
-        for r in dct.itervalues():
-            record = json.loads(r)
-            if not max_state or record['state'] <= max_state:
-                if not min_state or record['state'] >= min_state:
-                    records.append(record)
-        return records
-
 
 def group_records(records, *args):
     """Breaks records into groups of distinct values for the specified keys
@@ -7,6 +7,7 @@ log = ion.util.ionlog.getLogger(__name__)
 
 import uuid
 import time
+import threading
 
 from twisted.internet import defer
 from twisted.trial import unittest
@@ -248,6 +249,56 @@ class ProvisionerCoreTests(unittest.TestCase):
         self.assertEqual(len(self.notifier.nodes), 1)
         self.assertTrue(self.notifier.assure_state(states.FAILED))
 
+    @defer.inlineCallbacks
+    def test_query_one_site_batches(self):
+        launch_id = _new_id()
+        ts = time.time() - 120.0
+        node_records = [_one_fake_node_record(launch_id, states.PENDING,
+                                              pending_timestamp=ts)
+                        for i in range(3)]
+        launch_record = _one_fake_launch_record(launch_id, states.PENDING,
+                                                node_records)
+        yield self.store.put_launch(launch_record)
+        yield self.store.put_nodes(node_records)
+
+        store = CountingStore(self.store)
+        self.core.store = store
+        yield self.core.query_one_site('fake-site', node_records,
+                driver=FakeEmptyNodeQueryDriver())
+
+        self.assertEqual(len(self.notifier.nodes), 3)
+        self.assertTrue(self.notifier.assure_state(states.FAILED))
+        self.assertEqual(store.counts, {'get_launch' : 1, 'put_nodes' : 1})
+
+    @defer.inlineCallbacks
+    def test_query_nodes_slow_site(self):
+        slow_driver = FakeBlockingNodeQueryDriver()
+        self.addCleanup(slow_driver.release)
+        self.core.site_drivers = {'slow-site' : slow_driver,
+                                  'fake-site' : FakeEmptyNodeQueryDriver()}
+        self.core.query_timeout = 0.1
+
+        ts = time.time() - 120.0
+        for site in self.core.site_drivers:
+            launch_id = _new_id()
+            node = _one_fake_node_record(launch_id, states.PENDING,
+                                         site=site, pending_timestamp=ts)
+            launch = _one_fake_launch_record(launch_id, states.PENDING, [node])
+            yield self.store.put_launch(launch)
+            yield self.store.put_node(node)
+
+        yield self.core.query_nodes({})
+
+        # the responsive site is updated, the slow one is left for next time
+        self.assertEqual(len(self.notifier.nodes), 1)
+        self.assertTrue(self.notifier.assure_state(states.FAILED))
+        nodes = yield self.store.get_nodes(state=states.PENDING)
+        self.assertEqual(nodes[0]['site'], 'slow-site')
+
+        # while its thread is blocked the slow site is not queried again
+        yield self.core.query_nodes({})
+        self.assertEqual(slow_driver.calls, 1)
+
     @defer.inlineCallbacks
     def test_query_ctx(self):
         node_count = 3
@@ -394,6 +445,35 @@ class FakeEmptyNodeQueryDriver(object):
     def list_nodes(self):
         return []
 
+
+class FakeBlockingNodeQueryDriver(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.calls = 0
+
+    def list_nodes(self):
+        self.calls += 1
+        self.event.wait()
+        return []
+
+    def release(self):
+        self.event.set()
+
+
+class CountingStore(object):
+    """Wraps a store, counting the calls of each method
+    """
+    def __init__(self, store):
+        self.store = store
+        self.counts = {}
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+        def call(*args, **kwargs):
+            self.counts[name] = self.counts.get(name, 0) + 1
+            return method(*args, **kwargs)
+        return call
+
 def _new_id():
     return str(uuid.uuid4())
 
@@ -106,6 +106,125 @@ class BaseProvisionerStoreTests(unittest.TestCase):
         for l in at_least_pending:
             self.assertTrue(l['launch_id'] in (launch_id_1, launch_id_3))
 
+    @defer.inlineCallbacks
+    def test_put_nodes_batch(self):
+        launch_id = new_id()
+        nodes = [{'launch_id' : launch_id, 'node_id' : new_id(),
+                  'state' : states.REQUESTED} for i in range(25)]
+        yield self.store.put_nodes(nodes)
+
+        # a batch with newer and older records
+        updated = []
+        for node in nodes[:10]:
+            node = node.copy()
+            node['state'] = states.PENDING
+            updated.append(node)
+        yield self.store.put_nodes(updated + nodes[:5])
+
+        all = yield self.store.get_nodes()
+        self.assertEqual(25, len(all))
+        pending = yield self.store.get_nodes(state=states.PENDING)
+        self.assertEqual(10, len(pending))
+        for node in pending:
+            self.assertTrue(node in updated)
+
+        launches = [{'launch_id' : new_id(), 'state' : states.REQUESTED}
+                    for i in range(3)]
+        yield self.store.put_launches(launches)
+        all = yield self.store.get_launches()
+        self.assertEqual(3, len(all))
+
+    @defer.inlineCallbacks
+    def test_node_state_ranges(self):
+        launch_id = new_id()
+        node_states = [states.REQUESTED, states.PENDING, states.RUNNING,
+                       states.TERMINATING, states.TERMINATED]
+        nodes = []
+        for state in node_states:
+            nodes.append({'launch_id' : launch_id, 'node_id' : new_id(),
+                          'state' : state})
+        yield self.store.put_nodes(nodes)
+
+        found = yield self.store.get_nodes(max_state=states.TERMINATING)
+        self.assertEqual(4, len(found))
+        found = yield self.store.get_nodes(min_state=states.PENDING,
+                                           max_state=states.RUNNING)
+        self.assertEqual(sorted(n['state'] for n in found),
+                         [states.PENDING, states.RUNNING])
+        found = yield self.store.get_nodes(min_state=states.FAILED)
+        self.assertEqual([], found)
+
+        # move the last running node on, and the running range is empty
+        node = nodes[2].copy()
+        node['state'] = states.TERMINATED
+        yield self.store.put_node(node)
+        found = yield self.store.get_nodes(state=states.RUNNING)
+        self.assertEqual([], found)
+        found = yield self.store.get_nodes(state=states.TERMINATED)
+        self.assertEqual(2, len(found))
+
+    @defer.inlineCallbacks
+    def test_records_are_copies(self):
+        launch_id = new_id()
+        launch = {'launch_id' : launch_id, 'state' : states.REQUESTED,
+                  'node_ids' : ['a', 'b']}
+        yield self.store.put_launch(launch)
+        launch['node_ids'].append('c')
+
+        got = yield self.store.get_launch(launch_id)
+        self.assertEqual(['a', 'b'], got['node_ids'])
+
+        got['state'] = states.FAILED
+        got['node_ids'].append('d')
+        got = yield self.store.get_launch(launch_id)
+        self.assertEqual(states.REQUESTED, got['state'])
+        self.assertEqual(['a', 'b'], got['node_ids'])
+
+        all = yield self.store.get_launches(state=states.REQUESTED)
+        all[0]['node_ids'].append('e')
+        got = yield self.store.get_launch(launch_id)
+        self.assertEqual(['a', 'b'], got['node_ids'])
+
+class FakeCassandraClient(object):
+    def __init__(self):
+        self.mutations = []
+
+    def batch_mutate(self, mutations):
+        self.mutations.append(mutations)
+        return defer.succeed(None)
+
+class CassandraBatchTests(unittest.TestCase):
+    """Checks how node writes are split into batch mutations, without cassandra
+    """
+
+    def setUp(self):
+        self.store = CassandraProvisionerStore('localhost', 9160,
+                                               'ooiuser', 'oceans11',
+                                               prefix='test', batch_size=10)
+        self.store.client = FakeCassandraClient()
+
+    @defer.inlineCallbacks
+    def test_chunks(self):
+        nodes = [{'node_id' : 'node%d' % i, 'state' : states.REQUESTED}
+                 for i in range(25)]
+        yield self.store.put_nodes(nodes)
+
+        mutations = self.store.client.mutations
+        self.assertEqual([len(m) for m in mutations], [10, 10, 5])
+        self.assertEqual(mutations[0]['node0'].keys(), ['testNode'])
+
+    @defer.inlineCallbacks
+    def test_same_row(self):
+        nodes = [{'node_id' : 'node1', 'state' : states.REQUESTED},
+                 {'node_id' : 'node1', 'state' : states.PENDING}]
+        yield self.store.put_nodes(nodes)
+
+        mutations = self.store.client.mutations
+        self.assertEqual(len(mutations), 1)
+        columns = mutations[0]['node1']['testNode']
+        self.assertEqual(sorted(columns.keys()),
+                         sorted([states.REQUESTED, states.PENDING]))
+
 class CassandraProvisionerStoreTests(BaseProvisionerStoreTests):
     """Runs same tests as BaseProvisionerStoreTests but cassandra backend
     """
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""
+@file ion/services/cei/test/test_controller_core.py
+@author agent
+@brief Test the EPU controller state bookkeeping
+"""
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from ion.services.cei.epucontroller.controller_core import ControllerCore, \
+    ControllerCoreState, StateHistory
+from ion.services.cei.decisionengine import Engine
+from ion.services.cei.epucontroller import StateItem
+from ion.services.cei.decisionengine.test.mockcontroller import DeeState
+import ion.services.cei.states as InstanceStates
+
+BAD_STATES = [InstanceStates.TERMINATING, InstanceStates.TERMINATED, InstanceStates.FAILED]
+
+
+class ControllerCoreStateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.state = ControllerCoreState(max_items=3, max_age=100)
+
+    def _instance(self, node_id, state):
+        self.state.new_instancestate({'node_id':node_id, 'state':state})
+
+    def test_history_bounded(self):
+        for i in range(10):
+            self.state.new_queuelen({'queue_id':'q1', 'queuelen':i})
+
+        history = self.state.get("queue-length", "q1")
+        self.assertEqual(len(history), 3)
+        self.assertEqual([item.value for item in history], [7, 8, 9])
+        self.assertEqual(history[-1].value, 9)
+        self.assertEqual(self.state.get_latest("queue-length", "q1").value, 9)
+        self.assertEqual(self.state.get_latest("queue-length", "q2"), None)
+
+    def test_history_aged(self):
+        history = StateHistory(max_items=10, max_age=100)
+        history.append(StateItem("queue-length", "q1", 1000, 1))
+        history.append(StateItem("queue-length", "q1", 1050, 2))
+        self.assertEqual([item.value for item in history], [1, 2])
+        history.append(StateItem("queue-length", "q1", 1120, 3))
+        self.assertEqual([item.value for item in history], [2, 3])
+
+        # the newest item is kept however old
+        history.append(StateItem("queue-length", "q1", 2000, 4))
+        self.assertEqual([item.value for item in history], [4])
+
+    def test_keys_seen(self):
+        self._instance('n1', InstanceStates.RUNNING)
+        self._instance('n2', InstanceStates.RUNNING)
+        self._instance('n2', InstanceStates.TERMINATING)
+
+        # push the bad state out of the retained history
+        for i in range(5):
+            self._instance('n2', InstanceStates.TERMINATED)
+        self.assertEqual(self.state.get_keys_seen("instance-state", [InstanceStates.TERMINATING]),
+                         set(['n2']))
+        self.assertEqual(self.state.get_keys_seen("instance-state", BAD_STATES),
+                         set(['n2']))
+        self.assertEqual(self.state.get_keys_seen("instance-state", [InstanceStates.RUNNING]),
+                         set(['n1', 'n2']))
+
+        latest = self.state.get_all_latest("instance-state")
+        self.assertEqual(sorted((item.key, item.value) for item in latest),
+                         [('n1', InstanceStates.RUNNING), ('n2', InstanceStates.TERMINATED)])
+
+    def test_prune(self):
+        self.state.new_instancestate({'node_id':'n1', 'state':InstanceStates.RUNNING})
+        self.state.new_instancestate({'node_id':'n2', 'state':InstanceStates.RUNNING})
+        self.state.new_instancestate({'node_id':'n2', 'state':InstanceStates.TERMINATED})
+        self.state.new_instancestate({'node_id':'n3', 'state':InstanceStates.FAILED})
+        self.state.new_instancestate({'node_id':'n3', 'state':InstanceStates.PENDING})
+        now = self.state.get_latest("instance-state", "n2").time
+
+        # terminal but not yet old enough
+        self.assertEqual(self.state.prune(now + 50), [])
+
+        self.assertEqual(self.state.prune(now + 101), ['n2'])
+        self.assertEqual(self.state.get("instance-state", "n2"), [])
+        self.assertEqual(sorted(item.key for item in
+                                self.state.get_all_latest("instance-state")),
+                         ['n1', 'n3'])
+        self.assertEqual(self.state.get_keys_seen("instance-state", [InstanceStates.RUNNING]),
+                         set(['n1']))
+        self.assertEqual(self.state.get_keys_seen("instance-state", BAD_STATES),
+                         set(['n3']))
+        self.assertEqual(self.state.prune(now + 1000), [])
+
+    def test_unknown_type(self):
+        self.assertRaises(KeyError, self.state.get_latest, "nothing", "x")
+        self.assertRaises(KeyError, self.state.get_all_latest, "nothing")
+
+    def test_matches_default(self):
+        # The State defaults walk the full history; the controller tracks it
+        dee = DeeState()
+        for node_id, value in (('a', InstanceStates.RUNNING),
+                               ('b', InstanceStates.PENDING),
+                               ('b', InstanceStates.FAILED),
+                               ('c', InstanceStates.REQUESTING)):
+            dee.instance_states[node_id].append(
+                StateItem("instance-state", node_id, 0, value))
+            self._instance(node_id, value)
+
+        for values in (BAD_STATES, [InstanceStates.RUNNING], []):
+            self.assertEqual(dee.get_keys_seen("instance-state", values),
+                             self.state.get_keys_seen("instance-state", values))
+        self.assertEqual(dee.get_latest("instance-state", "b").value,
+                         self.state.get_latest("instance-state", "b").value)
+
+
+class RecordingEngine(Engine):
+    """Records the calls made to it by the controller
+    """
+    def __init__(self):
+        super(RecordingEngine, self).__init__()
+        self.changes = []
+        self.decides = 0
+        self.reconfigures = 0
+
+    def initialize(self, control, state, conf=None):
+        pass
+
+    def reconfigure(self, control, newconf):
+        self.reconfigures += 1
+
+    def state_changed(self, state_items):
+        self.changes.append([item.value for item in state_items])
+
+    def decide(self, control, state):
+        self.decides += 1
+
+
+class ControllerCoreDecideTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.core = ControllerCore(None,
+                "ion.services.cei.test.test_controller_core.RecordingEngine")
+        self.engine = self.core.engine
+
+    @defer.inlineCallbacks
+    def test_skip_unchanged(self):
+        # the first decide always happens
+        yield self.core.run_decide()
+        self.assertEqual(self.engine.decides, 1)
+        self.assertEqual(self.engine.changes, [])
+
+        yield self.core.run_decide()
+        self.assertEqual(self.engine.decides, 1)
+        self.assertEqual(self.core.decides_skipped, 1)
+
+        self.core.new_sensor_info({'queue_id':'q1', 'queuelen':5})
+        self.core.new_sensor_info({'node_id':'n1', 'state':InstanceStates.RUNNING})
+        yield self.core.run_decide()
+        self.assertEqual(self.engine.decides, 2)
+        self.assertEqual(self.engine.changes, [[5, InstanceStates.RUNNING]])
+
+        yield self.core.run_decide()
+        self.assertEqual(self.engine.decides, 2)
+
+        yield self.core.run_reconfigure({})
+        yield self.core.run_decide()
+        self.assertEqual(self.engine.reconfigures, 1)
+        self.assertEqual(self.engine.decides, 3)
+        self.assertEqual(len(self.engine.changes), 1)
+
+    @defer.inlineCallbacks
+    def test_idle_interval(self):
+        yield self.core.run_decide()
+        self.core.last_decide -= self.core.decide_idle_interval
+        yield self.core.run_decide()
+        self.assertEqual(self.engine.decides, 2)
+
+        self.core.decide_idle_interval = 0
+        self.core.last_decide -= 1000
+        yield self.core.run_decide()
+        self.assertEqual(self.engine.decides, 2)
@@ -371,3 +371,65 @@ class NPreservingEngineTestCase(unittest.TestCase):
         assert iaas_id != None
         assert self._is_iaas_id_active(iaas_id)
         assert original_iaas_id == iaas_id
+
+
+class ChangesDeeState(DeeState):
+    """DeeState which also records the items added, like the controller
+    does for the engine's state_changed calls.
+    """
+    def __init__(self):
+        super(ChangesDeeState, self).__init__()
+        self.changes = []
+
+    def new_launch(self, new_instance_id):
+        DeeState.new_launch(self, new_instance_id)
+        self.changes.append(self.instance_states[str(new_instance_id)][-1])
+
+    def new_kill(self, instanceid):
+        DeeState.new_kill(self, instanceid)
+        self.changes.append(self.instance_states[str(instanceid)][-1])
+
+    def take_changes(self):
+        changes = self.changes
+        self.changes = []
+        return changes
+
+
+class NPreservingEngineIncrementalTestCase(NPreservingEngineTestCase):
+    """Runs the same tests with the engine keeping its own instance view.
+    """
+
+    def setUp(self):
+        self.engine = EngineLoader().load(ENGINE)
+        self.state = ChangesDeeState()
+        self.state.new_qlen(0)
+        self.control = DeeControl(self.state)
+
+        decide = self.engine.decide
+        def decide_with_changes(control, state):
+            self.engine.state_changed(state.take_changes())
+            decide(control, state)
+        self.engine.decide = decide_with_changes
+
+    def test_view(self):
+        conf = {'preserve_n':'3'}
+        self.engine.initialize(self.control, self.state, conf)
+        self.engine.decide(self.control, self.state)
+        self.engine.reconfigure(self.control, {'preserve_n':'1'})
+        self.engine.decide(self.control, self.state)
+        self.engine.decide(self.control, self.state)
+        assert self.control.num_launched == 1
+
+        latest = self.engine.instance_latest
+        assert set(latest.keys()) == set(self.state.instance_states.keys())
+        assert len(self.engine.instance_bad) == 2
+        for key, items in self.state.instance_states.iteritems():
+            assert latest[key] is items[-1]
+
+        # instances the State forgets are dropped from the view
+        for key in list(self.engine.instance_bad):
+            del self.state.instance_states[key]
+        self.engine.decide(self.control, self.state)
+        assert len(latest) == 1
+        assert len(self.engine.instance_bad) == 0
+        assert self.control.num_launched == 1
@@ -3,28 +3,30 @@
 """
 @file ion/services/coi/datastore.py
 @author David Stuebe
-
-@TODO
-use persistent key:value store in work bench to persist push and get pull!
 """
 
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 from twisted.internet import defer
 
+from ion.core import ioninit
 import ion.util.procutils as pu
 from ion.core.process.process import ProcessFactory
 from ion.core.process.service_process import ServiceProcess, ServiceClient
+from ion.core.object.workbench_store import WorkBenchStore
+
+from net.ooici.core.link import link_pb2
 
-from ion.data import store
+CONF = ioninit.config(__name__)
 
 
 class DataStoreService(ServiceProcess):
     """
-    The data store is not yet persistent. At the moment all its stored objects
-    are kept in a python dictionary, part of the work bench. This service will
-    be modified to use a persistent store - a set of cache instances to which
-    it will dump data from push ops and retrieve data for pull and fetch ops.
+    The data store keeps its repositories in the work bench. If a backend is
+    configured, the work bench is persisted to it by a WorkBenchStore: what is
+    pushed is written behind to the backend, and the repositories and elements
+    which are not in memory are read back from it for pull and fetch ops.
+    Without a backend all stored objects are kept in memory only.
     """
     # Declaration of service
     declare = ServiceProcess.service_declare(name='datastore',
@@ -33,15 +35,12 @@ class DataStoreService(ServiceProcess):
 
     def __init__(self, *args, **kwargs):
         # Service class initializer. Basic config, but no yields allowed.
-        
-        #assert isinstance(backend, store.IStore)
-        #self.backend = backend
         ServiceProcess.__init__(self, *args, **kwargs)
-        
-        self.op_push = self.workbench.op_push
-        self.op_pull = self.workbench.op_pull
-        #self.op_clone = self.workbench.op_clone
-        self.op_fetch_linked_objects = self.workbench.op_fetch_linked_objects
+
+        self.spawn_args['backend_class'] = self.spawn_args.get('backend_class', CONF.getValue('backend_class', default=None))
+        self.spawn_args['backend_args'] = self.spawn_args.get('backend_args', CONF.getValue('backend_args', default={}))
+
+        self.store = None
 
         self.push = self.workbench.push
         self.pull = self.workbench.pull
@@ -49,11 +48,77 @@ class DataStoreService(ServiceProcess):
         self.fetch_linked_objects = self.workbench.fetch_linked_objects
 
         log.info('DataStoreService.__init__()')
-        
 
+
+    @defer.inlineCallbacks
     def slc_init(self):
         # Service life cycle state. Initialize service here. Can use yields.
-        pass
+        backendcls = self.spawn_args['backend_class']
+        if not backendcls:
+            log.info('DataStoreService: no backend, the work bench is not persistent')
+            return
+
+        backendargs = self.spawn_args['backend_args']
+        backend = pu.get_class(backendcls)
+        if hasattr(backend, 'create_store'):
+            backend = yield backend.create_store(**backendargs)
+        else:
+            backend = backend(**backendargs)
+
+        self.store = WorkBenchStore(self.workbench, backend,
+            flush_interval=CONF.getValue('flush_interval', 1.0),
+            batch_size=CONF.getValue('batch_size', 500),
+            max_pending_bytes=CONF.getValue('max_pending_bytes', 16777216),
+            max_bytes=CONF.getValue('max_bytes', None),
+            max_repositories=CONF.getValue('max_repositories', None))
+        self.store.start()
+        log.info('DataStoreService: work bench persisted to %s' % backendcls)
+
+    @defer.inlineCallbacks
+    def slc_terminate(self):
+        if self.store is not None:
+            yield self.store.stop()
+
+    def _load_repository(self, key):
+        if self.store is None:
+            return defer.succeed(None)
+        return self.store.load_repository(key)
+
+    @defer.inlineCallbacks
+    def op_pull(self, content, headers, msg):
+        if isinstance(content, dict):
+            repo = yield self._load_repository(content['repository_key'])
+            if repo is not None:
+                # Only the structure the delta sends, and what the puller has
+                have = self.workbench._decode_keys(content.get('have', []))
+                yield self.store.load_delta(repo, have)
+        else:
+            # Old style pull - the commits only
+            yield self._load_repository(content)
+        yield self.workbench.op_pull(content, headers, msg)
+
+    @defer.inlineCallbacks
+    def op_push_heads(self, content, headers, msg):
+        # The pusher sends what the stored heads lack
+        yield self._load_repository(content['repository_key'])
+        yield self.workbench.op_push_heads(content, headers, msg)
+
+    @defer.inlineCallbacks
+    def op_push(self, content, headers, msg):
+        # The stored heads are merged with the pushed ones
+        yield self._load_repository(content.repository_key)
+        yield self.workbench.op_push(content, headers, msg)
+
+    @defer.inlineCallbacks
+    def op_fetch_linked_objects(self, elements, headers, msg):
+        if self.store is not None:
+            keys = []
+            for se in elements:
+                link = link_pb2.CASRef()
+                link.ParseFromString(se.value)
+                keys.append(link.key)
+            yield self.store.load_elements(keys)
+        yield self.workbench.op_fetch_linked_objects(elements, headers, msg)
 
 #
 #
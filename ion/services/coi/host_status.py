@@ -20,6 +20,10 @@ from twisted.web import xmlrpc
 
 from ion.core.process.process import ProcessFactory
 from ion.core.process.service_process import ServiceProcess, ServiceClient
+from ion.services.coi.hostsensor.readers import AsyncHostReader
+from ion.services.coi.hostsensor.metrics import HostMetricsSampler, \
+    HostMetricsPublisher
+from ion.services.dm.distribution.publisher_subscriber import PublisherFactory
 
 
 class HostStatusService(ServiceProcess):
@@ -37,6 +41,7 @@ class HostStatusService(ServiceProcess):
 
 
 
+    @defer.inlineCallbacks
     def slc_init(self):
         self.INTERVAL = 1 # seconds
         self.COUNT    = 1
@@ -46,6 +51,27 @@ class HostStatusService(ServiceProcess):
         self.lc = task.LoopingCall(self.report)
         self.lc.start(self.INTERVAL)
 
+        # Publish the changes in host metrics if given a topic
+        self.metrics = None
+        topic = self.spawn_args.get('metrics_topic', None)
+        if topic:
+            reader = AsyncHostReader(
+                self.spawn_args.get('snmp_host', 'localhost'),
+                self.spawn_args.get('snmp_port', 161),
+                self.spawn_args.get('snmp_agent', 'ooici'),
+                self.spawn_args.get('snmp_community', 'ooicinet'))
+            publisher = yield PublisherFactory().build(
+                publisher_name=self.proc_name, topic_id=topic)
+            self.metrics = HostMetricsPublisher(
+                HostMetricsSampler(reader), publisher, topic,
+                self.spawn_args.get('metrics_interval', 10.0))
+            self.metrics.start()
+
+    def slc_terminate(self):
+        if self.metrics:
+            self.metrics.stop()
+            return self.metrics.sampler.reader.close()
+
 
     @defer.inlineCallbacks
     def report(self):
@@ -0,0 +1,267 @@
+"""
+@file ion/services/coi/hostsensor/metrics.py
+@author agent
+@brief Samples a HostReader on a schedule and publishes what changed since
+the previous sample, with the counters turned into rates
+"""
+
+import time
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+try:
+    import json
+except:
+    import simplejson as json
+
+from twisted.internet import defer, task
+
+
+# The column each table row is known by between samples.  The rows of
+# HostReader tables do not carry their SNMP index, so the interface and
+# storage descriptions are used, and the process id for processes.
+ROW_KEYS = {
+    'network' : 'IfDescr',
+    'storage' : 'StorageDesc',
+    'cpu'     : 'SWRunIndex'
+}
+
+# Counters turned into rates: (counter column, rate column, scale, wrap).
+# The rate is scale * increase / seconds.  A counter which went down is
+# taken to have wrapped at wrap, or to have been reset if wrap is None.
+RATES = {
+    'network' : [
+        ('IfInOctets',   'IfInBytesPerSec',  1.0, 2 ** 32),
+        ('IfOutOctets',  'IfOutBytesPerSec', 1.0, 2 ** 32)
+    ],
+    # hrSWRunPerfCPU is centiseconds of CPU time, so centiseconds per
+    # second is the percent of one CPU
+    'cpu' : [
+        ('SWRunPerfCPU', 'SWRunPerfCPUPercent', 1.0, None)
+    ]
+}
+
+# Base fields which change on every sample and are carried by the record
+# time instead
+SKIP_BASE = ['LocalTime']
+
+
+class HostMetricsSampler:
+    """
+    Keeps the previous sample of a host and turns each new one into a
+    record of only the rows which changed, with rates computed from the
+    counters.  Every keyframeInterval records a full record is made
+    instead, so a consumer joining late has a starting point.
+
+    A record is a dict:
+        host, time, seq    - where and when it was sampled
+        full               - True if the record replaces all earlier state
+        base               - the base fields which changed
+        tables             - for each table with changes:
+            cols           - column names, rate columns last
+            keys           - the key of each changed row
+            values         - one list per column, aligned with keys
+            removed        - keys of the rows which went away
+    """
+
+    def __init__(self, reader, host=None, subsystem='all', keyframeInterval=60, clock=time.time):
+        """
+        @param reader a HostReader or AsyncHostReader
+        @param host name recorded in each record, defaults to the reader host
+        @param keyframeInterval records between full records, 0 for only
+        the first one
+        """
+        self.reader = reader
+        if host is None:
+            host = getattr(reader.reader, 'host', None)
+        self.host = host
+        self.subsystem = subsystem
+        self.keyframeInterval = keyframeInterval
+        self._clock = clock
+
+        self.seq = 0
+        self._time = None
+        self._base = {}
+        self._tables = {}
+        """
+        Map of table name to (cols, {key: raw row}, {key: emitted row})
+        """
+
+    def reset(self):
+        """
+        Forget the previous sample, so the next record is a full one
+        """
+        self._time = None
+        self._base = {}
+        self._tables = {}
+
+    @defer.inlineCallbacks
+    def sample(self):
+        """
+        Reads the host and makes the record of what changed
+        @retval Deferred firing with the record
+        """
+        report = yield defer.maybeDeferred(self.reader.get, self.subsystem)
+        defer.returnValue(self.update(report, self._clock()))
+
+    def update(self, report, now):
+        """
+        Makes the record for a report from HostReader.get sampled at now
+        """
+        full = self._time is None or (self.keyframeInterval and
+                                      self.seq % self.keyframeInterval == 0)
+        elapsed = None
+        if self._time is not None and now > self._time:
+            elapsed = now - self._time
+
+        record = {'host':self.host, 'time':now, 'seq':self.seq, 'full':bool(full),
+                  'base':{}, 'tables':{}}
+
+        for name, value in report.items():
+            if name == 'base':
+                record['base'] = self._updateBase(value, full)
+            elif isinstance(value, dict) and 'rows' in value:
+                table = self._updateTable(name, value, elapsed, full)
+                if table is not None:
+                    record['tables'][name] = table
+
+        self._time = now
+        self.seq += 1
+        return record
+
+    def _updateBase(self, base, full):
+        changed = {}
+        for key, value in base.items():
+            if key in SKIP_BASE:
+                continue
+            if full or key not in self._base or self._base[key] != value:
+                changed[key] = value
+        self._base = dict(base)
+        return changed
+
+    def _updateTable(self, name, table, elapsed, full):
+        cols = list(table['cols'])
+        rates = [r for r in RATES.get(name, []) if r[0] in cols]
+        keyCol = ROW_KEYS.get(name)
+        keyIndex = 0
+        if keyCol in cols:
+            keyIndex = cols.index(keyCol)
+        rateIndexes = [(cols.index(counter), scale, wrap) for counter, rcol, scale, wrap in rates]
+        outCols = cols + [rcol for counter, rcol, scale, wrap in rates]
+
+        prevCols, prevRaw, prevOut = self._tables.get(name, (None, {}, {}))
+        if prevCols != outCols:
+            full = True
+            prevRaw, prevOut = {}, {}
+
+        raw = {}
+        out = {}
+        keys = []
+        for row in table['rows']:
+            key = row[keyIndex]
+            if key in raw:
+                # The key is not unique - tell the rows apart by position
+                key = '%s#%d' % (key, len(raw))
+            raw[key] = row
+
+            emitted = list(row)
+            last = prevRaw.get(key)
+            for index, scale, wrap in rateIndexes:
+                emitted.append(_rate(last and last[index], row[index], elapsed, scale, wrap))
+            out[key] = emitted
+            if full or prevOut.get(key) != emitted:
+                keys.append(key)
+
+        removed = []
+        if not full:
+            removed = [key for key in prevOut if key not in out]
+        self._tables[name] = (outCols, raw, out)
+
+        if not keys and not removed and not full:
+            return None
+        values = [[out[key][i] for key in keys] for i in range(len(outCols))]
+        return {'cols':outCols, 'keys':keys, 'values':values, 'removed':removed}
+
+
+def _rate(last, value, elapsed, scale, wrap):
+    """
+    Rate of a counter between two samples, None when it can not be known
+    """
+    if last is None or value is None or not elapsed:
+        return None
+    increase = value - last
+    if increase < 0:
+        if wrap is None:
+            return None
+        increase += wrap
+    return scale * increase / elapsed
+
+
+def applyRecord(state, record):
+    """
+    Brings the state of a host up to date with a record, the way a
+    subscriber rebuilds the tables from the stream
+    @param state dict from a previous applyRecord, or {} to start
+    @retval the state: {'time', 'base':{}, 'tables':{name: {'cols', 'rows':{key: row}}}}
+    """
+    if record['full'] or not state:
+        state = {'base':{}, 'tables':{}}
+    state['time'] = record['time']
+    state['base'].update(record['base'])
+    for name, table in record['tables'].items():
+        current = state['tables'].get(name)
+        if record['full'] or current is None or current['cols'] != table['cols']:
+            current = state['tables'][name] = {'cols':table['cols'], 'rows':{}}
+        rows = current['rows']
+        for key in table['removed']:
+            rows.pop(key, None)
+        for i, key in enumerate(table['keys']):
+            rows[key] = [column[i] for column in table['values']]
+    return state
+
+
+class HostMetricsPublisher:
+    """
+    Publishes the records of a HostMetricsSampler at an interval through a
+    pubsub Publisher.  A sample which fails to be read or published is
+    logged and skipped, and the sampler starts over with a full record so
+    subscribers do not miss a change.
+    """
+
+    def __init__(self, sampler, publisher, topic, interval=10.0):
+        """
+        @param publisher a Publisher, as made by PublisherFactory.build
+        @param topic the topic to publish the records to
+        @param interval seconds between samples
+        """
+        self.sampler = sampler
+        self.publisher = publisher
+        self.topic = topic
+        self.interval = interval
+        self.published = 0
+        self.failed = 0
+        self.loop = task.LoopingCall(self.publishSample)
+
+    def start(self):
+        if not self.loop.running:
+            self.loop.start(self.interval)
+
+    def stop(self):
+        if self.loop.running:
+            self.loop.stop()
+
+    def isRunning(self):
+        return self.loop.running
+
+    @defer.inlineCallbacks
+    def publishSample(self):
+        try:
+            record = yield self.sampler.sample()
+            yield self.publisher.publish(self.topic, json.dumps(record))
+        except Exception, ex:
+            self.failed += 1
+            self.sampler.reset()
+            log.warn('Host metrics sample of %s failed: %s' % (self.sampler.host, str(ex)))
+            return
+        self.published += 1
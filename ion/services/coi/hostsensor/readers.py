@@ -7,12 +7,18 @@
 ### This module requires pyasn1 and pysnmp
 
 
-import os,datetime
+import os,datetime,random
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 
+from twisted.internet import defer, protocol, reactor
+
+from ion.util.deferreds import gather
+
 try:
     from pysnmp.entity.rfc3413.oneliner import cmdgen
+    from pysnmp.proto import api as snmpapi
+    from pyasn1.codec.ber import encoder as berencoder, decoder as berdecoder
     PysnmpImported = True
 except ImportError:
     PysnmpImported = False
@@ -76,23 +82,10 @@ class HostReader:
 
     def _getBase(self):
         """
-        Gets basic machine information.
+        Gets basic machine information, all of it in one request.
         """
-        ret = {}
-        ret['SupportsSNMP']      = self.reader.supportsSNMP()
-        ret['SupportsRFC1213']   = self.reader.supportsRFC1213()
-        ret['SupportsRFC2790']   = self.reader.supportsRFC2790()
-        ret['LocalTime']         = datetime.datetime.today().isoformat()
-
-
-        ret['rfc1213_SystemDescr']    = self.reader.get(Rfc1213Mib.system_sysDescr)
-        ret['rfc1213_SystemContact']  = self.reader.get(Rfc1213Mib.system_sysContact)
-        ret['rfc1213_SystemName']     = self.reader.get(Rfc1213Mib.system_sysName)
-        ret['rfc1213_SystemLocation'] = self.reader.get(Rfc1213Mib.system_sysLocation)
-        ret['rfc1213_UpTime']         = self.reader.get(Rfc1213Mib.system_sysUpTime)
-        ret['rfc2790_UpTime'] = self.reader.get(Rfc2790Mib.hrSystemUptime)
-
-        return ret
+        values = self.reader.getMany([f for k, f in BASE_FIELDS])
+        return _baseReport(self.reader, values)
 
     def _getPython(self):
 
@@ -110,90 +103,29 @@ class HostReader:
         """
         Gets information about the host's network interfaces.
         """
-        source = 'rfc1213_mib'
-        fields = [
-                    Rfc1213Mib.interfaces_ifTable_ifDescr,
-                    Rfc1213Mib.interfaces_ifTable_ifSpeed,
-                    Rfc1213Mib.interfaces_ifTable_ifInOctets,
-                    Rfc1213Mib.interfaces_ifTable_ifInErrors,
-                    Rfc1213Mib.interfaces_ifTable_ifOutOctets,
-                    Rfc1213Mib.interfaces_ifTable_ifOutErrors
-                 ]
-        cols = []
-        for f in fields:
-            cols.append(f[1])
-        rows = self.reader.getTable(Rfc1213Mib.interfaces_ifTable, fields)
-
-        return {
-                'source'  : source,
-                'cols' : cols,
-                'rows' : rows
-                }
-
+        source, table, fields = NETWORK_TABLE
+        rows = self.reader.getTable(table, fields)
+        return _tableReport(source, [fields], rows)
 
 
     def _getStorage(self):
         """
         Gets information about the host's storage, including disk drives and memory.
         """
-        source = 'rfc2790_mib'
-        fields = [
-                    Rfc2790Mib.hrStorageDescr,
-                    Rfc2790Mib.hrStorageAllocationUnits,
-                    Rfc2790Mib.hrStorageSize,
-                    Rfc2790Mib.hrStorageUsed,
-                    Rfc2790Mib.hrStorageAllocationFailures
-                ]
-        cols = []
-        for f in fields:
-            cols.append(f[1])
-        rows = self.reader.getTable(Rfc2790Mib.hrStorageTable, fields)
-
-        return {
-                'source'  : source,
-                'cols' : cols,
-                'rows' : rows
-                }
+        source, table, fields = STORAGE_TABLE
+        rows = self.reader.getTable(table, fields)
+        return _tableReport(source, [fields], rows)
 
 
     def _getProcesses(self):
         """
         Gets information about processes currently running on the host.
         """
-
         # This is really a two-part table that needs to be assembled.
         # We'll be pulling data from two distinct snmp tables.
-
-        source = 'rfc1213_mib'
-        oid1 = Rfc2790Mib.hrSWRunTable
-        fields1 = [
-                    Rfc2790Mib.hrSWRunIndex,
-                    Rfc2790Mib.hrSWRunName,
-                    Rfc2790Mib.hrSWRunID,
-                    Rfc2790Mib.hrSWRunPath,
-                    Rfc2790Mib.hrSWRunParameters,
-                    Rfc2790Mib.hrSWRunType,
-                    Rfc2790Mib.hrSWRunStatus
-                 ]
-        oid2 =     Rfc2790Mib.hrSWRunPerfTable
-        fields2 = [
-                    Rfc2790Mib.hrSWRunPerfCPU,
-                    Rfc2790Mib.hrSWRunPerfMem
-                 ]
-
-        cols = []
-        for f in fields1:
-            cols.append(f[1])
-        for f in fields2:
-            cols.append(f[1])
-
-        rows = self.reader.stitchTables([oid1,oid2], [fields1,fields2])
-
-        return {
-            'source' : source,
-            'cols' : cols,
-            'rows' : rows
-            }
+        source, tables, fieldsList = PROCESS_TABLES
+        rows = self.reader.stitchTables(tables, fieldsList)
+        return _tableReport(source, fieldsList, rows)
 
     @staticmethod
     def _isTable(object):
@@ -289,15 +221,19 @@ class SnmpReader:
     MIBs are specifically targeted, more information available here
     http://www.ietf.org/rfc/rfc1213.txt and also here
     http://portal.acm.org/citation.cfm?id=Rfc2790Mib
+
+    The command generator and transport are made once and reused for every
+    request to the agent.  Tables are walked with GETBULK.
     """
 
-    def __init__(self, host, port, agentName, communityName, timeout=1.5, retries=3):
+    def __init__(self, host, port, agentName, communityName, timeout=1.5, retries=3, maxRepetitions=25):
         self.agentName = agentName
         self.communityName = communityName
         self.host = host
         self.port = port
         self.timeout = timeout
-        self.retries = 3
+        self.retries = retries
+        self.maxRepetitions = maxRepetitions
         self._supportsSNMP = True
         log.debug('Supports Pysnmp - ' + str(PysnmpImported))
         if not PysnmpImported:
@@ -305,8 +241,15 @@ class SnmpReader:
             self._supportsRfc2790 = False
             self._supportsRfc1213 = False
         else:
-            self._supportsRfc2790 = self.get(Rfc2790Mib.hrSystemNumUsers) != None
-            self._supportsRfc1213 = self.get(Rfc1213Mib.system_sysDescr) != None
+            self._cmdgen = cmdgen.CommandGenerator()
+            self._auth = cmdgen.CommunityData(self.agentName, self.communityName, 1)
+            self._target = cmdgen.UdpTransportTarget(
+                                      (self.host, self.port),
+                                      timeout=self.timeout,
+                                      retries=self.retries )
+            users, descr = self.getMany([Rfc2790Mib.hrSystemNumUsers, Rfc1213Mib.system_sysDescr])
+            self._supportsRfc2790 = users != None
+            self._supportsRfc1213 = descr != None
             self._supportsPysnmp = True
         self._supportsSNMP = PysnmpImported and (self._supportsRfc1213 or self._supportsRfc2790)
 
@@ -322,10 +265,7 @@ class SnmpReader:
 
 
     def _toTuple(self, oid):
-        array = []
-        for dec in oid[1:].split("."):
-            array.append(int(dec))
-        return tuple(array)
+        return _toTuple(oid)
 
 
     def get(self, oid):
@@ -333,67 +273,33 @@ class SnmpReader:
         Gets an SNMP single value and converts it into a more mainstream
         value (i.e. gets rid of ASN.1).
         """
+        return self.getMany([oid])[0]
+
+
+    def getMany(self, oids):
+        """
+        Gets several SNMP values in one request.  Returns a list of values
+        in the order of the oids, None for each value the agent does not
+        have.
+        """
         if not self._supportsSNMP:
-            return None
+            return [None] * len(oids)
 
-        tupleoid = self._toTuple(oid[0])
-        shot = self._get(tupleoid)
-        try:
-            return shot[3][0][1]._value
-        except:
-            return None
+        shot = self._get(*[_toTuple(oid[0]) for oid in oids])
+        if shot[0] or shot[1] or len(shot[3]) != len(oids):
+            return [None] * len(oids)
+        return [_snmpValue(val) for name, val in shot[3]]
 
 
     def stitchTables(self, tableOidList, fieldsList):
         """
         Stitches multiple tables together joined by table ids
         """
-        # This is a bit tricky.  Since some SNMP tables are related by ids,
-        # but the ids are fleeting and very temporal, the stitching has to
-        # assume information will be missing.
-        #
-        # The stitch then becomes something like a SQL full outer join
-        # Weird errors?  Look here first.
-
-
-        # query all the tables
         tables = []
         for i in range(0,len(tableOidList)):
             next = self.getTable(tableOidList[i],fieldsList[i],includeId=True)
             tables.append(next)
-
-        # this is our working value, a hash for easy id retrieval
-        work = {}
-
-        # we're going to need this to properly pad new rows
-        totalFields = 0
-        for fields in fieldsList:
-            totalFields += len(fields)
-
-        # simple offset
-        currentField = 0
-        for i in range(0,len(tables)):
-            for id in tables[i]:
-
-                # Create a fully populated row of Nones.
-                if not work.has_key(id):
-                    newrow = []
-                    for j in range(0,totalFields):
-                        newrow.append(None)
-                    work[id] = newrow
-
-                # Populate data now that a row is guaranteed to exist
-                for j in range(0,len(tables[i][id])):
-                    work[id][j + currentField] = tables[i][id][j]
-
-            currentField += len(fieldsList[i])
-
-        # Strip off the ids, they're no longer necessary
-        final = []
-        for key in work:
-            final.append(work[key])
-
-        return final
+        return _stitchTables(tables, fieldsList)
 
 
 
@@ -402,61 +308,21 @@ class SnmpReader:
         Gets an SNMP table and converts it into a more mainstream
         value (i.e. gets rid of ASN.1 and converts key-value pairs into
         a list of dictionaries.  Result should be JSON ready.)
+
+        Only the columns of the fields are walked, all of them at once.
         """
         if not self._supportsSNMP:
-            return []
-
-        # MIB OID manipulation.
-        tupleoid = self._toTuple(tableOid[0])
-        tuplefields = []
-        for field in fields:
-            tuplefields.append(self._toTuple(field[0]))
-
-        table = self._getNext(tupleoid)
-
-
-        # SNMP can return non-sequential row numbers.  So we check which
-        # rows are available explicitly.
-        ids = set()
-        for row in table:
-            if row[:-1] in tuplefields:
-                ids.add(row[-1])
-        ids = list(ids)
-        ids.sort()
-
-
-        # Assemble the table in a more user-friendly format than the
-        # oid.row = value model that snmp uses.
-        if includeId:
-            ret = {}
-        else:
-            ret = []
-
-        for i in ids:
-            row = []
-            for field in tuplefields:
-                # table keys are made up of the table field oid plus
-                # the row number.
-                key =  list(field)
-                key.append(i)
-                key = tuple(key)
-
-                if table.has_key(key):
-                    row.append(table[key]._value)
-                else:
-                    # place holder
-                    row.append(None)
-
             if includeId:
-                ret[i] = row
-            else:
-                ret.append(row)
+                return {}
+            return []
 
-        return ret
+        tuplefields = [_toTuple(field[0]) for field in fields]
+        table = self._getBulk(tuplefields)
+        return _assembleTable(table, tuplefields, includeId)
 
 
 
-    def _get(self, object):
+    def _get(self, *objects):
         """
         Implements SNMP's get function.
         """
@@ -464,14 +330,7 @@ class SnmpReader:
         errorIndication,    \
         errorStatus,        \
         errorIndex,         \
-        varBinds = cmdgen.CommandGenerator().getCmd(
-            cmdgen.CommunityData(self.agentName, self.communityName, 1),
-            cmdgen.UdpTransportTarget(
-                                      (self.host, self.port),
-                                      timeout=self.timeout,
-                                      retries=self.retries ),
-            object
-        )
+        varBinds = self._cmdgen.getCmd(self._auth, self._target, *objects)
         return errorIndication, errorStatus, errorIndex, varBinds
 
 
@@ -483,18 +342,520 @@ class SnmpReader:
         errorIndication,    \
         errorStatus,        \
         errorIndex,         \
-        varBinds = cmdgen.CommandGenerator().nextCmd(
-            cmdgen.CommunityData(self.agentName, self.communityName, 1),
-            cmdgen.UdpTransportTarget((self.host, self.port), timeout=self.timeout, retries=self.retries),
-            object
-        )
+        varBinds = self._cmdgen.nextCmd(self._auth, self._target, object)
         ret = {}
         for row in varBinds:
-            ret[eval(str(row[0][0]))] = row[0][1]
+            ret[tuple(row[0][0])] = row[0][1]
         return ret
 
 
 
+    def _getBulk(self, objects):
+        """
+        Implements an SNMP walk of several columns with GETBULK.
+        """
+        errorIndication,    \
+        errorStatus,        \
+        errorIndex,         \
+        varBindTable = self._cmdgen.bulkCmd(
+            self._auth, self._target, 0, self.maxRepetitions, *objects
+        )
+        ret = {}
+        if errorIndication or errorStatus:
+            return ret
+        for row in varBindTable:
+            for name, val in row:
+                ret[tuple(name)] = val
+        return ret
+
+
+
+def _toTuple(oid):
+    """
+    Converts a '.1.3.6' string oid to the tuple pysnmp requires
+    """
+    return tuple([int(dec) for dec in oid[1:].split(".")])
+
+
+def _snmpValue(value):
+    """
+    Gets rid of the ASN.1 of a value, None for the SNMPv2 exceptions
+    (noSuchObject, noSuchInstance, endOfMibView).
+    """
+    if value is None or value.tagSet in _SNMP_EXCEPTIONS:
+        return None
+    return value._value
+
+_SNMP_EXCEPTIONS = []
+if PysnmpImported:
+    _SNMP_EXCEPTIONS = [t.tagSet for t in (snmpapi.v2c.NoSuchObject,
+                                           snmpapi.v2c.NoSuchInstance,
+                                           snmpapi.v2c.EndOfMibView)]
+
+
+def _assembleTable(table, tuplefields, includeId):
+    """
+    Assembles a table in a more user-friendly format than the oid.row =
+    value model that snmp uses.  Oids outside of the fields are ignored.
+    """
+    # SNMP can return non-sequential row numbers.  So we check which
+    # rows are available explicitly.
+    ids = set()
+    for row in table:
+        if row[:-1] in tuplefields:
+            ids.add(row[-1])
+    ids = list(ids)
+    ids.sort()
+
+    if includeId:
+        ret = {}
+    else:
+        ret = []
+
+    for i in ids:
+        row = []
+        for field in tuplefields:
+            # table keys are made up of the table field oid plus
+            # the row number.
+            key = field + (i,)
+            if table.has_key(key):
+                row.append(_snmpValue(table[key]))
+            else:
+                # place holder
+                row.append(None)
+
+        if includeId:
+            ret[i] = row
+        else:
+            ret.append(row)
+
+    return ret
+
+
+def _stitchTables(tables, fieldsList):
+    """
+    Joins tables from getTable(includeId=True) by their row ids
+    """
+    # This is a bit tricky.  Since some SNMP tables are related by ids,
+    # but the ids are fleeting and very temporal, the stitching has to
+    # assume information will be missing.
+    #
+    # The stitch then becomes something like a SQL full outer join
+    # Weird errors?  Look here first.
+
+    # this is our working value, a hash for easy id retrieval
+    work = {}
+
+    # we're going to need this to properly pad new rows
+    totalFields = 0
+    for fields in fieldsList:
+        totalFields += len(fields)
+
+    # simple offset
+    currentField = 0
+    for i in range(0,len(tables)):
+        for id in tables[i]:
+
+            # Create a fully populated row of Nones.
+            if not work.has_key(id):
+                work[id] = [None] * totalFields
+
+            # Populate data now that a row is guaranteed to exist
+            for j in range(0,len(tables[i][id])):
+                work[id][j + currentField] = tables[i][id][j]
+
+        currentField += len(fieldsList[i])
+
+    # Strip off the ids, they're no longer necessary
+    return work.values()
+
+
+def _baseReport(reader, values):
+    """
+    The 'base' subsystem report from the values of BASE_FIELDS
+    """
+    ret = {}
+    ret['SupportsSNMP']      = reader.supportsSNMP()
+    ret['SupportsRFC1213']   = reader.supportsRFC1213()
+    ret['SupportsRFC2790']   = reader.supportsRFC2790()
+    ret['LocalTime']         = datetime.datetime.today().isoformat()
+    for (key, field), value in zip(BASE_FIELDS, values):
+        ret[key] = value
+    return ret
+
+
+def _tableReport(source, fieldsList, rows):
+    cols = []
+    for fields in fieldsList:
+        for f in fields:
+            cols.append(f[1])
+    return {
+            'source'  : source,
+            'cols' : cols,
+            'rows' : rows
+            }
+
+
+
+class SnmpProtocol(protocol.DatagramProtocol):
+    """
+    Sends SNMPv2c requests from one UDP port and matches the responses to
+    them by request id.  One protocol can carry the requests to any number
+    of agents, so polling many hosts does not need a socket for each.
+    Each request is resent after timeout seconds, up to retries times.
+    """
+
+    def __init__(self, clock=reactor):
+        self._clock = clock
+        self._nextId = random.randint(1, 1 << 30)
+        self.pending = {}
+        """
+        Map of request id to [deferred, address, data, retries left, timer]
+        """
+
+    def send(self, address, community, pdu, timeout, retries):
+        """
+        Sends a request PDU.  The request id of the pdu is set here.
+        Returns a Deferred firing with the response PDU.
+        """
+        pMod = snmpapi.v2c
+        reqId = self._nextId
+        self._nextId = (self._nextId % 0x7fffffff) + 1
+        pMod.apiPDU.setRequestID(pdu, reqId)
+
+        msg = pMod.Message()
+        pMod.apiMessage.setDefaults(msg)
+        pMod.apiMessage.setCommunity(msg, community)
+        pMod.apiMessage.setPDU(msg, pdu)
+        data = berencoder.encode(msg)
+
+        d = defer.Deferred()
+        timer = self._clock.callLater(timeout, self._timeout, reqId, timeout)
+        self.pending[reqId] = [d, address, data, retries, timer]
+        self.transport.write(data, address)
+        return d
+
+    def _timeout(self, reqId, timeout):
+        request = self.pending.get(reqId)
+        if request is None:
+            return
+        d, address, data, retries, timer = request
+        if retries > 0:
+            request[3] = retries - 1
+            request[4] = self._clock.callLater(timeout, self._timeout, reqId, timeout)
+            self.transport.write(data, address)
+            return
+        del self.pending[reqId]
+        d.errback(SnmpReaderException('No SNMP response from %s:%s' % address))
+
+    def datagramReceived(self, data, address):
+        pMod = snmpapi.v2c
+        try:
+            msg, rest = berdecoder.decode(data, asn1Spec=pMod.Message())
+            pdu = pMod.apiMessage.getPDU(msg)
+            reqId = int(pMod.apiPDU.getRequestID(pdu))
+        except Exception, ex:
+            log.warn('Dropped undecodable SNMP datagram from %s: %s' % (str(address), str(ex)))
+            return
+
+        request = self.pending.get(reqId)
+        if request is None or request[1] != address:
+            log.debug('Dropped SNMP response %s from %s' % (reqId, str(address)))
+            return
+        del self.pending[reqId]
+        d, address, data, retries, timer = request
+        if timer.active():
+            timer.cancel()
+
+        errorStatus = pMod.apiPDU.getErrorStatus(pdu)
+        if errorStatus:
+            d.errback(SnmpReaderException('SNMP error %s at index %s from %s:%s' %
+                ((errorStatus.prettyPrint(), pMod.apiPDU.getErrorIndex(pdu)) + address)))
+        else:
+            d.callback(pdu)
+
+    def stopProtocol(self):
+        pending, self.pending = self.pending, {}
+        for d, address, data, retries, timer in pending.itervalues():
+            if timer.active():
+                timer.cancel()
+            d.errback(SnmpReaderException('SNMP port closed'))
+
+
+def listenSnmp(port=0, interface='', clock=reactor):
+    """
+    Opens a UDP port for sending SNMP requests
+    @retval the SnmpProtocol listening on it
+    """
+    proto = SnmpProtocol(clock)
+    reactor.listenUDP(port, proto, interface)
+    return proto
+
+
+
+class AsyncSnmpReader:
+    """
+    The non-blocking counterpart of SnmpReader.  Every method returns a
+    Deferred and the requests are sent from the reactor, so many agents can
+    be read at once.  The agent address is resolved once when the reader is
+    opened and every request goes out on the same SnmpProtocol, which may be
+    shared between readers.
+    """
+
+    def __init__(self, host, port, agentName, communityName, timeout=1.5, retries=3, maxRepetitions=25, protocol=None):
+        self.agentName = agentName
+        self.communityName = communityName
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.maxRepetitions = maxRepetitions
+        self.protocol = protocol
+        self.address = None
+        self._ownProtocol = False
+        self._supportsSNMP = False
+        self._supportsRfc2790 = False
+        self._supportsRfc1213 = False
+
+    @defer.inlineCallbacks
+    def open(self):
+        """
+        Resolves the agent address and checks which MIBs it supports.  Does
+        nothing if the reader is already open.
+        """
+        if self.address is not None:
+            return
+        if not PysnmpImported:
+            self.address = (self.host, self.port)
+            return
+
+        ip = yield reactor.resolve(self.host)
+        if self.protocol is None:
+            self.protocol = listenSnmp()
+            self._ownProtocol = True
+        self.address = (ip, self.port)
+        self._supportsSNMP = True
+        users, descr = yield self.getMany([Rfc2790Mib.hrSystemNumUsers, Rfc1213Mib.system_sysDescr])
+        self._supportsRfc2790 = users != None
+        self._supportsRfc1213 = descr != None
+        self._supportsSNMP = self._supportsRfc1213 or self._supportsRfc2790
+
+    def close(self):
+        """
+        Closes the UDP port, unless it was given to the reader
+        """
+        self.address = None
+        if self._ownProtocol and self.protocol.transport is not None:
+            self._ownProtocol = False
+            return self.protocol.transport.stopListening()
+
+    def supportsSNMP(self):
+        return self._supportsSNMP
+
+    def supportsRFC2790(self):
+        return self._supportsRfc2790
+
+    def supportsRFC1213(self):
+        return self._supportsRfc1213
+
+    def _send(self, pdu):
+        return self.protocol.send(self.address, self.communityName, pdu,
+                                  self.timeout, self.retries)
+
+    @defer.inlineCallbacks
+    def get(self, oid):
+        values = yield self.getMany([oid])
+        defer.returnValue(values[0])
+
+    @defer.inlineCallbacks
+    def getMany(self, oids):
+        """
+        Gets several values in one GET PDU
+        @retval list of values in the order of the oids, None for each
+        value the agent does not have
+        """
+        if not self._supportsSNMP:
+            defer.returnValue([None] * len(oids))
+
+        pMod = snmpapi.v2c
+        pdu = pMod.GetRequestPDU()
+        pMod.apiPDU.setDefaults(pdu)
+        pMod.apiPDU.setVarBinds(pdu, [(_toTuple(oid[0]), pMod.Null('')) for oid in oids])
+        response = yield self._send(pdu)
+        defer.returnValue([_snmpValue(val) for name, val in pMod.apiPDU.getVarBinds(response)])
+
+    @defer.inlineCallbacks
+    def walk(self, columns):
+        """
+        Walks the subtrees of several oids at once with GETBULK.  Each
+        request carries the next oid of every subtree still being walked.
+        @param columns tuple oids
+        @retval dict of tuple oid to the ASN.1 value
+        """
+        pMod = snmpapi.v2c
+        last = dict([(col, col) for col in columns])
+        walking = list(columns)
+        table = {}
+        while walking:
+            pdu = pMod.GetBulkRequestPDU()
+            pMod.apiBulkPDU.setDefaults(pdu)
+            pMod.apiBulkPDU.setNonRepeaters(pdu, 0)
+            pMod.apiBulkPDU.setMaxRepetitions(pdu, self.maxRepetitions)
+            pMod.apiBulkPDU.setVarBinds(pdu, [(last[col], pMod.Null('')) for col in walking])
+            response = yield self._send(pdu)
+            varBinds = pMod.apiBulkPDU.getVarBinds(response)
+            if not varBinds:
+                break
+
+            # The response holds up to maxRepetitions rows of one varbind
+            # for each column requested, in order
+            done = set()
+            width = len(walking)
+            for i, (name, val) in enumerate(varBinds):
+                col = walking[i % width]
+                if col in done:
+                    continue
+                name = tuple(name)
+                if name[:len(col)] != col or name <= last[col] or \
+                        val.tagSet in _SNMP_EXCEPTIONS:
+                    done.add(col)
+                    continue
+                table[name] = val
+                last[col] = name
+            walking = [col for col in walking if col not in done]
+        defer.returnValue(table)
+
+    @defer.inlineCallbacks
+    def getTable(self, tableOid, fields, includeId=False):
+        """
+        Gets a table in the same form as SnmpReader.getTable
+        """
+        if not self._supportsSNMP:
+            if includeId:
+                defer.returnValue({})
+            defer.returnValue([])
+
+        tuplefields = [_toTuple(field[0]) for field in fields]
+        table = yield self.walk(tuplefields)
+        defer.returnValue(_assembleTable(table, tuplefields, includeId))
+
+    @defer.inlineCallbacks
+    def stitchTables(self, tableOidList, fieldsList):
+        """
+        Stitches tables together like SnmpReader.stitchTables, walking them
+        at the same time
+        """
+        tables = yield gather([self.getTable(tableOidList[i], fieldsList[i], includeId=True)
+                                for i in range(len(tableOidList))])
+        defer.returnValue(_stitchTables(tables, fieldsList))
+
+
+
+class AsyncHostReader:
+    """
+    The non-blocking counterpart of HostReader.  The requests of every
+    subsystem asked for are in flight at the same time.
+    """
+
+    def __init__(self, host, port, agentName, communityName, timeout=1.5, retries=3, protocol=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.reader = AsyncSnmpReader(
+                                 host,
+                                 port,
+                                 agentName,
+                                 communityName,
+                                 timeout,
+                                 retries,
+                                 protocol=protocol
+                                 )
+
+    def open(self):
+        return self.reader.open()
+
+    def close(self):
+        return self.reader.close()
+
+    @defer.inlineCallbacks
+    def get(self, subsystem):
+        """
+        Produces the same dictionary as HostReader.get
+        @retval Deferred
+        """
+        yield self.reader.open()
+
+        keys = []
+        calls = []
+        if (subsystem in ['base','all']):
+            keys.append('base')
+            calls.append(self._getBase())
+        if (subsystem in ['network','all']):
+            keys.append('network')
+            calls.append(self._getTable(NETWORK_TABLE))
+        if (subsystem in ['storage','all']):
+            keys.append('storage')
+            calls.append(self._getTable(STORAGE_TABLE))
+        if (subsystem in ['cpu','all']):
+            keys.append('cpu')
+            calls.append(self._getProcesses())
+
+        values = yield gather(calls)
+        defer.returnValue(dict(zip(keys, values)))
+
+    @defer.inlineCallbacks
+    def _getBase(self):
+        values = yield self.reader.getMany([f for k, f in BASE_FIELDS])
+        defer.returnValue(_baseReport(self.reader, values))
+
+    @defer.inlineCallbacks
+    def _getTable(self, spec):
+        source, table, fields = spec
+        rows = yield self.reader.getTable(table, fields)
+        defer.returnValue(_tableReport(source, [fields], rows))
+
+    @defer.inlineCallbacks
+    def _getProcesses(self):
+        source, tables, fieldsList = PROCESS_TABLES
+        rows = yield self.reader.stitchTables(tables, fieldsList)
+        defer.returnValue(_tableReport(source, fieldsList, rows))
+
+
+def _withTimeout(d, timeout, what, clock=reactor):
+    """
+    @retval a Deferred with the result of d, or failing with an
+    SnmpReaderException if d has not fired after timeout seconds
+    """
+    result = defer.Deferred()
+    def _expired():
+        result.errback(SnmpReaderException('%s timed out after %s seconds' % (what, timeout)))
+    timer = clock.callLater(timeout, _expired)
+    def _done(value):
+        if timer.active():
+            timer.cancel()
+            result.callback(value)
+    d.addBoth(_done)
+    return result
+
+
+def pollHosts(readers, subsystem='all', timeout=5.0, concurrency=50, clock=reactor):
+    """
+    Samples many hosts at the same time.  Readers which are not open yet
+    are opened.  A host which is down or slow only costs its own timeout.
+    @param readers AsyncHostReaders, best sharing one SnmpProtocol
+    @param timeout seconds allowed for each host
+    @param concurrency most hosts sampled at once
+    @retval Deferred firing with a list of (success, report or Failure),
+    one for each reader in order
+    """
+    sem = defer.DeferredSemaphore(concurrency)
+    def _sample(reader):
+        what = 'Polling %s:%s' % (reader.reader.host, reader.reader.port)
+        return _withTimeout(reader.get(subsystem), timeout, what, clock)
+    return defer.DeferredList([sem.run(_sample, reader) for reader in readers],
+                              consumeErrors=True)
+
+
+
 # A note about OIDS
 # -----------------
 # The MIB OIDs quickly become a headache.  Should they be represented
@@ -559,3 +920,48 @@ class Rfc1213Mib:
     interfaces_ifTable_ifInErrors  = ('.1.3.6.1.2.1.2.2.1.14', 'IfInErrors')
     interfaces_ifTable_ifOutOctets = ('.1.3.6.1.2.1.2.2.1.16', 'IfOutOctets')
     interfaces_ifTable_ifOutErrors = ('.1.3.6.1.2.1.2.2.1.20', 'IfOutErrors')
+
+
+# The oids of each HostReader subsystem, shared by HostReader and
+# AsyncHostReader
+
+BASE_FIELDS = [
+    ('rfc1213_SystemDescr',    Rfc1213Mib.system_sysDescr),
+    ('rfc1213_SystemContact',  Rfc1213Mib.system_sysContact),
+    ('rfc1213_SystemName',     Rfc1213Mib.system_sysName),
+    ('rfc1213_SystemLocation', Rfc1213Mib.system_sysLocation),
+    ('rfc1213_UpTime',         Rfc1213Mib.system_sysUpTime),
+    ('rfc2790_UpTime',         Rfc2790Mib.hrSystemUptime)
+]
+
+NETWORK_TABLE = ('rfc1213_mib', Rfc1213Mib.interfaces_ifTable, [
+                    Rfc1213Mib.interfaces_ifTable_ifDescr,
+                    Rfc1213Mib.interfaces_ifTable_ifSpeed,
+                    Rfc1213Mib.interfaces_ifTable_ifInOctets,
+                    Rfc1213Mib.interfaces_ifTable_ifInErrors,
+                    Rfc1213Mib.interfaces_ifTable_ifOutOctets,
+                    Rfc1213Mib.interfaces_ifTable_ifOutErrors
+                 ])
+
+STORAGE_TABLE = ('rfc2790_mib', Rfc2790Mib.hrStorageTable, [
+                    Rfc2790Mib.hrStorageDescr,
+                    Rfc2790Mib.hrStorageAllocationUnits,
+                    Rfc2790Mib.hrStorageSize,
+                    Rfc2790Mib.hrStorageUsed,
+                    Rfc2790Mib.hrStorageAllocationFailures
+                ])
+
+PROCESS_TABLES = ('rfc1213_mib',
+                  [Rfc2790Mib.hrSWRunTable, Rfc2790Mib.hrSWRunPerfTable],
+                  [[
+                    Rfc2790Mib.hrSWRunIndex,
+                    Rfc2790Mib.hrSWRunName,
+                    Rfc2790Mib.hrSWRunID,
+                    Rfc2790Mib.hrSWRunPath,
+                    Rfc2790Mib.hrSWRunParameters,
+                    Rfc2790Mib.hrSWRunType,
+                    Rfc2790Mib.hrSWRunStatus
+                   ], [
+                    Rfc2790Mib.hrSWRunPerfCPU,
+                    Rfc2790Mib.hrSWRunPerfMem
+                  ]])
@@ -9,8 +9,19 @@
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 
+from twisted.internet import defer, protocol, reactor
+from twisted.trial import unittest
+
 from ion.test.iontest import IonTestCase
-from ion.services.coi.hostsensor.readers import HostReader
+from ion.services.coi.hostsensor.readers import HostReader, AsyncHostReader, \
+    AsyncSnmpReader, SnmpReaderException, Rfc1213Mib, Rfc2790Mib, \
+    PROCESS_TABLES, PysnmpImported, listenSnmp, pollHosts
+
+try:
+    from pysnmp.proto.api import v2c as pMod
+    from pyasn1.codec.ber import encoder, decoder
+except ImportError:
+    pass
 
 
 class HostStatusTest(IonTestCase):
@@ -40,3 +51,139 @@ class HostStatusTest(IonTestCase):
         log.debug(report)
         #status = reader.pprint(report)
         #log.debug(status)
+
+
+class FakeAgent(protocol.DatagramProtocol):
+    """
+    Answers SNMPv2c GET and GETBULK requests from a dict of oid to value
+    """
+    def __init__(self, mib, answer=True):
+        self.oids = sorted(mib.keys())
+        self.mib = mib
+        self.answer = answer
+        self.requests = []
+
+    def _next(self, oid):
+        for name in self.oids:
+            if name > oid:
+                return name, self.mib[name]
+        return oid, pMod.EndOfMibView('')
+
+    def datagramReceived(self, data, address):
+        msg, rest = decoder.decode(data, asn1Spec=pMod.Message())
+        pdu = pMod.apiMessage.getPDU(msg)
+        self.requests.append(pdu.__class__.__name__)
+        if not self.answer:
+            return
+
+        varBinds = []
+        if pdu.tagSet == pMod.GetRequestPDU.tagSet:
+            for name, val in pMod.apiPDU.getVarBinds(pdu):
+                name = tuple(name)
+                varBinds.append((name, self.mib.get(name, pMod.NoSuchObject(''))))
+        else:
+            cursors = [tuple(name) for name, val in pMod.apiBulkPDU.getVarBinds(pdu)]
+            for r in range(pMod.apiBulkPDU.getMaxRepetitions(pdu)):
+                for i, cursor in enumerate(cursors):
+                    cursors[i], val = self._next(cursor)
+                    varBinds.append((cursors[i], val))
+
+        response = pMod.apiPDU.getResponse(pdu)
+        pMod.apiPDU.setVarBinds(response, varBinds)
+        pMod.apiMessage.setPDU(msg, response)
+        self.transport.write(encoder.encode(msg), address)
+
+
+def _oid(field, *index):
+    return tuple([int(dec) for dec in field[0][1:].split('.')]) + index
+
+
+class AsyncHostReaderTest(unittest.TestCase):
+
+    if not PysnmpImported:
+        skip = 'pysnmp is not installed'
+
+    def setUp(self):
+        mib = {_oid(Rfc1213Mib.system_sysDescr): pMod.OctetString('Fake host'),
+               _oid(Rfc1213Mib.system_sysUpTime): pMod.TimeTicks(1234),
+               _oid(Rfc2790Mib.hrSystemNumUsers): pMod.Integer(2)}
+        for i in (1, 2, 5):
+            mib[_oid(Rfc1213Mib.interfaces_ifTable_ifDescr, i)] = pMod.OctetString('eth%d' % i)
+            mib[_oid(Rfc1213Mib.interfaces_ifTable_ifSpeed, i)] = pMod.Gauge32(1000 * i)
+        for i in (10, 11):
+            mib[_oid(Rfc2790Mib.hrSWRunName, i)] = pMod.OctetString('proc%d' % i)
+        mib[_oid(Rfc2790Mib.hrSWRunPerfMem, 11)] = pMod.Integer(64)
+        mib[_oid(Rfc2790Mib.hrSWRunPerfMem, 12)] = pMod.Integer(32)
+
+        self.agent = FakeAgent(mib)
+        self.agentPort = reactor.listenUDP(0, self.agent, interface='127.0.0.1')
+        self.silent = FakeAgent({}, answer=False)
+        self.silentPort = reactor.listenUDP(0, self.silent, interface='127.0.0.1')
+        self.snmp = listenSnmp(interface='127.0.0.1')
+        self.reader = self._reader(self.agentPort, maxRepetitions=2)
+
+    def tearDown(self):
+        self.snmp.transport.stopListening()
+        self.agentPort.stopListening()
+        self.silentPort.stopListening()
+
+    def _reader(self, port, **kwargs):
+        return AsyncSnmpReader('127.0.0.1', port.getHost().port, 'agent',
+                               'public', timeout=0.2, retries=0,
+                               protocol=self.snmp, **kwargs)
+
+    @defer.inlineCallbacks
+    def test_getMany(self):
+        yield self.reader.open()
+        self.assertTrue(self.reader.supportsRFC1213())
+        self.assertTrue(self.reader.supportsRFC2790())
+
+        del self.agent.requests[:]
+        values = yield self.reader.getMany([Rfc1213Mib.system_sysDescr,
+                                            Rfc1213Mib.system_sysContact,
+                                            Rfc1213Mib.system_sysUpTime])
+        self.assertEqual(values, ['Fake host', None, 1234])
+        self.assertEqual(self.agent.requests, ['GetRequestPDU'])
+
+    @defer.inlineCallbacks
+    def test_getTable(self):
+        yield self.reader.open()
+        del self.agent.requests[:]
+        rows = yield self.reader.getTable(Rfc1213Mib.interfaces_ifTable,
+                                          [Rfc1213Mib.interfaces_ifTable_ifDescr,
+                                           Rfc1213Mib.interfaces_ifTable_ifSpeed])
+        self.assertEqual(rows, [['eth1', 1000], ['eth2', 2000], ['eth5', 5000]])
+        # Both columns together, two rows per request
+        self.assertEqual(self.agent.requests, ['GetBulkRequestPDU'] * 2)
+
+        rows = yield self.reader.stitchTables(PROCESS_TABLES[1], PROCESS_TABLES[2])
+        names = [(row[1], row[-1]) for row in rows]
+        self.assertEqual(sorted(names), [(None, 32), ('proc10', None), ('proc11', 64)])
+
+    @defer.inlineCallbacks
+    def test_hostReader(self):
+        host = AsyncHostReader('127.0.0.1', self.agentPort.getHost().port,
+                               'agent', 'public', timeout=0.2, retries=0,
+                               protocol=self.snmp)
+        report = yield host.get('all')
+        self.assertEqual(sorted(report.keys()), ['base', 'cpu', 'network', 'storage'])
+        self.assertEqual(report['base']['rfc1213_SystemDescr'], 'Fake host')
+        self.assertTrue(report['base']['SupportsSNMP'])
+        self.assertEqual(len(report['network']['rows']), 3)
+        self.assertEqual(report['storage']['rows'], [])
+        self.assertEqual(len(report['cpu']['cols']), 9)
+
+    @defer.inlineCallbacks
+    def test_pollHosts(self):
+        readers = [AsyncHostReader('127.0.0.1', port.getHost().port, 'agent',
+                                   'public', timeout=0.2, retries=1,
+                                   protocol=self.snmp)
+                   for port in (self.agentPort, self.silentPort)]
+        results = yield pollHosts(readers, 'base', timeout=2.0)
+        self.assertEqual(results[0][0], True)
+        self.assertEqual(results[0][1]['base']['rfc1213_UpTime'], 1234)
+        self.assertEqual(results[1][0], False)
+        results[1][1].trap(SnmpReaderException)
+        # The silent agent was asked once and then once more
+        self.assertEqual(len(self.silent.requests), 2)
+        self.assertEqual(self.snmp.pending, {})
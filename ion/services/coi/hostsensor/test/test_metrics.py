@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""
+@file ion/services/coi/hostsensor/test/test_metrics.py
+@author agent
+@brief test the host metrics sampler and its records
+"""
+
+try:
+    import json
+except:
+    import simplejson as json
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from ion.services.coi.hostsensor.metrics import HostMetricsSampler, \
+    HostMetricsPublisher, applyRecord
+
+
+NETWORK_COLS = ['IfDescr', 'IfSpeed', 'IfInOctets', 'IfInErrors', 'IfOutOctets', 'IfOutErrors']
+CPU_COLS = ['SWRunIndex', 'SWRunName', 'SWRunPerfCPU']
+
+
+class FakeReader:
+    """
+    Stands in for a HostReader, returning the reports it is given in turn
+    """
+    def __init__(self, reports):
+        self.reports = list(reports)
+        self.host = 'fakehost'
+        self.reader = self
+
+    def get(self, subsystem):
+        report = self.reports.pop(0)
+        if isinstance(report, Exception):
+            raise report
+        return report
+
+
+def _report(uptime, network, cpu):
+    return {'base':{'rfc1213_UpTime':uptime, 'rfc1213_SystemName':'fake',
+                    'LocalTime':str(uptime)},
+            'network':{'source':'rfc1213_mib', 'cols':NETWORK_COLS, 'rows':network},
+            'cpu':{'source':'rfc1213_mib', 'cols':CPU_COLS, 'rows':cpu}}
+
+
+REPORTS = [
+    _report(100,
+            [['eth0', 1000, 5000, 0, 100, 0], ['lo', 10, 50, 0, 50, 0]],
+            [[1, 'init', 10], [42, 'python', 500]]),
+    # eth0 moves, lo is idle, python uses half a CPU, a process starts
+    _report(110,
+            [['eth0', 1000, 25000, 0, 1100, 0], ['lo', 10, 50, 0, 50, 0]],
+            [[1, 'init', 10], [42, 'python', 1000], [77, 'sh', 0]]),
+    # eth0 in counter wraps, python exits
+    _report(120,
+            [['eth0', 1000, 4000, 0, 1100, 0], ['lo', 10, 50, 0, 50, 0]],
+            [[1, 'init', 10], [77, 'sh', 0]]),
+]
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class HostMetricsSamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sampler = HostMetricsSampler(FakeReader(REPORTS), clock=self.clock)
+
+    @defer.inlineCallbacks
+    def _samples(self, count):
+        records = []
+        for i in range(count):
+            record = yield self.sampler.sample()
+            records.append(record)
+            self.clock.now += 10
+        defer.returnValue(records)
+
+    def _rows(self, table):
+        return dict([(key, [column[i] for column in table['values']])
+                     for i, key in enumerate(table['keys'])])
+
+    @defer.inlineCallbacks
+    def test_deltas(self):
+        first, second, third = yield self._samples(3)
+
+        self.assertTrue(first['full'])
+        self.assertEqual(first['host'], 'fakehost')
+        self.assertEqual(sorted(first['base'].keys()), ['rfc1213_SystemName', 'rfc1213_UpTime'])
+        network = first['tables']['network']
+        self.assertEqual(network['cols'], NETWORK_COLS + ['IfInBytesPerSec', 'IfOutBytesPerSec'])
+        self.assertEqual(network['keys'], ['eth0', 'lo'])
+        self.assertEqual(network['values'][-1], [None, None])
+
+        self.assertFalse(second['full'])
+        self.assertEqual(second['base'], {'rfc1213_UpTime':110})
+        network = self._rows(second['tables']['network'])
+        self.assertEqual(network['eth0'][-2:], [2000.0, 100.0])
+        # The rates of lo are known from the second sample on
+        self.assertEqual(network['lo'][-2:], [0.0, 0.0])
+        cpu = self._rows(second['tables']['cpu'])
+        self.assertEqual(sorted(cpu.keys()), [1, 42, 77])
+        self.assertEqual(cpu[1][-1], 0.0)
+        self.assertEqual(cpu[42][-1], 50.0)
+        self.assertEqual(cpu[77][-1], None)
+
+        network = self._rows(third['tables']['network'])
+        # lo did not change, so it is left out
+        self.assertEqual(network.keys(), ['eth0'])
+        self.assertEqual(network['eth0'][-2:], [(2 ** 32 - 21000) / 10.0, 0.0])
+        # sh gets its first rate, init is unchanged
+        self.assertEqual(third['tables']['cpu']['keys'], [77])
+        self.assertEqual(third['tables']['cpu']['removed'], [42])
+
+    @defer.inlineCallbacks
+    def test_applyRecord(self):
+        records = yield self._samples(3)
+        state = {}
+        for record in records:
+            # What a subscriber receives
+            state = applyRecord(state, json.loads(json.dumps(record)))
+
+        self.assertEqual(state['base']['rfc1213_UpTime'], 120)
+        self.assertEqual(sorted(state['tables']['network']['rows'].keys()), ['eth0', 'lo'])
+        self.assertEqual(state['tables']['network']['rows']['lo'][:6], REPORTS[2]['network']['rows'][1])
+        self.assertEqual(sorted(state['tables']['cpu']['rows'].keys()), [1, 77])
+
+    @defer.inlineCallbacks
+    def test_keyframe(self):
+        self.sampler.keyframeInterval = 2
+        records = yield self._samples(3)
+        self.assertEqual([r['full'] for r in records], [True, False, True])
+        self.assertEqual(records[2]['tables']['network']['keys'], ['eth0', 'lo'])
+        self.assertEqual(records[2]['tables']['cpu']['removed'], [])
+
+
+class FakePublisher:
+    def __init__(self):
+        self.sent = []
+
+    def publish(self, topic, data):
+        self.sent.append((topic, json.loads(data)))
+        return defer.succeed(None)
+
+
+class HostMetricsPublisherTest(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def test_publish(self):
+        reports = [REPORTS[0], Exception('agent went away'), REPORTS[1]]
+        sampler = HostMetricsSampler(FakeReader(reports), clock=FakeClock())
+        publisher = FakePublisher()
+        metrics = HostMetricsPublisher(sampler, publisher, 'host.metrics')
+
+        for i in range(3):
+            yield metrics.publishSample()
+        self.assertEqual((metrics.published, metrics.failed), (2, 1))
+        self.assertEqual([topic for topic, record in publisher.sent], ['host.metrics'] * 2)
+        # The sampler starts over after a failure
+        self.assertTrue(publisher.sent[1][1]['full'])
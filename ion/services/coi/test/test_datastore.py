@@ -118,6 +118,68 @@ class DataStoreTest(IonTestCase):
 
         self.assertNotEqual(response, proc_ds1.ION_SUCCESS)
         
+    @defer.inlineCallbacks
+    def test_push_whole_repository(self):
+        # A push in a single message, as sent by processes which do not
+        # ask for the heads first
+
+        child_ds1 = yield self.sup.get_child_id('ds1')
+        proc_ds1 = self._get_procinstance(child_ds1)
+        
+        child_ds2 = yield self.sup.get_child_id('ds2')
+        proc_ds2 = self._get_procinstance(child_ds2)
+
+        repo, ab = proc_ds1.workbench.init_repository(addresslink_type,'addressbook')
+        p = repo.create_object(person_type)
+        p.name='David'
+        ab.owner = p
+        repo.commit()
+
+        response, ex = yield proc_ds1.push('ps2','addressbook', delta=False)
+        self.assertEqual(response, proc_ds1.ION_SUCCESS)
+
+        p.name='Changed'
+        repo.commit()
+
+        response, ex = yield proc_ds1.push('ps2','addressbook', delta=False)
+        self.assertEqual(response, proc_ds1.ION_SUCCESS)
+
+        repo_ds2 = proc_ds2.workbench.get_repository(repo.repository_key)
+        self.assertEqual(repo_ds2._dotgit, repo._dotgit)
+        self.assertEqual(repo_ds2.checkout('master').owner.name, 'Changed')
+        
+    @defer.inlineCallbacks
+    def test_pull_old_peer(self):
+        # A peer which only knows the pull by repository name
+
+        child_ds1 = yield self.sup.get_child_id('ds1')
+        proc_ds1 = self._get_procinstance(child_ds1)
+        
+        child_ds2 = yield self.sup.get_child_id('ds2')
+        proc_ds2 = self._get_procinstance(child_ds2)
+
+        @defer.inlineCallbacks
+        def old_op_pull(content, headers, msg):
+            repo = proc_ds1.workbench.get_repository(content)
+            if repo:
+                yield proc_ds1.reply(msg,content=repo)
+            else:
+                yield proc_ds1.reply(msg,response_code=proc_ds1.APP_RESOURCE_NOT_FOUND)
+        proc_ds1.op_pull = old_op_pull
+
+        repo, ab = proc_ds1.workbench.init_repository(addresslink_type,'addressbook')
+        p = repo.create_object(person_type)
+        p.name='David'
+        ab.owner = p
+        repo.commit()
+
+        response, ex = yield proc_ds2.pull('ps1','addressbook', delta=False)
+        self.assertEqual(response, proc_ds1.ION_SUCCESS)
+
+        repo_ds2 = proc_ds2.workbench.get_repository(repo.repository_key)
+        self.assertEqual(repo_ds2._dotgit, repo._dotgit)
+        self.assertEqual(repo_ds2.checkout('master').owner.name, 'David')
+        
     @defer.inlineCallbacks
     def test_merge_push(self):
             
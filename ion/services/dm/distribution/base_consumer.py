@@ -11,6 +11,7 @@ import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
 
 import time
+from collections import deque
 
 from twisted.internet import defer
 from twisted.internet.task import LoopingCall
@@ -20,21 +21,32 @@ from twisted.internet import reactor
 #from ion.core.cc.container import Container
 from ion.core.messaging.receiver import Receiver, FanoutReceiver
 
+from ion.core import ioninit
 from ion.core.process.process import Process, ProcessDesc
 import ion.util.procutils as pu
 
 from ion.data import dataobject
+from ion.services.dm.distribution import windows
 from ion.resources.dm_resource_descriptions import PubSubTopicResource, \
     DataMessageObject, StringMessageObject, DictionaryMessageObject
 
+CONF = ioninit.config(__name__)
+
 
 class BaseConsumer(Process):
     '''
     @brief This is the base class from which all consumer processes should inherit.
     All tranformaitons and data presentation methods should inherit for this
     and implement the ondata method to perform the desired task.
+
+    In digest mode ('delivery interval' set) the data received on each queue
+    is summarized in tumbling windows of one delivery interval, with the
+    reducers in digest_reducers (a count by default). A digest runs when a
+    window holding data ends and passes the ended windows to onschedule.
     '''
 
+    digest_reducers = None
+
     @defer.inlineCallbacks
     def plc_init(self):
         p = self.spawn_args.get('process parameters',{})
@@ -52,7 +64,10 @@ class BaseConsumer(Process):
         if self.delivery_interval:
             assert isinstance(self.delivery_interval, (int,float)), 'delivery interval must be a float or a integer'
         self.last_delivered = None
-        self.interval_cnt = {}
+        self.interval_windows = None
+        if self.delivery_interval:
+            self.interval_windows = windows.TumblingWindows(
+                self.delivery_interval, self.digest_reducers)
         self.loop = None
         #if self.delivery_interval:
         #    self.loop = LoopingCall(self.digest)
@@ -61,10 +76,17 @@ class BaseConsumer(Process):
 
         self.receive_cnt = {}
         #self.received_msg = []
-        self.msgs_to_send = []
+        self.msgs_to_send = deque()
         self.send_cnt = {}
         self.dataReceivers = {}
 
+        # Sends in flight are bounded. When they are all taken, op_data
+        # waits for one before it handles more data.
+        max_sends = self.spawn_args.get('max sends in flight',
+                                        CONF.getValue('max_sends_in_flight', 20))
+        self.send_limit = defer.DeferredSemaphore(int(max_sends))
+        self.start_time = pu.currenttime()
+
         queuenames = self.spawn_args.get('attach',None)
         if queuenames:
 
@@ -213,7 +235,22 @@ class BaseConsumer(Process):
         '''
         log.info(self.__class__.__name__ +'; Calling Get Msg Count;')
 
-        yield self.reply_ok(msg,{'received':self.receive_cnt,'sent':self.send_cnt})
+        yield self.reply_ok(msg, self.msg_stats())
+
+    def msg_stats(self):
+        """
+        @retval dict of message counts per queue, overall rates in messages
+        per second, and the number of messages waiting to be sent or in flight
+        """
+        elapsed = max(pu.currenttime() - self.start_time, 1e-6)
+        in_flight = self.send_limit.limit - self.send_limit.tokens
+        return {'received':self.receive_cnt,
+                'sent':self.send_cnt,
+                'receive_rate':sum(self.receive_cnt.values()) / elapsed,
+                'send_rate':sum(self.send_cnt.values()) / elapsed,
+                'queued':len(self.msgs_to_send),
+                'in_flight':in_flight,
+                'waiting':len(self.send_limit.waiting)}
 
     @defer.inlineCallbacks
     def op_data(self, content, headers, msg):
@@ -228,6 +265,11 @@ class BaseConsumer(Process):
         self.receive_cnt[headers.get('receiver')] += 1
         #self.received_msg.append(content) # Do not keep the messages!
 
+        # Back pressure - wait while the sends in flight are at their limit
+        if self.send_limit.tokens == 0:
+            yield self.send_limit.acquire()
+            self.send_limit.release()
+
         # Unpack the message and turn it into data
         datamessage = dataobject.DataObject.decode(content)
         if isinstance(datamessage, (StringMessageObject, DictionaryMessageObject)):
@@ -256,35 +298,20 @@ class BaseConsumer(Process):
 
         else: # Do the digets thing...
 
-            if self.interval_cnt.has_key(headers.get('receiver')):
-                self.interval_cnt[headers.get('receiver')] += 1
-            else:
-                self.interval_cnt[headers.get('receiver')] = 1
-
+            now = pu.currenttime()
+            self.interval_windows.add(headers.get('receiver'), data, now)
 
             log.debug(self.__class__.__name__ +"; op_data: digest state: \n" + \
                           "Last Delivered: " +str(self.last_delivered) +";\n" +\
                           "Loop Running: " +str(self.loop_running))
 
-            # First time data has arrived?
-            if self.last_delivered == None:
-                self.last_delivered = pu.currenttime()
-
+            # Digest when the window of this data ends
             if not self.loop_running:
-
-                # Is it already time to go?
-                if self.last_delivered + self.delivery_interval <= pu.currenttime():
-                    yield self.digest()
-
-                # if data has arrived but it is not yet time to deliver, schedule a call back
-                else:
-                    self.loop_running = True
-                    delta_t = self.last_delivered + self.delivery_interval - pu.currenttime()
-                    log.debug('Scheduling a call back in %s seconds' % delta_t)
-                    #self.loop.start(delta_t)
-                    reactor.callLater(delta_t, self.digest)
-
-                    #IReactorTime.callLater(delta_t, self.digest)
+                self.loop_running = True
+                end = self.interval_windows.end(now)
+                delta_t = max(0, end - now)
+                log.debug('Scheduling a call back in %s seconds' % delta_t)
+                reactor.callLater(delta_t, self.digest, end)
 
 
 
@@ -295,7 +322,10 @@ class BaseConsumer(Process):
         raise NotImplementedError, "BaseConsumer class does not implement ondata"
 
     @defer.inlineCallbacks
-    def digest(self):
+    def digest(self, end=None):
+        """
+        @param end time the digested windows end by, defaults to now
+        """
 
         log.info(self.__class__.__name__ +"; Digesting results!")
 
@@ -306,18 +336,21 @@ class BaseConsumer(Process):
 
         args = dict(self.params)
         args.update(self.deliver)
+        args['intervals'] = self.interval_windows.close(end)
 
         yield defer.maybeDeferred(self.onschedule, **args)
 
         yield self.deliver_messages()
         # Update last_delivered
-        self.interval_cnt={} # Reset the interval receive count
         self.last_delivered = pu.currenttime()
         log.info(self.__class__.__name__ +"; digest: Finished sending results")
 
-    def onschedule(self, intrval_cnt, **kwargs):
+    def onschedule(self, intervals, **kwargs):
         """
         Override this method
+        @param intervals list of (start, end, {queue: results}) for the
+        windows which ended since the last digest, oldest first. The results
+        are those of the digest_reducers.
         """
         raise NotImplementedError, "BaseConsumer class does not implement onschedule"
 
@@ -346,15 +379,46 @@ class BaseConsumer(Process):
 
     @defer.inlineCallbacks
     def deliver_messages(self):
+        """
+        Send the queued results, grouped by destination queue in the order
+        each queue first appears. Sends are pipelined with at most
+        send_limit in flight; the messages to each queue go out in order.
+        """
         # Send data only when the process is complete!
-        if self.msgs_to_send:
-            while len(self.msgs_to_send) > 0:
-                queue, msg = self.msgs_to_send.pop(0)
-                yield self.send(queue, 'data', msg)
-                if self.send_cnt.has_key(queue):
-                    self.send_cnt[queue] += 1
-                else:
-                    self.send_cnt[queue] = 1
+        if not self.msgs_to_send:
+            return
+
+        batches = {}
+        order = []
+        while self.msgs_to_send:
+            queue, msg = self.msgs_to_send.popleft()
+            batch = batches.get(queue)
+            if batch is None:
+                batch = batches[queue] = []
+                order.append(queue)
+            batch.append(msg)
+
+        sends = []
+        for queue in order:
+            for msg in batches[queue]:
+                yield self.send_limit.acquire()
+                d = defer.maybeDeferred(self.send, queue, 'data', msg)
+                d.addCallback(self._sent, queue)
+                d.addBoth(self._release_send)
+                sends.append(d)
+
+        results = yield defer.DeferredList(sends, consumeErrors=True)
+        for success, result in results:
+            if not success:
+                result.raiseException()
+
+    def _sent(self, result, queue):
+        self.send_cnt[queue] = self.send_cnt.get(queue, 0) + 1
+        return result
+
+    def _release_send(self, result):
+        self.send_limit.release()
+        return result
 
 class ConsumerDesc(ProcessDesc):
     '''
@@ -19,7 +19,7 @@ class LatestConsumer(base_consumer.BaseConsumer):
     def ondata(self, data, notification, timestamp, queues=[]):
         
         # Wipe the list of messages to send then add the latest ones
-        self.msgs_to_send=[]
+        self.msgs_to_send.clear()
         
         # Queue new messages to send
         if not hasattr(queues,'__iter__'):
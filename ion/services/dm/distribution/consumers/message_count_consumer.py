@@ -127,7 +127,7 @@ class MessageCountConsumer(base_consumer.BaseConsumer):
             raise RuntimeError('MessageCountConsumer must be called with a delivery interval')
         
     
-    def onschedule(self, queue='', max_points=50, **kwargs):
+    def onschedule(self, intervals=(), queue='', max_points=50, **kwargs):
         '''
         This method is called when it is time to actually send the results
         in this case it is not needed, but must be over-riden...
@@ -139,9 +139,10 @@ class MessageCountConsumer(base_consumer.BaseConsumer):
             total += v
         
         # Count the messages this interval
-        interval = 0 
-        for k,v in self.interval_cnt.items():
-            interval += v
+        interval = 0
+        for start, end, results in intervals:
+            for k,v in results.items():
+                interval += v['count']
             
             
         notification = '''Message Counter has received %s messages, %s since last report''' \
@@ -47,7 +47,7 @@ class TestForwardingConsumer(IonTestCase):
     def test_no_queues(self):
         self.fc.ondata(self.dictdata, self.notification, self.timestamp)
 
-        self.assertEqual(self.fc.msgs_to_send,[])
+        self.assertEqual(list(self.fc.msgs_to_send),[])
 
     def test_dict_queues1(self):
         self.fc.ondata(self.dictdata, self.notification, self.timestamp,queues=self.queues1)
@@ -64,3 +64,64 @@ class TestForwardingConsumer(IonTestCase):
     def test_strdata(self):
         self.fc.ondata(self.strdata, self.notification, self.timestamp,queues=self.queues1)
         self.assertEqual(len(self.fc.msgs_to_send),1)
+
+
+class TestDeliverMessages(unittest.TestCase):
+    '''
+    @brief Test the pipelined delivery of queued messages, with a send that
+    completes only when the test says so.
+    '''
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.fc = forwarding_consumer.ForwardingConsumer(spawnargs={'max sends in flight':2})
+        yield self.fc.plc_init()
+        self.sent = []
+        self.fc.send = self._send
+
+    def _send(self, queue, operation, msg):
+        d = defer.Deferred()
+        self.sent.append((queue, msg, d))
+        return d
+
+    def _complete(self):
+        for queue, msg, d in self.sent:
+            if not d.called:
+                d.callback(None)
+
+    def test_grouped_and_bounded(self):
+        for queue, msg in (('a',1), ('b',1), ('a',2), ('b',2), ('a',3)):
+            self.fc.msgs_to_send.append((queue, msg))
+
+        done = self.fc.deliver_messages()
+        self.assertEqual(len(self.fc.msgs_to_send), 0)
+        self.assertEqual([(q, m) for q, m, d in self.sent], [('a',1), ('a',2)])
+
+        stats = self.fc.msg_stats()
+        self.assertEqual(stats['in_flight'], 2)
+        self.assertEqual(stats['sent'], {})
+
+        self.sent[0][2].callback(None)
+        self.assertEqual([(q, m) for q, m, d in self.sent],
+                         [('a',1), ('a',2), ('a',3)])
+        self._complete()
+        self._complete()
+        self.assertEqual([(q, m) for q, m, d in self.sent],
+                         [('a',1), ('a',2), ('a',3), ('b',1), ('b',2)])
+
+        self.assertTrue(done.called)
+        stats = self.fc.msg_stats()
+        self.assertEqual(stats['sent'], {'a':3, 'b':2})
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['queued'], 0)
+        return done
+
+    def test_send_failure(self):
+        self.fc.msgs_to_send.append(('a', 1))
+        self.fc.msgs_to_send.append(('a', 2))
+        done = self.fc.deliver_messages()
+        self.sent[0][2].errback(RuntimeError('no route'))
+        self.sent[1][2].callback(None)
+
+        self.assertEqual(self.fc.send_cnt, {'a':1})
+        self.assertEqual(self.fc.msg_stats()['in_flight'], 0)
+        return self.assertFailure(done, RuntimeError)
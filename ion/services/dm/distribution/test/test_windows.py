@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""
+@file ion/services/dm/distribution/test/test_windows.py
+@author agent
+@brief test cases for the windowed aggregation of consumer data
+"""
+
+from twisted.trial import unittest
+
+from ion.services.dm.distribution.windows import TumblingWindows, \
+    SlidingWindows, CountReducer, RateReducer, MinReducer, MaxReducer, \
+    MeanReducer, LastNReducer, last_n
+
+
+class FakeClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+STATS = {'count':CountReducer, 'min':MinReducer, 'max':MaxReducer,
+         'mean':MeanReducer, 'rate':RateReducer, 'last':last_n(2)}
+
+
+class ReducerTest(unittest.TestCase):
+
+    def test_merge(self):
+        for factory, values, expected in ((CountReducer, [1, 2, 3], 3),
+                                          (MinReducer, [4, 2, 7], 2),
+                                          (MaxReducer, [4, 9, 7], 9),
+                                          (MeanReducer, [1, 2, 6], 3.0),
+                                          (last_n(2), [1, 2, 3], [2, 3])):
+            whole = factory()
+            first = factory()
+            second = factory()
+            for i, value in enumerate(values):
+                whole.add(value, i)
+                if i < 2:
+                    first.add(value, i)
+                else:
+                    second.add(value, i)
+            first.merge(second)
+            self.assertEqual(whole.result(10), expected)
+            self.assertEqual(first.result(10), expected)
+
+    def test_empty(self):
+        self.assertEqual(MeanReducer().result(10), None)
+        self.assertEqual(MinReducer().result(10), None)
+        self.assertEqual(RateReducer().result(0), 0.0)
+        self.assertRaises(ValueError, LastNReducer, 0)
+
+
+class TumblingWindowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.windows = TumblingWindows(10, STATS, clock=self.clock)
+
+    def test_windows(self):
+        for value in (3, 1, 5):
+            self.windows.add('q1', value)
+            self.clock.now += 1
+        self.windows.add('q2', 7)
+
+        current = self.windows.current()
+        self.assertEqual(current['q1'], {'count':3, 'min':1, 'max':5,
+                                         'mean':3.0, 'rate':0.3, 'last':[1, 5]})
+        self.assertEqual(current['q2']['count'], 1)
+        self.assertEqual(self.windows.close(), [])
+
+        self.clock.now = 1012
+        self.windows.add('q1', 10)
+        self.assertEqual(self.windows.current('q1')['last'], [10])
+
+        closed = self.windows.close()
+        self.assertEqual(len(closed), 1)
+        start, end, results = closed[0]
+        self.assertEqual((start, end), (1000, 1010))
+        self.assertEqual(sorted(results.keys()), ['q1', 'q2'])
+        self.assertEqual(results['q1']['count'], 3)
+
+        # q2 has no open window, so it holds no state
+        self.assertEqual(self.windows.keys(), ['q1'])
+
+        # too late for the closed window
+        self.windows.add('q1', 1, timestamp=1005)
+        self.assertEqual(self.windows.late, 1)
+
+        flushed = self.windows.flush()
+        self.assertEqual([(s, e, r['q1']['count']) for s, e, r in flushed],
+                         [(1010, 1020, 1)])
+        self.assertEqual(len(self.windows), 0)
+
+    def test_end(self):
+        # the clock starts at 1000
+        self.assertEqual(self.windows.end(), 1010)
+        self.assertEqual(self.windows.end(1009.5), 1010)
+        self.assertEqual(self.windows.end(1010), 1020)
+
+        self.windows.add('q1', 1)
+        self.assertEqual(self.windows.close(self.windows.end() - 1), [])
+        closed = self.windows.close(self.windows.end())
+        self.assertEqual([(s, e) for s, e, r in closed], [(1000, 1010)])
+
+    def test_state_bounded(self):
+        for i in range(1000):
+            self.windows.add('q1', i)
+        panes = self.windows._panes['q1']
+        self.assertEqual(len(panes), 1)
+        self.assertEqual(len(panes[0].reducers['last'].values), 2)
+        self.assertEqual(self.windows.current('q1')['count'], 1000)
+
+
+class SlidingWindowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.windows = SlidingWindows(30, 10,
+                                      {'count':CountReducer, 'max':MaxReducer},
+                                      clock=self.clock)
+
+    def test_slide(self):
+        for i in range(60):
+            self.windows.add('q1', i)
+            self.clock.now += 1
+            # never more panes than fit in a window
+            self.assertTrue(len(self.windows._panes['q1']) <= 3)
+
+        # now is 1060: the window is the panes from 1040 to 1060
+        self.assertEqual(self.windows.summary('q1'), {'count':20, 'max':59})
+        self.assertEqual(self.windows.summary('q1', now=1059),
+                         {'count':30, 'max':59})
+
+        self.clock.now = 1100
+        self.assertEqual(self.windows.summary('q1'), None)
+        self.assertEqual(self.windows.summary(), {})
+        self.assertEqual(len(self.windows), 0)
+
+    def test_out_of_order(self):
+        self.windows.add('q1', 5, timestamp=1025)
+        self.windows.add('q1', 9, timestamp=1005)
+        self.windows.add('q1', 2, timestamp=1015)
+        self.assertEqual([p.start for p in self.windows._panes['q1']],
+                         [1000, 1010, 1020])
+        self.assertEqual(self.windows.summary('q1', now=1025),
+                         {'count':3, 'max':9})
+
+        self.windows.add('q1', 1, timestamp=1045)
+        self.windows.add('q1', 100, timestamp=1005)
+        self.assertEqual(self.windows.late, 1)
+        self.assertEqual(self.windows.summary('q1', now=1045),
+                         {'count':2, 'max':5})
+
+    def test_length(self):
+        self.assertRaises(ValueError, SlidingWindows, 5, 10)
+        self.assertEqual(SlidingWindows(25, 10).length, 30)
@@ -0,0 +1,403 @@
+#!/usr/bin/env python
+
+"""
+@file ion/services/dm/distribution/windows.py
+@author agent
+@brief Windowed aggregation of the values received by a consumer. Values are
+folded into reducers as they arrive so that a summary of a high rate stream
+does not require keeping the messages.
+"""
+
+from collections import deque
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from ion.util import procutils as pu
+
+
+class Reducer(object):
+    """
+    @brief Incremental summary of the values in a window. A reducer holds a
+    fixed amount of state however many values are added to it.
+    """
+
+    def add(self, value, timestamp):
+        raise NotImplementedError, 'Reducer class does not implement add'
+
+    def merge(self, other):
+        """
+        @brief Fold the state of another reducer of the same kind into this one
+        """
+        raise NotImplementedError, 'Reducer class does not implement merge'
+
+    def result(self, span):
+        """
+        @param span the length of the window in seconds
+        @retval the summary of the values added
+        """
+        raise NotImplementedError, 'Reducer class does not implement result'
+
+
+class CountReducer(Reducer):
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, value, timestamp):
+        self.count += 1
+
+    def merge(self, other):
+        self.count += other.count
+
+    def result(self, span):
+        return self.count
+
+
+class RateReducer(CountReducer):
+    """
+    @brief Values per second over the window
+    """
+
+    def result(self, span):
+        if span <= 0:
+            return 0.0
+        return self.count / float(span)
+
+
+class MinReducer(Reducer):
+
+    def __init__(self):
+        self.value = None
+
+    def add(self, value, timestamp):
+        if self.value is None or value < self.value:
+            self.value = value
+
+    def merge(self, other):
+        if other.value is not None:
+            self.add(other.value, None)
+
+    def result(self, span):
+        return self.value
+
+
+class MaxReducer(MinReducer):
+
+    def add(self, value, timestamp):
+        if self.value is None or value > self.value:
+            self.value = value
+
+
+class MeanReducer(Reducer):
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value, timestamp):
+        self.count += 1
+        self.total += value
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+
+    def result(self, span):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+
+class LastNReducer(Reducer):
+    """
+    @brief The last n values, oldest first
+    """
+
+    def __init__(self, n=1):
+        if n <= 0:
+            raise ValueError('LastNReducer must keep at least one value')
+        self.n = n
+        self.values = deque()
+
+    def add(self, value, timestamp):
+        self.values.append(value)
+        if len(self.values) > self.n:
+            self.values.popleft()
+
+    def merge(self, other):
+        for value in other.values:
+            self.add(value, None)
+
+    def result(self, span):
+        return list(self.values)
+
+
+def last_n(n):
+    """
+    @retval a reducer factory keeping the last n values
+    """
+    return lambda: LastNReducer(n)
+
+
+class _Pane(object):
+    """
+    The reducers of one key over one slice of time
+    """
+    __slots__ = ('start', 'reducers')
+
+    def __init__(self, start, factories):
+        self.start = start
+        self.reducers = dict((name, factory()) for name, factory in factories.iteritems())
+
+    def add(self, value, timestamp):
+        for reducer in self.reducers.itervalues():
+            reducer.add(value, timestamp)
+
+
+class Windows(object):
+    """
+    @brief Base class of the window kinds. Values are added under a key, such
+    as the queue they arrived on, and each key is summarized separately with
+    the same set of reducers.
+
+    Time is cut into panes of a fixed length, aligned to the epoch, and each
+    key keeps one set of reducers per pane. A window is made of whole panes,
+    so the state of a key is bounded by the number of panes in a window
+    rather than by the number of values.
+    """
+
+    def __init__(self, pane, reducers=None, clock=pu.currenttime):
+        """
+        @param pane length of a pane in seconds
+        @param reducers dict of name to a reducer factory, a callable returning
+        a new Reducer. Defaults to a count.
+        @param clock a function returning the current time in seconds
+        """
+        if pane <= 0:
+            raise ValueError('Window length must be positive')
+        self.pane = float(pane)
+        if reducers is None:
+            reducers = {'count':CountReducer}
+        self.reducers = dict(reducers)
+        self._clock = clock
+
+        self.late = 0
+        """
+        Number of values dropped because their window was already gone
+        """
+
+        self._panes = {}
+        """
+        Map of key to the deque of its panes, oldest first
+        """
+
+    def __len__(self):
+        return len(self._panes)
+
+    def __contains__(self, key):
+        return key in self._panes
+
+    def keys(self):
+        return self._panes.keys()
+
+    def _pane_start(self, timestamp):
+        return int(timestamp // self.pane) * self.pane
+
+    def add(self, key, value=None, timestamp=None):
+        """
+        @brief Fold a value into the window of its timestamp
+        @param timestamp time of the value, defaults to now
+        """
+        if timestamp is None:
+            timestamp = self._clock()
+        start = self._pane_start(timestamp)
+
+        panes = self._panes.get(key)
+        if panes is None:
+            panes = self._panes[key] = deque()
+
+        if panes and panes[-1].start == start:
+            pane = panes[-1]
+        elif not panes or panes[-1].start < start:
+            pane = _Pane(start, self.reducers)
+            panes.append(pane)
+            self._trim(panes, start)
+        else:
+            # Out of order - look back for its pane
+            pane = None
+            for p in panes:
+                if p.start == start:
+                    pane = p
+                    break
+            if pane is None:
+                if start < panes[0].start and self._is_gone(panes, start):
+                    self.late += 1
+                    return
+                pane = _Pane(start, self.reducers)
+                panes.append(pane)
+                ordered = sorted(panes, key=lambda p: p.start)
+                panes.clear()
+                panes.extend(ordered)
+        pane.add(value, timestamp)
+
+    def _trim(self, panes, start):
+        """
+        Drop the panes which no window ending at start can include
+        """
+
+    def _is_gone(self, panes, start):
+        return False
+
+    def _merge(self, panes):
+        merged = dict((name, factory()) for name, factory in self.reducers.iteritems())
+        for pane in panes:
+            for name, reducer in pane.reducers.iteritems():
+                merged[name].merge(reducer)
+        return merged
+
+    def _results(self, panes, span):
+        merged = self._merge(panes)
+        return dict((name, reducer.result(span)) for name, reducer in merged.iteritems())
+
+    def clear(self):
+        self._panes = {}
+
+
+class TumblingWindows(Windows):
+    """
+    @brief Consecutive windows which do not overlap. Each key holds one pane
+    per window, normally only the open one.
+    """
+
+    def __init__(self, length, reducers=None, clock=pu.currenttime):
+        """
+        @param length of a window in seconds
+        """
+        Windows.__init__(self, length, reducers, clock)
+        self.length = self.pane
+
+    def _is_gone(self, panes, start):
+        return True
+
+    def end(self, timestamp=None):
+        """
+        @retval the time the window holding timestamp ends, by default the
+        window open now
+        """
+        if timestamp is None:
+            timestamp = self._clock()
+        return self._pane_start(timestamp) + self.length
+
+    def current(self, key=None):
+        """
+        @retval dict of key to the results of its open window, or the results
+        of one key. Keys without values in the open window are left out.
+        """
+        start = self._pane_start(self._clock())
+        if key is not None:
+            panes = self._panes.get(key, ())
+            for pane in panes:
+                if pane.start == start:
+                    return self._results([pane], self.length)
+            return None
+
+        results = {}
+        for k, panes in self._panes.iteritems():
+            if panes and panes[-1].start == start:
+                results[k] = self._results([panes[-1]], self.length)
+        return results
+
+    def close(self, now=None):
+        """
+        @brief Remove the windows which have ended
+        @retval list of (start, end, {key: results}) for each ended window,
+        oldest first
+        """
+        if now is None:
+            now = self._clock()
+        return self._take(lambda pane: pane.start + self.length <= now)
+
+    def flush(self):
+        """
+        @brief Remove every window, including the open one
+        @retval list of (start, end, {key: results}), oldest first
+        """
+        return self._take(lambda pane: True)
+
+    def _take(self, ended):
+        windows = {}
+        for key in self._panes.keys():
+            panes = self._panes[key]
+            while panes and ended(panes[0]):
+                pane = panes.popleft()
+                windows.setdefault(pane.start, {})[key] = \
+                        self._results([pane], self.length)
+            if not panes:
+                del self._panes[key]
+
+        return [(start, start + self.length, windows[start])
+                for start in sorted(windows)]
+
+
+class SlidingWindows(Windows):
+    """
+    @brief Overlapping windows of a fixed length which move forward by a
+    slide. Each key holds at most length / slide panes.
+    """
+
+    def __init__(self, length, slide, reducers=None, clock=pu.currenttime):
+        """
+        @param length of a window in seconds
+        @param slide seconds between the starts of consecutive windows. The
+        length is rounded up to a whole number of slides.
+        """
+        Windows.__init__(self, slide, reducers, clock)
+        if length < slide:
+            raise ValueError('SlidingWindows length must be at least the slide')
+        self.npanes = int(-(-length // self.pane))
+        self.length = self.npanes * self.pane
+
+    def _oldest(self, start):
+        """
+        Start of the oldest pane in the window whose newest pane starts at start
+        """
+        return start - (self.npanes - 1) * self.pane
+
+    def _trim(self, panes, start):
+        oldest = self._oldest(start)
+        while panes and panes[0].start < oldest:
+            panes.popleft()
+
+    def _is_gone(self, panes, start):
+        return start < self._oldest(panes[-1].start)
+
+    def summary(self, key=None, now=None):
+        """
+        @brief Results over the window ending with the pane of now
+        @retval dict of key to results, or the results of one key. Keys
+        without values in the window are dropped.
+        """
+        if now is None:
+            now = self._clock()
+        newest = self._pane_start(now)
+        oldest = self._oldest(newest)
+
+        if key is not None:
+            panes = self._panes.get(key, ())
+            panes = [p for p in panes if oldest <= p.start <= newest]
+            if not panes:
+                return None
+            return self._results(panes, self.length)
+
+        results = {}
+        for k in self._panes.keys():
+            panes = self._panes[k]
+            self._trim(panes, newest)
+            if not panes:
+                del self._panes[k]
+                continue
+            in_window = [p for p in panes if p.start <= newest]
+            if in_window:
+                results[k] = self._results(in_window, self.length)
+        return results
@@ -9,13 +9,127 @@
 
 import ion.util.ionlog
 log = ion.util.ionlog.getLogger(__name__)
-from twisted.internet import defer, reactor
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+import random
 import re
+import time
 from uuid import uuid4
 
+from ion.core import ioninit
 from ion.core.process.process import ProcessFactory
 from ion.core.process.service_process import ServiceProcess, ServiceClient
 from ion.services.coi.attributestore import AttributeStoreClient
+from ion.util.timer_wheel import HierarchicalTimeWheel
+
+CONF = ioninit.config(__name__)
+
+MISSED_SKIP = 'skip'
+MISSED_CATCHUP = 'catchup'
+
+
+class TaskTable(object):
+    """
+    The scheduled tasks, held in a hierarchical time wheel.
+
+    A task definition is a dict with 'target', 'interval' and 'payload' and
+    optionally 'jitter', the most seconds of random delay added to each run,
+    and 'missed', what to do about runs missed while the scheduler was behind:
+    'skip' sends once, 'catchup' sends once for each missed run as well (up
+    to max_catchup). Either way later runs keep to the original period.
+    """
+
+    def __init__(self, granularity=0.1, jitter=0.0, missed=MISSED_SKIP,
+                 max_catchup=10, clock=time.time):
+        self.jitter = jitter
+        self.missed = missed
+        self.max_catchup = max_catchup
+        self._clock = clock
+        self.wheel = HierarchicalTimeWheel(granularity=granularity, clock=clock)
+
+        self.tasks = {}
+        """
+        Map of task id to task definition
+        """
+
+        self._next_run = {}
+        """
+        Map of task id to the time of its next run, without jitter
+        """
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __contains__(self, task_id):
+        return task_id in self.tasks
+
+    def add(self, task_id, tdef):
+        """
+        @brief Add a task, first run one interval from now
+        @retval the task definition, with its options filled in
+        @exception KeyError if target, interval or payload is missing
+        @exception ValueError for a bad interval or option
+        """
+        for key in ('target', 'interval', 'payload'):
+            if key not in tdef:
+                raise KeyError(key)
+
+        tdef = dict(tdef)
+        tdef['interval'] = interval = float(tdef['interval'])
+        if interval <= 0:
+            raise ValueError('Task interval must be positive, not %s' % interval)
+        tdef['jitter'] = float(tdef.get('jitter', self.jitter) or 0.0)
+        tdef['missed'] = tdef.get('missed', self.missed)
+        if tdef['missed'] not in (MISSED_SKIP, MISSED_CATCHUP):
+            raise ValueError('Unknown missed run policy "%s"' % tdef['missed'])
+
+        self.tasks[task_id] = tdef
+        self._schedule(task_id, self._clock() + interval)
+        return tdef
+
+    def remove(self, task_id):
+        """
+        @retval True if the task was in the table
+        """
+        self.wheel.discard(task_id)
+        self._next_run.pop(task_id, None)
+        return self.tasks.pop(task_id, None) is not None
+
+    def next_run(self, task_id):
+        return self._next_run.get(task_id)
+
+    def due(self):
+        """
+        @brief Reschedule the tasks which are due
+        @retval dict of target to the list of payloads to send it, in order
+        """
+        batches = {}
+        now = self._clock()
+        for task_id in self.wheel.advance():
+            tdef = self.tasks.get(task_id)
+            if tdef is None:
+                continue
+            interval = tdef['interval']
+            next_run = self._next_run[task_id]
+            missed = max(0, int((now - next_run) / interval))
+
+            count = 1
+            if missed and tdef['missed'] == MISSED_CATCHUP:
+                count += min(missed, self.max_catchup)
+            elif missed:
+                log.debug('Task %s skipped %d runs' % (task_id, missed))
+
+            batches.setdefault(tdef['target'], []).extend([tdef['payload']] * count)
+            self._schedule(task_id, next_run + interval * (missed + 1))
+        return batches
+
+    def _schedule(self, task_id, next_run):
+        self._next_run[task_id] = next_run
+        delay = next_run - self._clock()
+        jitter = self.tasks[task_id]['jitter']
+        if jitter:
+            delay += random.uniform(0, jitter)
+        self.wheel.add(task_id, max(0.0, delay))
 
 
 class SchedulerService(ServiceProcess):
@@ -33,16 +147,23 @@ class SchedulerService(ServiceProcess):
         # @note Might want to start another AS instance with a different target name
         self.store = AttributeStoreClient(targetname='attributestore')
 
+        # The task table is kept here; the store is only written on add and
+        # remove, so tasks survive in it but are not read back on each run
+        self.tasks = TaskTable(granularity=float(CONF.getValue('tick', 0.1)),
+                               jitter=float(CONF.getValue('jitter', 0.0)),
+                               missed=CONF.getValue('missed_policy', MISSED_SKIP),
+                               max_catchup=int(CONF.getValue('max_catchup', 10)))
+        self.loop = LoopingCall(self._tick)
+
     def slc_stop(self):
         log.debug('SLC stop of Scheduler')
 
     def slc_deactivate(self):
         """
         Called before terminate, this is a good place to tear down the AS and jobs.
-        @todo iterate over the list
-        foreach task in op_query:
-          rm_task(task)
+        Stops the timer; the tasks stay in the store.
         """
+        self._stop_loop()
 
     def slc_shutdown(self):
         log.debug('SLC shutdown of Scheduler')
@@ -51,38 +172,42 @@ class SchedulerService(ServiceProcess):
     def op_add_task(self, content, headers, msg):
         """
         @brief Add a new task to the crontab. Interval is in seconds, fractional.
-        @param content Message payload, must be a dictionary with 'target', 'interval' and 'payload' keys
+        @param content Message payload, must be a dictionary with 'target', 'interval' and 'payload' keys,
+        and optionally 'jitter' (seconds) and 'missed' ('skip' or 'catchup')
         @param headers Ignored here
         @param msg Ignored here
         @retval reply_ok or reply_err
         """
+        task_id = str(uuid4())
         try:
-            task_id = str(uuid4())
-            msg_interval = float(content['interval'])
+            self.tasks.add(task_id, content)
         except KeyError, ke:
             log.exception('Required keys in payload not found!')
             yield self.reply_err(msg, {'value': str(ke)})
             return
+        except ValueError, ex:
+            yield self.reply_err(msg, {'value': str(ex)})
+            return
 
         log.debug('ok, gotta task to save')
 
         # Just drop the entire message payload in
         rc = yield self.store.put(task_id, content)
         if re.search('rror', rc):
+            self.tasks.remove(task_id)
             yield self.reply_err(msg, 'Error "%s" adding task to registry!' % rc)
             return
 
-        # Now that task is stored into registry, add to messaging callback
         log.debug('Adding task to scheduler')
-        reactor.callLater(msg_interval, self._send_and_reschedule, task_id)
+        self._start_loop()
+
         log.debug('Add completed OK')
         yield self.reply_ok(msg, {'value':task_id})
 
     @defer.inlineCallbacks
     def op_rm_task(self, content, headers, msg):
         """
-        Remove a task from the list/store. Will be dropped from the reactor
-        when the timer fires and _send_and_reschedule checks the registry.
+        Remove a task from the table and the store. It does not run again.
         """
         task_id = content
 
@@ -92,6 +217,10 @@ class SchedulerService(ServiceProcess):
             self.reply_err(msg, {'value': err})
             return
 
+        self.tasks.remove(task_id)
+        if not self.tasks:
+            self._stop_loop()
+
         log.debug('Removing task_id %s from store...' % task_id)
         yield self.store.remove(task_id)
         log.debug('Removal completed')
@@ -112,38 +241,33 @@ class SchedulerService(ServiceProcess):
     ##################################################
     # Internal methods
 
-    @defer.inlineCallbacks
-    def _send_and_reschedule(self, task_id):
-        """
-        Check to see if we're still in the store - if not, we've been removed
-        and should abort the run.
-        """
-        log.debug('Worker activated for task %s' % task_id)
-        tdef = yield self.store.get(task_id)
-        if tdef == None:
-            log.info('Task ID missing in store, assuming removal and aborting')
-            return
-
-        payload = tdef['payload']
-        target_id = tdef['target']
-        interval = tdef['interval']
+    def _start_loop(self):
+        if not self.loop.running:
+            self.loop.start(self.tasks.wheel.granularity, now=False)
 
-        log.debug('Time to send "%s" to "%s", id "%s"' % (payload, target_id, task_id))
-        yield self.send(target_id, 'scheduler', payload)
-        log.debug('Send completed, rescheduling %s' % task_id)
-
-        reactor.callLater(interval, self._send_and_reschedule, task_id)
+    def _stop_loop(self):
+        if self.loop.running:
+            self.loop.stop()
 
+    def _tick(self):
         """
-        Update last-invoked timestamp in registry
-        @bug This code is commented out as it causes a run-time race condition with op_rm_task -
-        splitting the read and this write fails quite often.
-
-#        log.debug('Updating last-run time')
-#        tdef['last_run'] = time.time()
-#        self.store.put(task_id, tdef)
+        Send the tasks which are due, one batch of messages for each target.
+        Sends are not waited for, so a slow target does not hold up the timer.
         """
-        log.debug('Task %s rescheduled for %f seconds OK' % (task_id, interval))
+        batches = self.tasks.due()
+        for target_id, payloads in batches.iteritems():
+            d = self._send_batch(target_id, payloads)
+            d.addErrback(self._send_failed, target_id)
+
+    @defer.inlineCallbacks
+    def _send_batch(self, target_id, payloads):
+        log.debug('Time to send %d messages to "%s"' % (len(payloads), target_id))
+        for payload in payloads:
+            yield self.send(target_id, 'scheduler', payload)
+
+    def _send_failed(self, failure, target_id):
+        log.error('Failed to send scheduled messages to "%s": %s' %
+                  (target_id, failure.getErrorMessage()))
 
 class SchedulerServiceClient(ServiceClient):
     """
@@ -155,16 +279,22 @@ class SchedulerServiceClient(ServiceClient):
         ServiceClient.__init__(self, proc, **kwargs)
 
     @defer.inlineCallbacks
-    def add_task(self, target, interval, payload):
+    def add_task(self, target, interval, payload, jitter=None, missed=None):
         """
         @brief Add a recurring task to the scheduler
         @param target Destination address, available via self._get_procid
         @param interval Time, in fractional seconds, between messages
         @param payload Optional payload to include in the scheduled messages
+        @param jitter Optional most seconds of random delay added to each message
+        @param missed Optional 'skip' or 'catchup', for messages missed while the scheduler was behind
         @retval Task ID, a GUID used as a key for rm_task
         """
         yield self._check_init()
         msg_dict = {'target': target, 'payload': payload, 'interval': interval}
+        if jitter is not None:
+            msg_dict['jitter'] = jitter
+        if missed is not None:
+            msg_dict['missed'] = missed
         (content, headers, msg) = yield self.rpc_send('add_task', msg_dict)
         defer.returnValue(content)
 
@@ -8,8 +8,10 @@
 """
 
 from twisted.internet import defer
+from twisted.trial import unittest
 
-from ion.services.dm.scheduler.scheduler_service import SchedulerServiceClient
+from ion.services.dm.scheduler.scheduler_service import SchedulerServiceClient, \
+    TaskTable
 from ion.services.dm.scheduler.test.receiver import STClient
 
 from ion.test.iontest import IonTestCase
@@ -102,4 +104,81 @@ class SchedulerTest(IonTestCase):
         
         log.debug(rl)
         self.failUnlessEqual(len(rl['value']), 0)
-        yield asleep(0.5)
\ No newline at end of file
+        yield asleep(0.5)
+
+
+class TaskTableTest(unittest.TestCase):
+    """
+    Exercises the task table with a fake clock, no messaging involved
+    """
+    def setUp(self):
+        self.now = 1000.0
+        self.table = TaskTable(granularity=0.1, clock=lambda: self.now)
+
+    def _advance(self, seconds, step=0.05):
+        sent = {}
+        end = self.now + seconds
+        while self.now < end:
+            self.now += step
+            for target, payloads in self.table.due().items():
+                sent.setdefault(target, []).extend(payloads)
+        return sent
+
+    def test_periodic(self):
+        self.table.add('t1', {'target':'a', 'interval':1.0, 'payload':'one'})
+        self.table.add('t2', {'target':'a', 'interval':0.5, 'payload':'two'})
+        self.table.add('t3', {'target':'b', 'interval':2.0, 'payload':'three'})
+
+        sent = self._advance(4.02)
+        self.assertEqual(sent['a'].count('one'), 4)
+        self.assertEqual(sent['a'].count('two'), 8)
+        self.assertEqual(sent['b'], ['three', 'three'])
+
+    def test_same_tick_batched(self):
+        for i in range(5):
+            self.table.add('t%d' % i, {'target':'a', 'interval':1.0, 'payload':i})
+        self.now += 1.2
+        batches = self.table.due()
+        self.assertEqual(batches.keys(), ['a'])
+        self.assertEqual(sorted(batches['a']), range(5))
+
+    def test_remove(self):
+        self.table.add('t1', {'target':'a', 'interval':1.0, 'payload':'one'})
+        self.failUnless(self.table.remove('t1'))
+        self.failIf(self.table.remove('t1'))
+        self.assertEqual(self._advance(3), {})
+        self.assertEqual(len(self.table), 0)
+
+    def test_missed_runs(self):
+        self.table.add('skip', {'target':'a', 'interval':1.0, 'payload':'s'})
+        self.table.add('catch', {'target':'b', 'interval':1.0, 'payload':'c',
+                                 'missed':'catchup'})
+        start = self.table.next_run('skip') - 1.0
+
+        # the scheduler stalls for a while
+        self.now += 3.5
+        batches = self.table.due()
+        self.assertEqual(batches['a'], ['s'])
+        self.assertEqual(batches['b'], ['c'] * 3)
+
+        # and keeps to the original period afterwards
+        self.assertAlmostEqual(self.table.next_run('skip'), start + 4.0)
+        self.assertAlmostEqual(self.table.next_run('catch'), start + 4.0)
+
+    def test_jitter(self):
+        self.table.add('t1', {'target':'a', 'interval':1.0, 'payload':'one',
+                              'jitter':0.5})
+        start = self.now
+        # each run is at most 0.5 seconds late, plus a tick
+        sent = self._advance(5.7)
+        self.assertEqual(sent['a'], ['one'] * 5)
+        # and jitter does not accumulate
+        self.assertAlmostEqual(self.table.next_run('t1'), start + 6.0)
+
+    def test_bad_tasks(self):
+        self.assertRaises(KeyError, self.table.add, 't1', {'target':'a', 'payload':1})
+        self.assertRaises(ValueError, self.table.add, 't1',
+                          {'target':'a', 'interval':0, 'payload':1})
+        self.assertRaises(ValueError, self.table.add, 't1',
+                          {'target':'a', 'interval':1, 'payload':1, 'missed':'never'})
+        self.assertEqual(len(self.table), 0)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+@file ion/test/loadtests/commitload.py
+@author agent
+@brief Measures repository commit time against the number of modified nodes
+"""
+
+import time
+
+from twisted.internet import defer
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from ion.test.loadtest import LoadTest, LoadTestOptions
+from ion.core.object import workbench
+from ion.core.object import object_utils
+
+person_type = object_utils.create_type_identifier(object_id=20001, version=1)
+addresslink_type = object_utils.create_type_identifier(object_id=20003, version=1)
+
+class CommitLoadTestOptions(LoadTestOptions):
+    optParameters = [
+          ['nodes', 'n', 10000, 'Number of linked objects in the repository.']
+        , ['modified', 'm', '1,10,100,1000', 'Comma separated numbers of objects to modify before each commit.']
+        , ['repeat', 'r', 5, 'Number of commits to time for each number of modified objects.']
+    ]
+
+
+class CommitLoadTest(LoadTest):
+    """
+    Builds a repository with one root linking to many person objects, then
+    times commits after modifying an increasing number of them. With
+    incremental commit the time should grow with the number of modified
+    objects, not with the size of the repository.
+    """
+
+    def setUp(self, argv=None):
+        self.opts = opts = CommitLoadTestOptions()
+        opts.parseOptions(argv)
+
+        self.nodes = int(opts['nodes'])
+        self.modified = [int(m) for m in opts['modified'].split(',')]
+        self.repeat = int(opts['repeat'])
+        self.results = []
+
+        self.wb = workbench.WorkBench('Commit Load Test')
+        self.repo, self.ab = self.wb.init_repository(addresslink_type)
+
+    def generate_load(self):
+        repo, ab = self.repo, self.ab
+
+        tstart = time.time()
+        for i in range(self.nodes):
+            p = repo.create_object(person_type)
+            p.name = 'Person %d' % i
+            p.id = i
+            ab.person.add()
+            ab.person[i] = p
+        repo.commit(comment='Initial commit')
+        print '#%s] Built and committed a repository of %d objects in %.3f seconds' % (
+            self.load_id, self.nodes, time.time() - tstart)
+
+        for count in self.modified:
+            count = min(count, self.nodes)
+            elapsed = 0.0
+            for r in range(self.repeat):
+                for i in range(count):
+                    ab.person[i].name = 'Person %d revision %d' % (i, r)
+
+                tstart = time.time()
+                repo.commit(comment='Modified %d objects' % count)
+                elapsed += time.time() - tstart
+
+                if self.is_shutdown():
+                    return defer.succeed(None)
+
+            self.results.append((count, elapsed / self.repeat))
+
+        return defer.succeed(None)
+
+    def tearDown(self):
+        self.summary()
+        return defer.succeed(None)
+
+    def summary(self):
+        lines = ['-'*80,
+                 '#%s Summary: commit time in a repository of %d objects' % (self.load_id, self.nodes),
+                 '%12s %16s %20s' % ('modified', 'msec/commit', 'usec/modified obj')]
+        for count, elapsed in self.results:
+            lines.append('%12d %16.3f %20.1f' % (count, elapsed * 1000, elapsed * 1e6 / count))
+        lines.append('-'*80)
+        print '\n'.join(lines)
+
+
+"""
+python -m ion.test.load_runner -s -c ion.test.loadtests.commitload.CommitLoadTest - -n 10000 -m 1,10,100,1000
+"""
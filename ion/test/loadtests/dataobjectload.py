@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+@file ion/test/loadtests/dataobjectload.py
+@author agent
+@brief Measures the number of DataObject messages encoded and decoded per
+second, for each wire format.
+"""
+
+import time
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from ion.test.loadtest import LoadTest, LoadTestOptions
+from ion.data import dataobject
+from ion.resources import description_utility
+from ion.resources.dm_resource_descriptions import DictionaryMessageObject, \
+    Publication
+
+
+class DataObjectLoadTestOptions(LoadTestOptions):
+    optParameters = [
+          ['count', 'c', 2000, 'Number of messages to encode and decode for each format.']
+        , ['formats', 'f', 'legacy,json', 'Comma separated wire formats: legacy, json.']
+    ]
+
+
+class DataObjectLoadTest(LoadTest):
+    """
+    Encodes and decodes a data message as a consumer receives it, and a
+    resource with nested objects and a list of objects.
+    """
+
+    FORMATS = {
+        'legacy':(lambda o: o.encode(), dataobject.DataObject.decode),
+        'json':(lambda o: o.encode_json(), dataobject.DataObject.decode_json),
+    }
+
+    def setUp(self, argv=None):
+        self.opts = opts = DataObjectLoadTestOptions()
+        opts.parseOptions(argv)
+        self.count = int(opts['count'])
+        self.formats = opts['formats'].split(',')
+        self.results = []
+
+        # The message classes must be known to decode them
+        description_utility.load_descriptions()
+        dataobject.DataObject._types['TestResource'] = dataobject.TestResource
+
+        msg = DictionaryMessageObject()
+        msg.notification = 'A new sample'
+        msg.timestamp = time.time()
+        msg.data = {'temperature':[10.1, 10.2, 10.4], 'depth':[1, 2, 3]}
+
+        pub = Publication()
+        pub.topic_ref = dataobject.ResourceReference.create_new_resource()
+        pub.data = msg
+        pub.publisher = 'dataobjectload'
+
+        res = dataobject.TestResource.create_new_resource()
+        res.name = 'resource'
+        res.i = 42
+        res.f = 3.14159
+        res.b = dataobject.InformationResource.create_new_resource()
+        res.a = [dataobject.Resource.create_new_resource() for i in range(5)] + [1, 'two']
+
+        self.objects = [('DictionaryMessageObject', msg),
+                        ('Publication', pub),
+                        ('TestResource', res)]
+
+    def _time(self, fmt, obj):
+        encode, decode = self.FORMATS[fmt]
+        tstart = time.time()
+        for i in range(self.count):
+            decode(encode(obj))
+        return self.count / max(time.time() - tstart, 1e-9)
+
+    def generate_load(self):
+        for name, obj in self.objects:
+            for fmt in self.formats:
+                rate = self._time(fmt, obj)
+                self.results.append((name, fmt, rate))
+                if self.is_shutdown():
+                    return
+
+    def tearDown(self):
+        self.summary()
+
+    def summary(self):
+        lines = ['-'*80,
+                 '#%s Summary: DataObject encode + decode round trips' % self.load_id,
+                 '%24s %8s %12s' % ('object', 'format', 'msgs/s')]
+        for name, fmt, rate in self.results:
+            lines.append('%24s %8s %12.0f' % (name, fmt, rate))
+        lines.append('-'*80)
+        print '\n'.join(lines)
+
+
+"""
+python -m ion.test.load_runner -s -c ion.test.loadtests.dataobjectload.DataObjectLoadTest - -c 5000
+"""
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+@file ion/test/loadtests/provisionload.py
+@author agent
+@brief Measures the time to store the records of a launch against the number
+of nodes in it, with batched and with serial node writes.
+"""
+
+import time
+import uuid
+
+from twisted.internet import defer
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from ion.test.loadtest import LoadTest, LoadTestOptions
+from ion.services.cei.provisioner.store import ProvisionerStore, \
+    CassandraProvisionerStore
+from ion.services.cei import states
+
+
+class ProvisionLoadTestOptions(LoadTestOptions):
+    optParameters = [
+          ['nodes', 'n', '1,10,100,200,1000', 'Comma separated numbers of nodes in a launch.']
+        , ['repeat', 'r', 3, 'Number of launches to time for each number of nodes.']
+        , ['backend', 'b', 'memory', 'Store to use: memory or cassandra.']
+        , ['host', None, 'localhost', 'Cassandra host.']
+        , ['port', None, 9160, 'Cassandra port.']
+        , ['username', None, 'ooiuser', 'Cassandra username.']
+        , ['password', None, 'oceans11', 'Cassandra password.']
+        , ['batchsize', None, None, 'Most records in one batch_mutate.']
+    ]
+
+
+class ProvisionLoadTest(LoadTest):
+    """
+    Stores a launch record and its node records, as the provisioner does when
+    a request arrives, once with put_nodes and once with a put_node per node.
+    """
+
+    @defer.inlineCallbacks
+    def setUp(self, argv=None):
+        self.opts = opts = ProvisionLoadTestOptions()
+        opts.parseOptions(argv)
+
+        self.nodes = [int(n) for n in opts['nodes'].split(',')]
+        self.repeat = int(opts['repeat'])
+        self.backend = opts['backend']
+        self.results = []
+
+        if self.backend == 'cassandra':
+            batch_size = opts['batchsize'] and int(opts['batchsize'])
+            prefix = str(uuid.uuid4())[:8]
+            self.store = CassandraProvisionerStore(opts['host'],
+                    int(opts['port']), opts['username'], opts['password'],
+                    prefix=prefix, batch_size=batch_size)
+            self.store.initialize()
+            self.store.activate()
+            yield self.store.assure_schema('ProvisionerLoadTest')
+        else:
+            self.store = ProvisionerStore()
+
+    def _make_launch(self, count):
+        launch_id = str(uuid.uuid4())
+        launch = {'launch_id' : launch_id, 'state' : states.REQUESTED,
+                  'node_ids' : []}
+        nodes = []
+        for i in range(count):
+            node = {'launch_id' : launch_id, 'node_id' : str(uuid.uuid4()),
+                    'state' : states.REQUESTED, 'site' : 'ec2-east',
+                    'allocation' : 'small', 'ctx_name' : 'worker'}
+            launch['node_ids'].append(node['node_id'])
+            nodes.append(node)
+        return launch, nodes
+
+    @defer.inlineCallbacks
+    def _time_batched(self, count):
+        launch, nodes = self._make_launch(count)
+        tstart = time.time()
+        yield self.store.put_launch(launch)
+        yield self.store.put_nodes(nodes)
+        defer.returnValue(time.time() - tstart)
+
+    @defer.inlineCallbacks
+    def _time_serial(self, count):
+        launch, nodes = self._make_launch(count)
+        tstart = time.time()
+        yield self.store.put_launch(launch)
+        for node in nodes:
+            yield self.store.put_node(node)
+        defer.returnValue(time.time() - tstart)
+
+    @defer.inlineCallbacks
+    def generate_load(self):
+        for count in self.nodes:
+            batched = serial = 0.0
+            for r in range(self.repeat):
+                batched += yield self._time_batched(count)
+                serial += yield self._time_serial(count)
+
+                if self.is_shutdown():
+                    return
+
+            self.results.append((count, batched / self.repeat,
+                                 serial / self.repeat))
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        if self.backend == 'cassandra':
+            yield self.store.drop_schema()
+            yield self.store.terminate()
+        self.summary()
+
+    def summary(self):
+        lines = ['-'*80,
+                 '#%s Summary: launch storage time with the %s store' % (self.load_id, self.backend),
+                 '%10s %16s %16s %10s' % ('nodes', 'batched msec', 'serial msec', 'speedup')]
+        for count, batched, serial in self.results:
+            lines.append('%10d %16.3f %16.3f %10.2f' % (count, batched * 1000,
+                serial * 1000, serial / max(batched, 1e-9)))
+        lines.append('-'*80)
+        print '\n'.join(lines)
+
+
+"""
+python -m ion.test.load_runner -s -c ion.test.loadtests.provisionload.ProvisionLoadTest - -n 1,10,100,1000 -b cassandra
+"""
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""
+@file ion/test/loadtests/storeload.py
+@author agent
+@brief Measures the time to write, read, test and remove a number of keys in
+an IStore backend, with the multi-key operations and with one operation per
+key.
+"""
+
+import time
+import uuid
+
+from twisted.internet import defer
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from ion.test.loadtest import LoadTest, LoadTestOptions
+import ion.util.procutils as pu
+
+
+class StoreLoadTestOptions(LoadTestOptions):
+    optParameters = [
+          ['keys', 'k', '1,10,100,1000', 'Comma separated numbers of keys.']
+        , ['repeat', 'r', 3, 'Number of times to time each number of keys.']
+        , ['backend', 'b', 'ion.data.store.Store', 'IStore class to create with create_store.']
+        , ['host', None, None, 'Backend host, passed to create_store.']
+        , ['port', None, None, 'Backend port, passed to create_store.']
+        , ['valuesize', 's', 100, 'Bytes in each value.']
+    ]
+
+
+class StoreLoadTest(LoadTest):
+    """
+    Puts, gets, tests and removes the same keys once with put_many, get_many,
+    exists_many and remove_many, and once with one call per key made in turn.
+    """
+
+    OPS = ('put', 'get', 'exists', 'remove')
+
+    @defer.inlineCallbacks
+    def setUp(self, argv=None):
+        self.opts = opts = StoreLoadTestOptions()
+        opts.parseOptions(argv)
+
+        self.keys = [int(n) for n in opts['keys'].split(',')]
+        self.repeat = int(opts['repeat'])
+        self.value = 'x' * int(opts['valuesize'])
+        self.results = []
+
+        kwargs = {}
+        if opts['host']:
+            kwargs['host'] = opts['host']
+        if opts['port']:
+            kwargs['port'] = int(opts['port'])
+        self.backend = opts['backend']
+        self.store = yield pu.get_class(self.backend).create_store(**kwargs)
+
+    def _make_keys(self, count):
+        prefix = str(uuid.uuid4())
+        return ['%s.%d' % (prefix, i) for i in range(count)]
+
+    @defer.inlineCallbacks
+    def _time_many(self, count):
+        keys = self._make_keys(count)
+        times = {}
+        tstart = time.time()
+        yield self.store.put_many([(key, self.value) for key in keys])
+        times['put'] = time.time() - tstart
+        tstart = time.time()
+        yield self.store.get_many(keys)
+        times['get'] = time.time() - tstart
+        tstart = time.time()
+        yield self.store.exists_many(keys)
+        times['exists'] = time.time() - tstart
+        tstart = time.time()
+        yield self.store.remove_many(keys)
+        times['remove'] = time.time() - tstart
+        defer.returnValue(times)
+
+    @defer.inlineCallbacks
+    def _time_single(self, count):
+        keys = self._make_keys(count)
+        times = {}
+        tstart = time.time()
+        for key in keys:
+            yield self.store.put(key, self.value)
+        times['put'] = time.time() - tstart
+        tstart = time.time()
+        for key in keys:
+            yield self.store.get(key)
+        times['get'] = time.time() - tstart
+        tstart = time.time()
+        for key in keys:
+            yield self.store.exists(key)
+        times['exists'] = time.time() - tstart
+        tstart = time.time()
+        for key in keys:
+            yield self.store.remove(key)
+        times['remove'] = time.time() - tstart
+        defer.returnValue(times)
+
+    @defer.inlineCallbacks
+    def generate_load(self):
+        for count in self.keys:
+            many = dict([(op, 0.0) for op in self.OPS])
+            single = dict([(op, 0.0) for op in self.OPS])
+            for r in range(self.repeat):
+                times = yield self._time_many(count)
+                for op in self.OPS:
+                    many[op] += times[op] / self.repeat
+                times = yield self._time_single(count)
+                for op in self.OPS:
+                    single[op] += times[op] / self.repeat
+
+                if self.is_shutdown():
+                    return
+
+            self.results.append((count, many, single))
+
+    def tearDown(self):
+        self.summary()
+
+    def summary(self):
+        lines = ['-'*80,
+                 '#%s Summary: msec per batch of keys with %s' % (self.load_id, self.backend),
+                 '%8s %8s %14s %14s %10s' % ('keys', 'op', 'many msec', 'single msec', 'speedup')]
+        for count, many, single in self.results:
+            for op in self.OPS:
+                lines.append('%8d %8s %14.3f %14.3f %10.2f' % (count, op,
+                    many[op] * 1000, single[op] * 1000,
+                    single[op] / max(many[op], 1e-9)))
+        lines.append('-'*80)
+        print '\n'.join(lines)
+
+
+"""
+python -m ion.test.load_runner -s -c ion.test.loadtests.storeload.StoreLoadTest - -k 1,10,100,1000
+python -m ion.test.load_runner -s -c ion.test.loadtests.storeload.StoreLoadTest - -b ion.data.backends.redis.Store --host localhost
+"""
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""
+@file ion/test/loadtests/wrapperload.py
+@author agent
+@brief Microbenchmark of attribute access on the GPB object wrapper. Compares
+the per class accessor tables with the isinstance dispatch they replaced.
+"""
+
+import time
+
+from twisted.internet import defer
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from google.protobuf import message
+from google.protobuf.internal import containers
+
+from ion.test.loadtest import LoadTest, LoadTestOptions
+from ion.core.object import workbench
+from ion.core.object import gpb_wrapper
+from ion.core.object import object_utils
+
+person_type = object_utils.create_type_identifier(object_id=20001, version=1)
+addresslink_type = object_utils.create_type_identifier(object_id=20003, version=1)
+
+
+class ReferenceWrapper(gpb_wrapper.Wrapper):
+    """
+    Wrapper with the attribute access used before the accessor tables
+    """
+
+    def __getattribute__(self, key):
+
+        invalid = object.__getattribute__(self,'Invalid')
+        if key == 'Invalid':
+            return invalid
+        elif invalid:
+            raise gpb_wrapper.OOIObjectError('Can not access Invalidated Object which may be left behind after a checkout or reset.')
+
+        gpbfields = object.__getattribute__(self,'_gpbFields')
+
+        if key in gpbfields:
+            gpb = self.GPBMessage
+            field = getattr(gpb,key)
+
+            if isinstance(field, containers.RepeatedScalarFieldContainer):
+                result = gpb_wrapper.ScalarContainerWrapper.factory(self, field)
+
+            elif isinstance(field, containers.RepeatedCompositeFieldContainer):
+                result = gpb_wrapper.ContainerWrapper.factory(self, field)
+
+            elif isinstance(field, message.Message):
+                result = self._rewrap(field)
+
+                if result.ObjectType == self.LinkClassType:
+                    result = self.Repository.get_linked_object(result)
+            else:
+                result = field
+
+        else:
+            try:
+                result = object.__getattribute__(self, key)
+            except AttributeError, ex:
+                raise gpb_wrapper.OOIObjectError(
+                '''"Wrapper" object for GPB class "%s"; has no attribute "%s"'''
+                % (self._GPBClass, key))
+
+        return result
+
+
+class WrapperLoadTestOptions(LoadTestOptions):
+    optParameters = [
+          ['count', 'n', 100000, 'Number of attribute reads to time for each case.']
+    ]
+
+
+class WrapperLoadTest(LoadTest):
+    """
+    Times attribute reads of each kind of field with the accessor tables and
+    with the reference implementation.
+    """
+
+    def setUp(self, argv=None):
+        self.opts = opts = WrapperLoadTestOptions()
+        opts.parseOptions(argv)
+        self.count = int(opts['count'])
+        self.results = []
+
+        wb = workbench.WorkBench('Wrapper Load Test')
+        repo, ab = wb.init_repository(addresslink_type)
+
+        p = repo.create_object(person_type)
+        p.name = 'David'
+        p.id = 5
+        ph = p.phone.add()
+        ph.number = '123 456 7890'
+        ab.owner = p
+
+        self.cases = [('scalar', p, 'name'),
+                      ('enum value', p, 'WORK'),
+                      ('repeated composite', p, 'phone'),
+                      ('link', ab, 'owner'),
+                      ('wrapper property', p, 'ObjectType')]
+
+    def _time_reads(self, obj, key):
+        count = self.count
+        tstart = time.time()
+        for i in xrange(count):
+            getattr(obj, key)
+        return time.time() - tstart
+
+    def generate_load(self):
+        for name, obj, key in self.cases:
+            new = self._time_reads(obj, key)
+
+            cls = obj.__class__
+            obj.__class__ = ReferenceWrapper
+            try:
+                ref = self._time_reads(obj, key)
+            finally:
+                obj.__class__ = cls
+
+            self.results.append((name, new, ref))
+
+        return defer.succeed(None)
+
+    def tearDown(self):
+        self.summary()
+        return defer.succeed(None)
+
+    def summary(self):
+        lines = ['-'*80,
+                 '#%s Summary: %d attribute reads per case' % (self.load_id, self.count),
+                 '%20s %16s %16s %10s' % ('field kind', 'table usec/read', 'ref usec/read', 'speedup')]
+        for name, new, ref in self.results:
+            lines.append('%20s %16.3f %16.3f %10.2f' % (name, new * 1e6 / self.count,
+                ref * 1e6 / self.count, ref / max(new, 1e-9)))
+        lines.append('-'*80)
+        print '\n'.join(lines)
+
+
+"""
+python -m ion.test.load_runner -s -c ion.test.loadtests.wrapperload.WrapperLoadTest - -n 100000
+"""
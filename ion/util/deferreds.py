@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+"""
+@file ion/util/deferreds.py
+@author agent
+@brief Helpers for waiting on several Deferreds at once
+"""
+
+from twisted.internet import defer
+
+
+def gather(deferreds):
+    """
+    @brief Wait for a list of Deferreds, which all run at once
+    @retval a Deferred with the list of their results in order. It fails
+    with the failure of the first one to fail.
+    """
+    dl = defer.DeferredList(list(deferreds), fireOnOneErrback=True, consumeErrors=True)
+    dl.addCallback(lambda results: [result for success, result in results])
+    dl.addErrback(_first_error)
+    return dl
+
+def _first_error(failure):
+    """
+    Unwrap the failure of the first Deferred of a DeferredList to fail
+    """
+    failure.trap(defer.FirstError)
+    return failure.value.subFailure
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+"""
+@file ion/util/test/test_deferreds.py
+@author agent
+@brief Test the helpers for waiting on several Deferreds
+"""
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from ion.util.deferreds import gather
+
+
+class GatherTest(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def test_in_order(self):
+        d1 = defer.Deferred()
+        d2 = defer.Deferred()
+        d = gather([d1, d2, defer.succeed(3)])
+        d2.callback(2)
+        d1.callback(1)
+        results = yield d
+        self.assertEqual(results, [1, 2, 3])
+
+        results = yield gather([])
+        self.assertEqual(results, [])
+
+    @defer.inlineCallbacks
+    def test_first_failure(self):
+        d1 = defer.Deferred()
+        d = gather([d1, defer.fail(KeyError('missing'))])
+        try:
+            yield d
+            self.fail('KeyError expected')
+        except KeyError:
+            pass
+        # The others are not left with an unhandled error
+        d1.errback(ValueError())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""
+@file ion/util/test/test_timer_wheel.py
+@author agent
+"""
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+from twisted.trial import unittest
+
+from ion.util.timer_wheel import TimeWheel, HierarchicalTimeWheel
+
+
+class TimeWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.expired = []
+
+    def _wheel(self, **kwargs):
+        return TimeWheel(granularity=1.0, slots=10, clock=lambda: self.now,
+                         on_expire=self.expired.append, **kwargs)
+
+    def test_expire(self):
+        wheel = self._wheel()
+        wheel.add('a', 2)
+        wheel.add('b', 5)
+        self.assertEqual(len(wheel), 2)
+
+        self.now += 2
+        self.assertEqual(wheel.advance(), [])
+
+        self.now += 1
+        self.assertEqual(wheel.advance(), ['a'])
+        self.assertNotIn('a', wheel)
+        self.assertIn('b', wheel)
+
+        self.now += 3
+        wheel.advance()
+        self.assertEqual(self.expired, ['a', 'b'])
+        self.assertEqual(wheel.stats(), {'entries':0, 'expired':2, 'evicted':0})
+
+    def test_discard_and_move(self):
+        wheel = self._wheel()
+        wheel.add('a', 2)
+        wheel.add('b', 2)
+        self.assertEqual(wheel.discard('a'), True)
+        self.assertEqual(wheel.discard('a'), False)
+
+        # Adding again reschedules
+        wheel.add('b', 8)
+        self.now += 5
+        self.assertEqual(wheel.advance(), [])
+        self.now += 5
+        self.assertEqual(wheel.advance(), ['b'])
+
+    def test_ttl_capped_at_horizon(self):
+        wheel = self._wheel()
+        wheel.add('a', 1000)
+        self.now += 10
+        self.assertEqual(wheel.advance(), ['a'])
+
+    def test_idle_gap(self):
+        wheel = self._wheel()
+        for i in range(5):
+            wheel.add(i, i)
+        self.now += 1000
+        self.assertEqual(sorted(wheel.advance()), range(5))
+        self.assertEqual(len(wheel), 0)
+
+    def test_max_entries(self):
+        wheel = self._wheel(max_entries=3)
+        wheel.add('a', 5)
+        wheel.add('b', 1)
+        wheel.add('c', 9)
+        self.assertEqual(wheel.add('d', 9), ['b'])
+        self.assertEqual(len(wheel), 3)
+        self.assertEqual(self.expired, ['b'])
+        self.assertEqual(wheel.stats()['evicted'], 1)
+
+    def test_horizon(self):
+        # Capped at the horizon of the wheel
+        wheel = self._wheel()
+        wheel.add('a', 1000)
+        self.now += 11
+        self.assertEqual(wheel.advance(), ['a'])
+
+        # unless the wheel is sized for the ttl
+        wheel = TimeWheel(slots=TimeWheel.slots_for(1000), clock=lambda: self.now)
+        wheel.add('a', 1000)
+        self.now += 999
+        self.assertEqual(wheel.advance(), [])
+        self.now += 2
+        self.assertEqual(wheel.advance(), ['a'])
+
+    def test_bad_args(self):
+        self.assertRaises(ValueError, TimeWheel, granularity=0)
+        self.assertRaises(ValueError, TimeWheel, slots=0)
+
+
+class HierarchicalTimeWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+
+    def _wheel(self):
+        # levels of 1, 10 and 100 second slots
+        return HierarchicalTimeWheel(granularity=1.0, slots=10, levels=3,
+                                     clock=lambda: self.now)
+
+    def _advance_until(self, wheel, until, step=0.5):
+        """Advance in steps, returning when each key came due"""
+        fired = {}
+        while self.now < until:
+            self.now += step
+            for key in wheel.advance():
+                fired[key] = self.now
+        return fired
+
+    def test_never_early(self):
+        wheel = self._wheel()
+        delays = {'a':0.2, 'b':3.7, 'c':9.9, 'd':10.0, 'e':57.3, 'f':250.0,
+                  'g':2500.0}
+        for key, delay in delays.items():
+            wheel.add(key, delay)
+        self.assertEqual(len(wheel), len(delays))
+
+        start = self.now
+        fired = self._advance_until(wheel, start + 2600)
+        self.assertEqual(sorted(fired.keys()), sorted(delays.keys()))
+        for key, delay in delays.items():
+            late = fired[key] - (start + delay)
+            self.failUnless(0 <= late <= 1.5, (key, late))
+        self.assertEqual(len(wheel), 0)
+
+    def test_discard_and_move(self):
+        wheel = self._wheel()
+        wheel.add('a', 50)
+        wheel.add('b', 50)
+        self.assertEqual(wheel.due('a'), self.now + 50)
+        self.failUnless(wheel.discard('a'))
+        self.failIf(wheel.discard('a'))
+
+        wheel.add('b', 5)
+        start = self.now
+        fired = self._advance_until(wheel, start + 100)
+        self.assertEqual(fired.keys(), ['b'])
+        self.failUnless(fired['b'] - start < 7)
+
+    def test_idle_gap(self):
+        wheel = self._wheel()
+        wheel.add('a', 30)
+        wheel.add('b', 5000)
+        self.now += 2000
+        self.assertEqual(wheel.advance(), ['a'])
+        self.assertIn('b', wheel)
+        self.now += 3000
+        self.assertEqual(wheel.advance(), ['b'])
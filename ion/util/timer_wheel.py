@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+"""
+@file ion/util/timer_wheel.py
+@author agent
+@brief A hashed time wheel of keys which expire after a time to live
+"""
+
+import time
+
+import ion.util.ionlog
+log = ion.util.ionlog.getLogger(__name__)
+
+
+class TimeWheel(object):
+    """
+    @brief Keys scheduled to expire after a time to live, bucketed into slots
+    of a fixed granularity. Adding, discarding and expiring a key are O(1).
+
+    The wheel has no timer of its own; it is advanced by calling advance(),
+    which expires the keys of every slot that has passed - the owner calls
+    it from a LoopingCall when keys must expire without further adds. The
+    time to live is capped at the horizon of the wheel (granularity * slots,
+    see slots_for) and the number of keys can be bounded, in which case
+    adding a key past the bound expires the keys which are due first.
+    """
+
+    def __init__(self, granularity=1.0, slots=600, max_entries=None, on_expire=None, clock=time.time):
+        """
+        @param granularity seconds per slot
+        @param slots number of slots - the longest time to live is granularity * slots
+        @param max_entries the most keys held, or None for no bound
+        @param on_expire a function called with each key as it expires
+        @param clock a function returning the current time in seconds
+        """
+        if granularity <= 0 or slots <= 0:
+            raise ValueError('TimeWheel granularity and slots must be positive')
+
+        self.granularity = float(granularity)
+        self.slots = int(slots)
+        self.max_entries = max_entries
+        self.on_expire = on_expire
+        self._clock = clock
+
+        self.expired = 0
+        """
+        Number of keys expired by time
+        """
+
+        self.evicted = 0
+        """
+        Number of keys expired early to stay within max_entries
+        """
+
+        self._tick = self._now_tick()
+        """
+        The last tick the wheel was advanced to
+        """
+
+        self._buckets = {}
+        """
+        Map of tick to the set of keys which expire at that tick
+        """
+
+        self._ticks = {}
+        """
+        Map of key to the tick it expires at
+        """
+
+    @staticmethod
+    def slots_for(ttl, granularity=1.0):
+        """
+        @retval the number of slots a wheel needs to hold keys for ttl seconds
+        """
+        return int(ttl / float(granularity)) + 1
+
+    def __len__(self):
+        return len(self._ticks)
+
+    def __contains__(self, key):
+        return key in self._ticks
+
+    def _now_tick(self):
+        return int(self._clock() / self.granularity)
+
+    def add(self, key, ttl):
+        """
+        @brief Schedule a key to expire after ttl seconds. A key which is
+        already scheduled is moved. The wheel is advanced first.
+        @retval the list of keys expired to make room for it
+        """
+        self.advance()
+        self.discard(key)
+
+        nticks = int(ttl / self.granularity) + 1
+        if nticks > self.slots:
+            log.warn('TimeWheel ttl of %s seconds is beyond its horizon of %s seconds' % (
+                ttl, self.granularity * self.slots))
+            nticks = self.slots
+        nticks = max(1, nticks)
+        tick = self._tick + nticks
+
+        self._ticks[key] = tick
+        self._buckets.setdefault(tick, set()).add(key)
+
+        evicted = []
+        if self.max_entries is not None:
+            while len(self._ticks) > self.max_entries:
+                evicted.append(self._evict_first())
+            self.evicted += len(evicted)
+            self._notify(evicted)
+        return evicted
+
+    def discard(self, key):
+        """
+        @brief Remove a key without expiring it
+        @retval True if the key was in the wheel
+        """
+        tick = self._ticks.pop(key, None)
+        if tick is None:
+            return False
+        bucket = self._buckets[tick]
+        bucket.discard(key)
+        if not bucket:
+            del self._buckets[tick]
+        return True
+
+    def advance(self):
+        """
+        @brief Expire the keys of every slot up to the current time
+        @retval the list of expired keys
+        """
+        now = self._now_tick()
+        if now <= self._tick:
+            return []
+
+        expired = []
+        if now - self._tick >= self.slots:
+            # Every key is due
+            for bucket in self._buckets.itervalues():
+                expired.extend(bucket)
+            self._buckets = {}
+            self._ticks = {}
+        else:
+            for tick in xrange(self._tick + 1, now + 1):
+                bucket = self._buckets.pop(tick, None)
+                if bucket:
+                    for key in bucket:
+                        del self._ticks[key]
+                    expired.extend(bucket)
+
+        self._tick = now
+        self.expired += len(expired)
+        self._notify(expired)
+        return expired
+
+    def clear(self):
+        self._buckets = {}
+        self._ticks = {}
+
+    def stats(self):
+        """
+        @retval dictionary of counters
+        """
+        return {'entries':len(self._ticks),
+                'expired':self.expired,
+                'evicted':self.evicted}
+
+    def _evict_first(self):
+        for tick in xrange(self._tick + 1, self._tick + self.slots + 1):
+            bucket = self._buckets.get(tick, None)
+            if bucket:
+                key = bucket.pop()
+                if not bucket:
+                    del self._buckets[tick]
+                del self._ticks[key]
+                return key
+        raise RuntimeError('TimeWheel has keys outside of its horizon')
+
+    def _notify(self, keys):
+        if self.on_expire is None:
+            return
+        for key in keys:
+            try:
+                self.on_expire(key)
+            except Exception, ex:
+                log.exception('Error in TimeWheel expire callback for key %s' % str(key))
+
+
+class HierarchicalTimeWheel(object):
+    """
+    @brief Keys due at a point in time, which may be far in the future. Each
+    level is a TimeWheel whose slots span the whole horizon of the level
+    below. A key is held in the finest level whose horizon reaches its due
+    time and is moved down a level as that time nears, so the cost of a key
+    does not depend on how far away it is.
+
+    Like TimeWheel it has no timer of its own: advance() returns the keys
+    which are due. A key is never returned before its due time, and at most
+    about one granularity after it.
+    """
+
+    def __init__(self, granularity=0.1, slots=600, levels=3, clock=time.time):
+        """
+        @param granularity seconds per slot of the finest level
+        @param slots number of slots of each level
+        @param levels number of levels. Keys due beyond the horizon of the
+        coarsest level are held there and moved down as time passes
+        @param clock a function returning the current time in seconds
+        """
+        if levels <= 0:
+            raise ValueError('HierarchicalTimeWheel needs at least one level')
+
+        self._clock = clock
+        self._expired = []
+        self.wheels = []
+        for level in range(levels):
+            self.wheels.append(TimeWheel(granularity * (slots ** level), slots,
+                                         on_expire=self._expired.append,
+                                         clock=clock))
+        self.granularity = self.wheels[0].granularity
+
+        self._due = {}
+        """
+        Map of key to the time it is due
+        """
+
+        self._level = {}
+        """
+        Map of key to the level it is held in
+        """
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, key):
+        return key in self._due
+
+    def add(self, key, delay):
+        """
+        @brief Schedule a key to be due after delay seconds. A key which is
+        already scheduled is moved.
+        """
+        self.discard(key)
+        self._due[key] = self._clock() + delay
+        self._place(key, delay)
+
+    def due(self, key):
+        """
+        @retval the time a key is due, or None
+        """
+        return self._due.get(key)
+
+    def discard(self, key):
+        """
+        @brief Remove a key
+        @retval True if the key was scheduled
+        """
+        level = self._level.pop(key, None)
+        if level is None:
+            return False
+        self.wheels[level].discard(key)
+        del self._due[key]
+        return True
+
+    def advance(self):
+        """
+        @brief Move keys down the levels as their time nears
+        @retval the list of keys which are due, in no particular order
+        """
+        for wheel in self.wheels:
+            wheel.advance()
+
+        due = []
+        now = self._clock()
+        expired = self._expired
+        while expired:
+            key = expired.pop()
+            if key not in self._level:
+                continue
+            remaining = self._due[key] - now
+            if remaining <= 0:
+                del self._level[key]
+                del self._due[key]
+                due.append(key)
+            else:
+                # Placing may advance a wheel, adding to expired
+                self._place(key, remaining)
+        return due
+
+    def clear(self):
+        for wheel in self.wheels:
+            wheel.clear()
+        self._due = {}
+        self._level = {}
+        del self._expired[:]
+
+    def _place(self, key, remaining):
+        last = len(self.wheels) - 1
+        for level, wheel in enumerate(self.wheels):
+            horizon = wheel.granularity * wheel.slots
+            if remaining < horizon or level == last:
+                if level > 0:
+                    # Come down a level before the key is due
+                    remaining = max(0, remaining - wheel.granularity)
+                self._level[key] = level
+                wheel.add(key, remaining)
+                return